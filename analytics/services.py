@@ -1,8 +1,9 @@
 from datetime import date, timedelta
-from django.db.models import Q, Sum, Count, Avg, Max, Min
+from django.db.models import F, Q, Sum, Count, Avg, Max, Min
 from django.db.models.functions import TruncDate, TruncMonth, TruncYear
 from django.utils import timezone
 from borrowings.models import Borrowing
+from payments.fine_policy import FinePolicy
 from payments.models import Payment
 from books.models import Book
 from users.models import User
@@ -25,15 +26,19 @@ class AnalyticsService:
             dict: Revenue analytics data
         """
         start_date = self.today - timedelta(days=period_days)
+        # Revenue is net of refunds, which are tracked locally on each payment
+        net_amount = Sum(F('money_to_pay') - F('refunded_amount'))
         
         # Daily revenue
         daily_revenue = Payment.objects.filter(
             status='PAID',
             borrowing__borrow_date__gte=start_date
         ).annotate(
-            date=TruncDate('borrowing__borrow_date')
+            # borrow_date is already a date; TruncDate on it fails on SQLite
+            date=F('borrowing__borrow_date')
         ).values('date').annotate(
-            total=Sum('money_to_pay'),
+            total=net_amount,
+            refunded=Sum('refunded_amount'),
             count=Count('id')
         ).order_by('date')
         
@@ -42,12 +47,14 @@ class AnalyticsService:
             status='PAID',
             borrowing__borrow_date__gte=start_date
         ).values('type').annotate(
-            total=Sum('money_to_pay'),
+            total=net_amount,
+            refunded=Sum('refunded_amount'),
             count=Count('id')
         )
         
         # Total revenue
         total_revenue = sum(item['total'] for item in daily_revenue)
+        total_refunded = sum(item['refunded'] for item in daily_revenue)
         total_payments = sum(item['count'] for item in daily_revenue)
         
         # Average daily revenue
@@ -58,6 +65,8 @@ class AnalyticsService:
             'start_date': start_date,
             'end_date': self.today,
             'total_revenue': total_revenue,
+            'gross_revenue': total_revenue + total_refunded,
+            'total_refunded': total_refunded,
             'total_payments': total_payments,
             'avg_daily_revenue': avg_daily_revenue,
             'daily_revenue': list(daily_revenue),
@@ -251,7 +260,7 @@ class AnalyticsService:
             status='PAID',
             borrowing__borrow_date__gte=start_date
         ).aggregate(
-            total=Sum('money_to_pay')
+            total=Sum(F('money_to_pay') - F('refunded_amount'))
         )['total'] or 0
         
         # Average fine amount
@@ -266,6 +275,14 @@ class AnalyticsService:
         # Fine payment rate
         fine_payment_rate = (paid_fines / total_fines * 100) if total_fines > 0 else 0
         
+        # Fines still growing on books that are not back yet, priced by the policy in the database
+        accruing_fines = Borrowing.objects.filter(
+            expected_return_date__lt=self.today,
+            actual_return_date__isnull=True
+        ).aggregate(
+            total=Sum(FinePolicy.from_settings().borrowing_expression(self.today))
+        )['total'] or 0
+        
         return {
             'period_days': period_days,
             'total_fines': total_fines,
@@ -273,7 +290,8 @@ class AnalyticsService:
             'pending_fines': pending_fines,
             'fine_revenue': fine_revenue,
             'avg_fine_amount': avg_fine_amount,
-            'fine_payment_rate': fine_payment_rate
+            'fine_payment_rate': fine_payment_rate,
+            'accruing_fines': accruing_fines
         }
     
     def get_overdue_analytics(self) -> dict:
@@ -3,4 +3,8 @@ from django.apps import AppConfig
 
 class BooksConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'books'
\ No newline at end of file
+    name = 'books'
+    
+    def ready(self):
+        """Import signals when app is ready."""
+        import books.signals
\ No newline at end of file
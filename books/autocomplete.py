@@ -0,0 +1,546 @@
+import fcntl
+import heapq
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from .models import Book
+
+logger = logging.getLogger(__name__)
+
+# Snapshot layout (little endian):
+#   header   : magic, entry, book, prefix and top counts, generation
+#   entries  : (term offset, book id, rank, title order) sorted by term
+#   books    : (book id, label offset) sorted by book id
+#   prefixes : (prefix offset, first top, top count, match count) sorted by prefix
+#   tops     : (book id, rank, title order) best first, per prefix
+#   strings  : NUL-terminated UTF-8 terms, prefixes and "title\x1fauthor" labels
+HEADER = struct.Struct('<4sIIIIQ')
+ENTRY = struct.Struct('<IQBI')
+BOOK = struct.Struct('<QI')
+PREFIX = struct.Struct('<IIII')
+TOP = struct.Struct('<QBI')
+MAGIC = b'BAC3'
+# Prefixes up to this many characters match too much of the catalog to rank
+# per lookup; their best TOP_SIZE books are stored in the snapshot instead
+TOP_PREFIX_LENGTH = 3
+TOP_SIZE = 64
+SEPARATOR = '\x1f'
+# Sorts after every character that can follow a prefix
+PREFIX_END = '\U0010ffff'
+
+
+def normalize(text: str) -> str:
+    """Normalize text for case-insensitive prefix matching."""
+    return ' '.join(text.casefold().split())
+
+
+def book_terms(title: str, author: str) -> list:
+    """
+    Return (term, rank) pairs indexed for a book.
+    
+    Every word start of the title and author is indexed so "gats" matches
+    "The Great Gatsby"; rank 0 marks a match at the start of the field.
+    """
+    terms = []
+    for field in (title, author):
+        words = normalize(field).split(' ')
+        for position in range(len(words)):
+            term = ' '.join(words[position:])
+            if term:
+                terms.append((term, 0 if position == 0 else 1))
+    return terms
+
+
+def build_snapshot(books: dict, generation: int = 0) -> bytes:
+    """
+    Serialize books into the snapshot format.
+    
+    Every entry carries the book's position in title order, so a search
+    can rank a prefix range without decoding a single string. Prefixes of
+    up to ``TOP_PREFIX_LENGTH`` characters get their best ``TOP_SIZE``
+    books precomputed.
+    
+    Args:
+        books: Mapping of book_id to (title, author)
+        generation: Delta log generation the snapshot was built for
+    
+    Returns:
+        bytes: Snapshot contents
+    """
+    strings = bytearray()
+    offsets = {}
+    
+    def intern(value):
+        if value not in offsets:
+            offsets[value] = len(strings)
+            strings.extend(value.encode() + b'\0')
+        return offsets[value]
+    
+    title_order = {
+        book_id: position
+        for position, book_id in enumerate(sorted(books, key=lambda book_id: (normalize(books[book_id][0]), book_id)))
+    }
+    entries = sorted(
+        (term, book_id, rank)
+        for book_id, (title, author) in books.items()
+        for term, rank in book_terms(title, author)
+    )
+    entry_table = b''.join(
+        ENTRY.pack(intern(term), book_id, rank, title_order[book_id]) for term, book_id, rank in entries
+    )
+    book_table = b''.join(
+        BOOK.pack(book_id, intern(f'{title}{SEPARATOR}{author}'))
+        for book_id, (title, author) in sorted(books.items())
+    )
+    
+    # Best (rank, title order) of every book per short prefix
+    matches = {}
+    for term, book_id, rank in entries:
+        key = (rank, title_order[book_id])
+        for length in range(1, min(len(term), TOP_PREFIX_LENGTH) + 1):
+            prefix_matches = matches.setdefault(term[:length], {})
+            current = prefix_matches.get(book_id)
+            if current is None or key < current:
+                prefix_matches[book_id] = key
+    prefix_rows = []
+    top_rows = []
+    for prefix in sorted(matches):
+        top = heapq.nsmallest(TOP_SIZE, matches[prefix].items(), key=lambda item: item[1])
+        prefix_rows.append(PREFIX.pack(intern(prefix), len(top_rows), len(top), len(matches[prefix])))
+        top_rows.extend(TOP.pack(book_id, rank, order) for book_id, (rank, order) in top)
+    
+    header = HEADER.pack(MAGIC, len(entries), len(books), len(prefix_rows), len(top_rows), generation)
+    return header + entry_table + book_table + b''.join(prefix_rows) + b''.join(top_rows) + bytes(strings)
+
+
+class BookAutocompleteIndex:
+    """
+    Read-only prefix index over a memory-mapped snapshot.
+    
+    Lookups binary-search the mapped entry table directly, so every worker
+    process shares the same page-cache copy of the index. The mapping is
+    closed when the last reference to the index goes away, so a search
+    that is still running on a replaced index keeps a valid buffer.
+    """
+    
+    def __init__(self, path: str):
+        with open(path, 'rb') as snapshot:
+            stat = os.fstat(snapshot.fileno())
+            self.version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            self.buffer = mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ)
+        
+        magic, self.entry_count, self.book_count, self.prefix_count, self.top_count, self.generation = (
+            HEADER.unpack_from(self.buffer, 0)
+        )
+        if magic != MAGIC:
+            raise ValueError(f"Invalid autocomplete snapshot: {path}")
+        
+        self.entries_start = HEADER.size
+        self.books_start = self.entries_start + self.entry_count * ENTRY.size
+        self.prefixes_start = self.books_start + self.book_count * BOOK.size
+        self.tops_start = self.prefixes_start + self.prefix_count * PREFIX.size
+        self.strings_start = self.tops_start + self.top_count * TOP.size
+    
+    def _string(self, offset: int) -> str:
+        start = self.strings_start + offset
+        return self.buffer[start:self.buffer.find(b'\0', start)].decode()
+    
+    def _term(self, position: int) -> str:
+        offset = ENTRY.unpack_from(self.buffer, self.entries_start + position * ENTRY.size)[0]
+        return self._string(offset)
+    
+    def _lower_bound(self, prefix: str) -> int:
+        low, high = 0, self.entry_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._term(middle) < prefix:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+    
+    def _top(self, prefix: str):
+        """Return (first top, top count, match count) of a short prefix, or None if nothing matches it."""
+        low, high = 0, self.prefix_count
+        while low < high:
+            middle = (low + high) // 2
+            offset, first, count, matches = PREFIX.unpack_from(self.buffer, self.prefixes_start + middle * PREFIX.size)
+            current = self._string(offset)
+            if current == prefix:
+                return first, count, matches
+            if current < prefix:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+    
+    def get_book(self, book_id: int):
+        """Return (title, author) for a book id, or None if it is not indexed."""
+        low, high = 0, self.book_count
+        while low < high:
+            middle = (low + high) // 2
+            current_id, offset = BOOK.unpack_from(self.buffer, self.books_start + middle * BOOK.size)
+            if current_id == book_id:
+                return tuple(self._string(offset).split(SEPARATOR, 1))
+            if current_id < book_id:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+    
+    def search(self, prefix: str, limit: int, exclude=()) -> list:
+        """
+        Return the best ``limit`` matches for a normalized prefix.
+        
+        Short prefixes read their precomputed best books and stop after
+        ``limit``; they only fall back to ranking the range when excluded
+        books leave too few of them. Longer prefixes match a narrow range,
+        which is ranked on the numeric rank and title order stored in each
+        entry. Only the labels of the returned books are decoded.
+        
+        Args:
+            prefix: Normalized prefix
+            limit: Maximum number of matches
+            exclude: Book ids to skip (overridden by the delta log)
+        
+        Returns:
+            list: (rank, normalized title, book_id, title, author) tuples, best first
+        """
+        if len(prefix) <= TOP_PREFIX_LENGTH:
+            top = self._top(prefix)
+            if top is None:
+                return []
+            first, count, matches = top
+            best = []
+            for book_id, rank, _ in TOP.iter_unpack(
+                self.buffer[self.tops_start + first * TOP.size:self.tops_start + (first + count) * TOP.size]
+            ):
+                if book_id not in exclude:
+                    best.append((book_id, rank))
+                    if len(best) == limit:
+                        break
+            if len(best) == limit or matches == count:
+                return self._labels(best)
+        
+        return self._labels(self._rank_range(prefix, limit, exclude))
+    
+    def _rank_range(self, prefix: str, limit: int, exclude) -> list:
+        first = self._lower_bound(prefix)
+        last = self._lower_bound(prefix + PREFIX_END)
+        table = memoryview(self.buffer)[
+            self.entries_start + first * ENTRY.size:self.entries_start + last * ENTRY.size
+        ]
+        try:
+            best = {}
+            for _, book_id, rank, order in ENTRY.iter_unpack(table):
+                current = best.get(book_id)
+                if current is None or (rank, order) < current:
+                    best[book_id] = (rank, order)
+        finally:
+            table.release()
+        
+        for book_id in exclude:
+            best.pop(book_id, None)
+        top = heapq.nsmallest(limit, best.items(), key=lambda item: item[1])
+        return [(book_id, rank) for book_id, (rank, _) in top]
+    
+    def _labels(self, best: list) -> list:
+        results = []
+        for book_id, rank in best:
+            title, author = self.get_book(book_id)
+            results.append((rank, normalize(title), book_id, title, author))
+        return results
+
+
+class BookAutocompleteService:
+    """
+    Per-process handle to the shared autocomplete snapshot.
+    
+    Each node builds its snapshot from the Book table. Created, renamed
+    and deleted books are appended to a delta log in the default cache
+    (Redis whenever ``REDIS_URL`` is set, so every process and node reads
+    the same log); a change costs one cache write and every process sees
+    it on its next lookup by replaying the new log entries into an
+    in-memory overlay. Once the log reaches ``BOOK_AUTOCOMPLETE_DELTA_MAX``
+    entries its generation is bumped: every node rebuilds its snapshot in
+    a background thread and keeps answering from the old snapshot plus the
+    logs written since, so no request waits for a rebuild.
+    """
+    
+    generation_key = 'books:autocomplete:generation'
+    # A log entry missing for this long was evicted, not still being written
+    gap_timeout = 5
+    # Logs replayed on top of a snapshot whose rebuild is still running;
+    # after a bigger jump (an evicted generation) it is served as is until then
+    replay_generations = 3
+    # Seconds before a failed background rebuild is retried
+    rebuild_retry_delay = 30
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.lock_path = f'{path}.lock'
+        self.delta_max = getattr(settings, 'BOOK_AUTOCOMPLETE_DELTA_MAX', 1000)
+        self._index = None
+        self._sync_lock = threading.Lock()
+        self._overlay = {}
+        self._overlay_base = None
+        self._applied = {}
+        self._gap_since = None
+        self._build_lock = threading.Lock()
+        self._building = False
+        self._retry_at = 0
+    
+    @classmethod
+    def sequence_key(cls, generation: int) -> str:
+        return f'books:autocomplete:{generation}:seq'
+    
+    @classmethod
+    def change_key(cls, generation: int, number: int) -> str:
+        return f'books:autocomplete:{generation}:change:{number}'
+    
+    @contextmanager
+    def _locked(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    def _write(self, books: dict, generation: int):
+        temp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as snapshot:
+            snapshot.write(build_snapshot(books, generation))
+        os.replace(temp_path, self.path)
+    
+    def _current_version(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    
+    def current_generation(self) -> int:
+        """
+        Return the delta log generation shared by all nodes.
+        
+        Generations start from the clock, so one re-created after the key
+        was evicted is still newer than every snapshot and all nodes rebuild.
+        """
+        return cache.get_or_set(self.generation_key, time.time_ns() // 1000, timeout=None)
+    
+    def _snapshot_generation(self):
+        """Return the generation of the snapshot on disk, or None if it is missing or unreadable."""
+        try:
+            with open(self.path, 'rb') as snapshot:
+                header = snapshot.read(HEADER.size)
+        except FileNotFoundError:
+            return None
+        if len(header) < HEADER.size:
+            return None
+        magic, *_, generation = HEADER.unpack(header)
+        return generation if magic == MAGIC else None
+    
+    def _remap(self):
+        version = self._current_version()
+        if version is None:
+            return None
+        if self._index is None or self._index.version != version:
+            try:
+                # The replaced index is unmapped once the searches still using it finish
+                self._index = BookAutocompleteIndex(self.path)
+            except ValueError:
+                # Written in an older format; rebuilt like a missing snapshot
+                return None
+        return self._index
+    
+    def get_index(self, generation: int):
+        """
+        Return the mapped index, re-mapping it if the snapshot was replaced.
+        
+        A missing snapshot, or one older than ``generation``, is rebuilt in
+        the background; until then the old index (or None) is returned.
+        """
+        index = self._remap()
+        if index is None or index.generation < generation:
+            self.schedule_rebuild(generation)
+            # Picks up a rebuild another process finished in the meantime
+            index = self._remap()
+        return index
+    
+    def rebuild(self):
+        """Rebuild the snapshot from the Book table for the current generation."""
+        with self._locked():
+            self._build(self.current_generation())
+        self._remap()
+    
+    def schedule_rebuild(self, generation: int):
+        """Start rebuilding the snapshot for ``generation`` in a background thread, unless one is running."""
+        with self._build_lock:
+            if self._building or time.monotonic() < self._retry_at:
+                return
+            self._building = True
+        threading.Thread(target=self._rebuild_in_background, args=(generation,), daemon=True).start()
+    
+    def _rebuild_in_background(self, generation: int):
+        try:
+            with self._locked():
+                # Another process on this node may have rebuilt it while we waited
+                built = self._snapshot_generation()
+                if built is None or built < generation:
+                    self._build(generation)
+        except Exception as e:
+            self._retry_at = time.monotonic() + self.rebuild_retry_delay
+            logger.error(f"Failed to rebuild autocomplete index: {str(e)}")
+        finally:
+            connections.close_all()
+            self._building = False
+    
+    def _build(self, generation: int):
+        books = {
+            book_id: (title, author)
+            for book_id, title, author in Book.objects.values_list('id', 'title', 'author').iterator()
+        }
+        self._write(books, generation)
+        logger.info(f"Autocomplete index rebuilt with {len(books)} books")
+    
+    def _sync(self) -> tuple:
+        """
+        Return the index and the delta overlay, replaying new log entries.
+        
+        Returns:
+            tuple: (index or None, {book_id: (title, author, terms) or None})
+        """
+        generation = self.current_generation()
+        index = self.get_index(generation)
+        if index is None:
+            return None, {}
+        if generation - index.generation < self.replay_generations:
+            logs = range(index.generation, generation + 1)
+        else:
+            logs = range(index.generation, index.generation + 1)
+        
+        with self._sync_lock:
+            if self._overlay_base != index.generation:
+                self._overlay, self._overlay_base, self._applied, self._gap_since = {}, index.generation, {}, None
+            
+            overlay = None
+            for log in logs:
+                applied = self._applied.get(log, 0)
+                sequence = cache.get(self.sequence_key(log), 0)
+                if sequence <= applied:
+                    continue
+                numbers = range(applied + 1, sequence + 1)
+                changes = cache.get_many([self.change_key(log, number) for number in numbers])
+                if overlay is None:
+                    overlay = dict(self._overlay)
+                for number in numbers:
+                    change = changes.get(self.change_key(log, number))
+                    if change is None:
+                        if log == generation:
+                            self._handle_gap(generation)
+                        break
+                    book_id, label = change
+                    overlay[book_id] = (*label, book_terms(*label)) if label else None
+                    self._applied[log] = number
+                    if log == generation:
+                        self._gap_since = None
+            if overlay is not None:
+                # Readers keep the overlay they started with
+                self._overlay = overlay
+            return index, self._overlay
+    
+    def _handle_gap(self, generation: int):
+        """Start a new generation if a log entry stays missing (evicted)."""
+        now = time.monotonic()
+        if self._gap_since is None:
+            self._gap_since = now
+        elif now - self._gap_since > self.gap_timeout:
+            logger.warning(f"Autocomplete delta log {generation} lost an entry, rebuilding")
+            self._bump_generation(generation)
+    
+    def _bump_generation(self, generation: int):
+        # Only the first caller moves a generation on
+        if cache.get(self.generation_key) == generation:
+            try:
+                cache.incr(self.generation_key)
+            except ValueError:
+                # Evicted; the next lookup starts a new generation
+                pass
+    
+    def search(self, query: str, limit: int = 10) -> list:
+        """
+        Return up to ``limit`` books whose title or author has a word starting with ``query``.
+        
+        Matches at the start of a field rank first, then results are ordered by title.
+        """
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        
+        index, overlay = self._sync()
+        if index is None:
+            # The first snapshot of this node is still being built
+            return []
+        results = index.search(prefix, limit, exclude=overlay)
+        for book_id, book in overlay.items():
+            if book is None:
+                continue
+            title, author, terms = book
+            ranks = [rank for term, rank in terms if term.startswith(prefix)]
+            if ranks:
+                results.append((min(ranks), normalize(title), book_id, title, author))
+        results.sort()
+        
+        return [
+            {'id': book_id, 'title': title, 'author': author}
+            for rank, _, book_id, title, author in results[:limit]
+        ]
+    
+    def get_book(self, book_id: int):
+        """Return the indexed (title, author) of a book, or None."""
+        index, overlay = self._sync()
+        if book_id in overlay:
+            book = overlay[book_id]
+            return book[:2] if book else None
+        return index.get_book(book_id) if index is not None else None
+    
+    def update_book(self, book_id: int, title: str, author: str):
+        """Index a created or renamed book; no-op if its title and author are unchanged."""
+        self._publish(book_id, (title, author))
+    
+    def remove_book(self, book_id: int):
+        """Remove a deleted book from the index."""
+        self._publish(book_id, None)
+    
+    def _publish(self, book_id: int, label):
+        generation = self.current_generation()
+        index = self._index
+        # Only compared when this process is current: a write never pays for a rebuild
+        if index is not None and index.generation >= generation and self.get_book(book_id) == label:
+            # Inventory-only saves (e.g. from Borrowing.save) don't touch the index
+            return
+        
+        key = self.sequence_key(generation)
+        cache.add(key, 0, timeout=None)
+        number = cache.incr(key)
+        cache.set(self.change_key(generation, number), [book_id, list(label) if label else None], timeout=None)
+        if number == self.delta_max:
+            # Fold the log into fresh snapshots; each node rebuilds once, in the background, on its next lookup
+            self._bump_generation(generation)
+
+
+@lru_cache(maxsize=None)
+def get_autocomplete_service() -> BookAutocompleteService:
+    """Return the process-wide autocomplete service."""
+    return BookAutocompleteService(str(settings.BOOK_AUTOCOMPLETE_INDEX_PATH))
\ No newline at end of file
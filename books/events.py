@@ -0,0 +1,236 @@
+import json
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+
+import redis
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+
+class InMemoryEventBroker:
+    """
+    Single-process event broker for book availability changes.
+    
+    Keeps a bounded replay buffer so reconnecting clients can resume from
+    their last seen event id. Suitable for a single node and for tests.
+    """
+    
+    def __init__(self, buffer_size: int = 1000):
+        self._events = deque(maxlen=buffer_size)
+        self._last_id = 0
+        self._condition = threading.Condition()
+    
+    def publish(self, event: str, data: dict) -> dict:
+        """
+        Publish an event to all subscribers.
+        
+        Args:
+            event: Event type, e.g. ``book.updated``
+            data: JSON-serializable payload
+        
+        Returns:
+            dict: Published event with its id
+        """
+        with self._condition:
+            self._last_id += 1
+            message = {'id': self._last_id, 'event': event, 'data': data}
+            self._events.append(message)
+            self._condition.notify_all()
+        return message
+    
+    def last_event_id(self) -> int:
+        """Return the id of the most recently published event."""
+        return self._last_id
+    
+    def events_after(self, last_event_id: int):
+        """
+        Return buffered events newer than ``last_event_id``.
+        
+        Returns:
+            list or None: Events in order, or None if some were already evicted
+        """
+        with self._condition:
+            if last_event_id >= self._last_id:
+                return []
+            oldest_id = self._events[0]['id'] if self._events else self._last_id + 1
+            if last_event_id + 1 < oldest_id:
+                return None
+            return [message for message in self._events if message['id'] > last_event_id]
+    
+    def subscribe(self):
+        """Return a subscription used to block until new events arrive."""
+        return InMemorySubscription(self)
+
+
+class InMemorySubscription:
+    """Subscription to an InMemoryEventBroker."""
+    
+    def __init__(self, broker: InMemoryEventBroker):
+        self.broker = broker
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        return False
+    
+    def wait(self, last_event_id: int, timeout: float) -> bool:
+        """Block until an event newer than ``last_event_id`` exists or timeout."""
+        with self.broker._condition:
+            return self.broker._condition.wait_for(
+                lambda: self.broker._last_id > last_event_id,
+                timeout=timeout
+            )
+
+
+class RedisEventBroker:
+    """
+    Redis-backed event broker for multi-node deployments.
+    
+    Event ids come from ``INCR``, the replay buffer is a capped sorted set
+    scored by id and live delivery uses pub/sub. Publishing runs as one
+    Lua script, so every id is in the buffer as soon as it is issued and
+    concurrent publishers cannot add id N+1 before id N.
+    """
+    
+    PUBLISH_SCRIPT = """
+        local event_id = redis.call('INCR', KEYS[1])
+        local payload = '{"id": ' .. event_id .. ', "event": ' .. ARGV[1] .. ', "data": ' .. ARGV[2] .. '}'
+        redis.call('ZADD', KEYS[2], event_id, payload)
+        redis.call('ZREMRANGEBYRANK', KEYS[2], 0, -tonumber(ARGV[3]) - 1)
+        redis.call('PUBLISH', ARGV[4], payload)
+        return event_id
+    """
+    
+    def __init__(self, url: str, buffer_size: int = 1000, prefix: str = 'library:book_events'):
+        self.client = redis.Redis.from_url(url)
+        self.buffer_size = buffer_size
+        self.sequence_key = f'{prefix}:seq'
+        self.log_key = f'{prefix}:log'
+        self.channel = f'{prefix}:channel'
+        self._publish = self.client.register_script(self.PUBLISH_SCRIPT)
+    
+    def publish(self, event: str, data: dict) -> dict:
+        """Publish an event to all subscribers across processes."""
+        event_id = self._publish(
+            keys=[self.sequence_key, self.log_key],
+            args=[json.dumps(event), json.dumps(data), self.buffer_size, self.channel]
+        )
+        return {'id': int(event_id), 'event': event, 'data': data}
+    
+    def last_event_id(self) -> int:
+        """Return the id of the most recently published event."""
+        return int(self.client.get(self.sequence_key) or 0)
+    
+    def events_after(self, last_event_id: int):
+        """
+        Return buffered events newer than ``last_event_id``.
+        
+        Returns:
+            list or None: Events in order, or None if some were already evicted
+        """
+        current_id = self.last_event_id()
+        if last_event_id >= current_id:
+            return []
+        
+        oldest = self.client.zrange(self.log_key, 0, 0, withscores=True)
+        oldest_id = int(oldest[0][1]) if oldest else current_id + 1
+        if last_event_id + 1 < oldest_id:
+            return None
+        
+        payloads = self.client.zrangebyscore(self.log_key, f'({last_event_id}', '+inf')
+        return [json.loads(payload) for payload in payloads]
+    
+    def subscribe(self):
+        """Return a subscription used to block until new events arrive."""
+        return RedisSubscription(self)
+
+
+class RedisSubscription:
+    """Pub/sub subscription to a RedisEventBroker."""
+    
+    def __init__(self, broker: RedisEventBroker):
+        self.pubsub = broker.client.pubsub(ignore_subscribe_messages=True)
+        self.channel = broker.channel
+    
+    def __enter__(self):
+        self.pubsub.subscribe(self.channel)
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.pubsub.close()
+        return False
+    
+    def wait(self, last_event_id: int, timeout: float) -> bool:
+        """Block until a message arrives on the channel or timeout."""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            message = self.pubsub.get_message(timeout=remaining)
+            if message and message['type'] == 'message':
+                if json.loads(message['data'])['id'] > last_event_id:
+                    return True
+
+
+@lru_cache(maxsize=None)
+def get_event_broker():
+    """Return the process-wide broker configured by ``BOOK_EVENTS_BROKER``."""
+    backend = getattr(settings, 'BOOK_EVENTS_BROKER', 'memory')
+    buffer_size = getattr(settings, 'BOOK_EVENTS_BUFFER_SIZE', 1000)
+    
+    if backend == 'memory':
+        return InMemoryEventBroker(buffer_size=buffer_size)
+    if backend == 'redis':
+        return RedisEventBroker(settings.REDIS_URL, buffer_size=buffer_size)
+    raise ImproperlyConfigured(f"Unknown BOOK_EVENTS_BROKER: {backend}")
+
+
+def iter_events(broker, last_event_id: int, heartbeat: float, duration: float):
+    """
+    Yield events newer than ``last_event_id`` for ``duration`` seconds.
+    
+    Yields an event dict for every change, a ``reset`` event when the client
+    has fallen behind the replay buffer, and None on idle heartbeats.
+    """
+    deadline = time.monotonic() + duration
+    
+    with broker.subscribe() as subscription:
+        while True:
+            events = broker.events_after(last_event_id)
+            if events is None:
+                last_event_id = broker.last_event_id()
+                yield {'id': last_event_id, 'event': 'reset', 'data': {}}
+            elif events:
+                for message in events:
+                    yield message
+                last_event_id = events[-1]['id']
+            
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            if not subscription.wait(last_event_id, min(heartbeat, remaining)):
+                yield None
+
+
+def format_event(message) -> str:
+    """Format an event (or a None heartbeat) for the ``text/event-stream`` wire format."""
+    if message is None:
+        return ': keep-alive\n\n'
+    return (
+        f"id: {message['id']}\n"
+        f"event: {message['event']}\n"
+        f"data: {json.dumps(message['data'])}\n\n"
+    )
+
+
+def book_event_payload(book) -> dict:
+    """Build the availability payload published for a book."""
+    return {
+        'book_id': book.id,
+        'inventory': book.inventory,
+        'is_available': book.is_available,
+    }
\ No newline at end of file
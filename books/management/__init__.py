@@ -0,0 +1 @@
+# Management commands for books
\ No newline at end of file
@@ -0,0 +1,15 @@
+import time
+from django.core.management.base import BaseCommand
+from books.autocomplete import get_autocomplete_service
+
+
+class Command(BaseCommand):
+    help = "Build this node's book autocomplete snapshot (run before starting the web server)"
+    
+    def handle(self, *args, **options):
+        """Rebuild the autocomplete snapshot from the Book table."""
+        started = time.monotonic()
+        get_autocomplete_service().rebuild()
+        self.stdout.write(
+            self.style.SUCCESS(f'Autocomplete index built in {time.monotonic() - started:.1f}s')
+        )
\ No newline at end of file
@@ -14,6 +14,7 @@ class Book(models.Model):
     cover = models.CharField(max_length=4, choices=COVER_CHOICES, default='HARD')
     inventory = models.PositiveIntegerField(default=0)
     daily_fee = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         verbose_name = 'Book'
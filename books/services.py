@@ -0,0 +1,190 @@
+import hashlib
+import json
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+from .models import Book
+from .serializers import BookListSerializer
+
+
+class BookBatchService:
+    """Service for fetching many books at once through a per-id object cache."""
+    
+    cache_prefix = 'books:book'
+    
+    def __init__(self):
+        self.cache_timeout = getattr(settings, 'BOOK_OBJECT_CACHE_TIMEOUT', 300)
+    
+    @classmethod
+    def cache_key(cls, book_id) -> str:
+        """Return the cache key for a single serialized book."""
+        return f'{cls.cache_prefix}:{book_id}'
+    
+    @classmethod
+    def generation_key(cls, book_id) -> str:
+        """Return the key of the book's generation, bumped on every invalidation."""
+        return f'{cls.cache_prefix}:{book_id}:generation'
+    
+    @classmethod
+    def invalidate(cls, book_id):
+        """Drop a book from the object cache and bump its generation."""
+        key = cls.generation_key(book_id)
+        cache.add(key, 0, timeout=None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Evicted between add() and incr()
+            cache.set(key, 1, timeout=None)
+        cache.delete(cls.cache_key(book_id))
+    
+    def get_books(self, book_ids: list) -> tuple:
+        """
+        Get serialized books for a list of ids.
+        
+        Cached books are served without touching the database; the rest are
+        loaded with a single ``IN`` query and written back to the cache.
+        Entries are tagged with the book's generation as read before the
+        load, so a load that races an invalidation writes an entry that is
+        never served instead of stale inventory for the whole timeout.
+        
+        Args:
+            book_ids: Book ids in the order they should be returned
+        
+        Returns:
+            tuple: (list of serialized books in request order, list of missing ids)
+        """
+        book_ids = list(dict.fromkeys(book_ids))
+        found = {}
+        generations = {}
+        
+        if self.cache_timeout:
+            cached = cache.get_many(
+                [self.cache_key(book_id) for book_id in book_ids] +
+                [self.generation_key(book_id) for book_id in book_ids]
+            )
+            for book_id in book_ids:
+                generations[book_id] = cached.get(self.generation_key(book_id), 0)
+                entry = cached.get(self.cache_key(book_id))
+                if entry is not None and entry['generation'] == generations[book_id]:
+                    found[book_id] = entry['data']
+        
+        to_load = [book_id for book_id in book_ids if book_id not in found]
+        if to_load:
+            books = Book.objects.in_bulk(to_load)
+            loaded = {book_id: dict(BookListSerializer(book).data) for book_id, book in books.items()}
+            found.update(loaded)
+            
+            if self.cache_timeout and loaded:
+                cache.set_many(
+                    {
+                        self.cache_key(book_id): {'generation': generations[book_id], 'data': data}
+                        for book_id, data in loaded.items()
+                    },
+                    timeout=self.cache_timeout
+                )
+        
+        results = [found[book_id] for book_id in book_ids if book_id in found]
+        missing = [book_id for book_id in book_ids if book_id not in found]
+        return results, missing
+
+
+class BookFacetService:
+    """
+    Service for catalog facet counts (cover, author, availability).
+    
+    All facets are rolled up from one ``GROUP BY cover, author`` query over
+    the searched catalog. Each facet is counted with the *other* facet's
+    filter applied, so the sidebar keeps showing alternatives for the
+    currently selected value.
+    """
+    
+    version_key = 'books:facets:version'
+    
+    def __init__(self):
+        self.cache_timeout = getattr(settings, 'BOOK_FACETS_CACHE_TIMEOUT', 60)
+    
+    @staticmethod
+    def initial_version() -> int:
+        """Return a starting version that an evicted counter never repeats (it also tags list ETags)."""
+        return time.time_ns() // 1000
+    
+    @classmethod
+    def bump_version(cls):
+        """Invalidate all cached facet results after a catalog change."""
+        cache.add(cls.version_key, cls.initial_version(), timeout=None)
+        try:
+            cache.incr(cls.version_key)
+        except ValueError:
+            # Evicted between add() and incr()
+            cache.set(cls.version_key, cls.initial_version(), timeout=None)
+    
+    @classmethod
+    def current_version(cls) -> int:
+        """Return the catalog version, bumped on every book save and delete."""
+        return cache.get_or_set(cls.version_key, cls.initial_version, timeout=None)
+    
+    def cache_key(self, search: str, cover: str, author: str) -> str:
+        """Return the cache key for a normalized filter state."""
+        version = self.current_version()
+        filters = json.dumps([' '.join(search.casefold().split()), cover, author])
+        return f'books:facets:{version}:{hashlib.md5(filters.encode()).hexdigest()}'
+    
+    def get_facets(self, queryset, search: str = '', cover: str = '', author: str = '') -> dict:
+        """
+        Get facet counts for a filter state.
+        
+        Args:
+            queryset: Book queryset with the search filter already applied
+            search: Search term (part of the cache key only)
+            cover: Selected cover filter, or empty
+            author: Selected author filter, or empty
+        
+        Returns:
+            dict: Facet counts
+        """
+        key = self.cache_key(search, cover, author)
+        if self.cache_timeout:
+            facets = cache.get(key)
+            if facets is not None:
+                return facets
+        
+        groups = queryset.order_by().values('cover', 'author').annotate(
+            count=Count('id'),
+            available=Count('id', filter=Q(inventory__gt=0))
+        )
+        
+        covers = {}
+        authors = {}
+        total = available = 0
+        for group in groups:
+            cover_matches = not cover or group['cover'] == cover
+            author_matches = not author or group['author'] == author
+            
+            if author_matches:
+                covers[group['cover']] = covers.get(group['cover'], 0) + group['count']
+            if cover_matches:
+                authors[group['author']] = authors.get(group['author'], 0) + group['count']
+            if cover_matches and author_matches:
+                total += group['count']
+                available += group['available']
+        
+        facets = {
+            'total': total,
+            'cover': [
+                {'value': value, 'count': count}
+                for value, count in sorted(covers.items())
+            ],
+            'author': [
+                {'value': value, 'count': count}
+                for value, count in sorted(authors.items(), key=lambda item: (-item[1], item[0]))
+            ],
+            'availability': {
+                'available': available,
+                'unavailable': total - available,
+            },
+        }
+        
+        if self.cache_timeout:
+            cache.set(key, facets, timeout=self.cache_timeout)
+        return facets
\ No newline at end of file
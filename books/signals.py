@@ -0,0 +1,81 @@
+import logging
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Book
+from .events import get_event_broker, book_event_payload
+from .services import BookBatchService, BookFacetService
+from .autocomplete import get_autocomplete_service
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=Book)
+def publish_book_updated(sender, instance, created, **kwargs):
+    """
+    Publish availability changes (including inventory updates made by
+    Borrowing.save) once the transaction commits.
+    """
+    event = 'book.created' if created else 'book.updated'
+    payload = book_event_payload(instance)
+    transaction.on_commit(lambda: publish_book_event(event, payload))
+
+
+@receiver(post_delete, sender=Book)
+def publish_book_deleted(sender, instance, **kwargs):
+    """
+    Publish book removal once the transaction commits.
+    """
+    payload = {'book_id': instance.id}
+    transaction.on_commit(lambda: publish_book_event('book.deleted', payload))
+
+
+def publish_book_event(event: str, payload: dict):
+    """Publish a book event; the change is already committed, so a broker outage is only logged."""
+    try:
+        get_event_broker().publish(event, payload)
+    except Exception as e:
+        logger.error(f"Failed to publish {event} for book {payload['book_id']}: {str(e)}")
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def invalidate_book_cache(sender, instance, **kwargs):
+    """
+    Drop the cached book and facet counts once the transaction commits.
+    """
+    book_id = instance.id
+    transaction.on_commit(lambda: BookBatchService.invalidate(book_id))
+    transaction.on_commit(BookFacetService.bump_version)
+
+
+@receiver(post_save, sender=Book)
+def update_autocomplete_index(sender, instance, **kwargs):
+    """
+    Re-index the book's title and author once the transaction commits.
+    """
+    book_id, title, author = instance.id, instance.title, instance.author
+    
+    def update():
+        try:
+            get_autocomplete_service().update_book(book_id, title, author)
+        except Exception as e:
+            logger.error(f"Failed to update autocomplete index for book {book_id}: {str(e)}")
+    
+    transaction.on_commit(update)
+
+
+@receiver(post_delete, sender=Book)
+def remove_from_autocomplete_index(sender, instance, **kwargs):
+    """
+    Drop the book from the autocomplete index once the transaction commits.
+    """
+    book_id = instance.id
+    
+    def remove():
+        try:
+            get_autocomplete_service().remove_book(book_id)
+        except Exception as e:
+            logger.error(f"Failed to remove book {book_id} from autocomplete index: {str(e)}")
+    
+    transaction.on_commit(remove)
\ No newline at end of file
@@ -3,6 +3,7 @@ Tests for Books app.
 """
 
 import pytest
+from datetime import date, timedelta
 from django.urls import reverse
 from rest_framework import status
 
@@ -378,4 +379,663 @@ class TestBookPermissions:
         
         response = auth_client.delete(url)
         
-        assert response.status_code == status.HTTP_403_FORBIDDEN
\ No newline at end of file
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+
+@pytest.mark.django_db
+class TestBookConditionalGet:
+    """Test ETag/Last-Modified support for book views."""
+    
+    def test_book_detail_not_modified(self, api_client, book):
+        """Test that a matching If-None-Match returns 304."""
+        url = reverse('books:book-detail', kwargs={'pk': book.pk})
+        
+        response = api_client.get(url)
+        etag = response['ETag']
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert 'Last-Modified' in response
+        
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response['ETag'] == etag
+    
+    def test_book_detail_etag_changes_on_borrowing(self, api_client, user, book):
+        """Test that inventory changes from Borrowing.save invalidate the ETag."""
+        from borrowings.models import Borrowing
+        url = reverse('books:book-detail', kwargs={'pk': book.pk})
+        etag = api_client.get(url)['ETag']
+        initial_inventory = book.inventory
+        
+        Borrowing.objects.create(
+            user=user,
+            book=book,
+            expected_return_date=date.today() + timedelta(days=7)
+        )
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert response['ETag'] != etag
+        assert response.data['inventory'] == initial_inventory - 1
+    
+    def test_book_list_not_modified(self, api_client, multiple_books):
+        """Test that an unchanged book list returns 304."""
+        url = reverse('books:book-list')
+        etag = api_client.get(url)['ETag']
+        
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    
+    def test_book_list_etag_changes_on_borrowing_and_return(self, api_client, user, multiple_books):
+        """Test that borrowing and returning a book invalidate the list ETag."""
+        from borrowings.models import Borrowing
+        url = reverse('books:book-list')
+        first_etag = api_client.get(url)['ETag']
+        
+        borrowing = Borrowing.objects.create(
+            user=user,
+            book=multiple_books[0],
+            expected_return_date=date.today() + timedelta(days=7)
+        )
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=first_etag)
+        second_etag = response['ETag']
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert second_etag != first_etag
+        
+        borrowing.actual_return_date = date.today()
+        borrowing.save()
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=second_etag)
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert response['ETag'] not in (first_etag, second_etag)
+    
+    def test_book_list_etag_depends_on_filters(self, api_client, multiple_books):
+        """Test that differently filtered lists get different ETags."""
+        url = reverse('books:book-list')
+        
+        all_etag = api_client.get(url)['ETag']
+        filtered_etag = api_client.get(url, {'author': multiple_books[0].author})['ETag']
+        
+        assert all_etag != filtered_etag
+    
+    def test_book_list_revalidates_after_deleting_older_book(self, api_client, multiple_books,
+                                                             django_capture_on_commit_callbacks):
+        """Test that deleting a book other than the newest invalidates the list."""
+        url = reverse('books:book-list')
+        response = api_client.get(url)
+        etag = response['ETag']
+        
+        assert 'Last-Modified' not in response
+        
+        oldest = min(multiple_books, key=lambda book: book.updated_at)
+        with django_capture_on_commit_callbacks(execute=True):
+            oldest.delete()
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert response['ETag'] != etag
+    
+    def test_book_list_version_is_not_repeated_after_eviction(self, api_client, multiple_books):
+        """Test that a lost version counter restarts at a value no earlier ETag used."""
+        from django.core.cache import cache
+        from books.services import BookFacetService
+        url = reverse('books:book-list')
+        etag = api_client.get(url)['ETag']
+        
+        cache.delete(BookFacetService.version_key)
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert response['ETag'] != etag
+
+
+@pytest.mark.django_db
+class TestBookEvents:
+    """Test book availability event stream."""
+    
+    @pytest.fixture(autouse=True)
+    def fresh_broker(self):
+        """Give every test its own in-memory broker."""
+        from books.events import get_event_broker
+        get_event_broker.cache_clear()
+        yield get_event_broker()
+        get_event_broker.cache_clear()
+    
+    def read_stream(self, api_client, **headers):
+        """Read the (time-limited) event stream to completion."""
+        url = reverse('books:book-events')
+        response = api_client.get(url, HTTP_ACCEPT='text/event-stream', **headers)
+        assert response.status_code == status.HTTP_200_OK
+        assert response['Content-Type'] == 'text/event-stream'
+        return b''.join(response.streaming_content).decode()
+    
+    def test_broker_replay_and_gap(self):
+        """Test that the replay buffer detects evicted events."""
+        from books.events import InMemoryEventBroker
+        broker = InMemoryEventBroker(buffer_size=2)
+        for inventory in range(3):
+            broker.publish('book.updated', {'book_id': 1, 'inventory': inventory})
+        
+        assert [event['id'] for event in broker.events_after(1)] == [2, 3]
+        assert broker.events_after(3) == []
+        assert broker.events_after(0) is None
+    
+    def test_borrowing_publishes_inventory_change(self, fresh_broker, user, book, django_capture_on_commit_callbacks):
+        """Test that Borrowing.save publishes the new book inventory."""
+        from borrowings.models import Borrowing
+        initial_inventory = book.inventory
+        last_event_id = fresh_broker.last_event_id()
+        
+        with django_capture_on_commit_callbacks(execute=True):
+            Borrowing.objects.create(
+                user=user,
+                book=book,
+                expected_return_date=date.today() + timedelta(days=7)
+            )
+        
+        events = fresh_broker.events_after(last_event_id)
+        assert events[-1]['event'] == 'book.updated'
+        assert events[-1]['data'] == {
+            'book_id': book.id,
+            'inventory': initial_inventory - 1,
+            'is_available': initial_inventory - 1 > 0,
+        }
+    
+    def test_broker_outage_does_not_fail_committed_write(self, fresh_broker, monkeypatch, user, book,
+                                                         django_capture_on_commit_callbacks):
+        """Test that a failing broker is logged instead of failing the borrowing."""
+        from borrowings.models import Borrowing
+        
+        def unavailable(*args, **kwargs):
+            raise ConnectionError('broker down')
+        
+        monkeypatch.setattr(fresh_broker, 'publish', unavailable)
+        with django_capture_on_commit_callbacks(execute=True):
+            borrowing = Borrowing.objects.create(
+                user=user,
+                book=book,
+                expected_return_date=date.today() + timedelta(days=7)
+            )
+        
+        assert Borrowing.objects.filter(pk=borrowing.pk).exists()
+    
+    def test_stream_resumes_from_last_event_id(self, api_client, fresh_broker):
+        """Test that the stream replays events after Last-Event-ID."""
+        for book_id in (1, 2, 3):
+            fresh_broker.publish('book.updated', {'book_id': book_id, 'inventory': 0, 'is_available': False})
+        
+        content = self.read_stream(api_client, HTTP_LAST_EVENT_ID='1')
+        
+        assert 'id: 1\n' not in content
+        assert 'id: 2\nevent: book.updated\n' in content
+        assert 'id: 3\nevent: book.updated\n' in content
+        assert ': keep-alive' in content
+    
+    def test_stream_sends_reset_when_behind_buffer(self, api_client, settings):
+        """Test that a too-old Last-Event-ID gets a reset event."""
+        from books.events import get_event_broker
+        settings.BOOK_EVENTS_BUFFER_SIZE = 1
+        get_event_broker.cache_clear()
+        broker = get_event_broker()
+        broker.publish('book.updated', {'book_id': 1})
+        broker.publish('book.updated', {'book_id': 2})
+        
+        content = self.read_stream(api_client, HTTP_LAST_EVENT_ID='0')
+        
+        assert content.startswith('id: 2\nevent: reset\n')
+    
+    def test_stream_without_last_event_id_starts_from_now(self, api_client, fresh_broker):
+        """Test that new clients do not receive old events."""
+        fresh_broker.publish('book.updated', {'book_id': 1})
+        
+        content = self.read_stream(api_client)
+        
+        assert 'event: book.updated' not in content
+
+
+@pytest.mark.django_db
+class TestBookBatch:
+    """Test batched multi-get of books."""
+    
+    @pytest.fixture(autouse=True)
+    def clear_cache(self):
+        """Start every test with an empty object cache."""
+        from django.core.cache import cache
+        cache.clear()
+        yield
+        cache.clear()
+    
+    def test_book_batch_preserves_order_and_reports_missing(self, api_client, multiple_books):
+        """Test that books come back in request order with missing ids listed."""
+        url = reverse('books:book-batch')
+        ids = [multiple_books[2].id, 99999, multiple_books[0].id, multiple_books[2].id]
+        
+        response = api_client.get(url, {'ids': ','.join(str(book_id) for book_id in ids)})
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert [book['id'] for book in response.data['results']] == [multiple_books[2].id, multiple_books[0].id]
+        assert response.data['missing'] == [99999]
+    
+    def test_book_batch_post(self, api_client, multiple_books):
+        """Test multi-get with ids in the request body."""
+        url = reverse('books:book-batch')
+        ids = [book.id for book in reversed(multiple_books)]
+        
+        response = api_client.post(url, {'ids': ids}, format='json')
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert [book['id'] for book in response.data['results']] == ids
+        assert response.data['missing'] == []
+    
+    def test_book_batch_invalid_ids(self, api_client):
+        """Test multi-get with non-integer ids."""
+        url = reverse('books:book-batch')
+        
+        response = api_client.get(url, {'ids': '1,abc'})
+        
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+    
+    def test_book_batch_post_requires_object_body(self, api_client, multiple_books):
+        """Test that a bare JSON list body is rejected instead of failing."""
+        url = reverse('books:book-batch')
+        
+        response = api_client.post(url, [book.id for book in multiple_books], format='json')
+        
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+    
+    def test_book_batch_uses_single_query_then_cache(self, multiple_books, django_assert_num_queries):
+        """Test that misses cost one query and hits cost none."""
+        from books.services import BookBatchService
+        ids = [book.id for book in multiple_books]
+        
+        with django_assert_num_queries(1):
+            BookBatchService().get_books(ids)
+        with django_assert_num_queries(0):
+            results, missing = BookBatchService().get_books(ids)
+        
+        assert [book['id'] for book in results] == ids
+    
+    def test_book_batch_cache_invalidated_on_borrowing(self, user, book, django_capture_on_commit_callbacks):
+        """Test that inventory changes drop the cached book."""
+        from books.services import BookBatchService
+        from borrowings.models import Borrowing
+        initial_inventory = book.inventory
+        BookBatchService().get_books([book.id])
+        
+        with django_capture_on_commit_callbacks(execute=True):
+            Borrowing.objects.create(
+                user=user,
+                book=book,
+                expected_return_date=date.today() + timedelta(days=7)
+            )
+        results, missing = BookBatchService().get_books([book.id])
+        
+        assert results[0]['inventory'] == initial_inventory - 1
+    
+    def test_book_batch_load_racing_invalidation_is_not_cached(self, monkeypatch, book,
+                                                               django_assert_num_queries):
+        """Test that a load overtaken by an invalidation does not serve its copy later."""
+        from django.db.models import QuerySet
+        from books.services import BookBatchService
+        in_bulk = QuerySet.in_bulk
+        
+        def in_bulk_then_invalidate(queryset, *args, **kwargs):
+            books = in_bulk(queryset, *args, **kwargs)
+            # A write commits after the read but before the cache is filled
+            BookBatchService.invalidate(book.id)
+            return books
+        
+        monkeypatch.setattr(QuerySet, 'in_bulk', in_bulk_then_invalidate)
+        BookBatchService().get_books([book.id])
+        monkeypatch.setattr(QuerySet, 'in_bulk', in_bulk)
+        
+        with django_assert_num_queries(1):
+            BookBatchService().get_books([book.id])
+
+
+@pytest.mark.django_db
+class TestBookAutocomplete:
+    """Test the prefix autocomplete index."""
+    
+    @pytest.fixture(autouse=True)
+    def index_path(self, settings, tmp_path, monkeypatch):
+        """Point the index at a fresh snapshot file and delta log, rebuilt inline instead of in a thread."""
+        from django.core.cache import cache
+        from books.autocomplete import BookAutocompleteService, get_autocomplete_service
+        settings.BOOK_AUTOCOMPLETE_INDEX_PATH = str(tmp_path / 'autocomplete.idx')
+        self.schedule_rebuild = BookAutocompleteService.schedule_rebuild
+        
+        def schedule_rebuild(service, generation):
+            with service._locked():
+                service._build(generation)
+        
+        monkeypatch.setattr(BookAutocompleteService, 'schedule_rebuild', schedule_rebuild)
+        cache.clear()
+        get_autocomplete_service.cache_clear()
+        yield
+        get_autocomplete_service.cache_clear()
+        cache.clear()
+    
+    def create_book(self, title, author):
+        """Create a book with the given title and author."""
+        from books.models import Book
+        return Book.objects.create(title=title, author=author, inventory=1, daily_fee=1)
+    
+    def test_autocomplete_matches_word_prefixes(self, api_client):
+        """Test that any word start in the title or author matches."""
+        gatsby = self.create_book('The Great Gatsby', 'F. Scott Fitzgerald')
+        self.create_book('Great Expectations', 'Charles Dickens')
+        self.create_book('Dune', 'Frank Herbert')
+        url = reverse('books:book-autocomplete')
+        
+        response = api_client.get(url, {'q': 'GAT'})
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert [book['id'] for book in response.data['results']] == [gatsby.id]
+        
+        response = api_client.get(url, {'q': 'great'})
+        titles = [book['title'] for book in response.data['results']]
+        
+        # Start-of-field matches rank before later-word matches
+        assert titles == ['Great Expectations', 'The Great Gatsby']
+    
+    def test_autocomplete_limit(self, api_client):
+        """Test that results are capped at limit."""
+        for number in range(5):
+            self.create_book(f'Python {number}', 'Author')
+        url = reverse('books:book-autocomplete')
+        
+        response = api_client.get(url, {'q': 'py', 'limit': 2})
+        
+        assert len(response.data['results']) == 2
+    
+    def test_autocomplete_incremental_updates(self, django_capture_on_commit_callbacks):
+        """Test that saves and deletes patch an existing snapshot."""
+        from books.autocomplete import get_autocomplete_service
+        service = get_autocomplete_service()
+        book = self.create_book('Dune', 'Frank Herbert')
+        assert [result['id'] for result in service.search('dune')] == [book.id]
+        
+        with django_capture_on_commit_callbacks(execute=True):
+            book.title = 'Children of Dune'
+            book.save()
+            new_book = self.create_book('Neuromancer', 'William Gibson')
+        
+        assert service.search('children')[0]['id'] == book.id
+        assert service.search('neuro')[0]['id'] == new_book.id
+        
+        with django_capture_on_commit_callbacks(execute=True):
+            book.delete()
+        
+        assert service.search('dune') == []
+    
+    def test_autocomplete_snapshot_shared_between_handles(self, settings, django_capture_on_commit_callbacks):
+        """Test that another process handle sees a patched snapshot."""
+        from books.autocomplete import BookAutocompleteService
+        first = BookAutocompleteService(settings.BOOK_AUTOCOMPLETE_INDEX_PATH)
+        second = BookAutocompleteService(settings.BOOK_AUTOCOMPLETE_INDEX_PATH)
+        book = self.create_book('Dune', 'Frank Herbert')
+        assert second.search('dune')[0]['id'] == book.id
+        
+        snapshot_version = second._current_version()
+        
+        first.update_book(book.id, 'Dune Messiah', 'Frank Herbert')
+        
+        assert second.search('dune')[0]['title'] == 'Dune Messiah'
+        # Changes travel through the delta log, not by rewriting the snapshot
+        assert second._current_version() == snapshot_version
+    
+    def test_autocomplete_ranks_whole_prefix_range(self):
+        """Test that the best match is found even when many worse terms sort before it."""
+        from books.autocomplete import get_autocomplete_service
+        for number in range(10):
+            self.create_book(f'Zz {number}', f'Pyaa {number}')
+        best = self.create_book('Aa', 'Pyzz')
+        
+        results = get_autocomplete_service().search('py', limit=1)
+        
+        assert [result['id'] for result in results] == [best.id]
+    
+    def test_autocomplete_delta_log_compaction(self, settings):
+        """Test that a full delta log moves every node to a rebuilt snapshot."""
+        from books.autocomplete import BookAutocompleteService
+        settings.BOOK_AUTOCOMPLETE_DELTA_MAX = 2
+        writer = BookAutocompleteService(settings.BOOK_AUTOCOMPLETE_INDEX_PATH)
+        reader = BookAutocompleteService(settings.BOOK_AUTOCOMPLETE_INDEX_PATH)
+        book = self.create_book('Dune', 'Frank Herbert')
+        generation = reader.current_generation()
+        assert reader.search('dune')[0]['id'] == book.id
+        
+        for title in ('Dune Messiah', 'Children of Dune'):
+            book.title = title
+            book.save()
+            writer.update_book(book.id, book.title, book.author)
+        
+        assert reader.current_generation() > generation
+        assert reader.search('messiah') == []
+        assert reader.search('children')[0]['id'] == book.id
+        assert reader.get_index(reader.current_generation()).get_book(book.id) == ('Children of Dune', 'Frank Herbert')
+    
+    def test_autocomplete_replaced_index_stays_readable(self, settings):
+        """Test that an index still in use keeps working after the snapshot is replaced."""
+        from books.autocomplete import get_autocomplete_service, normalize
+        service = get_autocomplete_service()
+        book = self.create_book('Dune', 'Frank Herbert')
+        service.search('dune')
+        old_index = service._index
+        
+        service.rebuild()
+        service.search('dune')
+        
+        assert service._index is not old_index
+        assert old_index.search(normalize('dune'), 10)[0][2] == book.id
+    
+    def test_autocomplete_serves_old_snapshot_during_rebuild(self, settings, monkeypatch):
+        """Test that a lookup never waits for a rebuild and still sees changes made since the old snapshot."""
+        from books.autocomplete import BookAutocompleteService
+        settings.BOOK_AUTOCOMPLETE_DELTA_MAX = 2
+        started = []
+        
+        class NotStartedThread:
+            def __init__(self, target, args, daemon):
+                started.append(args)
+            
+            def start(self):
+                pass
+        
+        service = BookAutocompleteService(settings.BOOK_AUTOCOMPLETE_INDEX_PATH)
+        book = self.create_book('Dune', 'Frank Herbert')
+        service.rebuild()
+        snapshot_version = service._current_version()
+        generation = service.current_generation()
+        monkeypatch.setattr(BookAutocompleteService, 'schedule_rebuild', self.schedule_rebuild)
+        monkeypatch.setattr('books.autocomplete.threading.Thread', NotStartedThread)
+        
+        # The second change fills the log and moves to the next generation
+        service.update_book(book.id, 'Dune Messiah', 'Frank Herbert')
+        new_book = self.create_book('Neuromancer', 'William Gibson')
+        service.update_book(new_book.id, new_book.title, new_book.author)
+        service.update_book(new_book.id, 'Count Zero', 'William Gibson')
+        
+        assert service.current_generation() == generation + 1
+        assert service.search('messiah')[0]['id'] == book.id
+        assert service.search('count')[0]['id'] == new_book.id
+        assert service.search('neuro') == []
+        assert started == [(generation + 1,)]
+        assert service._current_version() == snapshot_version
+    
+    @pytest.mark.django_db(transaction=True)
+    def test_autocomplete_rebuilds_in_background(self, settings):
+        """Test that a missing snapshot is built by a background thread."""
+        import time
+        from books.autocomplete import BookAutocompleteService
+        service = BookAutocompleteService(settings.BOOK_AUTOCOMPLETE_INDEX_PATH)
+        book = self.create_book('Dune', 'Frank Herbert')
+        
+        self.schedule_rebuild(service, service.current_generation())
+        for _ in range(100):
+            if not service._building:
+                break
+            time.sleep(0.05)
+        
+        assert service._snapshot_generation() == service.current_generation()
+        assert service.search('dune')[0]['id'] == book.id
+    
+    def test_short_prefixes_use_precomputed_top_books(self, tmp_path):
+        """Test that the stored best books of short prefixes match ranking the whole range."""
+        from books.autocomplete import TOP_SIZE, BookAutocompleteIndex, build_snapshot
+        books = {book_id: (f'Title {book_id:03}', f'Pyauthor {book_id % 7}') for book_id in range(1, TOP_SIZE * 2)}
+        books[500] = ('Python', 'Guido')
+        path = tmp_path / 'top.idx'
+        path.write_bytes(build_snapshot(books))
+        index = BookAutocompleteIndex(str(path))
+        
+        for prefix, limit, exclude in [('p', 5, ()), ('py', 10, {500}), ('t', 3, set(range(1, TOP_SIZE)))]:
+            expected = index._labels(index._rank_range(prefix, limit, exclude))
+            assert index.search(prefix, limit, exclude) == expected
+        assert index.search('py', 1)[0][2] == 500
+        assert index.search('zz', 5) == []
+
+
+@pytest.mark.django_db
+class TestBookFacets:
+    """Test faceted catalog counts."""
+    
+    @pytest.fixture(autouse=True)
+    def catalog(self):
+        """Create a small catalog and start with an empty cache."""
+        from django.core.cache import cache
+        from books.models import Book
+        cache.clear()
+        Book.objects.create(title='Dune', author='Herbert', cover='HARD', inventory=1, daily_fee=1)
+        Book.objects.create(title='Dune Messiah', author='Herbert', cover='SOFT', inventory=0, daily_fee=1)
+        Book.objects.create(title='Emma', author='Austen', cover='SOFT', inventory=2, daily_fee=1)
+        yield
+        cache.clear()
+    
+    def test_facets_without_filters(self, api_client):
+        """Test facet counts over the whole catalog."""
+        url = reverse('books:book-facets')
+        
+        response = api_client.get(url)
+        facets = response.data['facets']
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert facets['total'] == 3
+        assert facets['cover'] == [{'value': 'HARD', 'count': 1}, {'value': 'SOFT', 'count': 2}]
+        assert facets['author'] == [{'value': 'Herbert', 'count': 2}, {'value': 'Austen', 'count': 1}]
+        assert facets['availability'] == {'available': 2, 'unavailable': 1}
+    
+    def test_facets_exclude_own_filter(self, api_client):
+        """Test that each facet is counted with only the other filters applied."""
+        url = reverse('books:book-facets')
+        
+        response = api_client.get(url, {'cover': 'SOFT'})
+        facets = response.data['facets']
+        
+        assert facets['total'] == 2
+        assert facets['cover'] == [{'value': 'HARD', 'count': 1}, {'value': 'SOFT', 'count': 2}]
+        assert facets['author'] == [{'value': 'Austen', 'count': 1}, {'value': 'Herbert', 'count': 1}]
+        assert facets['availability'] == {'available': 1, 'unavailable': 1}
+    
+    def test_facets_with_search(self, api_client):
+        """Test that the search term narrows all facets."""
+        url = reverse('books:book-facets')
+        
+        response = api_client.get(url, {'search': 'dune'})
+        
+        assert response.data['facets']['total'] == 2
+        assert response.data['facets']['author'] == [{'value': 'Herbert', 'count': 2}]
+    
+    def test_facets_single_query_and_cache(self, django_assert_num_queries):
+        """Test that a miss costs one grouped query and a hit costs none."""
+        from books.models import Book
+        from books.services import BookFacetService
+        
+        with django_assert_num_queries(1):
+            first = BookFacetService().get_facets(Book.objects.all(), search='  DUNE ')
+        with django_assert_num_queries(0):
+            second = BookFacetService().get_facets(Book.objects.all(), search='dune')
+        
+        assert first == second
+    
+    def test_facets_invalidated_on_borrowing(self, user, django_capture_on_commit_callbacks):
+        """Test that inventory changes from Borrowing.save invalidate cached facets."""
+        from books.models import Book
+        from books.services import BookFacetService
+        from borrowings.models import Borrowing
+        assert BookFacetService().get_facets(Book.objects.all())['availability']['available'] == 2
+        
+        with django_capture_on_commit_callbacks(execute=True):
+            Borrowing.objects.create(
+                user=user,
+                book=Book.objects.get(title='Dune'),
+                expected_return_date=date.today() + timedelta(days=7)
+            )
+        
+        assert BookFacetService().get_facets(Book.objects.all())['availability']['available'] == 1
+
+
+@pytest.mark.django_db
+class TestEstimatedCountPagination:
+    """Test estimated counts on paginated lists."""
+    
+    @pytest.fixture(autouse=True)
+    def clear_cache(self):
+        """Start every test with an empty count cache."""
+        from django.core.cache import cache
+        cache.clear()
+        yield
+        cache.clear()
+    
+    def test_small_list_has_exact_count(self, api_client, multiple_books):
+        """Test that small result sets report an exact count."""
+        url = reverse('books:book-list')
+        
+        response = api_client.get(url)
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['count'] == 5
+        assert response.data['count_is_approximate'] is False
+    
+    def test_large_estimate_is_flagged_approximate(self, api_client, multiple_books, monkeypatch, settings):
+        """Test that an estimate above the threshold replaces the exact count."""
+        from library_service.pagination import EstimatedCountPaginator
+        settings.ESTIMATED_COUNT_THRESHOLD = 1000
+        monkeypatch.setattr(EstimatedCountPaginator, 'get_estimate', lambda self, queryset: 250000)
+        url = reverse('books:book-list')
+        
+        response = api_client.get(url)
+        
+        assert response.data['count'] == 250000
+        assert response.data['count_is_approximate'] is True
+        assert len(response.data['results']) == 5
+    
+    def test_large_count_cached_per_filter(self, multiple_books, settings, django_assert_num_queries):
+        """Test that large counts are cached per filtered query."""
+        from books.models import Book
+        from library_service.pagination import EstimatedCountPaginator
+        settings.ESTIMATED_COUNT_THRESHOLD = 1
+        queryset = Book.objects.order_by('id')
+        
+        with django_assert_num_queries(1):
+            assert EstimatedCountPaginator(queryset, 10).count == 5
+        with django_assert_num_queries(0):
+            assert EstimatedCountPaginator(queryset, 10).count == 5
+        with django_assert_num_queries(1):
+            assert EstimatedCountPaginator(queryset.filter(author=multiple_books[0].author), 10).count >= 1
+    
+    def test_small_count_not_cached(self, multiple_books, django_assert_num_queries):
+        """Test that counts below the threshold stay live."""
+        from books.models import Book
+        from library_service.pagination import EstimatedCountPaginator
+        queryset = Book.objects.order_by('id')
+        
+        assert EstimatedCountPaginator(queryset, 10).count == 5
+        multiple_books[0].delete()
+        
+        with django_assert_num_queries(1):
+            assert EstimatedCountPaginator(queryset, 10).count == 4
\ No newline at end of file
@@ -6,4 +6,8 @@ app_name = 'books'
 urlpatterns = [
     path('', views.BookListView.as_view(), name='book-list'),
     path('<int:pk>/', views.BookDetailView.as_view(), name='book-detail'),
+    path('autocomplete/', views.BookAutocompleteView.as_view(), name='book-autocomplete'),
+    path('facets/', views.BookFacetView.as_view(), name='book-facets'),
+    path('batch/', views.BookBatchView.as_view(), name='book-batch'),
+    path('events/', views.BookEventStreamView.as_view(), name='book-events'),
 ]
\ No newline at end of file
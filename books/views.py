@@ -1,13 +1,20 @@
-from rest_framework import generics, permissions
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework import generics, permissions, status
+from rest_framework.renderers import BaseRenderer
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
 from .models import Book
 from .serializers import BookSerializer, BookListSerializer
 from .permissions import BookPermissions
+from .events import get_event_broker, iter_events, format_event
+from .services import BookBatchService, BookFacetService
+from .autocomplete import get_autocomplete_service
+from library_service.conditional import ConditionalGetMixin
 
 
-class BookListView(generics.ListCreateAPIView):
+class BookListView(ConditionalGetMixin, generics.ListCreateAPIView):
     """View for listing and creating books."""
     
     queryset = Book.objects.all()
@@ -18,15 +25,187 @@ class BookListView(generics.ListCreateAPIView):
     ordering_fields = ['title', 'author', 'daily_fee', 'inventory']
     ordering = ['title']
     
+    def get_list_version(self):
+        """Catalog version bumped on every book save and delete, so no extra COUNT is needed."""
+        return BookFacetService.current_version()
+    
     def get_serializer_class(self):
         if self.request.method == 'GET':
             return BookListSerializer
         return BookSerializer
 
 
-class BookDetailView(generics.RetrieveUpdateDestroyAPIView):
+class BookDetailView(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     """View for retrieving, updating and deleting books."""
     
     queryset = Book.objects.all()
     serializer_class = BookSerializer
-    permission_classes = [BookPermissions]
\ No newline at end of file
+    permission_classes = [BookPermissions]
+
+
+class BookFacetView(generics.GenericAPIView):
+    """
+    View for catalog sidebar facet counts.
+    
+    Accepts the same ``search``, ``cover`` and ``author`` parameters as the
+    book list and returns counts per cover, per author and by availability.
+    """
+    
+    queryset = Book.objects.all()
+    permission_classes = [permissions.AllowAny]
+    filter_backends = [SearchFilter]
+    search_fields = ['title', 'author']
+    
+    def get(self, request, *args, **kwargs):
+        """Get facet counts for the current filter state."""
+        queryset = self.filter_queryset(self.get_queryset())
+        facets = BookFacetService().get_facets(
+            queryset,
+            search=request.query_params.get('search', ''),
+            cover=request.query_params.get('cover', ''),
+            author=request.query_params.get('author', '')
+        )
+        
+        return Response({
+            "facets": facets
+        }, status=status.HTTP_200_OK)
+
+
+class BookBatchView(generics.GenericAPIView):
+    """
+    View for fetching many books in one request.
+    
+    Accepts ``?ids=1,2,3`` on GET or ``{"ids": [1, 2, 3]}`` on POST and
+    returns the books in request order along with the ids that were not found.
+    """
+    
+    permission_classes = [permissions.AllowAny]
+    
+    def get(self, request, *args, **kwargs):
+        """Get books by a comma-separated ``ids`` query parameter."""
+        raw_ids = request.query_params.get('ids', '')
+        return self.batch_response([value for value in raw_ids.split(',') if value.strip()])
+    
+    def post(self, request, *args, **kwargs):
+        """Get books by an ``ids`` list in the request body."""
+        raw_ids = request.data.get('ids', []) if isinstance(request.data, dict) else None
+        if not isinstance(raw_ids, list):
+            return Response(
+                {"error": "ids must be a list of book ids."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return self.batch_response(raw_ids)
+    
+    def batch_response(self, raw_ids):
+        """Validate ids and return the batch result."""
+        max_ids = getattr(settings, 'BOOK_BATCH_MAX_IDS', 100)
+        
+        try:
+            book_ids = [int(value) for value in raw_ids]
+        except (TypeError, ValueError):
+            return Response(
+                {"error": "ids must be integers."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if not book_ids:
+            return Response(
+                {"error": "At least one id is required."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if len(book_ids) > max_ids:
+            return Response(
+                {"error": f"At most {max_ids} ids can be requested at once."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        results, missing = BookBatchService().get_books(book_ids)
+        
+        return Response({
+            "results": results,
+            "missing": missing
+        }, status=status.HTTP_200_OK)
+
+
+class BookAutocompleteView(generics.GenericAPIView):
+    """
+    View for search-as-you-type suggestions.
+    
+    Served from the shared in-memory prefix index instead of an
+    ``icontains`` scan over the Book table.
+    """
+    
+    permission_classes = [permissions.AllowAny]
+    
+    def get(self, request, *args, **kwargs):
+        """Get books whose title or author has a word starting with ``q``."""
+        query = request.query_params.get('q', '')
+        max_limit = getattr(settings, 'BOOK_AUTOCOMPLETE_MAX_RESULTS', 50)
+        
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), max_limit)
+        except ValueError:
+            return Response(
+                {"error": "limit must be an integer."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        results = get_autocomplete_service().search(query, max(limit, 1)) if query.strip() else []
+        
+        return Response({
+            "query": query,
+            "results": results
+        }, status=status.HTTP_200_OK)
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Renderer that lets content negotiation accept ``text/event-stream``."""
+    
+    media_type = 'text/event-stream'
+    format = 'txt'
+    
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return data
+
+
+class BookEventStreamView(generics.GenericAPIView):
+    """
+    Server-Sent Events stream of book availability changes.
+    
+    Clients resume from the ``Last-Event-ID`` header (or ``last_event_id``
+    query parameter). If the requested id is older than the replay buffer a
+    ``reset`` event is sent and the client should reload the book list once.
+    The stream closes after ``BOOK_EVENTS_STREAM_DURATION`` seconds and the
+    browser reconnects with its last id. An open stream holds a web worker
+    thread, so it is served by the threaded gunicorn workers configured in
+    ``gunicorn.conf.py``.
+    """
+    
+    permission_classes = [permissions.AllowAny]
+    renderer_classes = [EventStreamRenderer]
+    
+    def get(self, request, *args, **kwargs):
+        """Open the event stream."""
+        last_event_id = request.META.get('HTTP_LAST_EVENT_ID') or request.GET.get('last_event_id')
+        broker = get_event_broker()
+        
+        try:
+            last_event_id = int(last_event_id)
+        except (TypeError, ValueError):
+            # Fresh clients only want changes from now on
+            last_event_id = broker.last_event_id()
+        
+        events = iter_events(
+            broker,
+            last_event_id,
+            heartbeat=getattr(settings, 'BOOK_EVENTS_HEARTBEAT', 15),
+            duration=getattr(settings, 'BOOK_EVENTS_STREAM_DURATION', 60)
+        )
+        response = StreamingHttpResponse(
+            (format_event(message) for message in events),
+            content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
\ No newline at end of file
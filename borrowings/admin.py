@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Borrowing
+from .models import Borrowing, ArchivedBorrowing
+from .services import BorrowingReturnService
 
 
 @admin.register(Borrowing)
@@ -24,6 +25,7 @@ class BorrowingAdmin(admin.ModelAdmin):
     )
     
     readonly_fields = ('borrow_date', 'is_active', 'is_overdue')
+    actions = ['mark_returned', 'waive_fines']
     
     def is_active(self, obj):
         """Display active status."""
@@ -35,4 +37,34 @@ class BorrowingAdmin(admin.ModelAdmin):
         """Display overdue status."""
         return obj.is_overdue
     is_overdue.boolean = True
-    is_overdue.short_description = 'Overdue'
\ No newline at end of file
+    is_overdue.short_description = 'Overdue'
+    
+    def mark_returned(self, request, queryset):
+        """Return the selected active borrowings in one statement."""
+        returned = BorrowingReturnService().mark_returned(queryset, user=request.user)
+        self.message_user(request, f"Marked {len(returned)} borrowings returned")
+    mark_returned.short_description = 'Mark selected borrowings returned'
+    
+    def waive_fines(self, request, queryset):
+        """Waive the fines of the selected borrowings in one statement per table."""
+        from payments.fine_service import FineCalculationService
+        result = FineCalculationService().waive_fines(
+            queryset.values('pk'), 'Admin bulk action', user=request.user
+        )
+        self.message_user(request, f"Waived fines of {result['waived']} borrowings (${result['total_waived']})")
+    waive_fines.short_description = 'Waive fines of selected borrowings'
+
+
+@admin.register(ArchivedBorrowing)
+class ArchivedBorrowingAdmin(admin.ModelAdmin):
+    """Read-only admin for archived borrowings."""
+    
+    list_display = ('id', 'user', 'book_title', 'borrow_date', 'actual_return_date', 'archived_at')
+    search_fields = ('user__email', 'book_title', 'book_author')
+    ordering = ('-borrow_date',)
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
\ No newline at end of file
@@ -0,0 +1 @@
+# Management commands for borrowings
\ No newline at end of file
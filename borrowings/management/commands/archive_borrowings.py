@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from borrowings.services import BorrowingArchiveService
+
+
+class Command(BaseCommand):
+    help = 'Move returned borrowings older than N years (with their payments) into the archive table'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--years',
+            type=int,
+            default=getattr(settings, 'BORROWING_ARCHIVE_AFTER_YEARS', 3),
+            help='Archive borrowings returned more than this many years ago'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=None,
+            help='Number of borrowings archived per transaction'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report how many borrowings would be archived'
+        )
+    
+    def handle(self, *args, **options):
+        """Archive old returned borrowings."""
+        if options['years'] < 1:
+            self.stdout.write(
+                self.style.ERROR('--years must be at least 1')
+            )
+            return
+        
+        service = BorrowingArchiveService(batch_size=options['batch_size'])
+        cutoff = service.get_cutoff(options['years'])
+        count = service.archive(cutoff, dry_run=options['dry_run'])
+        
+        if options['dry_run']:
+            self.stdout.write(
+                self.style.WARNING(f'{count} borrowings returned before {cutoff} would be archived')
+            )
+        else:
+            self.stdout.write(
+                self.style.SUCCESS(f'Archived {count} borrowings returned before {cutoff}')
+            )
\ No newline at end of file
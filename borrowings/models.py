@@ -15,11 +15,20 @@ class Borrowing(models.Model):
     actual_return_date = models.DateField(null=True, blank=True)
     book = models.ForeignKey('books.Book', on_delete=models.CASCADE, related_name='borrowings')
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='borrowings')
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         verbose_name = 'Borrowing'
         verbose_name_plural = 'Borrowings'
         ordering = ['-borrow_date']
+        indexes = [
+            # Overdue/reminder scans only ever look at active borrowings
+            models.Index(
+                fields=['expected_return_date'],
+                condition=models.Q(actual_return_date__isnull=True),
+                name='borrowing_active_due_idx'
+            ),
+        ]
     
     def __str__(self):
         return f"{self.user.email} borrowed {self.book.title} on {self.borrow_date}"
@@ -63,4 +72,41 @@ class Borrowing(models.Model):
                 self.book.inventory += 1
                 self.book.save()
         
-        super().save(*args, **kwargs)
\ No newline at end of file
+        super().save(*args, **kwargs)
+
+
+class ArchivedBorrowing(models.Model):
+    """
+    Returned borrowing moved out of the hot table by ``archive_borrowings``.
+    
+    Keeps the original id, the book title/author at archive time and the
+    borrowing's payments as JSON so history stays readable after the
+    Borrowing and Payment rows are gone.
+    """
+    
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_borrowings')
+    book_id = models.IntegerField()
+    book_title = models.CharField(max_length=255)
+    book_author = models.CharField(max_length=255)
+    borrow_date = models.DateField()
+    expected_return_date = models.DateField()
+    actual_return_date = models.DateField()
+    payments = models.JSONField(default=list)
+    archived_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        verbose_name = 'Archived borrowing'
+        verbose_name_plural = 'Archived borrowings'
+        ordering = ['-borrow_date']
+        indexes = [
+            models.Index(fields=['user', '-borrow_date'], name='archived_user_date_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Archived borrowing {self.id} of {self.book_title} on {self.borrow_date}"
+    
+    @property
+    def is_active(self):
+        """Archived borrowings are always returned."""
+        return False
\ No newline at end of file
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Borrowing
+from .models import Borrowing, ArchivedBorrowing
 from books.serializers import BookSerializer
 
 
@@ -70,4 +70,19 @@ class BorrowingReturnSerializer(serializers.ModelSerializer):
         from datetime import date
         if value < date.today():
             raise serializers.ValidationError("Return date cannot be in the past.")
-        return value
\ No newline at end of file
+        return value
+
+
+class ArchivedBorrowingSerializer(serializers.ModelSerializer):
+    """Serializer for archived borrowings with their payments."""
+    
+    is_active = serializers.ReadOnlyField()
+    
+    class Meta:
+        model = ArchivedBorrowing
+        fields = [
+            'id', 'borrow_date', 'expected_return_date', 'actual_return_date',
+            'book_id', 'book_title', 'book_author', 'user', 'is_active',
+            'payments', 'archived_at'
+        ]
+        read_only_fields = fields
\ No newline at end of file
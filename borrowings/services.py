@@ -0,0 +1,248 @@
+import logging
+from collections import Counter
+from datetime import date
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Exists, F, OuterRef, PositiveIntegerField, Value, When
+from django.utils import timezone
+from books.models import Book
+from library_service.bulk import log_bulk_change, update_returning
+from payments.fine_ledger import FineLedger
+from payments.models import Payment, Refund
+from .models import Borrowing, ArchivedBorrowing
+
+logger = logging.getLogger(__name__)
+
+
+class BorrowingArchiveService:
+    """
+    Service for moving old returned borrowings into ``ArchivedBorrowing``.
+    
+    Keeping only active and recent loans in the Borrowing table keeps its
+    indexes small, so the overdue/reminder scans and per-user lists stay
+    fast as history grows.
+    """
+    
+    def __init__(self, batch_size: int = None):
+        self.batch_size = batch_size or getattr(settings, 'BORROWING_ARCHIVE_BATCH_SIZE', 1000)
+    
+    @staticmethod
+    def get_cutoff(years: int, today: date = None) -> date:
+        """
+        Return the return date before which borrowings are archived.
+        
+        Args:
+            years: Age in years of the oldest returns to keep
+            today: Reference date (defaults to today)
+        
+        Returns:
+            date: Cutoff date
+        """
+        today = today or date.today()
+        try:
+            return today.replace(year=today.year - years)
+        except ValueError:
+            # 29 February in a non-leap target year
+            return today.replace(year=today.year - years, day=28)
+    
+    @staticmethod
+    def settled(queryset):
+        """
+        Narrow ``queryset`` to borrowings with nothing left to settle.
+        
+        Deleting a borrowing cascades to its payments, refunds and fine
+        ledger, so a borrowing with a pending payment, a refund that is
+        still queued or processing, or an outstanding fine balance stays
+        until it is settled.
+        """
+        outstanding_fines = FineLedger.balances().annotate(
+            owed=F('accrued') - F('waived') - F('paid')
+        ).filter(owed__gt=0)
+        return queryset.exclude(
+            Exists(Payment.objects.filter(borrowing_id=OuterRef('pk'), status='PENDING'))
+        ).exclude(
+            Exists(Refund.objects.filter(payment__borrowing_id=OuterRef('pk'), status__in=['QUEUED', 'PROCESSING']))
+        ).exclude(
+            Exists(outstanding_fines.filter(borrowing_id=OuterRef('pk')))
+        )
+    
+    def get_archivable(self, cutoff: date):
+        """Return settled borrowings returned before ``cutoff``."""
+        return self.settled(Borrowing.objects.filter(actual_return_date__lt=cutoff))
+    
+    @staticmethod
+    def serialize_payment(payment) -> dict:
+        """Return the compact JSON form of a payment stored in the archive."""
+        return {
+            'id': payment.id,
+            'type': payment.type,
+            'status': payment.status,
+            'money_to_pay': str(payment.money_to_pay),
+            'refunded_amount': str(payment.refunded_amount),
+            'created_at': payment.created_at.isoformat(),
+            'paid_at': payment.paid_at.isoformat() if payment.paid_at else None,
+            'session_id': payment.session_id,
+        }
+    
+    def archive_batch(self, borrowing_ids: list) -> int:
+        """
+        Archive one batch of borrowings and delete them (and their payments).
+        
+        Args:
+            borrowing_ids: Ids of returned borrowings; unsettled ones are skipped
+        
+        Returns:
+            int: Number of borrowings archived
+        """
+        with transaction.atomic():
+            borrowings = list(
+                # Re-checked here: a payment or refund may have been opened since the ids were listed
+                self.settled(Borrowing.objects.filter(id__in=borrowing_ids, actual_return_date__isnull=False))
+                .select_related('book')
+                .prefetch_related('payments')
+            )
+            ArchivedBorrowing.objects.bulk_create(
+                [
+                    ArchivedBorrowing(
+                        id=borrowing.id,
+                        user_id=borrowing.user_id,
+                        book_id=borrowing.book_id,
+                        book_title=borrowing.book.title,
+                        book_author=borrowing.book.author,
+                        borrow_date=borrowing.borrow_date,
+                        expected_return_date=borrowing.expected_return_date,
+                        actual_return_date=borrowing.actual_return_date,
+                        payments=[self.serialize_payment(payment) for payment in borrowing.payments.all()],
+                    )
+                    for borrowing in borrowings
+                ],
+                ignore_conflicts=True
+            )
+            Borrowing.objects.filter(id__in=[borrowing.id for borrowing in borrowings]).delete()
+        return len(borrowings)
+    
+    def archive(self, cutoff: date, dry_run: bool = False) -> int:
+        """
+        Archive every borrowing returned before ``cutoff`` in batches.
+        
+        Each batch runs in its own transaction, so an interrupted run can
+        simply be restarted.
+        
+        Args:
+            cutoff: Borrowings returned before this date are archived
+            dry_run: Only count what would be archived
+        
+        Returns:
+            int: Number of borrowings archived (or archivable for a dry run)
+        """
+        queryset = self.get_archivable(cutoff)
+        if dry_run:
+            return queryset.count()
+        
+        archived = 0
+        last_id = 0
+        while True:
+            batch_ids = list(
+                queryset.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:self.batch_size]
+            )
+            if not batch_ids:
+                break
+            archived += self.archive_batch(batch_ids)
+            last_id = batch_ids[-1]
+        
+        logger.info(f"Archived {archived} borrowings returned before {cutoff}")
+        return archived
+
+
+class BorrowingReturnService:
+    """
+    Mark many borrowings returned at once (admin action).
+    
+    The borrowings are updated with one ``UPDATE ... RETURNING`` and the
+    work ``Borrowing.save`` and its signals do per row is done set-based:
+    one inventory ``UPDATE`` for all books, and one delete each for the
+    pending due-date events and overdue alert states. Book caches and
+    availability events are refreshed and one digest notification is sent
+    after the transaction commits.
+    """
+    
+    def mark_returned(self, borrowings, user=None, return_date: date = None) -> list:
+        """
+        Return every active borrowing of a queryset.
+        
+        Args:
+            borrowings: Borrowing queryset
+            user: Admin returning the books, recorded in the admin history
+            return_date: Return date (defaults to today)
+        
+        Returns:
+            list: Ids of the borrowings returned
+        """
+        from notifications.models import OverdueNotificationState
+        from tasks.models import DueDateEvent
+        return_date = return_date or date.today()
+        
+        with transaction.atomic():
+            returned = update_returning(
+                borrowings.filter(actual_return_date__isnull=True),
+                ['id', 'book_id'],
+                actual_return_date=return_date,
+                updated_at=timezone.now()
+            )
+            if not returned:
+                return []
+            
+            borrowing_ids = [borrowing_id for borrowing_id, _ in returned]
+            copies = Counter(book_id for _, book_id in returned)
+            books_by_copies = {}
+            for book_id, count in copies.items():
+                books_by_copies.setdefault(count, []).append(book_id)
+            Book.objects.filter(pk__in=list(copies)).update(
+                inventory=F('inventory') + Case(
+                    *[When(pk__in=book_ids, then=Value(count)) for count, book_ids in books_by_copies.items()],
+                    output_field=PositiveIntegerField()
+                ),
+                updated_at=timezone.now()
+            )
+            DueDateEvent.objects.filter(borrowing_id__in=borrowing_ids).delete()
+            OverdueNotificationState.objects.filter(borrowing_id__in=borrowing_ids).delete()
+            log_bulk_change(user, Borrowing, borrowing_ids, f"Marked returned on {return_date}")
+            
+            transaction.on_commit(lambda: self.after_return(borrowing_ids, list(copies), return_date, user))
+        return borrowing_ids
+    
+    def after_return(self, borrowing_ids: list, book_ids: list, return_date: date, user=None):
+        """Publish the new availability of the books and send one digest notification."""
+        from books.events import book_event_payload, get_event_broker
+        from books.services import BookBatchService, BookFacetService
+        from notifications.services import TelegramNotificationService
+        
+        try:
+            broker = get_event_broker()
+            for book in Book.objects.filter(pk__in=book_ids):
+                BookBatchService.invalidate(book.id)
+                broker.publish('book.updated', book_event_payload(book))
+            BookFacetService.bump_version()
+        except Exception as e:
+            logger.error(f"Failed to publish availability of returned books: {str(e)}")
+        
+        try:
+            max_items = getattr(settings, 'BULK_NOTIFICATION_MAX_ITEMS', 20)
+            borrowings = Borrowing.objects.select_related('user', 'book').filter(
+                pk__in=borrowing_ids[:max_items]
+            ).order_by('pk')
+            TelegramNotificationService().send_bulk_notification(
+                "📖 Books Returned",
+                count=len(borrowing_ids),
+                details={
+                    '📚 Borrowings': len(borrowing_ids),
+                    '📅 Return Date': return_date,
+                    '👤 By': user.email if user is not None else 'System',
+                },
+                items=[
+                    f"{borrowing.user.get_full_name() or borrowing.user.email} - {borrowing.book.title} #{borrowing.id}"
+                    for borrowing in borrowings
+                ]
+            )
+        except Exception as e:
+            logger.error(f"Failed to send bulk return notification: {str(e)}")
\ No newline at end of file
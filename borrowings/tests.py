@@ -437,4 +437,267 @@ class TestBorrowingPermissions:
         
         response = auth_client.patch(url, data)
         
-        assert response.status_code == status.HTTP_200_OK
\ No newline at end of file
+        assert response.status_code == status.HTTP_200_OK
+
+
+@pytest.mark.django_db
+class TestBorrowingConditionalGet:
+    """Test ETag/Last-Modified support for borrowing detail."""
+    
+    def get_detail(self, user, borrowing, etag=None):
+        """Call BorrowingDetailView directly, optionally with If-None-Match."""
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from borrowings.views import BorrowingDetailView
+        
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        request = APIRequestFactory().get(f'/borrowings/{borrowing.pk}/', **headers)
+        force_authenticate(request, user=user)
+        return BorrowingDetailView.as_view()(request, pk=borrowing.pk)
+    
+    def test_borrowing_detail_not_modified(self, user, borrowing):
+        """Test that a matching If-None-Match returns 304."""
+        etag = self.get_detail(user, borrowing)['ETag']
+        
+        response = self.get_detail(user, borrowing, etag)
+        
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response['ETag'] == etag
+    
+    def test_borrowing_detail_last_modified_covers_today(self, user, borrowing):
+        """Test that Last-Modified moves with the date, like the overdue fields."""
+        from datetime import datetime, time
+        from django.utils import timezone
+        from django.utils.http import parse_http_date
+        from books.models import Book
+        from borrowings.models import Borrowing
+        long_ago = timezone.now() - timedelta(days=3)
+        Borrowing.objects.filter(pk=borrowing.pk).update(updated_at=long_ago)
+        Book.objects.filter(pk=borrowing.book_id).update(updated_at=long_ago)
+        
+        response = self.get_detail(user, borrowing)
+        start_of_day = timezone.make_aware(datetime.combine(date.today(), time.min))
+        
+        assert parse_http_date(response['Last-Modified']) == int(start_of_day.timestamp())
+    
+    def test_borrowing_detail_etag_changes_on_return(self, user, borrowing):
+        """Test that returning the book invalidates the ETag."""
+        etag = self.get_detail(user, borrowing)['ETag']
+        
+        borrowing.actual_return_date = date.today()
+        borrowing.save()
+        response = self.get_detail(user, borrowing, etag)
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert response['ETag'] != etag
+        assert response.data['actual_return_date'] == date.today().isoformat()
+    
+    def test_borrowing_detail_etag_changes_on_book_inventory(self, user, borrowing):
+        """Test that another borrowing of the same book invalidates the ETag."""
+        from borrowings.models import Borrowing
+        borrowing.book.inventory = 5
+        borrowing.book.save()
+        etag = self.get_detail(user, borrowing)['ETag']
+        
+        Borrowing.objects.create(
+            user=user,
+            book=borrowing.book,
+            expected_return_date=date.today() + timedelta(days=7)
+        )
+        response = self.get_detail(user, borrowing, etag)
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['book']['inventory'] == borrowing.book.inventory
+    
+    def test_borrowing_detail_not_modified_requires_permission(self, user, borrowing):
+        """Test that a valid ETag does not bypass object permissions."""
+        from django.contrib.auth import get_user_model
+        etag = self.get_detail(user, borrowing)['ETag']
+        other_user = get_user_model().objects.create_user(
+            email='other@example.com',
+            username='other',
+            password='password123'
+        )
+        
+        response = self.get_detail(other_user, borrowing, etag)
+        
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+
+@pytest.mark.django_db
+class TestBorrowingArchive:
+    """Test archiving of old returned borrowings."""
+    
+    @pytest.fixture
+    def book(self):
+        """Create a book with enough copies for several borrowings."""
+        from books.models import Book
+        return Book.objects.create(title='Dune', author='Herbert', cover='HARD', inventory=10, daily_fee=1)
+    
+    def create_borrowing(self, user, book, returned_days_ago=None):
+        """Create a borrowing, optionally returned the given number of days ago."""
+        from borrowings.models import Borrowing
+        borrowing = Borrowing.objects.create(
+            user=user,
+            book=book,
+            expected_return_date=date.today() + timedelta(days=7)
+        )
+        if returned_days_ago is not None:
+            returned = date.today() - timedelta(days=returned_days_ago)
+            Borrowing.objects.filter(pk=borrowing.pk).update(
+                borrow_date=returned - timedelta(days=10),
+                expected_return_date=returned,
+                actual_return_date=returned
+            )
+            borrowing.refresh_from_db()
+        return borrowing
+    
+    def test_archive_moves_old_returned_borrowings(self, user, book):
+        """Test that old returned borrowings move to the archive with their payments."""
+        from borrowings.models import Borrowing, ArchivedBorrowing
+        from borrowings.services import BorrowingArchiveService
+        from payments.models import Payment
+        old = self.create_borrowing(user, book, returned_days_ago=4 * 365)
+        recent = self.create_borrowing(user, book, returned_days_ago=30)
+        active = self.create_borrowing(user, book)
+        Payment.objects.create(borrowing=old, status='PAID', type='PAYMENT', money_to_pay='12.50')
+        service = BorrowingArchiveService(batch_size=1)
+        
+        archived = service.archive(service.get_cutoff(3))
+        
+        assert archived == 1
+        assert set(Borrowing.objects.values_list('id', flat=True)) == {recent.id, active.id}
+        assert not Payment.objects.exists()
+        archive = ArchivedBorrowing.objects.get(id=old.id)
+        assert archive.book_title == book.title
+        assert archive.actual_return_date == old.actual_return_date
+        assert archive.payments[0]['status'] == 'PAID'
+        assert archive.payments[0]['money_to_pay'] == '12.50'
+    
+    def test_archive_keeps_unsettled_borrowings(self, user, book):
+        """Test that pending payments, open refunds and unpaid fines keep a borrowing out of the archive."""
+        from decimal import Decimal
+        from borrowings.models import Borrowing, ArchivedBorrowing
+        from borrowings.services import BorrowingArchiveService
+        from payments.models import FineBalance, Payment, Refund
+        pending = self.create_borrowing(user, book, returned_days_ago=4 * 365)
+        refunding = self.create_borrowing(user, book, returned_days_ago=4 * 365)
+        fined = self.create_borrowing(user, book, returned_days_ago=4 * 365)
+        settled = self.create_borrowing(user, book, returned_days_ago=4 * 365)
+        Payment.objects.create(borrowing=pending, status='PENDING', type='FINE', money_to_pay='3.00')
+        paid = Payment.objects.create(borrowing=refunding, status='PAID', type='PAYMENT', money_to_pay='5.00')
+        Refund.objects.create(payment=paid, amount='5.00', status='QUEUED')
+        FineBalance.objects.create(borrowing=fined, accrued=Decimal('4.00'))
+        FineBalance.objects.create(borrowing=settled, accrued=Decimal('4.00'), waived=Decimal('4.00'))
+        service = BorrowingArchiveService()
+        cutoff = service.get_cutoff(3)
+        
+        assert service.archive(cutoff, dry_run=True) == 1
+        # Ids listed before a payment was opened are re-checked when the batch runs
+        assert service.archive_batch([pending.id, refunding.id, fined.id]) == 0
+        assert service.archive(cutoff) == 1
+        assert set(Borrowing.objects.values_list('id', flat=True)) == {pending.id, refunding.id, fined.id}
+        assert list(ArchivedBorrowing.objects.values_list('id', flat=True)) == [settled.id]
+        assert Refund.objects.filter(status='QUEUED').exists()
+    
+    def test_archive_dry_run(self, user, book):
+        """Test that a dry run only counts archivable borrowings."""
+        from borrowings.models import Borrowing, ArchivedBorrowing
+        from borrowings.services import BorrowingArchiveService
+        self.create_borrowing(user, book, returned_days_ago=4 * 365)
+        service = BorrowingArchiveService()
+        
+        assert service.archive(service.get_cutoff(3), dry_run=True) == 1
+        assert Borrowing.objects.count() == 1
+        assert not ArchivedBorrowing.objects.exists()
+    
+    def test_get_cutoff_leap_day(self):
+        """Test the cutoff for 29 February."""
+        from borrowings.services import BorrowingArchiveService
+        
+        assert BorrowingArchiveService.get_cutoff(1, date(2024, 2, 29)) == date(2023, 2, 28)
+    
+    def test_archive_command(self, user, book):
+        """Test the archive_borrowings management command."""
+        from io import StringIO
+        from django.core.management import call_command
+        from borrowings.models import ArchivedBorrowing
+        old = self.create_borrowing(user, book, returned_days_ago=4 * 365)
+        out = StringIO()
+        
+        call_command('archive_borrowings', '--years', '3', stdout=out)
+        
+        assert 'Archived 1 borrowings' in out.getvalue()
+        assert ArchivedBorrowing.objects.filter(id=old.id).exists()
+    
+    def test_archive_list_shows_only_own_history(self, user, book):
+        """Test that users only see their own archived borrowings."""
+        from django.contrib.auth import get_user_model
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from borrowings.services import BorrowingArchiveService
+        from borrowings.views import ArchivedBorrowingListView
+        other_user = get_user_model().objects.create_user(
+            email='other@example.com',
+            username='other',
+            password='password123'
+        )
+        own = self.create_borrowing(user, book, returned_days_ago=4 * 365)
+        self.create_borrowing(other_user, book, returned_days_ago=4 * 365)
+        service = BorrowingArchiveService()
+        service.archive(service.get_cutoff(3))
+        
+        request = APIRequestFactory().get('/borrowings/archive/')
+        force_authenticate(request, user=user)
+        response = ArchivedBorrowingListView.as_view()(request)
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert [item['id'] for item in response.data['results']] == [own.id]
+        assert response.data['results'][0]['is_active'] is False
+
+
+@pytest.mark.django_db
+class TestBulkReturn:
+    """Test marking many borrowings returned at once."""
+    
+    def test_mark_returned_updates_inventory_and_side_tables(self, user, settings, monkeypatch,
+                                                             django_capture_on_commit_callbacks):
+        """Test inventory, due events, overdue states, audit and a single notification."""
+        from django.contrib.admin.models import LogEntry
+        from books.models import Book
+        from borrowings.models import Borrowing
+        from borrowings.services import BorrowingReturnService
+        from notifications.models import OverdueNotificationState
+        from notifications.services import TelegramNotificationService
+        from tasks.models import DueDateEvent
+        settings.TELEGRAM_BOT_TOKEN = 'test-token'
+        settings.TELEGRAM_CHAT_ID = '1'
+        sent = []
+        monkeypatch.setattr(
+            TelegramNotificationService,
+            'send_message',
+            lambda service, message, priority='default': sent.append(message) or True
+        )
+        dune = Book.objects.create(title='Dune', author='Herbert', cover='HARD', inventory=3, daily_fee=1)
+        emma = Book.objects.create(title='Emma', author='Austen', cover='SOFT', inventory=1, daily_fee=1)
+        due = date.today() + timedelta(days=7)
+        borrowings = [Borrowing.objects.create(user=user, book=book, expected_return_date=due)
+                      for book in (dune, dune, emma)]
+        already_returned = Borrowing.objects.create(user=user, book=dune, expected_return_date=due)
+        already_returned.actual_return_date = date.today()
+        already_returned.save()
+        sent.clear()
+        
+        with django_capture_on_commit_callbacks(execute=True):
+            returned = BorrowingReturnService().mark_returned(Borrowing.objects.all(), user=user)
+        
+        ids = [borrowing.id for borrowing in borrowings]
+        assert sorted(returned) == ids
+        dune.refresh_from_db()
+        emma.refresh_from_db()
+        assert (dune.inventory, emma.inventory) == (3, 1)
+        assert not Borrowing.objects.filter(actual_return_date__isnull=True).exists()
+        assert not DueDateEvent.objects.filter(borrowing_id__in=ids).exists()
+        assert not OverdueNotificationState.objects.filter(borrowing_id__in=ids).exists()
+        assert LogEntry.objects.filter(user=user, object_id__in=[str(pk) for pk in ids]).count() == 3
+        assert len(sent) == 1
+        assert 'Books Returned' in sent[0]
+        assert BorrowingReturnService().mark_returned(Borrowing.objects.all()) == []
\ No newline at end of file
@@ -7,4 +7,6 @@ urlpatterns = [
     path('', views.BorrowingListView.as_view(), name='borrowing-list'),
     path('<int:pk>/', views.BorrowingDetailView.as_view(), name='borrowing-detail'),
     path('<int:pk>/return/', views.BorrowingReturnView.as_view(), name='borrowing-return'),
+    path('archive/', views.ArchivedBorrowingListView.as_view(), name='archived-borrowing-list'),
+    path('archive/<int:pk>/', views.ArchivedBorrowingDetailView.as_view(), name='archived-borrowing-detail'),
 ]
\ No newline at end of file
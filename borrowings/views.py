@@ -3,15 +3,18 @@ from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import OrderingFilter
 from django.db.models import Q
-from datetime import date
-from .models import Borrowing
+from datetime import date, datetime, time
+from django.utils import timezone
+from .models import Borrowing, ArchivedBorrowing
 from .serializers import (
     BorrowingListSerializer, 
     BorrowingDetailSerializer, 
     BorrowingCreateSerializer,
-    BorrowingReturnSerializer
+    BorrowingReturnSerializer,
+    ArchivedBorrowingSerializer
 )
 from .permissions import BorrowingPermissions, BorrowingCreatePermissions
+from library_service.conditional import ConditionalGetMixin
 
 
 class BorrowingListView(generics.ListCreateAPIView):
@@ -60,12 +63,20 @@ class BorrowingListView(generics.ListCreateAPIView):
         serializer.save(user=self.request.user)
 
 
-class BorrowingDetailView(generics.RetrieveAPIView):
+class BorrowingDetailView(ConditionalGetMixin, generics.RetrieveAPIView):
     """View for retrieving borrowing details."""
     
-    queryset = Borrowing.objects.all()
+    queryset = Borrowing.objects.select_related('book')
     serializer_class = BorrowingDetailSerializer
     permission_classes = [BorrowingPermissions]
+    
+    def get_object_updated_at(self, instance):
+        """
+        The nested book (inventory) is part of the representation, and the
+        overdue fields change at midnight, not only with the row.
+        """
+        start_of_day = timezone.make_aware(datetime.combine(date.today(), time.min))
+        return max(instance.updated_at, instance.book.updated_at, start_of_day)
 
 
 class BorrowingReturnView(generics.UpdateAPIView):
@@ -98,3 +109,36 @@ class BorrowingReturnView(generics.UpdateAPIView):
             },
             status=status.HTTP_200_OK
         )
+
+
+class ArchivedBorrowingListView(generics.ListAPIView):
+    """View for listing archived (old, returned) borrowings."""
+    
+    serializer_class = ArchivedBorrowingSerializer
+    permission_classes = [BorrowingPermissions]
+    filter_backends = [OrderingFilter]
+    ordering_fields = ['borrow_date', 'actual_return_date']
+    ordering = ['-borrow_date']
+    
+    def get_queryset(self):
+        """Filter archived borrowings based on user permissions."""
+        user = self.request.user
+        
+        if user.is_staff:
+            queryset = ArchivedBorrowing.objects.all()
+            
+            user_id = self.request.query_params.get('user_id')
+            if user_id:
+                queryset = queryset.filter(user_id=user_id)
+        else:
+            queryset = ArchivedBorrowing.objects.filter(user=user)
+        
+        return queryset
+
+
+class ArchivedBorrowingDetailView(generics.RetrieveAPIView):
+    """View for retrieving an archived borrowing by its original id."""
+    
+    queryset = ArchivedBorrowing.objects.all()
+    serializer_class = ArchivedBorrowingSerializer
+    permission_classes = [BorrowingPermissions]
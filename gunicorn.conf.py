@@ -0,0 +1,19 @@
+"""
+Gunicorn settings for the web container.
+
+The book event stream (``/api/books/events/``) keeps its connection open
+for ``BOOK_EVENTS_STREAM_DURATION`` seconds. Threaded workers serve each
+open stream from one thread while the worker keeps heartbeating the
+arbiter, so streams neither block the worker's other requests nor get it
+killed by ``timeout``. Size ``GUNICORN_THREADS`` for the open streams
+expected per worker plus the regular API traffic.
+"""
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+# Event streams only see changes published by their own process unless the
+# broker is Redis, so the in-memory broker gets a single worker
+workers = int(os.getenv('GUNICORN_WORKERS', '4' if os.getenv('BOOK_EVENTS_BROKER') == 'redis' else '1'))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '16'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
\ No newline at end of file
@@ -0,0 +1,90 @@
+from decimal import Decimal
+from django.contrib.admin.models import CHANGE, LogEntry
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, transaction
+from django.db.models import DecimalField, sql
+
+
+def update_returning(queryset, returning, **updates) -> list:
+    """
+    Run one ``UPDATE`` over a queryset and return columns of the rows it changed.
+    
+    Uses ``UPDATE ... RETURNING`` where the database supports it
+    (PostgreSQL, SQLite 3.35+; MySQL and MariaDB only support ``RETURNING``
+    on ``INSERT``/``DELETE``). Elsewhere the rows are locked and read first,
+    then updated by primary key in the same transaction.
+    
+    Args:
+        queryset: Rows to update
+        returning: Field names to return, e.g. ``['id', 'book_id']``
+        **updates: New values, as for ``QuerySet.update``
+    
+    Returns:
+        list: One tuple of ``returning`` values per updated row
+    """
+    model = queryset.model
+    fields = [model._meta.get_field(name) for name in returning]
+    connection = connections[queryset.db]
+    
+    if not supports_update_returning(connection):
+        with transaction.atomic(using=queryset.db):
+            rows = list(queryset.select_for_update().values_list('pk', *returning))
+            if rows:
+                model._base_manager.using(queryset.db).filter(pk__in=[row[0] for row in rows]).update(**updates)
+        return [row[1:] for row in rows]
+    
+    query = queryset.query.chain(sql.UpdateQuery)
+    query.add_update_values(updates)
+    query.clear_ordering(force=True)
+    query.annotations = {}
+    update_sql, params = query.get_compiler(queryset.db).as_sql()
+    if not update_sql:
+        return []
+    
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+    with transaction.mark_for_rollback_on_error(using=queryset.db), connection.cursor() as cursor:
+        cursor.execute(f'{update_sql} RETURNING {columns}', params)
+        rows = cursor.fetchall()
+    # Raw cursors skip the backend's converters (e.g. SQLite returns decimals as floats)
+    return [tuple(to_python(field, value) for field, value in zip(fields, row)) for row in rows]
+
+
+def supports_update_returning(connection) -> bool:
+    """Whether the database accepts ``UPDATE ... RETURNING``."""
+    if connection.vendor == 'postgresql':
+        return True
+    return connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 35)
+
+
+def to_python(field, value):
+    value = field.to_python(value)
+    if isinstance(field, DecimalField) and value is not None:
+        value = value.quantize(Decimal(1).scaleb(-field.decimal_places))
+    return value
+
+
+def log_bulk_change(user, model, object_ids, message: str):
+    """
+    Record a bulk change in the admin history with one ``INSERT``.
+    
+    Args:
+        user: User who made the change (nothing is logged without one)
+        model: Model of the changed objects
+        object_ids: Primary keys of the changed objects
+        message: Change message shown in each object's history
+    """
+    if user is None or not object_ids:
+        return
+    content_type = ContentType.objects.get_for_model(model)
+    name = model._meta.verbose_name
+    LogEntry.objects.bulk_create([
+        LogEntry(
+            user_id=user.pk,
+            content_type=content_type,
+            object_id=str(object_id),
+            object_repr=f'{name} {object_id}'[:200],
+            action_flag=CHANGE,
+            change_message=message
+        )
+        for object_id in object_ids
+    ])
\ No newline at end of file
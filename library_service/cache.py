@@ -0,0 +1,49 @@
+import time
+from django.core.cache import cache
+
+
+def get_or_refresh(key: str, compute, timeout: int, lock_timeout: int = 10, wait: float = 2.0):
+    """
+    Return a cached value, recomputing it at most once per expiry across all workers.
+    
+    The value is stored for twice ``timeout`` together with the time it
+    goes stale. Once stale, the first caller to take the refresh lock
+    (``cache.add``) recomputes it while everyone else keeps getting the
+    stale copy, so an expiry never sends every poller to the database at
+    once. Only a cold cache makes callers wait (up to ``wait`` seconds)
+    for the lock holder before computing the value themselves.
+    
+    Args:
+        key: Cache key
+        compute: Callable returning the value
+        timeout: Seconds the value is fresh (0 disables caching)
+        lock_timeout: Seconds after which a crashed refresh releases its lock
+        wait: Seconds to wait for another worker's value on a cold cache
+    
+    Returns:
+        The cached or freshly computed value
+    """
+    if not timeout:
+        return compute()
+    
+    lock_key = f'{key}:refresh'
+    deadline = time.monotonic() + wait
+    while True:
+        entry = cache.get(key)
+        if entry is not None and entry[1] > time.time():
+            return entry[0]
+        if cache.add(lock_key, 1, timeout=lock_timeout):
+            break
+        if entry is not None:
+            # Someone else is refreshing; serve the stale value meanwhile
+            return entry[0]
+        if time.monotonic() >= deadline:
+            return compute()
+        time.sleep(0.05)
+    
+    try:
+        value = compute()
+        cache.set(key, (value, time.time() + timeout), timeout=timeout * 2)
+        return value
+    finally:
+        cache.delete(lock_key)
\ No newline at end of file
@@ -0,0 +1,103 @@
+import hashlib
+from calendar import timegm
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+
+class ConditionalGetMixin:
+    """
+    Mixin adding ETag/Last-Modified support to list and retrieve views.
+    
+    Validators are derived from the model's ``updated_at`` column, so a
+    matching ``If-None-Match``/``If-Modified-Since`` request is answered
+    with ``304 Not Modified`` before the page is fetched or serialized.
+    
+    Lists are validated by ETag only: ``Max(updated_at)`` does not move
+    when a row other than the newest is deleted, so a ``Last-Modified``
+    built from it would answer ``If-Modified-Since`` with a stale 304.
+    """
+    
+    etag_prefix = None
+    
+    def get_etag_extra(self):
+        """Return extra state that affects the representation (e.g. today's date)."""
+        return ''
+    
+    def get_list_version(self):
+        """
+        Return a counter bumped on every change to the listed model, deletes included.
+        
+        Returns:
+            The version, or None to fold the row count into the list ETag instead
+        """
+        return None
+    
+    def get_object_updated_at(self, instance):
+        """Return the modification time covering everything the detail representation shows."""
+        return instance.updated_at
+    
+    def build_etag(self, *parts):
+        """Build a quoted ETag from the given state parts."""
+        prefix = self.etag_prefix or self.__class__.__name__
+        raw = ':'.join(str(part) for part in (prefix, *parts, self.get_etag_extra()))
+        return quote_etag(hashlib.md5(raw.encode()).hexdigest())
+    
+    def conditional_response(self, request, etag, last_modified):
+        """
+        Return a 304 response if the client's validators still match.
+        
+        Args:
+            request: Current request
+            etag: Quoted ETag for the current state
+            last_modified: Latest modification timestamp or None
+        
+        Returns:
+            HttpResponse or None: 304 response, or None if the client is stale
+        """
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            self.set_validators(response, etag, last_modified)
+        return response
+    
+    def set_validators(self, response, etag, last_modified):
+        """Attach ETag and Last-Modified headers to a response."""
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+    
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        updated_at = self.get_object_updated_at(instance)
+        last_modified = timegm(updated_at.utctimetuple())
+        etag = self.build_etag(instance.pk, updated_at.isoformat())
+        
+        not_modified = self.conditional_response(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
+        
+        serializer = self.get_serializer(instance)
+        response = Response(serializer.data)
+        self.set_validators(response, etag, last_modified)
+        return response
+    
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        version = self.get_list_version()
+        if version is None:
+            # Without a version only the count reveals a deleted row
+            state = queryset.aggregate(updated_at=Max('updated_at'), count=Count('pk'))
+            version = f"count={state['count']}"
+        else:
+            state = queryset.aggregate(updated_at=Max('updated_at'))
+        updated_at = state['updated_at']
+        etag = self.build_etag(version, updated_at.isoformat() if updated_at else '')
+        
+        not_modified = self.conditional_response(request, etag, None)
+        if not_modified is not None:
+            return not_modified
+        
+        response = super().list(request, *args, **kwargs)
+        self.set_validators(response, etag, None)
+        return response
\ No newline at end of file
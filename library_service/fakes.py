@@ -0,0 +1,405 @@
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+
+class FakeAPIServer(ThreadingHTTPServer):
+    """
+    Local stand-in for an external HTTP API, used by tests and benchmarks.
+    
+    Every request can be delayed (``latency`` +/- ``jitter`` seconds),
+    rejected with a server error (``error_rate``) or with a 429 once a key
+    exceeds ``rate_limit`` requests per second. ``responses`` holds
+    scripted (status, body) pairs that are returned before anything else.
+    """
+    
+    daemon_threads = True
+    
+    def __init__(self, handler_class, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0,
+                 jitter: float = 0.0, error_rate: float = 0.0, rate_limit: float = 0, retry_after: int = 1,
+                 seed: int = None):
+        super().__init__((host, port), handler_class)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.responses = []
+        self.stats = defaultdict(int)
+        self._windows = defaultdict(deque)
+        self._thread = None
+    
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+    
+    def start(self):
+        """Serve requests in a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        """Stop serving and close the socket."""
+        self.shutdown()
+        self.server_close()
+    
+    def __enter__(self):
+        return self.start()
+    
+    def __exit__(self, *exc_info):
+        self.stop()
+    
+    def delay(self):
+        """Sleep for the configured latency."""
+        seconds = self.latency + self.random.uniform(-self.jitter, self.jitter) if self.jitter else self.latency
+        if seconds > 0:
+            time.sleep(seconds)
+    
+    def fault(self, key: str):
+        """
+        Decide whether the next request for ``key`` fails.
+        
+        Returns:
+            tuple or None: (status, body) of a scripted or injected failure,
+            None if the request should succeed
+        """
+        with self.lock:
+            self.stats['requests'] += 1
+            if self.responses:
+                return self.responses.pop(0)
+            
+            if self.rate_limit:
+                now = time.monotonic()
+                window = self._windows[key]
+                while window and now - window[0] >= 1:
+                    window.popleft()
+                if len(window) >= self.rate_limit:
+                    self.stats['rate_limited'] += 1
+                    return 429, None
+                window.append(now)
+            
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.stats['errors'] += 1
+                return 500, None
+        return None
+
+
+class FakeAPIHandler(BaseHTTPRequestHandler):
+    """Request handler with JSON helpers; subclasses define ``routes``."""
+    
+    routes = []
+    
+    def log_message(self, *args):
+        pass
+    
+    def read_body(self) -> dict:
+        """Parse a JSON or form-encoded request body."""
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length).decode() if length else ''
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            return json.loads(raw or '{}')
+        return dict(parse_qsl(raw))
+    
+    def send_json(self, status_code: int, body: dict, headers: dict = None):
+        data = json.dumps(body).encode()
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def dispatch(self, method: str):
+        path = urlsplit(self.path).path
+        for route_method, pattern, handler_name in self.routes:
+            match = re.fullmatch(pattern, path)
+            if route_method == method and match:
+                self.server.delay()
+                return getattr(self, handler_name)(*match.groups())
+        return self.not_found(path)
+    
+    def do_GET(self):
+        self.dispatch('GET')
+    
+    def do_POST(self):
+        self.dispatch('POST')
+
+
+class FakeStripeHandler(FakeAPIHandler):
+    """
+    The subset of the Stripe API used by ``StripeService``.
+    
+    Checkout sessions are created unpaid unless the server was started with
+    ``auto_pay``; opening a session's ``url`` pays it and redirects to its
+    ``success_url`` like the hosted checkout page does.
+    """
+    
+    routes = [
+        ('POST', r'/v1/checkout/sessions', 'create_session'),
+        ('GET', r'/v1/checkout/sessions', 'list_sessions'),
+        ('GET', r'/v1/checkout/sessions/([\w-]+)', 'retrieve_session'),
+        ('GET', r'/v1/payment_intents/([\w-]+)', 'retrieve_payment_intent'),
+        ('POST', r'/v1/refunds', 'create_refund'),
+        ('GET', r'/pay/([\w-]+)', 'pay_session'),
+    ]
+    
+    def error(self, status_code: int, error_type: str, message: str, code: str = None):
+        error = {'type': error_type, 'message': message}
+        if code:
+            error['code'] = code
+        self.send_json(status_code, {'error': error})
+    
+    def not_found(self, path: str):
+        self.error(404, 'invalid_request_error', f'Unrecognized request URL ({self.command}: {path})')
+    
+    def check_fault(self) -> bool:
+        fault = self.server.fault('stripe')
+        if fault is None:
+            return False
+        status_code, body = fault
+        if body is not None:
+            self.send_json(status_code, body)
+        elif status_code == 429:
+            self.error(429, 'invalid_request_error', 'Request rate limit exceeded.', code='rate_limit')
+        else:
+            self.error(status_code, 'api_error', 'Fake Stripe server error.')
+        return True
+    
+    def create_session(self):
+        params = self.read_body()
+        if self.check_fault():
+            return
+        idempotency_key = self.headers.get('Idempotency-Key')
+        with self.server.lock:
+            replay = self.server.idempotent_responses.get(idempotency_key)
+        if replay is not None:
+            return self.send_json(200, replay, headers={'Idempotent-Replayed': 'true'})
+        amount = 0
+        for key, value in params.items():
+            match = re.fullmatch(r'line_items\[(\d+)\]\[price_data\]\[unit_amount\]', key)
+            if match:
+                amount += int(value) * int(params.get(f'line_items[{match.group(1)}][quantity]', 1))
+        
+        session_id = f'cs_test_{uuid.uuid4().hex}'
+        session = {
+            'id': session_id,
+            'object': 'checkout.session',
+            'mode': params.get('mode', 'payment'),
+            'status': 'open',
+            'payment_status': 'unpaid',
+            'payment_intent': None,
+            'amount_total': amount,
+            'currency': params.get('line_items[0][price_data][currency]', 'usd'),
+            'metadata': {
+                key[len('metadata['):-1]: value
+                for key, value in params.items() if key.startswith('metadata[')
+            },
+            'success_url': params.get('success_url'),
+            'cancel_url': params.get('cancel_url'),
+            'url': f'{self.server.url}/pay/{session_id}',
+            'created': int(time.time()),
+            'expires_at': int(time.time()) + self.server.session_lifetime,
+        }
+        with self.server.lock:
+            self.server.sessions[session_id] = session
+            if idempotency_key:
+                self.server.idempotent_responses[idempotency_key] = session
+            self.server.stats['sessions'] += 1
+            if self.server.auto_pay:
+                self.server.pay(session)
+        self.send_json(200, session)
+    
+    def list_sessions(self):
+        if self.check_fault():
+            return
+        params = dict(parse_qsl(urlsplit(self.path).query))
+        limit = min(int(params.get('limit', 10)), 100)
+        created_gte = int(params.get('created[gte]', 0))
+        with self.server.lock:
+            # Newest first, like Stripe
+            sessions = [
+                session for session in reversed(list(self.server.sessions.values()))
+                if session['created'] >= created_gte
+            ]
+        if params.get('starting_after'):
+            ids = [session['id'] for session in sessions]
+            if params['starting_after'] not in ids:
+                return self.error(400, 'invalid_request_error', 'Invalid starting_after id.')
+            sessions = sessions[ids.index(params['starting_after']) + 1:]
+        self.send_json(200, {
+            'object': 'list',
+            'url': '/v1/checkout/sessions',
+            'data': sessions[:limit],
+            'has_more': len(sessions) > limit,
+        })
+    
+    def retrieve_session(self, session_id: str):
+        if self.check_fault():
+            return
+        session = self.server.sessions.get(session_id)
+        if session is None:
+            return self.error(404, 'invalid_request_error', f"No such checkout.session: '{session_id}'", code='resource_missing')
+        self.send_json(200, session)
+    
+    def retrieve_payment_intent(self, intent_id: str):
+        if self.check_fault():
+            return
+        intent = self.server.payment_intents.get(intent_id)
+        if intent is None:
+            return self.error(404, 'invalid_request_error', f"No such payment_intent: '{intent_id}'", code='resource_missing')
+        self.send_json(200, intent)
+    
+    def create_refund(self):
+        params = self.read_body()
+        if self.check_fault():
+            return
+        idempotency_key = self.headers.get('Idempotency-Key')
+        with self.server.lock:
+            replay = self.server.idempotent_responses.get(idempotency_key)
+            if replay is not None:
+                return self.send_json(200, replay, headers={'Idempotent-Replayed': 'true'})
+            intent = self.server.payment_intents.get(params.get('payment_intent', ''))
+            if intent is None:
+                return self.error(400, 'invalid_request_error', 'A valid payment_intent is required.', code='resource_missing')
+            amount = int(params.get('amount', intent['amount'] - intent['amount_refunded']))
+            if intent['amount_refunded'] + amount > intent['amount']:
+                return self.error(
+                    400, 'invalid_request_error',
+                    'Refund amount is greater than the unrefunded amount on the charge.',
+                    code='charge_already_refunded'
+                )
+            refund = {
+                'id': f're_{uuid.uuid4().hex[:24]}',
+                'object': 'refund',
+                'amount': amount,
+                'currency': intent['currency'],
+                'payment_intent': intent['id'],
+                'metadata': {
+                    key[len('metadata['):-1]: value
+                    for key, value in params.items() if key.startswith('metadata[')
+                },
+                'status': 'succeeded',
+            }
+            intent['amount_refunded'] += amount
+            if idempotency_key:
+                self.server.idempotent_responses[idempotency_key] = refund
+            self.server.stats['refunds'] += 1
+        self.send_json(200, refund)
+    
+    def pay_session(self, session_id: str):
+        session = self.server.sessions.get(session_id)
+        if session is None:
+            return self.error(404, 'invalid_request_error', f"No such checkout.session: '{session_id}'")
+        with self.server.lock:
+            self.server.pay(session)
+        self.send_response(303)
+        self.send_header('Location', (session['success_url'] or '/').replace('{CHECKOUT_SESSION_ID}', session_id))
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+class FakeStripeServer(FakeAPIServer):
+    """
+    In-memory fake of the Stripe endpoints used by ``StripeService``.
+    
+    Point ``STRIPE_API_BASE`` at ``url``. With ``auto_pay`` every checkout
+    session is paid as soon as it is created. Session and refund creation
+    honour the ``Idempotency-Key`` header like Stripe does.
+    """
+    
+    def __init__(self, auto_pay: bool = False, session_lifetime: int = 24 * 3600, **options):
+        super().__init__(FakeStripeHandler, **options)
+        self.auto_pay = auto_pay
+        self.session_lifetime = session_lifetime
+        self.sessions = {}
+        self.payment_intents = {}
+        self.idempotent_responses = {}
+    
+    def expire(self, session_id: str):
+        """Expire an open checkout session."""
+        with self.lock:
+            session = self.sessions[session_id]
+            if session['status'] == 'open':
+                session.update(status='expired', url=None)
+    
+    def pay(self, session: dict):
+        """Mark a checkout session as paid and create its payment intent (caller holds ``lock``)."""
+        if session['payment_status'] == 'paid':
+            return
+        intent_id = f'pi_{uuid.uuid4().hex[:24]}'
+        self.payment_intents[intent_id] = {
+            'id': intent_id,
+            'object': 'payment_intent',
+            'amount': session['amount_total'],
+            'amount_refunded': 0,
+            'currency': session['currency'],
+            'status': 'succeeded',
+        }
+        session.update(status='complete', payment_status='paid', payment_intent=intent_id)
+        self.stats['paid'] += 1
+
+
+class FakeTelegramHandler(FakeAPIHandler):
+    """Bot API ``sendMessage``; 429s are limited per chat like the real API."""
+    
+    routes = [
+        ('POST', r'/bot([^/]+)/sendMessage', 'send_message'),
+    ]
+    
+    def not_found(self, path: str):
+        self.send_json(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+    
+    def send_message(self, token: str):
+        payload = self.read_body()
+        chat_id = str(payload.get('chat_id', ''))
+        fault = self.server.fault(chat_id)
+        if fault is not None:
+            status_code, body = fault
+            if body is None and status_code == 429:
+                retry_after = self.server.retry_after
+                body = {
+                    'ok': False,
+                    'error_code': 429,
+                    'description': f'Too Many Requests: retry after {retry_after}',
+                    'parameters': {'retry_after': retry_after},
+                }
+            elif body is None:
+                body = {'ok': False, 'error_code': status_code, 'description': 'Internal Server Error'}
+            return self.send_json(status_code, body)
+        
+        with self.server.lock:
+            self.server.received.append((time.monotonic(), chat_id, payload.get('text', '')))
+            message_id = len(self.server.received)
+        self.send_json(200, {
+            'ok': True,
+            'result': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': int(chat_id) if chat_id.lstrip('-').isdigit() else 0, 'type': 'private'},
+                'text': payload.get('text', ''),
+            },
+        })
+
+
+class FakeTelegramServer(FakeAPIServer):
+    """
+    In-memory fake of the Telegram Bot API ``sendMessage`` endpoint.
+    
+    Point ``TELEGRAM_API_URL`` at ``url``. Delivered messages are recorded
+    in ``received`` as (monotonic time, chat_id, text).
+    """
+    
+    def __init__(self, **options):
+        super().__init__(FakeTelegramHandler, **options)
+        self.received = []
\ No newline at end of file
@@ -0,0 +1,106 @@
+import hashlib
+import json
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that avoids exact ``COUNT(*)`` on large result sets.
+    
+    On PostgreSQL the planner's row estimate (``pg_class.reltuples`` for
+    unfiltered tables, ``EXPLAIN`` otherwise) is used when it exceeds
+    ``ESTIMATED_COUNT_THRESHOLD``; smaller results get an exact count.
+    Counts at or above the threshold are cached per query for
+    ``ESTIMATED_COUNT_CACHE_TIMEOUT`` seconds; small counts stay exact and live.
+    """
+    
+    count_is_approximate = False
+    
+    def _count_queryset(self):
+        return self.object_list.order_by()
+    
+    def _cache_key(self, queryset) -> str:
+        raw = f'{queryset.db}:{queryset.query}'
+        return f'pagination:count:{hashlib.md5(raw.encode()).hexdigest()}'
+    
+    def get_estimate(self, queryset):
+        """
+        Return the planner's row estimate, or None if unavailable.
+        
+        Args:
+            queryset: Unordered queryset being paginated
+        
+        Returns:
+            int or None: Estimated row count
+        """
+        if connections[queryset.db].vendor != 'postgresql':
+            return None
+        
+        if not queryset.query.where:
+            with connections[queryset.db].cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                    [queryset.model._meta.db_table]
+                )
+                row = cursor.fetchone()
+            # reltuples is -1 for tables that were never analyzed
+            if row and row[0] >= 0:
+                return row[0]
+            return None
+        
+        plan = json.loads(queryset.explain(format='json'))
+        return int(plan[0]['Plan']['Plan Rows'])
+    
+    @cached_property
+    def count(self):
+        if not hasattr(self.object_list, 'query'):
+            return super().count
+        
+        queryset = self._count_queryset()
+        key = self._cache_key(queryset)
+        timeout = getattr(settings, 'ESTIMATED_COUNT_CACHE_TIMEOUT', 30)
+        
+        cached = cache.get(key) if timeout else None
+        if cached is not None:
+            total, self.count_is_approximate = cached
+            return total
+        
+        threshold = getattr(settings, 'ESTIMATED_COUNT_THRESHOLD', 10000)
+        estimate = self.get_estimate(queryset)
+        if estimate is not None and estimate >= threshold:
+            total, self.count_is_approximate = estimate, True
+        else:
+            total, self.count_is_approximate = queryset.count(), False
+        
+        if timeout and total >= threshold:
+            cache.set(key, (total, self.count_is_approximate), timeout=timeout)
+        return total
+
+
+class EstimatedCountPagination(PageNumberPagination):
+    """Page number pagination that reports whether ``count`` is an estimate."""
+    
+    django_paginator_class = EstimatedCountPaginator
+    
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.page.paginator.count,
+            'count_is_approximate': self.page.paginator.count_is_approximate,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+    
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties']['count_is_approximate'] = {
+            'type': 'boolean',
+            'example': False,
+        }
+        return response_schema
\ No newline at end of file
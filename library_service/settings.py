@@ -129,7 +129,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ),
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'library_service.pagination.EstimatedCountPagination',
     'PAGE_SIZE': 10,
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
@@ -248,6 +248,17 @@ Q_CLUSTER = {
 # Stripe settings
 STRIPE_PUBLISHABLE_KEY = os.getenv('STRIPE_PUBLISHABLE_KEY', '')
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY', '')
+STRIPE_API_BASE = os.getenv('STRIPE_API_BASE', 'https://api.stripe.com')
+STRIPE_CONNECT_TIMEOUT = float(os.getenv('STRIPE_CONNECT_TIMEOUT', '3'))
+STRIPE_READ_TIMEOUT = float(os.getenv('STRIPE_READ_TIMEOUT', '10'))
+# Fail fast after N consecutive Stripe failures, probe again after the timeout (seconds)
+STRIPE_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('STRIPE_CIRCUIT_FAILURE_THRESHOLD', '5'))
+STRIPE_CIRCUIT_RECOVERY_TIMEOUT = float(os.getenv('STRIPE_CIRCUIT_RECOVERY_TIMEOUT', '30'))
+# Checkout sessions read per Stripe list call by the reconciliation job
+PAYMENT_RECONCILIATION_PAGE_SIZE = 100
+# Refunds run in Django-Q; failed Stripe calls are retried with doubling delays (seconds)
+REFUND_MAX_ATTEMPTS = int(os.getenv('REFUND_MAX_ATTEMPTS', '5'))
+REFUND_RETRY_DELAY = float(os.getenv('REFUND_RETRY_DELAY', '30'))
 SITE_URL = os.getenv('SITE_URL', 'http://localhost:8000')
 
 # Telegram settings
@@ -255,4 +266,102 @@ TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 TELEGRAM_CHAT_ID = os.getenv('TELEGRAM_CHAT_ID')
 
 # Fine settings
-FINE_MULTIPLIER = float(os.getenv('FINE_MULTIPLIER', '2.0'))
\ No newline at end of file
+FINE_MULTIPLIER = float(os.getenv('FINE_MULTIPLIER', '2.0'))
+# Tiered fines, e.g. {'tiers': [[1, 1], [8, 2]], 'grace_days': 2, 'cap': 50}: two free days,
+# then 1x the daily fee for a week and 2x afterwards, at most 50. None charges a flat FINE_MULTIPLIER.
+# A 'class' key selects a FinePolicy subclass by dotted path.
+FINE_POLICY = None
+FINE_STATISTICS_CACHE_TIMEOUT = int(os.getenv('FINE_STATISTICS_CACHE_TIMEOUT', '30'))  # 0 disables the cache
+
+# Bulk admin actions (fine waivers, returns, payment expiry)
+BULK_WAIVE_MAX_IDS = 10000  # borrowings per bulk waive request
+BULK_NOTIFICATION_MAX_ITEMS = 20  # objects listed in the digest notification
+
+# Redis settings
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+
+# Cache shared by every web and Django-Q process when REDIS_URL is set; the
+# per-process fallback keeps cache-based versions (list ETags, autocomplete
+# changes, digest counters) local to one process
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Book batch lookup and facet cache settings
+BOOK_BATCH_MAX_IDS = 100
+BOOK_OBJECT_CACHE_TIMEOUT = int(os.getenv('BOOK_OBJECT_CACHE_TIMEOUT', '300'))  # 0 disables the cache
+BOOK_FACETS_CACHE_TIMEOUT = int(os.getenv('BOOK_FACETS_CACHE_TIMEOUT', '60'))  # 0 disables the cache
+
+# Book autocomplete index (memory-mapped snapshot shared by all workers on a node)
+BOOK_AUTOCOMPLETE_INDEX_PATH = os.getenv('BOOK_AUTOCOMPLETE_INDEX_PATH', str(BASE_DIR / 'var' / 'book_autocomplete.idx'))
+BOOK_AUTOCOMPLETE_MAX_RESULTS = 50
+BOOK_AUTOCOMPLETE_DELTA_MAX = int(os.getenv('BOOK_AUTOCOMPLETE_DELTA_MAX', '1000'))  # changes logged in the cache before snapshots are rebuilt
+
+# Book availability event stream (SSE) settings
+BOOK_EVENTS_BROKER = os.getenv('BOOK_EVENTS_BROKER', 'memory')  # 'memory' or 'redis'
+BOOK_EVENTS_BUFFER_SIZE = int(os.getenv('BOOK_EVENTS_BUFFER_SIZE', '1000'))
+BOOK_EVENTS_HEARTBEAT = 15  # seconds
+# Each open stream holds a web worker thread; keep this below gunicorn's timeout
+# when not running the threaded workers of gunicorn.conf.py
+BOOK_EVENTS_STREAM_DURATION = int(os.getenv('BOOK_EVENTS_STREAM_DURATION', '60'))  # seconds
+
+# Pagination count settings (PostgreSQL planner estimates above the threshold)
+ESTIMATED_COUNT_THRESHOLD = int(os.getenv('ESTIMATED_COUNT_THRESHOLD', '10000'))
+ESTIMATED_COUNT_CACHE_TIMEOUT = int(os.getenv('ESTIMATED_COUNT_CACHE_TIMEOUT', '30'))  # 0 disables the cache
+
+# Borrowing archive settings (see manage.py archive_borrowings)
+BORROWING_ARCHIVE_AFTER_YEARS = int(os.getenv('BORROWING_ARCHIVE_AFTER_YEARS', '3'))
+BORROWING_ARCHIVE_BATCH_SIZE = 1000
+
+# Due-date event scheduler (reminders and overdue transitions)
+DUE_REMINDER_DAYS_BEFORE = [2, 1]
+DUE_EVENTS_BATCH_SIZE = 500
+# Failed sends of an event are retried by later runs up to this many times
+DUE_EVENTS_MAX_ATTEMPTS = 5
+
+# Nightly batch jobs (fines, overdue alerts, reminders): rows per chunk transaction,
+# seconds of work per invocation (below the Django-Q timeout) before the job re-queues itself,
+# seconds without a committed chunk before a run counts as abandoned and is resumed
+BATCH_JOB_CHUNK_SIZE = 500
+BATCH_JOB_TIME_BUDGET = 45
+BATCH_JOB_STALE_AFTER = 120
+BATCH_JOB_MAX_ATTEMPTS = 3
+# Fines and overdue alerts are split by borrowing id range into one Django-Q task per shard
+BATCH_JOB_SHARDS = int(os.getenv('BATCH_JOB_SHARDS', str(Q_CLUSTER['workers'])))
+
+# Scheduled task locks: a run is skipped while another one holds the task's lease.
+# 'database' (TaskLease rows) or 'redis' (SET NX PX); leases outlive the Django-Q timeout
+TASK_LOCK_BACKEND = os.getenv('TASK_LOCK_BACKEND', 'database')
+TASK_LOCK_TTL = 120
+
+# Overdue alert escalation: days after the due date, then repeat interval
+OVERDUE_ALERT_DAYS = [1, 3, 7]
+OVERDUE_ALERT_REPEAT_DAYS = 7
+
+# Notification digests: buffer per-event Telegram messages and send one summary
+# per event type every `window` seconds or `max_events` events
+NOTIFICATION_DIGEST_ENABLED = os.getenv('NOTIFICATION_DIGEST_ENABLED', 'False').lower() == 'true'
+NOTIFICATION_DIGEST = {
+    'borrowing': {'window': 60, 'max_events': 50},
+    'return': {'window': 60, 'max_events': 50},
+    'payment': {'window': 60, 'max_events': 50},
+}
+
+# Outbound Telegram queue: per-chat token bucket, priorities, retries and dead letters
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org')
+TELEGRAM_OUTBOUND_QUEUE_ENABLED = os.getenv('TELEGRAM_OUTBOUND_QUEUE_ENABLED', 'True').lower() == 'true'
+# 'memory' or 'redis'; the in-memory bucket is per process, so every Django-Q worker would get the full rate
+TELEGRAM_RATE_LIMIT_BACKEND = os.getenv('TELEGRAM_RATE_LIMIT_BACKEND', 'redis' if os.getenv('REDIS_URL') else 'memory')
+TELEGRAM_RATE_PER_SECOND = float(os.getenv('TELEGRAM_RATE_PER_SECOND', '1.0'))  # per chat
+TELEGRAM_RATE_BURST = int(os.getenv('TELEGRAM_RATE_BURST', '3'))
+TELEGRAM_OUTBOUND_MAX_ATTEMPTS = 5
\ No newline at end of file
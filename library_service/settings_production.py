@@ -100,6 +100,15 @@ LOGGING = {
     },
 }
 
+# Redis settings
+REDIS_URL = os.getenv('REDIS_URL', 'redis://redis:6379/0')
+
+# Book availability events are fanned out across nodes through Redis
+BOOK_EVENTS_BROKER = os.getenv('BOOK_EVENTS_BROKER', 'redis')
+
+# Telegram rate limits are shared by all Django-Q workers through Redis
+TELEGRAM_RATE_LIMIT_BACKEND = os.getenv('TELEGRAM_RATE_LIMIT_BACKEND', 'redis')
+
 # Django-Q settings for production
 Q_CLUSTER = {
     'name': 'library_cluster',
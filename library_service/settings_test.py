@@ -3,6 +3,7 @@ Test settings for DRF Library project.
 """
 
 from .settings import *
+import tempfile
 from datetime import timedelta
 
 # Use in-memory database for testing
@@ -83,7 +84,7 @@ REST_FRAMEWORK = {
         'django_filters.rest_framework.DjangoFilterBackend',
         'rest_framework.filters.OrderingFilter',
     ],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'library_service.pagination.EstimatedCountPagination',
     'PAGE_SIZE': 10,
     'TEST_REQUEST_DEFAULT_FORMAT': 'json',
 }
@@ -128,6 +129,14 @@ TELEGRAM_CHAT_ID = 'test_chat_id'
 # Test-specific fine settings
 FINE_MULTIPLIER = 2.0
 
+# Test-specific book event stream settings
+BOOK_EVENTS_BROKER = 'memory'
+BOOK_EVENTS_HEARTBEAT = 0.05
+BOOK_EVENTS_STREAM_DURATION = 0.2
+
+# Test-specific autocomplete index location
+BOOK_AUTOCOMPLETE_INDEX_PATH = os.path.join(tempfile.gettempdir(), 'library_test_book_autocomplete.idx')
+
 # Disable static files collection for tests
 STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
 
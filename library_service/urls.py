@@ -7,6 +7,8 @@ from django.http import JsonResponse
 from django.db import connection
 from django.core.cache import cache
 from django.utils import timezone
+from payments.stripe_client import get_stripe_client
+from tasks.locks import task_lock_metrics
 
 def health_check(request):
     """Health check endpoint for Docker."""
@@ -23,6 +25,8 @@ def health_check(request):
             'status': 'healthy',
             'database': 'connected',
             'cache': 'connected',
+            'stripe_circuit': get_stripe_client().breaker.metrics(),
+            'task_locks': task_lock_metrics(),
             'timestamp': timezone.now().isoformat()
         })
     except Exception as e:
@@ -0,0 +1,90 @@
+from django.db import models
+from django.utils import timezone
+
+
+class OverdueNotificationState(models.Model):
+    """
+    Overdue alert bookkeeping for an active borrowing.
+    
+    ``next_alert_on`` is indexed so the overdue sweep reads only the
+    borrowings whose next escalation step is due instead of every overdue
+    borrowing on every run.
+    """
+    
+    borrowing = models.OneToOneField(
+        'borrowings.Borrowing',
+        on_delete=models.CASCADE,
+        related_name='overdue_notification_state'
+    )
+    alert_count = models.PositiveIntegerField(default=0)
+    last_alerted_on = models.DateField(null=True, blank=True)
+    next_alert_on = models.DateField(db_index=True)
+    
+    class Meta:
+        verbose_name = 'Overdue notification state'
+        verbose_name_plural = 'Overdue notification states'
+    
+    def __str__(self):
+        return f"Borrowing {self.borrowing_id}: {self.alert_count} alerts, next on {self.next_alert_on}"
+
+
+class PendingNotification(models.Model):
+    """Event waiting to be sent as part of a notification digest."""
+    
+    event_type = models.CharField(max_length=20)
+    summary = models.CharField(max_length=500)
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        verbose_name = 'Pending notification'
+        verbose_name_plural = 'Pending notifications'
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['event_type', 'created_at'], name='pending_notif_type_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.event_type}: {self.summary}"
+
+
+class OutboundMessage(models.Model):
+    """
+    Telegram message waiting in the shared outbound queue.
+    
+    Delivered rows are deleted; rows that can't be delivered stay behind
+    with status ``DEAD`` as the dead-letter store.
+    """
+    
+    STATUS_CHOICES = [
+        ('QUEUED', 'Queued'),
+        ('DEAD', 'Dead letter'),
+    ]
+    
+    # Lower value is sent first
+    PRIORITIES = {
+        'payment': 0,
+        'fine': 1,
+        'overdue': 2,
+        'default': 3,
+        'summary': 4,
+    }
+    
+    chat_id = models.CharField(max_length=64)
+    text = models.TextField()
+    priority = models.PositiveSmallIntegerField(default=3)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='QUEUED')
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        verbose_name = 'Outbound message'
+        verbose_name_plural = 'Outbound messages'
+        ordering = ['priority', 'available_at', 'id']
+        indexes = [
+            models.Index(fields=['status', 'priority', 'available_at'], name='outbound_queue_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.status} message to {self.chat_id} (priority {self.priority})"
\ No newline at end of file
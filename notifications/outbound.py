@@ -0,0 +1,319 @@
+import atexit
+import logging
+import threading
+import time
+from datetime import timedelta
+from functools import lru_cache
+
+import httpx
+import redis
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+from .models import OutboundMessage
+
+logger = logging.getLogger(__name__)
+
+
+class InMemoryTokenBucket:
+    """
+    Per-chat token bucket for a single process (and tests).
+    
+    ``take`` returns 0 when a message may be sent now, otherwise the number
+    of seconds to wait. ``pause`` blocks a chat, e.g. after a 429.
+    """
+    
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._state = {}
+        self._lock = threading.Lock()
+    
+    def take(self, chat_id: str, now: float = None) -> float:
+        now = time.time() if now is None else now
+        with self._lock:
+            tokens, updated_at = self._state.get(chat_id, (self.burst, now))
+            if now < updated_at:
+                return updated_at - now
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            if tokens >= 1:
+                self._state[chat_id] = (tokens - 1, now)
+                return 0
+            self._state[chat_id] = (tokens, now)
+            return (1 - tokens) / self.rate
+    
+    def pause(self, chat_id: str, seconds: float, now: float = None):
+        now = time.time() if now is None else now
+        with self._lock:
+            self._state[chat_id] = (0, now + seconds)
+
+
+class RedisTokenBucket:
+    """
+    Per-chat token bucket shared by all Django-Q workers through Redis.
+    
+    The refill-and-take step runs as a Lua script so concurrent workers
+    never spend the same token twice.
+    """
+    
+    TAKE_SCRIPT = """
+        local rate = tonumber(ARGV[1])
+        local burst = tonumber(ARGV[2])
+        local now = tonumber(ARGV[3])
+        local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+        local tokens = tonumber(state[1]) or burst
+        local ts = tonumber(state[2]) or now
+        if now < ts then
+            return tostring(ts - now)
+        end
+        tokens = math.min(burst, tokens + (now - ts) * rate)
+        local wait = 0
+        if tokens >= 1 then
+            tokens = tokens - 1
+        else
+            wait = (1 - tokens) / rate
+        end
+        redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+        redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 3600)
+        return tostring(wait)
+    """
+    
+    def __init__(self, url: str, rate: float, burst: int, prefix: str = 'library:telegram:bucket'):
+        self.client = redis.Redis.from_url(url)
+        self.rate = rate
+        self.burst = burst
+        self.prefix = prefix
+        self._take = self.client.register_script(self.TAKE_SCRIPT)
+    
+    def _key(self, chat_id: str) -> str:
+        return f'{self.prefix}:{chat_id}'
+    
+    def take(self, chat_id: str, now: float = None) -> float:
+        now = time.time() if now is None else now
+        return float(self._take(keys=[self._key(chat_id)], args=[self.rate, self.burst, now]))
+    
+    def pause(self, chat_id: str, seconds: float, now: float = None):
+        now = time.time() if now is None else now
+        key = self._key(chat_id)
+        pipeline = self.client.pipeline()
+        pipeline.hset(key, mapping={'tokens': 0, 'ts': now + seconds})
+        pipeline.expire(key, int(seconds) + 3600)
+        pipeline.execute()
+
+
+@lru_cache(maxsize=None)
+def get_token_bucket():
+    """Return the process-wide bucket configured by ``TELEGRAM_RATE_LIMIT_BACKEND``."""
+    backend = getattr(settings, 'TELEGRAM_RATE_LIMIT_BACKEND', 'memory')
+    rate = getattr(settings, 'TELEGRAM_RATE_PER_SECOND', 1.0)
+    burst = getattr(settings, 'TELEGRAM_RATE_BURST', 3)
+    
+    if backend == 'memory':
+        return InMemoryTokenBucket(rate, burst)
+    if backend == 'redis':
+        return RedisTokenBucket(settings.REDIS_URL, rate, burst)
+    raise ImproperlyConfigured(f"Unknown TELEGRAM_RATE_LIMIT_BACKEND: {backend}")
+
+
+@lru_cache(maxsize=None)
+def get_http_client() -> httpx.Client:
+    """Return the process-wide HTTP client for the Bot API, closed when the process exits."""
+    client = httpx.Client(timeout=10)
+    atexit.register(client.close)
+    return client
+
+
+class OutboundTelegramSender:
+    """
+    Shared outbound sender for Telegram messages.
+    
+    Messages are queued in OutboundMessage and delivered in priority order
+    (payment > fine > overdue > default > summary) without exceeding the
+    per-chat token bucket. A 429 pauses the chat for ``retry_after``
+    seconds and re-queues the message; permanent errors and messages that
+    keep failing end up as dead letters instead of being dropped.
+    """
+    
+    # Bot API errors that will not succeed on retry (bad request, bot blocked, chat not found)
+    permanent_errors = {400, 401, 403, 404}
+    
+    def __init__(self, bucket=None, client=None):
+        self.bot_token = settings.TELEGRAM_BOT_TOKEN
+        self.chat_id = settings.TELEGRAM_CHAT_ID
+        if not self.bot_token:
+            raise ImproperlyConfigured("TELEGRAM_BOT_TOKEN is not set")
+        
+        api_url = getattr(settings, 'TELEGRAM_API_URL', 'https://api.telegram.org').rstrip('/')
+        self.url = f'{api_url}/bot{self.bot_token}/sendMessage'
+        self.bucket = bucket or get_token_bucket()
+        # Shared by every sender of the process, so connections and TLS sessions are reused
+        self.client = client or get_http_client()
+        self.max_attempts = getattr(settings, 'TELEGRAM_OUTBOUND_MAX_ATTEMPTS', 5)
+        self.lease = timedelta(seconds=60)
+    
+    def enqueue(self, text: str, priority: str = 'default', chat_id: str = None) -> OutboundMessage:
+        """
+        Queue a message for delivery.
+        
+        Args:
+            text: HTML message text
+            priority: Key of ``OutboundMessage.PRIORITIES``
+            chat_id: Target chat (defaults to ``TELEGRAM_CHAT_ID``)
+        
+        Returns:
+            OutboundMessage: Queued message
+        """
+        return OutboundMessage.objects.create(
+            chat_id=str(chat_id or self.chat_id),
+            text=text,
+            priority=OutboundMessage.PRIORITIES.get(priority, OutboundMessage.PRIORITIES['default'])
+        )
+    
+    def claim(self, limit: int = 5) -> list:
+        """
+        Lease up to ``limit`` due messages, highest priority first.
+        
+        Claimed rows are hidden from other workers for ``lease`` so a
+        crashed worker's messages are retried instead of lost.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            message_ids = list(
+                OutboundMessage.objects.select_for_update(skip_locked=True)
+                .filter(status='QUEUED', available_at__lte=now)
+                .order_by('priority', 'available_at', 'id')
+                .values_list('id', flat=True)[:limit]
+            )
+            OutboundMessage.objects.filter(id__in=message_ids).update(available_at=now + self.lease)
+        messages = OutboundMessage.objects.in_bulk(message_ids)
+        return [messages[message_id] for message_id in message_ids if message_id in messages]
+    
+    def _defer(self, message, seconds: float, **fields):
+        fields['available_at'] = timezone.now() + timedelta(seconds=seconds)
+        OutboundMessage.objects.filter(pk=message.pk).update(**fields)
+    
+    def acquire(self, chat_id: str, deadline: float) -> bool:
+        """Wait for a token of ``chat_id``; False if none is available before ``deadline`` (monotonic)."""
+        while True:
+            wait = self.bucket.take(chat_id)
+            if wait <= 0:
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+    
+    def deliver(self, message) -> str:
+        """
+        Try to deliver one claimed message without waiting for the bucket.
+        
+        Returns:
+            str: ``sent``, ``throttled``, ``retry`` or ``dead``
+        """
+        wait = self.bucket.take(message.chat_id)
+        if wait > 0:
+            self._defer(message, wait)
+            return 'throttled'
+        return self.send(message)
+    
+    def send(self, message) -> str:
+        """
+        Post a message to the Bot API (the caller has taken a token).
+        
+        Returns:
+            str: ``sent``, ``throttled``, ``retry`` or ``dead``
+        """
+        try:
+            response = self.client.post(self.url, json={
+                'chat_id': message.chat_id,
+                'text': message.text,
+                'parse_mode': 'HTML',
+            })
+            data = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            return self._fail(message, str(e))
+        
+        if response.status_code == 200 and data.get('ok'):
+            OutboundMessage.objects.filter(pk=message.pk).delete()
+            return 'sent'
+        
+        description = data.get('description', response.text)
+        if response.status_code == 429:
+            retry_after = float(data.get('parameters', {}).get('retry_after', 1))
+            self.bucket.pause(message.chat_id, retry_after)
+            self._defer(message, retry_after, last_error=description)
+            return 'throttled'
+        if response.status_code in self.permanent_errors:
+            return self._fail(message, description, permanent=True)
+        return self._fail(message, description)
+    
+    def _fail(self, message, error: str, permanent: bool = False) -> str:
+        attempts = message.attempts + 1
+        if permanent or attempts >= self.max_attempts:
+            OutboundMessage.objects.filter(pk=message.pk).update(
+                status='DEAD',
+                attempts=attempts,
+                last_error=error
+            )
+            logger.error(f"Telegram message {message.pk} moved to dead letters: {error}")
+            return 'dead'
+        self._defer(message, 2 ** attempts, attempts=attempts, last_error=error)
+        return 'retry'
+    
+    def deliver_now(self, message_id: int) -> str:
+        """Deliver a single queued message right away if the bucket allows it."""
+        now = timezone.now()
+        claimed = OutboundMessage.objects.filter(
+            pk=message_id,
+            status='QUEUED',
+            available_at__lte=now
+        ).update(available_at=now + self.lease)
+        if not claimed:
+            return 'throttled'
+        return self.deliver(OutboundMessage.objects.get(pk=message_id))
+    
+    def drain(self, duration: float = 50) -> dict:
+        """
+        Deliver queued messages for up to ``duration`` seconds.
+        
+        The worker waits for bucket tokens instead of bursting, so one run
+        keeps each chat at its rate limit; whatever is left when time runs
+        out stays queued in priority order for the next run.
+        
+        Returns:
+            dict: Count of delivery outcomes
+        """
+        deadline = time.monotonic() + duration
+        results = {'sent': 0, 'throttled': 0, 'retry': 0, 'dead': 0}
+        while time.monotonic() < deadline:
+            messages = self.claim()
+            if not messages:
+                next_at = OutboundMessage.objects.filter(status='QUEUED').aggregate(
+                    next_at=Min('available_at')
+                )['next_at']
+                if next_at is None:
+                    break
+                wait = max((next_at - timezone.now()).total_seconds(), 0.01)
+                if time.monotonic() + wait >= deadline:
+                    break
+                time.sleep(wait)
+                continue
+            
+            for index, message in enumerate(messages):
+                if not self.acquire(message.chat_id, deadline):
+                    # Out of time: release the rest of the lease
+                    OutboundMessage.objects.filter(
+                        pk__in=[pending.pk for pending in messages[index:]]
+                    ).update(available_at=timezone.now())
+                    return results
+                results[self.send(message)] += 1
+        return results
+    
+    def requeue_dead(self) -> int:
+        """Move every dead letter back to the queue."""
+        return OutboundMessage.objects.filter(status='DEAD').update(
+            status='QUEUED',
+            attempts=0,
+            available_at=timezone.now()
+        )
\ No newline at end of file
@@ -1,9 +1,19 @@
 import asyncio
 import logging
+from datetime import date, timedelta
 from telegram import Bot
 from telegram.error import TelegramError
 from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django_q.tasks import async_task
 from django.core.exceptions import ImproperlyConfigured
+from payments.fine_policy import FinePolicy
+from .models import OverdueNotificationState, PendingNotification
+from .outbound import OutboundTelegramSender
 
 logger = logging.getLogger(__name__)
 
@@ -19,19 +29,31 @@ class TelegramNotificationService:
             raise ImproperlyConfigured("TELEGRAM_BOT_TOKEN is not set")
         if not self.chat_id:
             raise ImproperlyConfigured("TELEGRAM_CHAT_ID is not set")
-        
-        self.bot = Bot(token=self.bot_token)
     
-    def send_message(self, message: str) -> bool:
+    @cached_property
+    def bot(self) -> Bot:
+        """Bot for direct sends, built on first use: creating one loads the TLS trust store twice."""
+        api_url = getattr(settings, 'TELEGRAM_API_URL', 'https://api.telegram.org').rstrip('/')
+        return Bot(token=self.bot_token, base_url=f'{api_url}/bot')
+    
+    def send_message(self, message: str, priority: str = 'default') -> bool:
         """
         Send a message to Telegram.
         
+        With ``TELEGRAM_OUTBOUND_QUEUE_ENABLED`` the message goes through the
+        shared outbound queue instead (rate limited per chat, ordered by
+        priority, retried and dead-lettered).
+        
         Args:
             message: Message to send
-            
+            priority: Outbound priority (payment, fine, overdue, default, summary)
+        
         Returns:
-            bool: True if message was sent successfully
+            bool: True if message was sent (or queued) successfully
         """
+        if getattr(settings, 'TELEGRAM_OUTBOUND_QUEUE_ENABLED', False):
+            return self.queue_message(message, priority)
+        
         try:
             # Use asyncio to run the async bot.send_message
             loop = asyncio.new_event_loop()
@@ -48,7 +70,7 @@ class TelegramNotificationService:
             loop.close()
             logger.info(f"Telegram message sent successfully: {message[:50]}...")
             return True
-            
+        
         except TelegramError as e:
             logger.error(f"Telegram error: {str(e)}")
             return False
@@ -56,15 +78,55 @@ class TelegramNotificationService:
             logger.error(f"Error sending Telegram message: {str(e)}")
             return False
     
-    def send_borrowing_notification(self, borrowing) -> bool:
+    def queue_message(self, message: str, priority: str = 'default') -> bool:
+        """
+        Queue a message for the outbound sender.
+        
+        Once the transaction commits a Django-Q task delivers it if the
+        chat's token bucket allows it, so the request never waits on the
+        Bot API; otherwise the ``telegram_outbound`` worker sends it later.
+        """
+        outbound = OutboundTelegramSender().enqueue(message, priority, self.chat_id)
+        transaction.on_commit(lambda: self.enqueue_delivery(outbound.pk))
+        return True
+    
+    @staticmethod
+    def enqueue_delivery(message_id: int):
+        """Queue the delivery task; if the broker is down the ``telegram_outbound`` worker sends the message."""
+        try:
+            async_task('tasks.scheduled_tasks.deliver_telegram_message_task', message_id)
+        except Exception as e:
+            logger.warning(f"Failed to queue delivery of Telegram message {message_id}: {str(e)}")
+    
+    def dispatch(self, event_type: str, message: str, summary: str, urgent: bool = False) -> bool:
+        """
+        Send a message now, or buffer it for the event type's digest.
+        
+        Args:
+            event_type: Digest key, e.g. ``borrowing``
+            message: Full message sent when the event is not digested
+            summary: One-line summary used in the digest
+            urgent: Bypass the digest and send immediately
+        
+        Returns:
+            bool: True if the message was sent or buffered
+        """
+        if urgent or NotificationDigestService.get_config(event_type) is None:
+            return self.send_message(message, NotificationDigestService.get_priority(event_type))
+        
+        NotificationDigestService(self).add(event_type, summary)
+        return True
+    
+    def send_borrowing_notification(self, borrowing, urgent: bool = False) -> bool:
         """
         Send notification about new borrowing.
         
         Args:
             borrowing: Borrowing instance
-            
+            urgent: Bypass the digest and send immediately
+        
         Returns:
-            bool: True if notification was sent successfully
+            bool: True if notification was sent (or buffered) successfully
         """
         message = (
             f"📚 <b>New Book Borrowed</b>\n\n"
@@ -75,18 +137,23 @@ class TelegramNotificationService:
             f"💰 Daily Fee: ${borrowing.book.daily_fee}\n\n"
             f"ID: {borrowing.id}"
         )
+        summary = (
+            f"{borrowing.user.get_full_name() or borrowing.user.email} - "
+            f"{borrowing.book.title} (due {borrowing.expected_return_date}) #{borrowing.id}"
+        )
         
-        return self.send_message(message)
+        return self.dispatch('borrowing', message, summary, urgent)
     
-    def send_return_notification(self, borrowing) -> bool:
+    def send_return_notification(self, borrowing, urgent: bool = False) -> bool:
         """
         Send notification about book return.
         
         Args:
             borrowing: Borrowing instance
-            
+            urgent: Bypass the digest and send immediately
+        
         Returns:
-            bool: True if notification was sent successfully
+            bool: True if notification was sent (or buffered) successfully
         """
         message = (
             f"📚 <b>Book Returned</b>\n\n"
@@ -96,8 +163,12 @@ class TelegramNotificationService:
             f"📅 Expected Return: {borrowing.expected_return_date}\n\n"
             f"ID: {borrowing.id}"
         )
+        summary = (
+            f"{borrowing.user.get_full_name() or borrowing.user.email} - "
+            f"{borrowing.book.title} (returned {borrowing.actual_return_date}) #{borrowing.id}"
+        )
         
-        return self.send_message(message)
+        return self.dispatch('return', message, summary, urgent)
     
     def send_overdue_notification(self, borrowing) -> bool:
         """
@@ -105,12 +176,12 @@ class TelegramNotificationService:
         
         Args:
             borrowing: Borrowing instance
-            
+        
         Returns:
             bool: True if notification was sent successfully
         """
         overdue_days = borrowing.overdue_days
-        fine_amount = borrowing.book.daily_fee * overdue_days * 2  # 2x multiplier
+        fine_amount = FinePolicy.from_settings().calculate(borrowing.book.daily_fee, overdue_days)
         
         message = (
             f"⚠️ <b>Overdue Book Alert</b>\n\n"
@@ -122,17 +193,42 @@ class TelegramNotificationService:
             f"ID: {borrowing.id}"
         )
         
+        return self.send_message(message, priority='overdue')
+    
+    def send_reminder_notification(self, borrowing) -> bool:
+        """
+        Send reminder about a book that is due soon.
+        
+        Args:
+            borrowing: Borrowing instance
+        
+        Returns:
+            bool: True if notification was sent successfully
+        """
+        days_until_due = (borrowing.expected_return_date - date.today()).days
+        
+        message = (
+            f"📚 <b>Return Reminder</b>\n\n"
+            f"👤 User: {borrowing.user.get_full_name() or borrowing.user.email}\n"
+            f"📖 Book: {borrowing.book.title} by {borrowing.book.author}\n"
+            f"📅 Due Date: {borrowing.expected_return_date}\n"
+            f"⏰ Days Until Due: {days_until_due}\n\n"
+            f"Please return the book on time to avoid fines.\n\n"
+            f"ID: {borrowing.id}"
+        )
+        
         return self.send_message(message)
     
-    def send_payment_notification(self, payment) -> bool:
+    def send_payment_notification(self, payment, urgent: bool = False) -> bool:
         """
         Send notification about payment.
         
         Args:
             payment: Payment instance
-            
+            urgent: Bypass the digest and send immediately
+        
         Returns:
-            bool: True if notification was sent successfully
+            bool: True if notification was sent (or buffered) successfully
         """
         status_emoji = {
             'PENDING': '⏳',
@@ -149,21 +245,27 @@ class TelegramNotificationService:
             f"📊 Status: {payment.status}\n\n"
             f"ID: {payment.id}"
         )
+        summary = (
+            f"{status_emoji.get(payment.status, '❓')} {payment.type} ${payment.money_to_pay} "
+            f"{payment.status} - {payment.user.get_full_name() or payment.user.email} #{payment.id}"
+        )
         
-        return self.send_message(message)
+        return self.dispatch('payment', message, summary, urgent)
     
-    def send_fine_notification(self, borrowing) -> bool:
+    def send_fine_notification(self, borrowing, fine_amount=None) -> bool:
         """
         Send notification about fine creation.
         
         Args:
             borrowing: Borrowing instance
-            
+            fine_amount: Amount of the fine (computed from the overdue days if not given)
+        
         Returns:
             bool: True if notification was sent successfully
         """
         overdue_days = borrowing.overdue_days
-        fine_amount = borrowing.book.daily_fee * overdue_days * 2  # 2x multiplier
+        if fine_amount is None:
+            fine_amount = FinePolicy.from_settings().calculate(borrowing.book.daily_fee, overdue_days)
         
         message = (
             f"💰 <b>Fine Created</b>\n\n"
@@ -175,7 +277,31 @@ class TelegramNotificationService:
             f"ID: {borrowing.id}"
         )
         
-        return self.send_message(message)
+        return self.send_message(message, priority='fine')
+    
+    def send_bulk_notification(self, title: str, count: int, details: dict, items: list,
+                               priority: str = 'default') -> bool:
+        """
+        Send one digest message about a bulk admin action.
+        
+        Args:
+            title: Message title
+            count: Number of affected objects
+            details: Label/value lines shown under the title
+            items: One-line summaries of (some of) the affected objects
+            priority: Outbound priority
+        
+        Returns:
+            bool: True if notification was sent successfully
+        """
+        lines = [f"<b>{title}</b>", ""] + [f"{label}: {value}" for label, value in details.items()]
+        if items:
+            lines.append("")
+            lines.extend(f"• {item}" for item in items)
+            if count > len(items):
+                lines.append(f"… and {count - len(items)} more")
+        
+        return self.send_message("\n".join(lines), priority=priority)
     
     def send_daily_summary(self, summary_data: dict) -> bool:
         """
@@ -183,7 +309,7 @@ class TelegramNotificationService:
         
         Args:
             summary_data: Dictionary with summary data
-            
+        
         Returns:
             bool: True if notification was sent successfully
         """
@@ -197,4 +323,329 @@ class TelegramNotificationService:
             f"📅 Date: {summary_data.get('date', 'N/A')}"
         )
         
-        return self.send_message(message)
\ No newline at end of file
+        return self.send_message(message, priority='summary')
+
+
+class NotificationDigestService:
+    """
+    Service that coalesces per-event messages into periodic digests.
+    
+    Events of a digested type are buffered in PendingNotification and sent
+    as one aggregated message once the oldest buffered event is older than
+    the type's ``window`` (seconds) or ``max_events`` are waiting. Types are
+    configured in ``NOTIFICATION_DIGEST``; the mode is switched on with
+    ``NOTIFICATION_DIGEST_ENABLED``.
+    """
+    
+    titles = {
+        'borrowing': '📚 New Borrowings',
+        'return': '📖 Returns',
+        'payment': '💳 Payments',
+    }
+    
+    # Outbound priority of each event type (see OutboundMessage.PRIORITIES)
+    priorities = {
+        'payment': 'payment',
+    }
+    
+    # Telegram rejects messages longer than 4096 characters
+    max_message_length = 4096
+    
+    def __init__(self, telegram_service=None):
+        self.telegram_service = telegram_service
+    
+    @classmethod
+    def get_priority(cls, event_type: str) -> str:
+        """Return the outbound priority used for an event type."""
+        return cls.priorities.get(event_type, 'default')
+    
+    @staticmethod
+    def get_config(event_type: str):
+        """Return the digest config of an event type, or None if it is sent immediately."""
+        if not getattr(settings, 'NOTIFICATION_DIGEST_ENABLED', False):
+            return None
+        return getattr(settings, 'NOTIFICATION_DIGEST', {}).get(event_type)
+    
+    @staticmethod
+    def counter_key(event_type: str) -> str:
+        """Return the cache key counting the buffered events of a type."""
+        return f'notifications:digest:{event_type}:buffered'
+    
+    def add(self, event_type: str, summary: str):
+        """
+        Buffer an event and flush the digest once it reaches ``max_events``.
+        
+        Buffered events are counted in the cache instead of the table, and
+        only the event that fills the digest schedules a flush. The flush
+        runs after the surrounding transaction commits, so events from
+        rolled back borrowings or payments are never sent.
+        """
+        PendingNotification.objects.create(event_type=event_type, summary=summary)
+        
+        max_events = self.get_config(event_type).get('max_events', 50)
+        key = self.counter_key(event_type)
+        try:
+            cache.add(key, 0, timeout=None)
+            buffered = cache.incr(key)
+        except Exception as e:
+            # flush_due still sends the digest when its window elapses
+            logger.error(f"Failed to count buffered {event_type} notifications: {str(e)}")
+            return
+        if buffered % max_events == 0:
+            transaction.on_commit(lambda: self.flush(event_type))
+    
+    def build_messages(self, event_type: str, summaries: list) -> list:
+        """Build digest messages, split so each fits into one Telegram message."""
+        title = self.titles.get(event_type, event_type)
+        messages = []
+        lines = []
+        length = 0
+        for summary in summaries:
+            line = f"• {summary}"
+            if lines and length + len(line) + 1 > self.max_message_length - 100:
+                messages.append(lines)
+                lines, length = [], 0
+            lines.append(line)
+            length += len(line) + 1
+        if lines:
+            messages.append(lines)
+        
+        return [
+            f"<b>{title}</b> ({len(chunk)} events)\n\n" + "\n".join(chunk)
+            for chunk in messages
+        ]
+    
+    def flush(self, event_type: str) -> int:
+        """
+        Send all buffered events of a type as digest messages.
+        
+        Buffered rows are claimed (``SKIP LOCKED`` where supported) and
+        deleted before sending; if Telegram rejects a digest its events are
+        buffered again for the next flush.
+        
+        Returns:
+            int: Number of events sent
+        """
+        with transaction.atomic():
+            pending = list(
+                PendingNotification.objects.select_for_update(skip_locked=True)
+                .filter(event_type=event_type)
+                .order_by('id')
+                .values_list('id', 'summary', 'created_at')
+            )
+            PendingNotification.objects.filter(id__in=[row[0] for row in pending]).delete()
+        if not pending:
+            return 0
+        self.adjust_counter(event_type, -len(pending))
+        
+        telegram_service = self.telegram_service or TelegramNotificationService()
+        summaries = [summary for _, summary, _ in pending]
+        priority = self.get_priority(event_type)
+        messages = self.build_messages(event_type, summaries)
+        if all(telegram_service.send_message(message, priority) for message in messages):
+            return len(pending)
+        
+        logger.error(f"Failed to send {event_type} digest, keeping {len(pending)} events buffered")
+        self.adjust_counter(event_type, len(pending))
+        PendingNotification.objects.bulk_create([
+            PendingNotification(event_type=event_type, summary=summary, created_at=created_at)
+            for _, summary, created_at in pending
+        ])
+        return 0
+    
+    def adjust_counter(self, event_type: str, amount: int):
+        """Move the buffered event count by ``amount``, never below zero."""
+        key = self.counter_key(event_type)
+        try:
+            cache.add(key, 0, timeout=None)
+            if cache.incr(key, amount) < 0:
+                cache.set(key, 0, timeout=None)
+        except Exception as e:
+            logger.error(f"Failed to count buffered {event_type} notifications: {str(e)}")
+    
+    def flush_due(self, now=None) -> dict:
+        """
+        Flush every digest whose window has elapsed or that is full.
+        
+        Returns:
+            dict: Number of events sent per event type
+        """
+        now = now or timezone.now()
+        digests = getattr(settings, 'NOTIFICATION_DIGEST', {})
+        pending = PendingNotification.objects.values('event_type').annotate(
+            oldest=Min('created_at'),
+            count=Count('id')
+        )
+        
+        sent = {}
+        for row in pending:
+            config = digests.get(row['event_type'], {})
+            window = timedelta(seconds=config.get('window', 60))
+            if row['oldest'] <= now - window or row['count'] >= config.get('max_events', 50):
+                sent[row['event_type']] = self.flush(row['event_type'])
+        return sent
+
+
+class OverdueAlertService:
+    """
+    Service for deduplicated, escalating overdue alerts.
+    
+    Each active borrowing has an OverdueNotificationState. An alert is sent
+    only when its ``next_alert_on`` has arrived, after which the state moves
+    to the next step of the policy (``OVERDUE_ALERT_DAYS`` after the due
+    date, then every ``OVERDUE_ALERT_REPEAT_DAYS``).
+    """
+    
+    def __init__(self, telegram_service=None):
+        self.telegram_service = telegram_service or TelegramNotificationService()
+        self.alert_days = getattr(settings, 'OVERDUE_ALERT_DAYS', [1, 3, 7])
+        self.repeat_days = getattr(settings, 'OVERDUE_ALERT_REPEAT_DAYS', 7)
+    
+    @classmethod
+    def first_alert_on(cls, borrowing) -> date:
+        """Return the date of the first overdue alert for a borrowing."""
+        alert_days = getattr(settings, 'OVERDUE_ALERT_DAYS', [1, 3, 7])
+        return borrowing.expected_return_date + timedelta(days=alert_days[0])
+    
+    def alert_on(self, borrowing, alert_count: int) -> date:
+        """
+        Return when alert number ``alert_count`` (0-based) is due.
+        
+        Args:
+            borrowing: Borrowing instance
+            alert_count: Number of alerts already sent
+        
+        Returns:
+            date: Date of the next alert
+        """
+        if alert_count < len(self.alert_days):
+            days = self.alert_days[alert_count]
+        else:
+            days = self.alert_days[-1] + self.repeat_days * (alert_count - len(self.alert_days) + 1)
+        return borrowing.expected_return_date + timedelta(days=days)
+    
+    @classmethod
+    def track(cls, borrowing):
+        """
+        Create, update or drop the state of a borrowing after it is saved.
+        
+        Returned borrowings lose their state; if the due date of a borrowing
+        that has not been alerted yet changes, its first alert moves with it.
+        """
+        if not borrowing.is_active:
+            OverdueNotificationState.objects.filter(borrowing=borrowing).delete()
+            return
+        
+        first_alert_on = cls.first_alert_on(borrowing)
+        state, created = OverdueNotificationState.objects.get_or_create(
+            borrowing=borrowing,
+            defaults={'next_alert_on': first_alert_on}
+        )
+        if not created and state.alert_count == 0 and state.next_alert_on != first_alert_on:
+            OverdueNotificationState.objects.filter(pk=state.pk, alert_count=0).update(next_alert_on=first_alert_on)
+    
+    @classmethod
+    def backfill(cls) -> int:
+        """
+        Create states for active borrowings that have none.
+        
+        Returns:
+            int: Number of states created
+        """
+        from borrowings.models import Borrowing
+        borrowings = Borrowing.objects.filter(
+            actual_return_date__isnull=True,
+            overdue_notification_state__isnull=True
+        )
+        states = [
+            OverdueNotificationState(borrowing=borrowing, next_alert_on=cls.first_alert_on(borrowing))
+            for borrowing in borrowings.only('id', 'expected_return_date').iterator()
+        ]
+        OverdueNotificationState.objects.bulk_create(states, ignore_conflicts=True, batch_size=1000)
+        return len(states)
+    
+    def send_alert(self, state, today: date) -> bool:
+        """
+        Send one overdue alert and advance the state.
+        
+        The state is claimed with a conditional update first, so concurrent
+        sweeps never alert twice; if Telegram rejects the message the claim
+        is rolled back and the alert is retried on the next run.
+        
+        Args:
+            state: OverdueNotificationState with borrowing, user and book loaded
+            today: Current date
+        
+        Returns:
+            bool: True if an alert was sent
+        """
+        borrowing = state.borrowing
+        alert_count = state.alert_count + 1
+        next_alert_on = self.alert_on(borrowing, alert_count)
+        while next_alert_on <= today:
+            # Skip steps missed while the sweep was not running instead of sending a burst
+            alert_count += 1
+            next_alert_on = self.alert_on(borrowing, alert_count)
+        
+        claimed = OverdueNotificationState.objects.filter(
+            pk=state.pk,
+            next_alert_on=state.next_alert_on
+        ).update(alert_count=alert_count, last_alerted_on=today, next_alert_on=next_alert_on)
+        if not claimed:
+            return False
+        
+        if self.telegram_service.send_overdue_notification(borrowing):
+            return True
+        
+        OverdueNotificationState.objects.filter(pk=state.pk, next_alert_on=next_alert_on).update(
+            alert_count=state.alert_count,
+            last_alerted_on=state.last_alerted_on,
+            next_alert_on=state.next_alert_on
+        )
+        return False
+    
+    def alert_borrowing(self, borrowing, today: date = None) -> bool:
+        """Send an alert for one borrowing if its next alert is due."""
+        today = today or date.today()
+        state = OverdueNotificationState.objects.filter(
+            borrowing=borrowing,
+            next_alert_on__lte=today
+        ).first()
+        if state is None or not borrowing.is_active:
+            return False
+        state.borrowing = borrowing
+        return self.send_alert(state, today)
+    
+    def process_due_alerts(self, today: date = None) -> int:
+        """
+        Send every overdue alert that is due today.
+        
+        Returns:
+            int: Number of alerts sent
+        """
+        today = today or date.today()
+        return self.send_alerts(self.due_states(today).order_by('next_alert_on').iterator(), today)
+    
+    @staticmethod
+    def due_states(today: date):
+        """States of active borrowings whose next alert is due, with borrowing, user and book."""
+        return OverdueNotificationState.objects.filter(
+            next_alert_on__lte=today,
+            borrowing__actual_return_date__isnull=True
+        ).select_related('borrowing__user', 'borrowing__book')
+    
+    def send_alerts(self, states, today: date) -> int:
+        """
+        Send the alerts of the given due states, logging failures.
+        
+        Returns:
+            int: Number of alerts sent
+        """
+        sent = 0
+        for state in states:
+            try:
+                if self.send_alert(state, today):
+                    sent += 1
+            except Exception as e:
+                logger.error(f"Failed to send overdue alert for borrowing {state.borrowing_id}: {str(e)}")
+        return sent
\ No newline at end of file
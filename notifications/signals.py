@@ -4,7 +4,7 @@ from django.utils import timezone
 from datetime import date
 from borrowings.models import Borrowing
 from payments.models import Payment
-from .services import TelegramNotificationService
+from .services import TelegramNotificationService, OverdueAlertService
 
 
 @receiver(post_save, sender=Borrowing)
@@ -41,6 +41,14 @@ def send_return_notification(sender, instance, **kwargs):
         print(f"Failed to send return notification: {str(e)}")
 
 
+@receiver(post_save, sender=Borrowing)
+def track_overdue_notification_state(sender, instance, **kwargs):
+    """
+    Keep the borrowing's overdue alert state in step with its due date and return.
+    """
+    OverdueAlertService.track(instance)
+
+
 @receiver(post_save, sender=Payment)
 def send_payment_notification(sender, instance, created, **kwargs):
     """
@@ -67,22 +75,11 @@ def send_payment_notification(sender, instance, created, **kwargs):
 
 def check_overdue_books():
     """
-    Check for overdue books and send notifications.
+    Send overdue alerts that are due according to the escalation policy.
     This function can be called by a scheduled task.
     """
-    today = date.today()
-    overdue_borrowings = Borrowing.objects.filter(
-        expected_return_date__lt=today,
-        actual_return_date__isnull=True
-    )
-    
-    telegram_service = TelegramNotificationService()
-    
-    for borrowing in overdue_borrowings:
-        try:
-            telegram_service.send_overdue_notification(borrowing)
-        except Exception as e:
-            print(f"Failed to send overdue notification for borrowing {borrowing.id}: {str(e)}")
+    sent = OverdueAlertService().process_due_alerts()
+    print(f"Sent {sent} overdue alerts")
 
 
 def send_daily_summary():
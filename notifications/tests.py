@@ -0,0 +1,377 @@
+"""
+Tests for Notifications app.
+"""
+
+import time
+import pytest
+from datetime import date, timedelta
+from unittest.mock import MagicMock
+
+
+@pytest.mark.django_db
+class TestOverdueAlerts:
+    """Test deduplicated, escalating overdue alerts."""
+    
+    @pytest.fixture
+    def book(self):
+        """Create a book with enough copies for several borrowings."""
+        from books.models import Book
+        return Book.objects.create(title='Dune', author='Herbert', cover='HARD', inventory=10, daily_fee=1)
+    
+    @pytest.fixture
+    def overdue_borrowing(self, user, book):
+        """Create a borrowing whose due date is 10 days ago."""
+        from borrowings.models import Borrowing
+        borrowing = Borrowing.objects.create(
+            user=user,
+            book=book,
+            expected_return_date=date.today() + timedelta(days=7)
+        )
+        borrowing.expected_return_date = date.today() - timedelta(days=10)
+        borrowing.save()
+        return borrowing
+    
+    def get_service(self):
+        """Return an OverdueAlertService with a fake Telegram service."""
+        from notifications.services import OverdueAlertService
+        telegram_service = MagicMock()
+        telegram_service.send_overdue_notification.return_value = True
+        return OverdueAlertService(telegram_service)
+    
+    def test_state_created_on_borrow(self, user, book):
+        """Test that borrowing creates state with the first alert the day after the due date."""
+        from borrowings.models import Borrowing
+        borrowing = Borrowing.objects.create(
+            user=user,
+            book=book,
+            expected_return_date=date.today() + timedelta(days=7)
+        )
+        
+        state = borrowing.overdue_notification_state
+        assert state.alert_count == 0
+        assert state.next_alert_on == borrowing.expected_return_date + timedelta(days=1)
+    
+    def test_state_removed_on_return(self, overdue_borrowing):
+        """Test that returning the book drops its alert state."""
+        from notifications.models import OverdueNotificationState
+        
+        overdue_borrowing.actual_return_date = date.today()
+        overdue_borrowing.save()
+        
+        assert not OverdueNotificationState.objects.filter(borrowing=overdue_borrowing).exists()
+    
+    def test_alert_sent_once_per_step(self, overdue_borrowing):
+        """Test that repeated sweeps on the same day send a single alert."""
+        service = self.get_service()
+        
+        assert service.process_due_alerts() == 1
+        assert service.process_due_alerts() == 0
+        assert service.telegram_service.send_overdue_notification.call_count == 1
+    
+    def test_escalation_schedule(self, overdue_borrowing):
+        """Test the 1, 3, 7 days then weekly escalation policy."""
+        service = self.get_service()
+        due = overdue_borrowing.expected_return_date
+        sent_on = []
+        
+        for offset in range(1, 30):
+            day = due + timedelta(days=offset)
+            if service.process_due_alerts(today=day):
+                sent_on.append(offset)
+        
+        assert sent_on == [1, 3, 7, 14, 21, 28]
+    
+    def test_missed_steps_are_not_sent_in_a_burst(self, overdue_borrowing):
+        """Test that a late first sweep sends one alert and schedules the next future step."""
+        service = self.get_service()
+        
+        assert service.process_due_alerts() == 1
+        
+        state = overdue_borrowing.overdue_notification_state
+        state.refresh_from_db()
+        assert state.alert_count == 3
+        assert state.next_alert_on == overdue_borrowing.expected_return_date + timedelta(days=14)
+    
+    def test_failed_send_is_retried(self, overdue_borrowing):
+        """Test that a rejected Telegram message does not advance the state."""
+        service = self.get_service()
+        service.telegram_service.send_overdue_notification.return_value = False
+        
+        assert service.process_due_alerts() == 0
+        
+        service.telegram_service.send_overdue_notification.return_value = True
+        assert service.process_due_alerts() == 1
+    
+    def test_sweep_reads_only_due_states(self, overdue_borrowing, user, book, django_assert_num_queries):
+        """Test that not-yet-due borrowings are not loaded by the sweep."""
+        from borrowings.models import Borrowing
+        for _ in range(3):
+            Borrowing.objects.create(user=user, book=book, expected_return_date=date.today() + timedelta(days=7))
+        service = self.get_service()
+        service.process_due_alerts()
+        
+        # One indexed query, nothing due
+        with django_assert_num_queries(1):
+            assert service.process_due_alerts() == 0
+    
+    def test_backfill_creates_missing_state(self, overdue_borrowing):
+        """Test that backfill creates state for borrowings without one."""
+        from notifications.models import OverdueNotificationState
+        from notifications.services import OverdueAlertService
+        OverdueNotificationState.objects.all().delete()
+        
+        assert OverdueAlertService.backfill() == 1
+        assert OverdueAlertService.backfill() == 0
+
+
+@pytest.mark.django_db
+class TestNotificationDigest:
+    """Test coalescing of per-event notifications into digests."""
+    
+    @pytest.fixture(autouse=True)
+    def digest_settings(self, settings, monkeypatch):
+        """Enable digests and record messages instead of calling Telegram."""
+        from django.core.cache import cache
+        from notifications.services import TelegramNotificationService
+        cache.clear()
+        settings.TELEGRAM_BOT_TOKEN = 'test-token'
+        settings.TELEGRAM_CHAT_ID = '1'
+        settings.NOTIFICATION_DIGEST_ENABLED = True
+        settings.NOTIFICATION_DIGEST = {'borrowing': {'window': 60, 'max_events': 3}}
+        self.sent = []
+        monkeypatch.setattr(
+            TelegramNotificationService,
+            'send_message',
+            lambda service, message, priority='default': self.sent.append(message) or True
+        )
+    
+    @pytest.fixture
+    def book(self):
+        """Create a book with enough copies for several borrowings."""
+        from books.models import Book
+        return Book.objects.create(title='Dune', author='Herbert', cover='HARD', inventory=10, daily_fee=1)
+    
+    def borrow(self, user, book):
+        """Create a borrowing (which triggers the borrowing notification)."""
+        from borrowings.models import Borrowing
+        return Borrowing.objects.create(user=user, book=book, expected_return_date=date.today() + timedelta(days=7))
+    
+    def test_digested_events_are_buffered(self, user, book):
+        """Test that borrowing notifications are buffered instead of sent."""
+        from notifications.models import PendingNotification
+        
+        self.borrow(user, book)
+        self.borrow(user, book)
+        
+        assert self.sent == []
+        assert PendingNotification.objects.filter(event_type='borrowing').count() == 2
+    
+    def test_flush_after_window(self, user, book):
+        """Test that one digest is sent once the window has elapsed."""
+        from django.utils import timezone
+        from notifications.models import PendingNotification
+        from notifications.services import NotificationDigestService
+        first = self.borrow(user, book)
+        second = self.borrow(user, book)
+        
+        assert NotificationDigestService().flush_due() == {}
+        
+        sent = NotificationDigestService().flush_due(now=timezone.now() + timedelta(seconds=61))
+        
+        assert sent == {'borrowing': 2}
+        assert len(self.sent) == 1
+        assert '(2 events)' in self.sent[0]
+        assert f'#{first.id}' in self.sent[0] and f'#{second.id}' in self.sent[0]
+        assert not PendingNotification.objects.exists()
+    
+    def test_flush_when_full(self, user, book, django_capture_on_commit_callbacks):
+        """Test that reaching max_events flushes after commit."""
+        with django_capture_on_commit_callbacks(execute=True):
+            for _ in range(3):
+                self.borrow(user, book)
+        
+        assert len(self.sent) == 1
+        assert '(3 events)' in self.sent[0]
+    
+    def test_one_flush_per_full_digest(self, django_capture_on_commit_callbacks, django_assert_num_queries):
+        """Test that buffering costs one insert and only the filling event schedules a flush."""
+        from notifications.services import NotificationDigestService
+        service = NotificationDigestService()
+        
+        with django_capture_on_commit_callbacks() as callbacks:
+            with django_assert_num_queries(1):
+                service.add('borrowing', 'first')
+            for number in range(4):
+                service.add('borrowing', f'event {number}')
+        
+        assert len(callbacks) == 1
+    
+    def test_urgent_and_undigested_events_bypass(self, user, book):
+        """Test that urgent events and types without a digest are sent immediately."""
+        from notifications.services import TelegramNotificationService
+        from payments.models import Payment
+        borrowing = self.borrow(user, book)
+        self.sent.clear()
+        
+        TelegramNotificationService().send_borrowing_notification(borrowing, urgent=True)
+        Payment.objects.create(borrowing=borrowing, status='PENDING', type='PAYMENT', money_to_pay='5.00')
+        
+        assert len(self.sent) == 2
+        assert 'New Book Borrowed' in self.sent[0]
+    
+    def test_failed_digest_is_rebuffered(self, user, book, monkeypatch):
+        """Test that a rejected digest keeps its events for the next flush."""
+        from notifications.models import PendingNotification
+        from notifications.services import NotificationDigestService, TelegramNotificationService
+        self.borrow(user, book)
+        monkeypatch.setattr(TelegramNotificationService, 'send_message', lambda service, message, priority='default': False)
+        
+        assert NotificationDigestService().flush('borrowing') == 0
+        assert PendingNotification.objects.filter(event_type='borrowing').count() == 1
+    
+    def test_long_digest_is_split(self):
+        """Test that digests are split to fit Telegram's message limit."""
+        from notifications.services import NotificationDigestService
+        
+        messages = NotificationDigestService().build_messages('borrowing', ['x' * 100] * 100)
+        
+        assert len(messages) == 3
+        assert all(len(message) <= 4096 for message in messages)
+
+
+@pytest.mark.django_db(transaction=True)
+class TestOutboundTelegramSender:
+    """Test the rate-limited, prioritized outbound Telegram sender."""
+    
+    @pytest.fixture(autouse=True)
+    def fake_telegram(self, settings):
+        """Run a local fake Telegram server and point the sender at it."""
+        from library_service.fakes import FakeTelegramServer
+        server = FakeTelegramServer().start()
+        settings.TELEGRAM_API_URL = server.url
+        settings.TELEGRAM_BOT_TOKEN = 'test-token'
+        settings.TELEGRAM_CHAT_ID = '42'
+        settings.TELEGRAM_OUTBOUND_QUEUE_ENABLED = True
+        self.server = server
+        yield server
+        server.stop()
+    
+    def get_sender(self, rate=100.0, burst=10):
+        """Return a sender with its own in-memory bucket."""
+        from notifications.outbound import InMemoryTokenBucket, OutboundTelegramSender
+        return OutboundTelegramSender(bucket=InMemoryTokenBucket(rate, burst))
+    
+    def test_token_bucket(self):
+        """Test burst capacity, refill and pause."""
+        from notifications.outbound import InMemoryTokenBucket
+        bucket = InMemoryTokenBucket(rate=2, burst=2)
+        
+        assert bucket.take('chat', now=100.0) == 0
+        assert bucket.take('chat', now=100.0) == 0
+        assert bucket.take('chat', now=100.0) == pytest.approx(0.5)
+        assert bucket.take('chat', now=100.5) == 0
+        bucket.pause('chat', 3, now=101.0)
+        assert bucket.take('chat', now=102.0) == pytest.approx(2.0)
+        assert bucket.take('other', now=102.0) == 0
+    
+    def test_priority_order(self):
+        """Test that payment > fine > overdue > summary regardless of queue order."""
+        sender = self.get_sender()
+        for priority in ['summary', 'overdue', 'payment', 'fine']:
+            sender.enqueue(priority, priority)
+        
+        result = sender.drain(duration=5)
+        
+        assert result['sent'] == 4
+        assert [text for _, _, text in self.server.received] == ['payment', 'fine', 'overdue', 'summary']
+    
+    def test_retry_after_is_honored(self):
+        """Test that a 429 pauses the chat for retry_after and the message is retried."""
+        from notifications.models import OutboundMessage
+        self.server.responses = [(429, {'ok': False, 'error_code': 429, 'parameters': {'retry_after': 1}})]
+        sender = self.get_sender()
+        sender.enqueue('first')
+        sender.enqueue('second')
+        started = time.monotonic()
+        
+        result = sender.drain(duration=5)
+        
+        assert result == {'sent': 2, 'throttled': 1, 'retry': 0, 'dead': 0}
+        assert self.server.received[0][0] - started >= 1
+        assert not OutboundMessage.objects.exists()
+    
+    def test_permanent_error_goes_to_dead_letters(self):
+        """Test that rejected messages are kept as dead letters and can be requeued."""
+        from notifications.models import OutboundMessage
+        self.server.responses = [(400, {'ok': False, 'error_code': 400, 'description': 'Bad Request: chat not found'})]
+        sender = self.get_sender()
+        message = sender.enqueue('lost')
+        
+        assert sender.drain(duration=5)['dead'] == 1
+        
+        message.refresh_from_db()
+        assert message.status == 'DEAD'
+        assert 'chat not found' in message.last_error
+        assert sender.requeue_dead() == 1
+        assert sender.drain(duration=5)['sent'] == 1
+        assert not OutboundMessage.objects.exists()
+    
+    def test_send_message_queues_delivery_task_on_commit(self, monkeypatch):
+        """Test that TelegramNotificationService leaves delivery to a Django-Q task."""
+        from django.db import transaction
+        from notifications import services
+        from notifications.models import OutboundMessage
+        from tasks.scheduled_tasks import deliver_telegram_message_task
+        queued = []
+        monkeypatch.setattr(services, 'async_task', lambda func, *args: queued.append((func, args)))
+        
+        with transaction.atomic():
+            assert services.TelegramNotificationService().send_message('hello', priority='payment')
+            message = OutboundMessage.objects.get()
+            assert message.priority == OutboundMessage.PRIORITIES['payment']
+            assert queued == []
+        
+        assert queued == [('tasks.scheduled_tasks.deliver_telegram_message_task', (message.pk,))]
+        assert self.server.received == []
+        
+        deliver_telegram_message_task(message.pk)
+        
+        assert [text for _, _, text in self.server.received] == ['hello']
+        assert not OutboundMessage.objects.exists()
+    
+    def test_senders_share_http_client(self):
+        """Test that senders reuse the process-wide HTTP client instead of opening their own."""
+        from notifications.outbound import OutboundTelegramSender
+        assert OutboundTelegramSender().client is OutboundTelegramSender().client
+    
+    def test_throughput_respects_rate_limit(self):
+        """Test sustained throughput against the fake server stays within the bucket."""
+        sender = self.get_sender(rate=50.0, burst=5)
+        for index in range(40):
+            sender.enqueue(f'message {index}')
+        started = time.monotonic()
+        
+        result = sender.drain(duration=10)
+        elapsed = time.monotonic() - started
+        
+        assert result['sent'] == 40
+        # 5 burst tokens, then 35 messages at 50/s
+        assert elapsed >= 35 / 50 * 0.9
+        times = [sent_at for sent_at, _, _ in self.server.received]
+        for index, sent_at in enumerate(times):
+            in_window = [other for other in times[index:] if other - sent_at < 0.2]
+            assert len(in_window) <= 5 + 0.2 * 50 + 1    
+    def test_fake_server_rate_limit_is_recovered(self):
+        """Test that 429s injected by the fake server are retried until everything is delivered."""
+        self.server.rate_limit = 2
+        self.server.retry_after = 1
+        sender = self.get_sender()
+        for index in range(4):
+            sender.enqueue(f'message {index}')
+        
+        result = sender.drain(duration=10)
+        
+        assert result['sent'] == 4
+        assert result['throttled'] >= 1
+        assert self.server.stats['rate_limited'] >= 1
+        assert sorted(text for _, _, text in self.server.received) == [f'message {index}' for index in range(4)]
\ No newline at end of file
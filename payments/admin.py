@@ -1,5 +1,20 @@
 from django.contrib import admin
-from .models import Payment
+from .fine_service import FineCalculationService
+from .models import FineBalance, Payment, Refund
+from .services import PaymentExpiryService
+
+
+class RefundInline(admin.TabularInline):
+    """Read-only list of a payment's refunds."""
+    
+    model = Refund
+    extra = 0
+    can_delete = False
+    fields = ('amount', 'status', 'stripe_refund_id', 'attempts', 'last_error', 'created_at', 'processed_at')
+    readonly_fields = fields
+    
+    def has_add_permission(self, request, obj=None):
+        return False
 
 
 @admin.register(Payment)
@@ -13,17 +28,19 @@ class PaymentAdmin(admin.ModelAdmin):
     
     fieldsets = (
         ('Payment Information', {
-            'fields': ('status', 'type', 'money_to_pay')
+            'fields': ('status', 'type', 'money_to_pay', 'refunded_amount', 'created_at', 'paid_at')
         }),
         ('Stripe Information', {
-            'fields': ('session_url', 'session_id')
+            'fields': ('session_url', 'session_id', 'session_expires_at', 'idempotency_key')
         }),
         ('Borrowing Information', {
             'fields': ('borrowing',)
         }),
     )
     
-    readonly_fields = ('user', 'book')
+    readonly_fields = ('user', 'book', 'refunded_amount', 'created_at', 'paid_at')
+    inlines = [RefundInline]
+    actions = ['waive_fines', 'expire_payments']
     
     def user(self, obj):
         """Display user from borrowing."""
@@ -33,4 +50,41 @@ class PaymentAdmin(admin.ModelAdmin):
     def book(self, obj):
         """Display book from borrowing."""
         return obj.book
-    book.short_description = 'Book'
\ No newline at end of file
+    book.short_description = 'Book'
+    
+    def waive_fines(self, request, queryset):
+        """Waive the fines of the selected payments' borrowings in one statement per table."""
+        borrowing_ids = queryset.filter(type='FINE').values('borrowing_id')
+        result = FineCalculationService().waive_fines(borrowing_ids, 'Admin bulk action', user=request.user)
+        self.message_user(request, f"Waived fines of {result['waived']} borrowings (${result['total_waived']})")
+    waive_fines.short_description = 'Waive fines of selected payments'
+    
+    def expire_payments(self, request, queryset):
+        """Expire the selected PENDING payments in one statement."""
+        expired = PaymentExpiryService().expire(queryset, user=request.user)
+        self.message_user(request, f"Expired {len(expired)} pending payments")
+    expire_payments.short_description = 'Expire selected pending payments'
+
+
+@admin.register(Refund)
+class RefundAdmin(admin.ModelAdmin):
+    """Admin configuration for Refund model."""
+    
+    list_display = ('id', 'payment', 'amount', 'status', 'attempts', 'stripe_refund_id', 'created_at')
+    list_filter = ('status',)
+    search_fields = ('stripe_refund_id', 'payment__session_id', 'payment__borrowing__user__email')
+    ordering = ('-id',)
+    readonly_fields = (
+        'payment', 'amount', 'requested_by', 'idempotency_key', 'payment_intent', 'stripe_refund_id',
+        'attempts', 'last_error', 'created_at', 'processed_at'
+    )
+
+
+@admin.register(FineBalance)
+class FineBalanceAdmin(admin.ModelAdmin):
+    """Read-only view of the running fine balances kept by the fine ledger."""
+    
+    list_display = ('borrowing', 'accrued', 'waived', 'days', 'accrued_through', 'updated_at')
+    search_fields = ('borrowing__user__email', 'borrowing__book__title')
+    ordering = ('-accrued_through',)
+    readonly_fields = ('borrowing', 'accrued', 'waived', 'days', 'accrued_through', 'updated_at')
\ No newline at end of file
@@ -0,0 +1,184 @@
+from datetime import date, timedelta
+from decimal import Decimal
+from django.db import connection, transaction
+from django.db.models import (
+    DateField, DateTimeField, DecimalField, Exists, ExpressionWrapper, F, Max, Min, OuterRef, Q, Subquery, Sum, Value
+)
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from books.models import Book
+from borrowings.models import Borrowing
+from .fine_policy import DaysBetween, FinePolicy
+from .models import FineAccrual, FineBalance, Payment
+
+
+class FineLedger:
+    """
+    Append-only daily fine ledger with a running balance per borrowing.
+    
+    Every overdue day adds one ``FineAccrual`` and the same amount to the
+    borrowing's ``FineBalance``. The amount of day ``n`` is what the
+    ``FinePolicy`` charges for ``n`` days minus what it charges for
+    ``n - 1``, so the balance always equals the policy's fine. Each day is
+    applied to all overdue borrowings with two set-based statements (an
+    ``INSERT ... SELECT`` into the ledger and an upsert of the balances), so
+    a run only writes the new day instead of recomputing every fine. Missed
+    days are caught up and re-running a day changes nothing.
+    
+    What is owed is the balance minus waivers and PAID fine payments, read
+    from the single balance row.
+    """
+    
+    # Only balances that have not seen the day yet are extended
+    balance_sql = """
+        INSERT INTO {balance} (borrowing_id, accrued, waived, days, accrued_through, updated_at)
+        SELECT a.borrowing_id, a.amount, 0, 1, a.accrual_date, %s
+        FROM {accrual} a
+        WHERE a.accrual_date = %s
+        ON CONFLICT (borrowing_id) DO UPDATE SET
+            accrued = {balance}.accrued + excluded.accrued,
+            days = {balance}.days + 1,
+            accrued_through = excluded.accrued_through,
+            updated_at = excluded.updated_at
+        WHERE {balance}.accrued_through IS NULL OR {balance}.accrued_through < excluded.accrued_through
+    """
+    
+    def __init__(self, policy: FinePolicy = None, fine_multiplier: float = None):
+        if policy is None:
+            policy = FinePolicy.flat(fine_multiplier) if fine_multiplier is not None else FinePolicy.from_settings()
+        self.policy = policy
+    
+    @staticmethod
+    def format_sql(sql: str) -> str:
+        tables = {
+            'accrual': FineAccrual._meta.db_table,
+            'balance': FineBalance._meta.db_table,
+            'borrowing': Borrowing._meta.db_table,
+            'book': Book._meta.db_table,
+        }
+        return sql.format(**{key: connection.ops.quote_name(table) for key, table in tables.items()})
+    
+    @staticmethod
+    def get_start_date():
+        """Return the first day the ledger has not accrued yet, or None if nothing is overdue."""
+        last = FineAccrual.objects.aggregate(last=Max('accrual_date'))['last']
+        if last is not None:
+            return last + timedelta(days=1)
+        # Empty ledger: back-fill from the oldest borrowing that is overdue now
+        oldest = Borrowing.objects.filter(actual_return_date__isnull=True).aggregate(
+            oldest=Min('expected_return_date')
+        )['oldest']
+        return oldest + timedelta(days=1) if oldest is not None else None
+    
+    def accrual_queryset(self, day: date, now):
+        """Rows to insert into the ledger for ``day``: (borrowing, day, amount, created_at)."""
+        day_index = DaysBetween(Value(day), F('expected_return_date'))
+        fee = F('book__daily_fee')
+        already_accrued = FineAccrual.objects.filter(borrowing_id=OuterRef('pk'), accrual_date=day)
+        return Borrowing.objects.filter(
+            Q(actual_return_date__isnull=True) | Q(actual_return_date__gte=day),
+            expected_return_date__lt=day
+        ).exclude(Exists(already_accrued)).order_by().annotate(
+            accrual_day=Value(day, output_field=DateField()),
+            accrual_amount=ExpressionWrapper(
+                self.policy.expression(fee, day_index) - self.policy.expression(fee, day_index - 1),
+                output_field=DecimalField(max_digits=10, decimal_places=2)
+            ),
+            accrual_created_at=Value(now, output_field=DateTimeField())
+        ).values_list('id', 'accrual_day', 'accrual_amount', 'accrual_created_at')
+    
+    def accrue_day(self, day: date) -> int:
+        """
+        Charge one day to every borrowing that was overdue and not yet returned on that day.
+        
+        Returns:
+            int: Number of borrowings charged
+        """
+        now = timezone.now()
+        select_sql, params = self.accrual_queryset(day, now).query.sql_with_params()
+        insert_sql = self.format_sql('INSERT INTO {accrual} (borrowing_id, accrual_date, amount, created_at) ')
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(insert_sql + select_sql, params)
+            charged = cursor.rowcount
+            if charged:
+                cursor.execute(self.format_sql(self.balance_sql), [now, day])
+        return charged
+    
+    def accrue(self, through: date = None) -> dict:
+        """
+        Extend the ledger up to and including ``through`` (default today).
+        
+        Returns:
+            dict: Days processed and accruals written
+        """
+        through = through or date.today()
+        result = {'days': 0, 'accruals': 0}
+        day = self.get_start_date()
+        if day is None:
+            return result
+        while day <= through:
+            result['accruals'] += self.accrue_day(day)
+            result['days'] += 1
+            day += timedelta(days=1)
+        return result
+    
+    @staticmethod
+    def paid_expression():
+        """Total of the PAID fine payments of a balance's borrowing."""
+        paid = Payment.objects.filter(
+            borrowing_id=OuterRef('borrowing_id'),
+            type='FINE',
+            status='PAID'
+        ).order_by().values('borrowing_id').annotate(total=Sum('money_to_pay')).values('total')
+        return Coalesce(
+            Subquery(paid),
+            Value(Decimal('0.00')),
+            output_field=DecimalField(max_digits=10, decimal_places=2)
+        )
+    
+    @classmethod
+    def balances(cls):
+        """Balances annotated with ``paid``, the total of their borrowing's PAID fine payments."""
+        return FineBalance.objects.annotate(paid=cls.paid_expression())
+    
+    def get_balance(self, borrowing_id: int):
+        """Return the borrowing's balance with ``paid`` and ``outstanding``, or None before its first accrual."""
+        return self.balances().filter(borrowing_id=borrowing_id).first()
+    
+    def waive(self, borrowing_id: int) -> Decimal:
+        """
+        Forgive everything the borrowing owes so far.
+        
+        Returns:
+            Decimal: Amount waived
+        """
+        return self.waive_many([borrowing_id]).get(borrowing_id, Decimal('0.00'))
+    
+    def waive_many(self, borrowings) -> dict:
+        """
+        Forgive everything a set of borrowings owes, with one locking read and one ``UPDATE``.
+        
+        Args:
+            borrowings: Borrowing ids, or a queryset of borrowings or their ids
+        
+        Returns:
+            dict: Amount waived per borrowing id (borrowings that owed nothing are left out)
+        """
+        with transaction.atomic():
+            owed = dict(
+                self.balances().select_for_update(of=('self',))
+                .filter(borrowing_id__in=borrowings)
+                .annotate(owed=F('accrued') - F('waived') - F('paid'))
+                .filter(owed__gt=0)
+                .values_list('borrowing_id', 'owed')
+            )
+            if owed:
+                # The rows are locked, so accrued - paid is exactly waived + owed
+                FineBalance.objects.filter(borrowing_id__in=list(owed)).update(
+                    waived=F('accrued') - self.paid_expression(),
+                    updated_at=timezone.now()
+                )
+        return {
+            borrowing_id: Decimal(str(amount)).quantize(Decimal('0.01'))
+            for borrowing_id, amount in owed.items()
+        }
\ No newline at end of file
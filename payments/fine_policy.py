@@ -0,0 +1,178 @@
+from datetime import date
+from decimal import Decimal, ROUND_HALF_UP
+from django.conf import settings
+from django.db.models import BigIntegerField, DecimalField, ExpressionWrapper, F, Func, IntegerField, Value
+from django.db.models.functions import Cast, Greatest, Least, Round
+from django.utils.module_loading import import_string
+
+CENT = Decimal('0.01')
+
+
+class DaysBetween(Func):
+    """Whole days from the second date expression to the first."""
+    
+    arity = 2
+    arg_joiner = ' - '
+    template = '(%(expressions)s)'
+    output_field = IntegerField()
+    
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            template='CAST(julianday(%(expressions)s) AS INTEGER)',
+            arg_joiner=') - julianday(',
+            **extra_context
+        )
+    
+    def as_mysql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, function='DATEDIFF', template='%(function)s(%(expressions)s)',
+                           arg_joiner=', ', **extra_context)
+
+
+class FinePolicy:
+    """
+    How much an overdue borrowing is fined.
+    
+    The first ``grace_days`` overdue days are free. Every later day costs
+    the book's daily fee times the rate of the tier it falls in; tiers are
+    ``(first_day, rate)`` pairs counted from the first chargeable day, so
+    ``[(1, 1), (8, 2)]`` charges 1x for a week and 2x afterwards. The total
+    is capped at ``cap`` if set.
+    
+    The same policy evaluates in Python (``calculate``) and as an ORM
+    expression (``expression``) for bulk queries. Both work in whole cents
+    with integer arithmetic (rates have at most 2 decimal places and the
+    total is rounded half up once), so they agree exactly on every backend.
+    """
+    
+    def __init__(self, tiers, grace_days: int = 0, cap=None):
+        tiers = [(int(first_day), Decimal(str(rate))) for first_day, rate in tiers]
+        if not tiers:
+            raise ValueError("A fine policy needs at least one tier")
+        first_days = [first_day for first_day, _ in tiers]
+        if first_days[0] != 1 or first_days != sorted(set(first_days)):
+            raise ValueError("Tiers must start at day 1 and increase (use grace_days for free days)")
+        for _, rate in tiers:
+            if rate < 0 or (rate * 100) % 1:
+                raise ValueError(f"Tier rate {rate} must be positive with at most 2 decimal places")
+        if grace_days < 0:
+            raise ValueError("Grace days cannot be negative")
+        
+        self.tiers = tuple(tiers)
+        self.grace_days = int(grace_days)
+        self.cap = Decimal(str(cap)).quantize(CENT) if cap is not None else None
+    
+    @classmethod
+    def flat(cls, multiplier, **options):
+        """Charge ``multiplier`` times the daily fee for every overdue day."""
+        return cls([(1, multiplier)], **options)
+    
+    @classmethod
+    def from_settings(cls):
+        """
+        Build the policy configured in ``FINE_POLICY``.
+        
+        Without ``FINE_POLICY`` a flat policy of ``FINE_MULTIPLIER`` is used.
+        A ``class`` key selects a ``FinePolicy`` subclass by dotted path.
+        """
+        config = getattr(settings, 'FINE_POLICY', None)
+        if not config:
+            return cls.flat(getattr(settings, 'FINE_MULTIPLIER', 2.0))
+        return cls.from_config(config)
+    
+    @classmethod
+    def from_config(cls, config: dict):
+        """Build a policy from a ``FINE_POLICY``-style dict."""
+        config = dict(config)
+        policy_class = import_string(config.pop('class')) if 'class' in config else cls
+        return policy_class(**config)
+    
+    def as_dict(self) -> dict:
+        return {
+            'tiers': [[first_day, str(rate)] for first_day, rate in self.tiers],
+            'grace_days': self.grace_days,
+            'cap': str(self.cap) if self.cap is not None else None,
+        }
+    
+    def segments(self):
+        """Yield ``(first_day, length, rate in percent)`` per tier; the last tier has no length."""
+        for index, (first_day, rate) in enumerate(self.tiers):
+            length = self.tiers[index + 1][0] - first_day if index + 1 < len(self.tiers) else None
+            yield first_day, length, int(rate * 100)
+    
+    def calculate(self, daily_fee, overdue_days: int) -> Decimal:
+        """
+        Fine for a borrowing, evaluated in Python.
+        
+        Args:
+            daily_fee: Daily fee of the book
+            overdue_days: Days since the expected return date (0 or less if not overdue)
+        
+        Returns:
+            Decimal: Fine amount
+        """
+        fee_cents = int((Decimal(str(daily_fee)) * 100).to_integral_value(rounding=ROUND_HALF_UP))
+        chargeable = max(int(overdue_days) - self.grace_days, 0)
+        
+        weighted_days = 0
+        for first_day, length, percent in self.segments():
+            days = max(chargeable - first_day + 1, 0)
+            if length is not None:
+                days = min(days, length)
+            weighted_days += percent * days
+        
+        cents = (fee_cents * weighted_days + 50) // 100
+        if self.cap is not None:
+            cents = min(cents, int(self.cap * 100))
+        return (Decimal(cents) * CENT).quantize(CENT)
+    
+    def expression(self, daily_fee, overdue_days):
+        """
+        Fine as an ORM expression, mirroring ``calculate``.
+        
+        Args:
+            daily_fee: Field name or expression of the daily fee
+            overdue_days: Field name or integer expression of the overdue days
+        
+        Returns:
+            Expression: Decimal fine amount
+        """
+        if isinstance(daily_fee, str):
+            daily_fee = F(daily_fee)
+        if isinstance(overdue_days, str):
+            overdue_days = F(overdue_days)
+        
+        # bigint keeps fee * rate * days from overflowing on PostgreSQL
+        fee_cents = Cast(Round(daily_fee * Value(100)), BigIntegerField())
+        chargeable = Greatest(overdue_days - Value(self.grace_days), Value(0))
+        
+        weighted_days = None
+        for first_day, length, percent in self.segments():
+            days = Greatest(chargeable - Value(first_day - 1), Value(0))
+            if length is not None:
+                days = Least(days, Value(length))
+            term = Value(percent) * days
+            weighted_days = term if weighted_days is None else weighted_days + term
+        
+        # Integer division on every backend: rounds half up to whole cents
+        cents = ExpressionWrapper(
+            (fee_cents * weighted_days + Value(50)) / Value(100),
+            output_field=BigIntegerField()
+        )
+        if self.cap is not None:
+            cents = Least(cents, Value(int(self.cap * 100)))
+        return ExpressionWrapper(cents * Value(CENT), output_field=DecimalField(max_digits=12, decimal_places=2))
+    
+    def borrowing_expression(self, as_of: date = None, prefix: str = ''):
+        """
+        Fine of a borrowing as of a date, for querysets of ``Borrowing`` (or related via ``prefix``).
+        
+        Args:
+            as_of: Day the overdue days are counted to (default today)
+            prefix: Lookup path to the borrowing, e.g. ``'borrowing__'``
+        
+        Returns:
+            Expression: Decimal fine amount
+        """
+        overdue_days = DaysBetween(Value(as_of or date.today()), F(f'{prefix}expected_return_date'))
+        return self.expression(F(f'{prefix}book__daily_fee'), overdue_days)
\ No newline at end of file
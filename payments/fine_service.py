@@ -1,9 +1,16 @@
-from datetime import date, timedelta
+from datetime import date, datetime, time, timedelta
 from decimal import Decimal
 from django.conf import settings
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Count, DecimalField, Exists, F, OuterRef, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from borrowings.models import Borrowing
-from payments.models import Payment
+from library_service.bulk import log_bulk_change, update_returning
+from payments.fine_ledger import FineLedger
+from payments.fine_policy import FinePolicy
+from payments.models import FineBalance, Payment
+from payments.pricing import PaymentPricer
 from notifications.services import TelegramNotificationService
 
 
@@ -12,27 +19,20 @@ class FineCalculationService:
     
     def __init__(self):
         self.fine_multiplier = getattr(settings, 'FINE_MULTIPLIER', 2.0)
+        self.policy = FinePolicy.from_settings()
+        self.ledger = FineLedger(self.policy)
     
     def calculate_fine_amount(self, borrowing: Borrowing) -> Decimal:
         """
-        Calculate fine amount for an overdue borrowing.
+        Calculate the fine a borrowing currently owes.
         
         Args:
             borrowing: Borrowing instance
             
         Returns:
-            Decimal: Fine amount
+            Decimal: Fine amount (accrued fines not yet paid or waived)
         """
-        if not borrowing.is_overdue:
-            return Decimal('0.00')
-        
-        overdue_days = borrowing.overdue_days
-        daily_fee = borrowing.book.daily_fee
-        
-        # Calculate fine: daily_fee * overdue_days * multiplier
-        fine_amount = daily_fee * overdue_days * Decimal(str(self.fine_multiplier))
-        
-        return fine_amount
+        return PaymentPricer(self.policy).quote(borrowing, 'FINE').amount
     
     def get_overdue_borrowings(self) -> list:
         """
@@ -64,11 +64,11 @@ class FineCalculationService:
         if fine_amount <= 0:
             raise ValueError("Cannot create fine payment for non-overdue borrowing")
         
-        # Check if fine payment already exists
+        # A paid fine does not cover days accrued after it
         existing_fine = Payment.objects.filter(
             borrowing=borrowing,
             type='FINE',
-            status__in=['PENDING', 'PAID']
+            status='PENDING'
         ).first()
         
         if existing_fine:
@@ -86,83 +86,113 @@ class FineCalculationService:
     
     def process_overdue_books(self) -> dict:
         """
-        Process all overdue books and create fine payments.
+        Accrue today's fines and open fine payments for borrowings that owe one.
+        
+        The ledger is extended with set-based statements; payments are only
+        created for balances with an outstanding amount and no PENDING fine,
+        i.e. newly overdue borrowings and ones that kept accruing after
+        their last fine was paid. PENDING fines are not rewritten every
+        day: their checkout is priced from the balance.
         
         Returns:
             dict: Summary of processed fines
         """
-        overdue_borrowings = self.get_overdue_borrowings()
+        accrual = self.ledger.accrue()
+        created_fines, errors = self.create_fines(self.owing_balances())
+        
+        total_overdue = Borrowing.objects.filter(
+            expected_return_date__lt=date.today(),
+            actual_return_date__isnull=True
+        ).count()
+        
+        return {
+            'created_fines': len(created_fines),
+            'errors': len(errors),
+            'total_overdue': total_overdue,
+            'accrued_days': accrual['days'],
+            'accruals': accrual['accruals'],
+            'errors_details': errors
+        }
+    
+    def owing_balances(self):
+        """Balances with an outstanding amount and no PENDING fine payment, with borrowing, user and book."""
+        pending_fine = Payment.objects.filter(borrowing_id=OuterRef('borrowing_id'), type='FINE', status='PENDING')
+        return self.ledger.balances().annotate(
+            owed=F('accrued') - F('waived') - F('paid')
+        ).filter(owed__gt=0).exclude(Exists(pending_fine)).select_related('borrowing__user', 'borrowing__book')
+    
+    def create_fines(self, balances) -> tuple:
+        """
+        Open a PENDING fine payment for each balance and send its notification.
+        
+        Args:
+            balances: Balances from ``owing_balances``
+        
+        Returns:
+            tuple: Created payments and per-borrowing errors
+        """
         created_fines = []
         errors = []
+        telegram_service = None
         
-        for borrowing in overdue_borrowings:
+        for balance in balances:
+            borrowing = balance.borrowing
             try:
-                # Check if fine already exists
-                existing_fine = Payment.objects.filter(
-                    borrowing=borrowing,
-                    type='FINE'
-                ).first()
+                # A savepoint keeps one failure from breaking a caller's transaction
+                with transaction.atomic():
+                    fine_payment = Payment.objects.create(
+                        borrowing=borrowing,
+                        type='FINE',
+                        money_to_pay=balance.outstanding,
+                        status='PENDING'
+                    )
+                created_fines.append(fine_payment)
                 
-                if not existing_fine:
-                    fine_payment = self.create_fine_payment(borrowing)
-                    created_fines.append(fine_payment)
+                # Send notification
+                try:
+                    telegram_service = telegram_service or TelegramNotificationService()
+                    telegram_service.send_fine_notification(borrowing, fine_amount=balance.outstanding)
+                except Exception as e:
+                    print(f"Failed to send fine notification: {str(e)}")
                     
-                    # Send notification
-                    try:
-                        telegram_service = TelegramNotificationService()
-                        telegram_service.send_fine_notification(borrowing)
-                    except Exception as e:
-                        print(f"Failed to send fine notification: {str(e)}")
-                        
             except Exception as e:
                 errors.append({
                     'borrowing_id': borrowing.id,
                     'error': str(e)
                 })
         
-        return {
-            'created_fines': len(created_fines),
-            'errors': len(errors),
-            'total_overdue': len(overdue_borrowings),
-            'errors_details': errors
-        }
+        return created_fines, errors
     
     def get_fine_statistics(self) -> dict:
         """
         Get statistics about fines.
         
+        All fine payment figures come from one conditional-aggregation
+        query over ``Payment``; "today" means created or paid since local
+        midnight.
+        
         Returns:
             dict: Fine statistics
         """
         today = date.today()
+        midnight = timezone.make_aware(datetime.combine(timezone.localdate(), time.min))
+        money = DecimalField(max_digits=12, decimal_places=2)
+        zero = Value(Decimal('0.00'), output_field=money)
         
-        # Total fines created today
-        fines_today = Payment.objects.filter(
-            type='FINE',
-            borrowing__borrow_date__lte=today
-        ).count()
-        
-        # Total fines paid today
-        fines_paid_today = Payment.objects.filter(
-            type='FINE',
-            status='PAID',
-            borrowing__borrow_date__lte=today
-        ).count()
-        
-        # Total fine revenue
-        total_fine_revenue = sum(
-            payment.money_to_pay for payment in Payment.objects.filter(
-                type='FINE',
-                status='PAID'
-            )
+        fines = Payment.objects.filter(type='FINE').aggregate(
+            fines_today=Count('id', filter=Q(created_at__gte=midnight)),
+            fines_paid_today=Count('id', filter=Q(paid_at__gte=midnight)),
+            pending_fines=Count('id', filter=Q(status='PENDING')),
+            paid_fines=Count('id', filter=Q(status='PAID')),
+            total_fine_revenue=Coalesce(
+                Sum(F('money_to_pay') - F('refunded_amount'), filter=Q(status='PAID'), output_field=money), zero
+            ),
+            fine_revenue_today=Coalesce(
+                Sum(F('money_to_pay') - F('refunded_amount'), filter=Q(paid_at__gte=midnight), output_field=money),
+                zero
+            ),
         )
         
-        # Pending fines
-        pending_fines = Payment.objects.filter(
-            type='FINE',
-            status='PENDING'
-        ).count()
-        
         # Overdue books without fines
         overdue_without_fines = Borrowing.objects.filter(
             expected_return_date__lt=today,
@@ -171,60 +201,105 @@ class FineCalculationService:
             payments__type='FINE'
         ).count()
         
+        # Everything the ledger has charged so far
+        ledger_totals = FineBalance.objects.aggregate(accrued=Sum('accrued'), waived=Sum('waived'))
+        
         return {
-            'fines_today': fines_today,
-            'fines_paid_today': fines_paid_today,
-            'total_fine_revenue': total_fine_revenue,
-            'pending_fines': pending_fines,
+            **fines,
+            'total_fines_accrued': ledger_totals['accrued'] or Decimal('0.00'),
+            'total_fines_waived': ledger_totals['waived'] or Decimal('0.00'),
             'overdue_without_fines': overdue_without_fines,
-            'fine_multiplier': self.fine_multiplier
+            'fine_multiplier': self.fine_multiplier,
+            'fine_policy': self.policy.as_dict(),
+            'generated_at': timezone.now()
         }
     
-    def waive_fine(self, borrowing: Borrowing, reason: str = None) -> bool:
+    def waive_fine(self, borrowing: Borrowing, reason: str = None, user=None) -> bool:
         """
         Waive a fine for a borrowing (admin only).
         
         Args:
             borrowing: Borrowing instance
             reason: Reason for waiving the fine
+            user: Admin waiving the fine, recorded in the admin history
             
         Returns:
             bool: True if fine was waived successfully
         """
         try:
-            # Find existing fine payment
-            fine_payment = Payment.objects.filter(
-                borrowing=borrowing,
-                type='FINE',
-                status='PENDING'
-            ).first()
-            
-            if fine_payment:
-                fine_payment.status = 'EXPIRED'
-                fine_payment.save()
-                
-                # Send notification about waived fine
-                try:
-                    telegram_service = TelegramNotificationService()
-                    telegram_service.send_message(
-                        f"💰 <b>Fine Waived</b>\n\n"
-                        f"👤 User: {borrowing.user.get_full_name() or borrowing.user.email}\n"
-                        f"📖 Book: {borrowing.book.title} by {borrowing.book.author}\n"
-                        f"💰 Waived Amount: ${fine_payment.money_to_pay}\n"
-                        f"📝 Reason: {reason or 'Admin decision'}\n\n"
-                        f"ID: {borrowing.id}"
-                    )
-                except Exception as e:
-                    print(f"Failed to send fine waiver notification: {str(e)}")
-                
-                return True
-            
-            return False
-            
+            return self.waive_fines([borrowing.id], reason, user)['waived'] > 0
         except Exception as e:
             print(f"Error waiving fine: {str(e)}")
             return False
     
+    def waive_fines(self, borrowings, reason: str = None, user=None) -> dict:
+        """
+        Waive the fines of many borrowings at once (admin only).
+        
+        Outstanding ledger balances are waived and PENDING fine payments are
+        expired with one set-based ``UPDATE`` each, the waived borrowings are
+        written to the admin history and one digest notification is sent
+        after the transaction commits.
+        
+        Args:
+            borrowings: Borrowing ids, or a queryset of borrowings or their ids
+            reason: Reason for waiving the fines
+            user: Admin waiving the fines, recorded in the admin history
+        
+        Returns:
+            dict: Waived borrowing ids, expired payment ids and the total waived
+        """
+        reason = reason or 'Admin decision'
+        with transaction.atomic():
+            amounts = self.ledger.waive_many(borrowings)
+            expired = update_returning(
+                Payment.objects.filter(borrowing_id__in=borrowings, type='FINE', status='PENDING'),
+                ['id', 'borrowing_id', 'money_to_pay'],
+                status='EXPIRED',
+                updated_at=timezone.now()
+            )
+            for _, borrowing_id, money_to_pay in expired:
+                # Fines created before the ledger existed have no balance
+                amounts.setdefault(borrowing_id, money_to_pay)
+            
+            borrowing_ids = sorted(amounts)
+            log_bulk_change(user, Borrowing, borrowing_ids, f"Waived fine: {reason}")
+            if borrowing_ids:
+                transaction.on_commit(lambda: self.send_waiver_notification(amounts, reason, user))
+        
+        return {
+            'waived': len(borrowing_ids),
+            'borrowing_ids': borrowing_ids,
+            'expired_payment_ids': [payment_id for payment_id, _, _ in expired],
+            'total_waived': sum(amounts.values(), Decimal('0.00')),
+        }
+    
+    def send_waiver_notification(self, amounts: dict, reason: str, user=None):
+        """Send one digest about waived fines, listing the first few borrowings."""
+        try:
+            max_items = getattr(settings, 'BULK_NOTIFICATION_MAX_ITEMS', 20)
+            borrowings = Borrowing.objects.select_related('user', 'book').filter(
+                pk__in=sorted(amounts)[:max_items]
+            ).order_by('pk')
+            TelegramNotificationService().send_bulk_notification(
+                "💰 Fines Waived",
+                count=len(amounts),
+                details={
+                    '📚 Borrowings': len(amounts),
+                    '💰 Waived Amount': f"${sum(amounts.values(), Decimal('0.00'))}",
+                    '📝 Reason': reason,
+                    '👤 By': user.email if user is not None else 'System',
+                },
+                items=[
+                    f"{borrowing.user.get_full_name() or borrowing.user.email} - {borrowing.book.title} "
+                    f"(${amounts[borrowing.id]}) #{borrowing.id}"
+                    for borrowing in borrowings
+                ],
+                priority='fine'
+            )
+        except Exception as e:
+            print(f"Failed to send fine waiver notification: {str(e)}")
+    
     def get_user_fines(self, user) -> list:
         """
         Get all fines for a specific user.
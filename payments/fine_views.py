@@ -1,3 +1,4 @@
+from django.conf import settings
 from rest_framework import generics, permissions, status
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
@@ -6,6 +7,7 @@ from .models import Payment
 from .serializers import PaymentListSerializer, PaymentDetailSerializer
 from .fine_service import FineCalculationService
 from .permissions import PaymentPermissions
+from library_service.cache import get_or_refresh
 
 
 class FineListView(generics.ListAPIView):
@@ -74,8 +76,12 @@ class FineStatisticsView(generics.GenericAPIView):
     def get(self, request, *args, **kwargs):
         """Get fine statistics."""
         try:
-            fine_service = FineCalculationService()
-            statistics = fine_service.get_fine_statistics()
+            # Dashboards poll this; one worker recomputes it per expiry
+            statistics = get_or_refresh(
+                'fines:statistics',
+                FineCalculationService().get_fine_statistics,
+                timeout=getattr(settings, 'FINE_STATISTICS_CACHE_TIMEOUT', 30)
+            )
             
             return Response({
                 "statistics": statistics
@@ -107,7 +113,7 @@ class WaiveFineView(generics.GenericAPIView):
             borrowing = Borrowing.objects.get(id=borrowing_id)
             
             fine_service = FineCalculationService()
-            success = fine_service.waive_fine(borrowing, reason)
+            success = fine_service.waive_fine(borrowing, reason, user=request.user)
             
             if success:
                 return Response({
@@ -130,6 +136,46 @@ class WaiveFineView(generics.GenericAPIView):
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+class BulkWaiveFineView(generics.GenericAPIView):
+    """View for waiving the fines of many borrowings at once."""
+    
+    permission_classes = [permissions.IsAdminUser]
+    
+    def post(self, request, *args, **kwargs):
+        """Waive the fines of a list of borrowings."""
+        borrowing_ids = request.data.get('borrowing_ids')
+        reason = request.data.get('reason', 'Admin decision')
+        max_ids = getattr(settings, 'BULK_WAIVE_MAX_IDS', 10000)
+        
+        if not isinstance(borrowing_ids, list) or not borrowing_ids:
+            return Response({
+                "error": "borrowing_ids must be a non-empty list"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if len(borrowing_ids) > max_ids:
+            return Response({
+                "error": f"At most {max_ids} borrowings can be waived per request"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            borrowing_ids = sorted({int(borrowing_id) for borrowing_id in borrowing_ids})
+        except (TypeError, ValueError):
+            return Response({
+                "error": "borrowing_ids must be integers"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            result = FineCalculationService().waive_fines(borrowing_ids, reason, user=request.user)
+            return Response({
+                "message": f"Waived fines of {result['waived']} borrowings",
+                "reason": reason,
+                **result
+            }, status=status.HTTP_200_OK)
+        
+        except Exception as e:
+            return Response({
+                "error": f"Error waiving fines: {str(e)}"
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
 class UserFinesView(generics.ListAPIView):
     """View for getting user's fines."""
     
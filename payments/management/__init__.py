@@ -0,0 +1 @@
+# Management commands for payments
\ No newline at end of file
@@ -0,0 +1,89 @@
+import json
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from payments.fine_policy import FinePolicy
+from payments.fine_simulation import FineSimulator
+
+
+class Command(BaseCommand):
+    help = 'Simulate the fine revenue of candidate fine policies over the whole borrowing history'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--multiplier',
+            type=float,
+            action='append',
+            default=[],
+            help='Flat fine multiplier to simulate (repeatable)'
+        )
+        parser.add_argument(
+            '--policy',
+            action='append',
+            default=[],
+            help='FINE_POLICY-style JSON to simulate, with an optional "name" (repeatable)'
+        )
+        parser.add_argument(
+            '--as-of',
+            type=date.fromisoformat,
+            default=None,
+            help='Count unreturned borrowings as overdue up to this date (YYYY-MM-DD, default today)'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=100000,
+            help='Number of borrowings loaded into each NumPy chunk'
+        )
+        parser.add_argument(
+            '--no-archive',
+            action='store_true',
+            help='Skip archived borrowings'
+        )
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Print the result as JSON'
+        )
+    
+    def get_policies(self, options) -> dict:
+        policies = {
+            f'flat x{multiplier:g}': FinePolicy.flat(multiplier) for multiplier in options['multiplier']
+        }
+        for index, raw in enumerate(options['policy'], start=1):
+            try:
+                config = json.loads(raw)
+                name = config.pop('name', f'policy {index}')
+                policies[name] = FinePolicy.from_config(config)
+            except (ValueError, TypeError, AttributeError, ImportError) as e:
+                raise CommandError(f'Invalid --policy {raw}: {str(e)}')
+        return policies
+    
+    def handle(self, *args, **options):
+        """Run the simulation and print one summary per policy."""
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+        
+        result = FineSimulator(
+            self.get_policies(options),
+            as_of=options['as_of'],
+            chunk_size=options['chunk_size'],
+            include_archive=not options['no_archive']
+        ).run()
+        
+        if options['json']:
+            self.stdout.write(json.dumps(result, default=str, indent=2))
+            return
+        
+        self.stdout.write(
+            f"{result['rows']} overdue borrowings as of {result['as_of']}, {result['elapsed']:.2f}s"
+        )
+        for name, summary in result['policies'].items():
+            percentiles = ' '.join(f'p{p}={value}' for p, value in summary['percentiles'].items())
+            self.stdout.write(
+                f"  {name:<16} revenue={summary['revenue']} ({summary['revenue_change']:+}) "
+                f"fined={summary['fined_borrowings']} users={summary['affected_users']} "
+                f"mean={summary['mean_fine']} {percentiles}"
+            )
+        self.stdout.write(
+            self.style.SUCCESS(f"Simulated {len(result['policies'])} policies")
+        )
\ No newline at end of file
@@ -1,5 +1,7 @@
 from django.db import models
 from django.contrib.auth import get_user_model
+from django.utils import timezone
+from datetime import timedelta
 from decimal import Decimal
 
 User = get_user_model()
@@ -25,15 +27,57 @@ class Payment(models.Model):
     session_url = models.URLField(max_length=500, blank=True)
     session_id = models.CharField(max_length=255, blank=True)
     money_to_pay = models.DecimalField(max_digits=10, decimal_places=2)
+    # Sum of the refunds Stripe accepted, kept up to date by RefundService
+    refunded_amount = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
+    session_expires_at = models.DateTimeField(null=True, blank=True)
+    idempotency_key = models.CharField(max_length=255, blank=True, db_index=True)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    # When the payment was first seen as PAID
+    paid_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         verbose_name = 'Payment'
         verbose_name_plural = 'Payments'
         ordering = ['-id']
+        indexes = [
+            # Lookup of a reusable open checkout session for a borrowing
+            models.Index(fields=['borrowing', 'type', 'status'], name='payment_borrowing_type_idx'),
+        ]
     
     def __str__(self):
         return f"Payment {self.id} - {self.status} - ${self.money_to_pay}"
     
+    def save(self, *args, **kwargs):
+        """Stamp ``paid_at`` the first time the payment is saved as PAID."""
+        if self.status == 'PAID' and self.paid_at is None:
+            self.paid_at = timezone.now()
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'paid_at'}
+        super().save(*args, **kwargs)
+    
+    def has_live_session(self, min_remaining: timedelta = timedelta(minutes=5)) -> bool:
+        """
+        Check if the payment has an open checkout session that can be handed out again.
+        
+        Args:
+            min_remaining: Time the session must stay valid for the customer to finish paying
+        
+        Returns:
+            bool: True if the session is pending, has a URL and is not about to expire
+        """
+        return (
+            self.status == 'PENDING'
+            and bool(self.session_url)
+            and self.session_expires_at is not None
+            and self.session_expires_at > timezone.now() + min_remaining
+        )
+    
+    @property
+    def net_amount(self) -> Decimal:
+        """Amount kept after refunds."""
+        return self.money_to_pay - self.refunded_amount
+    
     @property
     def user(self):
         """Get user from borrowing."""
@@ -45,16 +89,118 @@ class Payment(models.Model):
         return self.borrowing.book
     
     def calculate_payment_amount(self):
-        """Calculate payment amount based on borrowing."""
-        if self.type == 'PAYMENT':
-            # Calculate based on borrowing duration
-            from datetime import date
-            days_borrowed = (self.borrowing.expected_return_date - self.borrowing.borrow_date).days
-            return self.borrowing.book.daily_fee * days_borrowed
-        elif self.type == 'FINE':
-            # Calculate fine based on overdue days
-            overdue_days = self.borrowing.overdue_days
-            from django.conf import settings
-            fine_multiplier = getattr(settings, 'FINE_MULTIPLIER', 2.0)
-            return self.borrowing.book.daily_fee * overdue_days * Decimal(str(fine_multiplier))
-        return Decimal('0.00')
\ No newline at end of file
+        """Calculate payment amount based on borrowing (see ``PaymentPricer``)."""
+        from .pricing import PaymentPricer
+        return PaymentPricer().quote_payment(self).amount
+
+
+class Refund(models.Model):
+    """
+    Refund of a paid payment.
+    
+    Refunds are recorded when requested and executed at Stripe by a
+    Django-Q task (see ``RefundService``). Stripe is called with the
+    idempotency key ``refund-<id>``, so retries never refund twice.
+    """
+    
+    STATUS_CHOICES = [
+        ('QUEUED', 'Queued'),
+        ('PROCESSING', 'Processing'),
+        ('SUCCEEDED', 'Succeeded'),
+        ('FAILED', 'Failed'),
+    ]
+    
+    payment = models.ForeignKey(Payment, on_delete=models.CASCADE, related_name='refunds')
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='QUEUED')
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    idempotency_key = models.CharField(max_length=255, blank=True, db_index=True)
+    payment_intent = models.CharField(max_length=255, blank=True)
+    stripe_refund_id = models.CharField(max_length=255, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        verbose_name = 'Refund'
+        verbose_name_plural = 'Refunds'
+        ordering = ['-id']
+        indexes = [
+            # Sweep for refunds whose next attempt is due
+            models.Index(fields=['status', 'next_attempt_at'], name='refund_status_due_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Refund {self.id} - {self.status} - ${self.amount}"
+    
+    @property
+    def stripe_idempotency_key(self) -> str:
+        """Idempotency key of the Stripe refund request, stable across attempts."""
+        return f'refund-{self.id}'
+
+
+class FineAccrual(models.Model):
+    """
+    One overdue day of fine charged to a borrowing.
+    
+    Append-only: rows are inserted by ``FineLedger.accrue`` and never
+    changed, so the ledger shows what each day cost at the fee of that day.
+    """
+    
+    borrowing = models.ForeignKey('borrowings.Borrowing', on_delete=models.CASCADE, related_name='fine_accruals')
+    accrual_date = models.DateField()
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        verbose_name = 'Fine accrual'
+        verbose_name_plural = 'Fine accruals'
+        ordering = ['borrowing', 'accrual_date']
+        constraints = [
+            models.UniqueConstraint(fields=['borrowing', 'accrual_date'], name='fine_accrual_borrowing_day_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['accrual_date'], name='fine_accrual_date_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Fine accrual {self.borrowing_id} {self.accrual_date} - ${self.amount}"
+
+
+class FineBalance(models.Model):
+    """Running fine total of a borrowing, extended together with its ledger."""
+    
+    borrowing = models.OneToOneField(
+        'borrowings.Borrowing',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='fine_balance'
+    )
+    accrued = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
+    waived = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
+    days = models.PositiveIntegerField(default=0)
+    accrued_through = models.DateField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = 'Fine balance'
+        verbose_name_plural = 'Fine balances'
+    
+    def __str__(self):
+        return f"Fine balance {self.borrowing_id} - ${self.accrued}"
+    
+    @property
+    def outstanding(self) -> Decimal:
+        """Accrued fines not yet waived or paid."""
+        paid = getattr(self, 'paid', None)
+        if paid is None:
+            # Not loaded through FineLedger.balances, which annotates ``paid`` in the same query
+            paid = Payment.objects.filter(
+                borrowing_id=self.borrowing_id,
+                type='FINE',
+                status='PAID'
+            ).aggregate(total=models.Sum('money_to_pay'))['total'] or Decimal('0.00')
+        return max(self.accrued - self.waived - paid, Decimal('0.00'))
\ No newline at end of file
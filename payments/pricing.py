@@ -0,0 +1,117 @@
+from dataclasses import dataclass
+from decimal import Decimal
+from borrowings.models import Borrowing
+from .fine_ledger import FineLedger
+from .fine_policy import FinePolicy
+from .models import Payment
+
+CENT = Decimal('0.01')
+
+
+@dataclass(frozen=True)
+class PaymentQuote:
+    """
+    Price of a payment and the borrowing details shown at checkout.
+    
+    Computed once by ``PaymentPricer`` and shared by the create serializer,
+    the Stripe checkout call and the payment update, so none of them touch
+    the borrowing, book or user relations again.
+    """
+    
+    payment_type: str
+    amount: Decimal
+    days: int
+    borrowing_id: int
+    user_id: int
+    book_title: str
+    currency: str = 'usd'
+    
+    @property
+    def unit_amount(self) -> int:
+        """Amount in cents, as Stripe expects it."""
+        return int(self.amount * 100)
+    
+    @property
+    def product_name(self) -> str:
+        return f"{self.payment_type} - {self.book_title}"
+    
+    @property
+    def description(self) -> str:
+        return f"Payment for borrowing: {self.borrowing_id}"
+    
+    def metadata(self, payment_id: int) -> dict:
+        """Stripe metadata linking the checkout session back to the payment."""
+        return {
+            'payment_id': payment_id,
+            'borrowing_id': self.borrowing_id,
+            'user_id': self.user_id,
+        }
+
+
+class PaymentPricer:
+    """
+    Compute PAYMENT and FINE amounts for a borrowing.
+    
+    A PAYMENT costs the book's daily fee for every day of the borrowing
+    period; a FINE is set by the ``FinePolicy`` and read from the
+    borrowing's ``FineBalance`` once the fine ledger has accrued it.
+    Borrowings are loaded with their book and user in one query when they
+    are not loaded already.
+    """
+    
+    def __init__(self, policy: FinePolicy = None, fine_multiplier: float = None):
+        if policy is None:
+            policy = FinePolicy.flat(fine_multiplier) if fine_multiplier is not None else FinePolicy.from_settings()
+        self.policy = policy
+    
+    @staticmethod
+    def load_borrowing(borrowing_id: int) -> Borrowing:
+        """Fetch a borrowing with its book and user."""
+        return Borrowing.objects.select_related('book', 'user').get(pk=borrowing_id)
+    
+    def quote(self, borrowing: Borrowing, payment_type: str) -> PaymentQuote:
+        """
+        Price a payment of the given type for a borrowing.
+        
+        Args:
+            borrowing: Borrowing to charge
+            payment_type: ``PAYMENT`` or ``FINE``
+        
+        Returns:
+            PaymentQuote: Amount and checkout details (amount is 0 for unknown types)
+        """
+        if not Borrowing.book.is_cached(borrowing):
+            borrowing = self.load_borrowing(borrowing.pk)
+        # Unsaved books may still hold an int or float fee
+        daily_fee = Decimal(str(borrowing.book.daily_fee))
+        
+        if payment_type == 'PAYMENT':
+            days = (borrowing.expected_return_date - borrowing.borrow_date).days
+            amount = daily_fee * days
+        elif payment_type == 'FINE':
+            balance = FineLedger(self.policy).get_balance(borrowing.pk)
+            if balance is not None:
+                days = balance.days
+                amount = balance.outstanding
+            else:
+                # Not accrued by the nightly job yet
+                days = borrowing.overdue_days
+                amount = self.policy.calculate(daily_fee, days)
+        else:
+            days = 0
+            amount = Decimal('0.00')
+        
+        return PaymentQuote(
+            payment_type=payment_type,
+            amount=amount.quantize(CENT),
+            days=days,
+            borrowing_id=borrowing.pk,
+            user_id=borrowing.user_id,
+            book_title=borrowing.book.title
+        )
+    
+    def quote_payment(self, payment: Payment) -> PaymentQuote:
+        """Price an existing payment, loading its borrowing only if it is not cached."""
+        if Payment.borrowing.is_cached(payment):
+            return self.quote(payment.borrowing, payment.type)
+        return self.quote(self.load_borrowing(payment.borrowing_id), payment.type)
\ No newline at end of file
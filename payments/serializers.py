@@ -1,5 +1,7 @@
 from rest_framework import serializers
-from .models import Payment
+from .models import Payment, Refund
+from .pricing import PaymentPricer
+from borrowings.models import Borrowing
 from borrowings.serializers import BorrowingDetailSerializer
 
 
@@ -12,28 +14,48 @@ class PaymentListSerializer(serializers.ModelSerializer):
         model = Payment
         fields = [
             'id', 'status', 'type', 'borrowing', 'session_url', 
-            'session_id', 'money_to_pay'
+            'session_id', 'session_expires_at', 'money_to_pay', 'refunded_amount', 'created_at', 'paid_at'
         ]
-        read_only_fields = ['id', 'session_url', 'session_id']
+        read_only_fields = [
+            'id', 'session_url', 'session_id', 'session_expires_at', 'refunded_amount', 'created_at', 'paid_at'
+        ]
+
+
+class RefundSerializer(serializers.ModelSerializer):
+    """Serializer for refunds of a payment."""
+    
+    class Meta:
+        model = Refund
+        fields = [
+            'id', 'payment', 'amount', 'status', 'stripe_refund_id',
+            'attempts', 'last_error', 'created_at', 'processed_at'
+        ]
+        read_only_fields = fields
 
 
 class PaymentDetailSerializer(serializers.ModelSerializer):
     """Serializer for payment detail with full borrowing information."""
     
     borrowing = BorrowingDetailSerializer(read_only=True)
+    refunds = RefundSerializer(many=True, read_only=True)
     
     class Meta:
         model = Payment
         fields = [
             'id', 'status', 'type', 'borrowing', 'session_url', 
-            'session_id', 'money_to_pay'
+            'session_id', 'session_expires_at', 'money_to_pay', 'refunded_amount', 'created_at', 'paid_at', 'refunds'
+        ]
+        read_only_fields = [
+            'id', 'session_url', 'session_id', 'session_expires_at', 'refunded_amount', 'created_at', 'paid_at'
         ]
-        read_only_fields = ['id', 'session_url', 'session_id']
 
 
 class PaymentCreateSerializer(serializers.ModelSerializer):
     """Serializer for creating payments."""
     
+    # Book and user are needed for validation and pricing
+    borrowing = serializers.PrimaryKeyRelatedField(queryset=Borrowing.objects.select_related('book', 'user'))
+    
     class Meta:
         model = Payment
         fields = ['borrowing', 'type', 'money_to_pay']
@@ -41,7 +63,7 @@ class PaymentCreateSerializer(serializers.ModelSerializer):
     def validate_borrowing(self, value):
         """Validate borrowing exists and belongs to user."""
         user = self.context['request'].user
-        if value.user != user and not user.is_staff:
+        if value.user_id != user.id and not user.is_staff:
             raise serializers.ValidationError("You can only create payments for your own borrowings.")
         return value
     
@@ -49,4 +71,16 @@ class PaymentCreateSerializer(serializers.ModelSerializer):
         """Validate payment amount is positive."""
         if value <= 0:
             raise serializers.ValidationError("Payment amount must be positive.")
-        return value
\ No newline at end of file
+        return value
+    
+    def validate(self, attrs):
+        """Price the payment once; the quote is reused for the checkout session."""
+        quote = PaymentPricer().quote(attrs['borrowing'], attrs.get('type', 'PAYMENT'))
+        if quote.amount <= 0:
+            raise serializers.ValidationError("Nothing to pay for this borrowing.")
+        attrs['quote'] = quote
+        return attrs
+    
+    def create(self, validated_data):
+        validated_data.pop('quote', None)
+        return super().create(validated_data)
\ No newline at end of file
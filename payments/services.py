@@ -1,65 +1,104 @@
+import logging
 import stripe
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal, InvalidOperation
+from django.db import transaction
+from django.db.models import F, Min, Q, Sum
 from django.conf import settings
+from django.utils import timezone
 from django.urls import reverse
-from .models import Payment
+from django_q.tasks import async_task
+from borrowings.models import Borrowing
+from library_service.bulk import log_bulk_change, update_returning
+from notifications.services import TelegramNotificationService
+from .models import Payment, Refund
+from .pricing import PaymentPricer, PaymentQuote
+from .stripe_client import CircuitOpenError, get_stripe_client
+
+logger = logging.getLogger(__name__)
+
+
+class IdempotencyKeyConflict(Exception):
+    """An Idempotency-Key was reused for a different borrowing or payment type."""
+
+
+class RefundNotAllowed(Exception):
+    """The payment cannot be refunded by the requested amount."""
 
 
 class StripeService:
-    """Service for handling Stripe payment operations."""
+    """
+    Service for handling Stripe payment operations.
     
-    def __init__(self):
-        stripe.api_key = settings.STRIPE_SECRET_KEY
+    Calls go through the process-wide ``StripeClient`` (pooled connections,
+    timeouts, circuit breaker). ``CircuitOpenError`` is re-raised as is so
+    views can answer 503 instead of waiting on an unavailable Stripe.
+    """
     
-    def create_payment_session(self, payment: Payment) -> dict:
+    def __init__(self, client=None):
+        self.client = client or get_stripe_client()
+    
+    def create_payment_session(self, payment: Payment, idempotency_key: str = None,
+                               quote: PaymentQuote = None) -> dict:
         """
         Create a Stripe checkout session for payment.
         
         Args:
             payment: Payment instance
-            
+            idempotency_key: Stripe idempotency key (defaults to one derived from the payment)
+            quote: Price of the payment (computed with one query if not given)
+        
         Returns:
             dict: Session data with URL and ID
         """
         try:
-            # Calculate payment amount
-            amount = payment.calculate_payment_amount()
+            quote = quote or PaymentPricer().quote_payment(payment)
             
             # Create checkout session
-            session = stripe.checkout.Session.create(
+            session = self.client.create_checkout_session(
                 payment_method_types=['card'],
                 line_items=[{
                     'price_data': {
-                        'currency': 'usd',
+                        'currency': quote.currency,
                         'product_data': {
-                            'name': f"{payment.type} - {payment.book.title}",
-                            'description': f"Payment for borrowing: {payment.borrowing.id}",
+                            'name': quote.product_name,
+                            'description': quote.description,
                         },
-                        'unit_amount': int(amount * 100),  # Convert to cents
+                        'unit_amount': quote.unit_amount,
                     },
                     'quantity': 1,
                 }],
                 mode='payment',
                 success_url=settings.SITE_URL + reverse('payments:success') + f'?session_id={{CHECKOUT_SESSION_ID}}',
                 cancel_url=settings.SITE_URL + reverse('payments:cancel'),
-                metadata={
-                    'payment_id': payment.id,
-                    'borrowing_id': payment.borrowing.id,
-                    'user_id': payment.user.id,
-                }
+                metadata=quote.metadata(payment.id),
+                # A retried request for the same payment returns the same session
+                idempotency_key=idempotency_key or f'payment-{payment.id}-checkout'
             )
             
             # Update payment with session data
             payment.session_id = session.id
             payment.session_url = session.url
-            payment.money_to_pay = amount
-            payment.save()
+            payment.money_to_pay = quote.amount
+            if session.get('expires_at'):
+                payment.session_expires_at = datetime.fromtimestamp(session.expires_at, tz=dt_timezone.utc)
+            # A single UPDATE; the status is unchanged, so there is nothing for save() signals to do
+            Payment.objects.filter(pk=payment.pk).update(
+                session_id=payment.session_id,
+                session_url=payment.session_url,
+                money_to_pay=payment.money_to_pay,
+                session_expires_at=payment.session_expires_at,
+                updated_at=timezone.now()
+            )
             
             return {
                 'session_id': session.id,
                 'session_url': session.url,
-                'amount': amount
+                'amount': quote.amount
             }
-            
+        
+        except CircuitOpenError:
+            raise
         except stripe.error.StripeError as e:
             raise Exception(f"Stripe error: {str(e)}")
         except Exception as e:
@@ -71,13 +110,15 @@ class StripeService:
         
         Args:
             session_id: Stripe session ID
-            
+        
         Returns:
             bool: True if payment was successful
         """
         try:
-            session = stripe.checkout.Session.retrieve(session_id)
+            session = self.client.retrieve_checkout_session(session_id)
             return session.payment_status == 'paid'
+        except CircuitOpenError:
+            raise
         except stripe.error.StripeError as e:
             raise Exception(f"Stripe error: {str(e)}")
     
@@ -87,14 +128,14 @@ class StripeService:
         
         Args:
             session_id: Stripe session ID
-            
+        
         Returns:
             dict: Payment intent details
         """
         try:
-            session = stripe.checkout.Session.retrieve(session_id)
+            session = self.client.retrieve_checkout_session(session_id)
             if session.payment_intent:
-                intent = stripe.PaymentIntent.retrieve(session.payment_intent)
+                intent = self.client.retrieve_payment_intent(session.payment_intent)
                 return {
                     'id': intent.id,
                     'amount': intent.amount / 100,  # Convert from cents
@@ -102,6 +143,8 @@ class StripeService:
                     'currency': intent.currency,
                 }
             return None
+        except CircuitOpenError:
+            raise
         except stripe.error.StripeError as e:
             raise Exception(f"Stripe error: {str(e)}")
     
@@ -112,7 +155,7 @@ class StripeService:
         Args:
             payment: Payment instance
             amount: Amount to refund (None for full refund)
-            
+        
         Returns:
             dict: Refund details
         """
@@ -120,7 +163,7 @@ class StripeService:
             if not payment.session_id:
                 raise Exception("No session ID found for payment")
             
-            session = stripe.checkout.Session.retrieve(payment.session_id)
+            session = self.client.retrieve_checkout_session(payment.session_id)
             if not session.payment_intent:
                 raise Exception("No payment intent found")
             
@@ -131,7 +174,7 @@ class StripeService:
             if amount:
                 refund_data['amount'] = int(amount * 100)  # Convert to cents
             
-            refund = stripe.Refund.create(**refund_data)
+            refund = self.client.create_refund(**refund_data)
             
             return {
                 'id': refund.id,
@@ -139,8 +182,496 @@ class StripeService:
                 'status': refund.status,
                 'currency': refund.currency,
             }
-            
+        
+        except CircuitOpenError:
+            raise
         except stripe.error.StripeError as e:
             raise Exception(f"Stripe error: {str(e)}")
         except Exception as e:
-            raise Exception(f"Error creating refund: {str(e)}")
\ No newline at end of file
+            raise Exception(f"Error creating refund: {str(e)}")
+
+
+class PaymentInitiationService:
+    """
+    Idempotent entry point for starting a payment.
+    
+    Requests are serialized per borrowing (row lock), so retries and
+    double-clicks get the payment of the first request instead of a new
+    Payment and a new Stripe checkout session:
+    
+    - a repeated ``Idempotency-Key`` returns the payment it created;
+    - otherwise a PENDING payment of the same type whose session is still
+      open (or not opened yet) is returned;
+    - only then is a payment created.
+    
+    The lock only covers these queries: the PENDING payment is committed
+    first and its session is opened at Stripe afterwards, with an
+    idempotency key derived from the payment, so a slow Stripe call never
+    blocks other requests for the borrowing and a retry of a failed call
+    gets the same session.
+    """
+    
+    def __init__(self, stripe_service: StripeService = None):
+        self.stripe_service = stripe_service or StripeService()
+    
+    @staticmethod
+    def find_reusable(borrowing, payment_type: str):
+        """Return the newest pending payment of the borrowing with a live or unopened session, or None."""
+        pending = Payment.objects.filter(borrowing=borrowing, type=payment_type, status='PENDING').order_by('-id')
+        for payment in pending:
+            if not payment.session_id or payment.has_live_session():
+                return payment
+        return None
+    
+    @staticmethod
+    def get_stripe_key(payment) -> str:
+        """Return the Stripe idempotency key of the payment's checkout session."""
+        if payment.idempotency_key:
+            return f'{payment.idempotency_key}-{payment.id}'
+        return f'payment-{payment.id}-checkout'
+    
+    def initiate(self, borrowing, payment_type: str, money_to_pay, idempotency_key: str = '',
+                 quote: PaymentQuote = None) -> tuple:
+        """
+        Return the payment for this request, creating it and its checkout session if needed.
+        
+        Args:
+            borrowing: Borrowing being paid
+            payment_type: ``PAYMENT`` or ``FINE``
+            money_to_pay: Amount stored until the session is created
+            idempotency_key: Client supplied ``Idempotency-Key`` header, if any
+            quote: Price already computed for this borrowing and type, if any
+        
+        Returns:
+            tuple: (payment, created)
+        
+        Raises:
+            IdempotencyKeyConflict: The key belongs to a payment with other parameters
+        """
+        payment, created = self.claim(borrowing, payment_type, money_to_pay, idempotency_key)
+        if payment.status == 'PENDING' and not payment.session_id:
+            # Outside the transaction: a Stripe error leaves the PENDING
+            # payment for the next request to retry with the same key
+            quote = quote or PaymentPricer().quote(borrowing, payment_type)
+            self.stripe_service.create_payment_session(payment, idempotency_key=self.get_stripe_key(payment), quote=quote)
+        return payment, created
+    
+    def claim(self, borrowing, payment_type: str, money_to_pay, idempotency_key: str = '') -> tuple:
+        """
+        Return the payment of an earlier request, or commit a new PENDING one.
+        
+        Returns:
+            tuple: (payment, created)
+        """
+        with transaction.atomic():
+            # Serialize concurrent requests for the same borrowing
+            Borrowing.objects.select_for_update().filter(pk=borrowing.pk).first()
+            
+            if idempotency_key:
+                existing = Payment.objects.filter(
+                    idempotency_key=idempotency_key,
+                    borrowing__user_id=borrowing.user_id
+                ).first()
+                if existing is not None:
+                    if existing.borrowing_id != borrowing.pk or existing.type != payment_type:
+                        raise IdempotencyKeyConflict("Idempotency-Key was already used for a different payment")
+                    return existing, False
+            
+            reusable = self.find_reusable(borrowing, payment_type)
+            if reusable is not None:
+                return reusable, False
+            
+            payment = Payment.objects.create(
+                borrowing=borrowing,
+                type=payment_type,
+                money_to_pay=money_to_pay,
+                idempotency_key=idempotency_key
+            )
+            return payment, True
+
+
+class PaymentReconciliationService:
+    """
+    Bring PENDING payments in line with their Stripe checkout sessions.
+    
+    Sessions are read with Stripe's list API a page at a time (instead of
+    one retrieve per payment), matched to payments with one ``IN`` query
+    per page and updated with ``bulk_update``. This catches payments whose
+    success redirect never reached us and sessions that expired.
+    ``bulk_update`` skips the per-payment status notification, so each page
+    sends one digest about the payments it changed instead.
+    """
+    
+    def __init__(self, client=None, page_size: int = None):
+        self.client = client or get_stripe_client()
+        self.page_size = page_size or getattr(settings, 'PAYMENT_RECONCILIATION_PAGE_SIZE', 100)
+    
+    @staticmethod
+    def get_status(session) -> str:
+        """Return the Payment status a session implies, or None if it is still open."""
+        if session.get('payment_status') in ('paid', 'no_payment_required'):
+            return 'PAID'
+        if session.get('status') == 'expired':
+            return 'EXPIRED'
+        # Open, or complete with an asynchronous payment still processing
+        return None
+    
+    def get_window_start(self):
+        """Return when the oldest PENDING payment with a session was created, or None if there is none."""
+        return Payment.objects.filter(status='PENDING').exclude(session_id='').aggregate(
+            oldest=Min('created_at')
+        )['oldest']
+    
+    def reconcile_page(self, sessions: list) -> dict:
+        """
+        Apply the status of one page of sessions to their PENDING payments.
+        
+        Returns:
+            dict: Number of payments matched, marked PAID and marked EXPIRED
+        """
+        statuses = {session['id']: self.get_status(session) for session in sessions}
+        payments = list(Payment.objects.filter(
+            session_id__in=[session_id for session_id, status in statuses.items() if status],
+            status='PENDING'
+        ))
+        now = timezone.now()
+        for payment in payments:
+            payment.status = statuses[payment.session_id]
+            payment.updated_at = now
+            if payment.status == 'PAID':
+                payment.paid_at = now
+        Payment.objects.bulk_update(payments, ['status', 'paid_at', 'updated_at'])
+        if payments:
+            self.send_reconciliation_notification(payments)
+        
+        return {
+            'matched': len(payments),
+            'paid': sum(1 for payment in payments if payment.status == 'PAID'),
+            'expired': sum(1 for payment in payments if payment.status == 'EXPIRED'),
+        }
+    
+    @staticmethod
+    def send_reconciliation_notification(payments: list):
+        """Send one digest about payments marked PAID or EXPIRED, listing the first few."""
+        try:
+            max_items = getattr(settings, 'BULK_NOTIFICATION_MAX_ITEMS', 20)
+            paid = [payment for payment in payments if payment.status == 'PAID']
+            TelegramNotificationService().send_bulk_notification(
+                "🔄 Payments Reconciled",
+                count=len(payments),
+                details={
+                    '✅ Paid': len(paid),
+                    '❌ Expired': len(payments) - len(paid),
+                    '💰 Amount paid': f"${sum((payment.money_to_pay for payment in paid), Decimal('0.00'))}",
+                },
+                items=[
+                    f"{payment.status} {payment.type} ${payment.money_to_pay} #{payment.id}"
+                    for payment in payments[:max_items]
+                ],
+                priority='payment'
+            )
+        except Exception as e:
+            logger.error(f"Failed to send payment reconciliation notification: {str(e)}")
+    
+    def reconcile(self) -> dict:
+        """
+        Page through sessions created since the oldest PENDING payment and reconcile them.
+        
+        Returns:
+            dict: Pages read, sessions seen and payment updates
+        """
+        result = {'pages': 0, 'sessions': 0, 'matched': 0, 'paid': 0, 'expired': 0}
+        window_start = self.get_window_start()
+        if window_start is None:
+            return result
+        
+        # Small slack for clock differences between us and Stripe
+        params = {'limit': self.page_size, 'created': {'gte': int(window_start.timestamp()) - 300}}
+        while True:
+            page = self.client.list_checkout_sessions(**params)
+            result['pages'] += 1
+            result['sessions'] += len(page.data)
+            for key, value in self.reconcile_page(page.data).items():
+                result[key] += value
+            if not page.has_more or not page.data:
+                break
+            params['starting_after'] = page.data[-1].id
+        return result
+
+
+class PaymentExpiryService:
+    """Expire PENDING payments in bulk (admin action)."""
+    
+    def expire(self, payments, user=None) -> list:
+        """
+        Expire the PENDING payments of a queryset with one ``UPDATE``.
+        
+        The expired payments are written to the admin history and one digest
+        notification is sent after the transaction commits, instead of a
+        status notification per payment.
+        
+        Args:
+            payments: Payment queryset
+            user: Admin expiring the payments, recorded in the admin history
+        
+        Returns:
+            list: Ids of the expired payments
+        """
+        with transaction.atomic():
+            expired = update_returning(
+                payments.filter(status='PENDING'),
+                ['id', 'type', 'money_to_pay'],
+                status='EXPIRED',
+                updated_at=timezone.now()
+            )
+            payment_ids = [payment_id for payment_id, _, _ in expired]
+            log_bulk_change(user, Payment, payment_ids, "Expired")
+            if expired:
+                transaction.on_commit(lambda: self.send_expiry_notification(expired, user))
+        return payment_ids
+    
+    @staticmethod
+    def send_expiry_notification(expired: list, user=None):
+        """Send one digest about expired payments, listing the first few."""
+        try:
+            max_items = getattr(settings, 'BULK_NOTIFICATION_MAX_ITEMS', 20)
+            TelegramNotificationService().send_bulk_notification(
+                "⌛ Payments Expired",
+                count=len(expired),
+                details={
+                    '💳 Payments': len(expired),
+                    '💰 Amount': f"${sum((amount for _, _, amount in expired), Decimal('0.00'))}",
+                    '👤 By': user.email if user is not None else 'System',
+                },
+                items=[
+                    f"{payment_type} ${amount} #{payment_id}"
+                    for payment_id, payment_type, amount in expired[:max_items]
+                ],
+                priority='payment'
+            )
+        except Exception as e:
+            logger.error(f"Failed to send payment expiry notification: {str(e)}")
+
+
+class RefundService:
+    """
+    Queue refunds locally and execute them at Stripe in the background.
+    
+    ``request_refund`` only validates the amount against what is left to
+    refund and records a QUEUED ``Refund``; the Stripe calls happen in the
+    ``process_refund_task`` Django-Q task queued after commit. Connection
+    errors, 5xx, 429s and an open circuit put the refund back in the queue
+    with exponential backoff until ``REFUND_MAX_ATTEMPTS``; the
+    ``process_refunds_task`` sweep runs whatever is due, including refunds
+    whose task was lost. Accepted refunds are added to
+    ``Payment.refunded_amount`` so totals never need Stripe.
+    """
+    
+    retry_errors = (stripe.error.APIConnectionError, stripe.error.APIError, stripe.error.RateLimitError)
+    
+    def __init__(self, client=None, max_attempts: int = None, retry_delay: float = None,
+                 processing_timeout: float = None):
+        self.client = client or get_stripe_client()
+        self.max_attempts = max_attempts or getattr(settings, 'REFUND_MAX_ATTEMPTS', 5)
+        self.retry_delay = retry_delay or getattr(settings, 'REFUND_RETRY_DELAY', 30)
+        self.processing_timeout = processing_timeout or getattr(settings, 'REFUND_PROCESSING_TIMEOUT', 300)
+    
+    @staticmethod
+    def get_refundable_amount(payment: Payment) -> Decimal:
+        """Return what can still be refunded: the payment minus accepted and queued refunds."""
+        in_flight = payment.refunds.filter(status__in=['QUEUED', 'PROCESSING']).aggregate(
+            total=Sum('amount')
+        )['total'] or Decimal('0.00')
+        return payment.money_to_pay - payment.refunded_amount - in_flight
+    
+    def request_refund(self, payment: Payment, amount=None, requested_by=None, idempotency_key: str = '') -> tuple:
+        """
+        Record a refund and queue its execution.
+        
+        Args:
+            payment: Paid payment to refund
+            amount: Amount to refund (None for everything still refundable)
+            requested_by: Admin who asked for the refund
+            idempotency_key: Client supplied ``Idempotency-Key`` header, if any
+        
+        Returns:
+            tuple: (refund, created)
+        
+        Raises:
+            RefundNotAllowed: The payment is not paid or the amount is invalid
+            IdempotencyKeyConflict: The key belongs to a refund of another payment
+        """
+        with transaction.atomic():
+            # Serialize refund requests for the same payment
+            payment = Payment.objects.select_for_update().get(pk=payment.pk)
+            
+            if idempotency_key:
+                existing = Refund.objects.filter(idempotency_key=idempotency_key).first()
+                if existing is not None:
+                    if existing.payment_id != payment.pk:
+                        raise IdempotencyKeyConflict("Idempotency-Key was already used for a different refund")
+                    return existing, False
+            
+            if payment.status != 'PAID':
+                raise RefundNotAllowed("Only paid payments can be refunded")
+            if not payment.session_id:
+                raise RefundNotAllowed("No session ID found for payment")
+            
+            refundable = self.get_refundable_amount(payment)
+            if amount in (None, ''):
+                amount = refundable
+            try:
+                amount = Decimal(str(amount))
+            except InvalidOperation:
+                raise RefundNotAllowed("Refund amount must be a number")
+            if not amount.is_finite() or amount.as_tuple().exponent < -2:
+                raise RefundNotAllowed("Refund amount must be a number with at most 2 decimal places")
+            if refundable <= 0:
+                raise RefundNotAllowed("Payment is already fully refunded")
+            if amount <= 0:
+                raise RefundNotAllowed("Refund amount must be positive")
+            if amount > refundable:
+                raise RefundNotAllowed(f"Refund amount exceeds the refundable ${refundable}")
+            
+            refund = Refund.objects.create(
+                payment=payment,
+                amount=amount,
+                requested_by=requested_by,
+                idempotency_key=idempotency_key
+            )
+            transaction.on_commit(lambda: self.enqueue(refund.id))
+        return refund, True
+    
+    @staticmethod
+    def enqueue(refund_id: int):
+        """Queue the refund task; if the broker is down the sweep picks the refund up."""
+        try:
+            async_task('tasks.scheduled_tasks.process_refund_task', refund_id)
+        except Exception as e:
+            logger.warning(f"Failed to queue refund {refund_id}, leaving it to the sweep: {str(e)}")
+    
+    def due(self):
+        """Refunds whose next attempt is due, and PROCESSING ones abandoned by a crashed worker."""
+        now = timezone.now()
+        return Refund.objects.filter(
+            Q(status='QUEUED', next_attempt_at__lte=now) |
+            Q(status='PROCESSING', updated_at__lt=now - timedelta(seconds=self.processing_timeout))
+        )
+    
+    def claim(self, refund_id: int) -> bool:
+        """Atomically move a due refund to PROCESSING; False if another worker has it or it is not due."""
+        return self.due().filter(pk=refund_id).update(
+            status='PROCESSING',
+            attempts=F('attempts') + 1,
+            updated_at=timezone.now()
+        ) == 1
+    
+    def execute(self, refund_id: int):
+        """
+        Execute one refund at Stripe.
+        
+        Args:
+            refund_id: Refund to execute
+        
+        Returns:
+            Refund: The updated refund, or None if it was not due or already claimed
+        """
+        if not self.claim(refund_id):
+            return None
+        refund = Refund.objects.select_related('payment').get(pk=refund_id)
+        
+        try:
+            if not refund.payment_intent:
+                session = self.client.retrieve_checkout_session(refund.payment.session_id)
+                if not session.payment_intent:
+                    return self.mark_failed(refund, "No payment intent found")
+                # Retries go straight to the refund call
+                refund.payment_intent = session.payment_intent
+                refund.save(update_fields=['payment_intent', 'updated_at'])
+            
+            stripe_refund = self.client.create_refund(
+                payment_intent=refund.payment_intent,
+                amount=int(refund.amount * 100),  # Convert to cents
+                metadata={'refund_id': refund.id, 'payment_id': refund.payment_id},
+                idempotency_key=refund.stripe_idempotency_key
+            )
+        except self.retry_errors as e:
+            return self.retry_later(refund, e)
+        except stripe.error.StripeError as e:
+            return self.mark_failed(refund, f"Stripe error: {str(e)}")
+        
+        if stripe_refund.status in ('failed', 'canceled'):
+            return self.mark_failed(refund, f"Stripe refund {stripe_refund.id} {stripe_refund.status}")
+        # Pending refunds are committed at Stripe and count as refunded
+        return self.mark_succeeded(refund, stripe_refund.id)
+    
+    def mark_succeeded(self, refund: Refund, stripe_refund_id: str) -> Refund:
+        now = timezone.now()
+        with transaction.atomic():
+            updated = Refund.objects.filter(pk=refund.pk, status='PROCESSING').update(
+                status='SUCCEEDED',
+                stripe_refund_id=stripe_refund_id,
+                last_error='',
+                processed_at=now,
+                updated_at=now
+            )
+            # Only the worker that completed the refund adds it to the total
+            if updated:
+                Payment.objects.filter(pk=refund.payment_id).update(
+                    refunded_amount=F('refunded_amount') + refund.amount,
+                    updated_at=now
+                )
+        refund.refresh_from_db()
+        return refund
+    
+    def mark_failed(self, refund: Refund, error: str) -> Refund:
+        logger.error(f"Refund {refund.id} failed: {error}")
+        now = timezone.now()
+        Refund.objects.filter(pk=refund.pk, status='PROCESSING').update(
+            status='FAILED',
+            last_error=error,
+            processed_at=now,
+            updated_at=now
+        )
+        refund.refresh_from_db()
+        return refund
+    
+    def retry_later(self, refund: Refund, error: Exception) -> Refund:
+        if refund.attempts >= self.max_attempts:
+            return self.mark_failed(refund, f"Gave up after {refund.attempts} attempts: {str(error)}")
+        delay = self.retry_delay * 2 ** (refund.attempts - 1)
+        if isinstance(error, CircuitOpenError):
+            delay = max(delay, error.retry_after)
+        logger.warning(f"Refund {refund.id} attempt {refund.attempts} failed, retrying in {delay:.0f}s: {str(error)}")
+        Refund.objects.filter(pk=refund.pk, status='PROCESSING').update(
+            status='QUEUED',
+            last_error=str(error),
+            next_attempt_at=timezone.now() + timedelta(seconds=delay),
+            updated_at=timezone.now()
+        )
+        refund.refresh_from_db()
+        return refund
+    
+    def process_due(self, limit: int = 100) -> dict:
+        """
+        Execute refunds that are due.
+        
+        Args:
+            limit: Maximum number of refunds to execute
+        
+        Returns:
+            dict: Number of refunds succeeded, failed and requeued
+        """
+        result = {'succeeded': 0, 'failed': 0, 'requeued': 0}
+        refund_ids = list(self.due().order_by('next_attempt_at').values_list('id', flat=True)[:limit])
+        for refund_id in refund_ids:
+            refund = self.execute(refund_id)
+            if refund is None:
+                continue
+            if refund.status == 'SUCCEEDED':
+                result['succeeded'] += 1
+            elif refund.status == 'FAILED':
+                result['failed'] += 1
+            else:
+                result['requeued'] += 1
+        return result
\ No newline at end of file
@@ -0,0 +1,218 @@
+import logging
+import threading
+import time
+from functools import lru_cache
+
+import stripe
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(stripe.error.APIConnectionError):
+    """Raised without calling Stripe while the circuit breaker is open."""
+    
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(f"Stripe is unavailable, not retrying for {retry_after:.0f}s")
+
+
+class CircuitBreaker:
+    """
+    Per-process circuit breaker.
+    
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    calls fail immediately with ``CircuitOpenError``. Once
+    ``recovery_timeout`` seconds have passed it becomes half-open and lets
+    ``half_open_max_calls`` probe requests through: a successful probe
+    closes it, a failed one opens it again.
+    
+    Transitions are logged and counted in the cache (shared by all
+    workers) under ``circuit:<name>:<state>``.
+    """
+    
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30,
+                 half_open_max_calls: int = 1, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.clock = clock
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+        self.transitions = {self.OPEN: 0, self.HALF_OPEN: 0, self.CLOSED: 0}
+        self.rejected = 0
+    
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._refresh()
+            return self._state
+    
+    def _refresh(self):
+        if self._state == self.OPEN and self.clock() - self._opened_at >= self.recovery_timeout:
+            self._transition(self.HALF_OPEN)
+    
+    def _transition(self, state: str):
+        previous, self._state = self._state, state
+        self.transitions[state] += 1
+        if state == self.OPEN:
+            self._opened_at = self.clock()
+        if state != self.CLOSED:
+            self._probes = 0
+        if state == self.CLOSED:
+            self._failures = 0
+        
+        log = logger.warning if state == self.OPEN else logger.info
+        log(f"Circuit {self.name} {previous} -> {state}")
+        try:
+            key = f'circuit:{self.name}:{state}'
+            cache.add(key, 0, timeout=None)
+            cache.incr(key)
+        except Exception as e:
+            logger.error(f"Failed to record circuit {self.name} transition: {str(e)}")
+    
+    def before_call(self):
+        """Reserve a call, or raise ``CircuitOpenError`` if the circuit rejects it."""
+        with self._lock:
+            self._refresh()
+            if self._state == self.CLOSED:
+                return
+            if self._state == self.HALF_OPEN and self._probes < self.half_open_max_calls:
+                self._probes += 1
+                return
+            self.rejected += 1
+            retry_after = max(self.recovery_timeout - (self.clock() - self._opened_at), 0)
+            raise CircuitOpenError(retry_after)
+    
+    def record_success(self):
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._transition(self.CLOSED)
+            self._failures = 0
+    
+    def record_failure(self):
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._transition(self.OPEN)
+                return
+            self._failures += 1
+            if self._state == self.CLOSED and self._failures >= self.failure_threshold:
+                self._transition(self.OPEN)
+    
+    def metrics(self) -> dict:
+        """
+        Return the breaker state and transition counters.
+        
+        Returns:
+            dict: Local state, failures and counters, plus transitions of all workers
+        """
+        with self._lock:
+            self._refresh()
+            metrics = {
+                'state': self._state,
+                'consecutive_failures': self._failures,
+                'rejected': self.rejected,
+                'transitions': dict(self.transitions),
+            }
+        states = (self.OPEN, self.HALF_OPEN, self.CLOSED)
+        try:
+            shared = cache.get_many([f'circuit:{self.name}:{state}' for state in states])
+            metrics['transitions_all_workers'] = {
+                state: shared.get(f'circuit:{self.name}:{state}', 0) for state in states
+            }
+        except Exception:
+            pass
+        return metrics
+
+
+class StripeClient:
+    """
+    Long-lived Stripe client shared by a process.
+    
+    Requests go through one ``RequestsClient`` (a keep-alive session per
+    thread) with bounded connect/read timeouts, and the API key is passed
+    per request instead of being written to ``stripe.api_key``. Timeouts,
+    connection errors, 5xx and 429 responses count as failures for the
+    circuit breaker; card and validation errors do not.
+    """
+    
+    failure_errors = (stripe.error.APIConnectionError, stripe.error.APIError, stripe.error.RateLimitError)
+    
+    def __init__(self, api_key: str, api_base: str = None, connect_timeout: float = 3, read_timeout: float = 10,
+                 breaker: CircuitBreaker = None):
+        self.api_key = api_key
+        self.http_client = stripe.http_client.RequestsClient(timeout=(connect_timeout, read_timeout))
+        self.breaker = breaker or CircuitBreaker('stripe')
+        # The 7.x library only reads these globals; they are set once per process
+        stripe.default_http_client = self.http_client
+        if api_base:
+            stripe.api_base = api_base
+    
+    def call(self, method, *args, **kwargs):
+        """
+        Call a Stripe resource method through the circuit breaker.
+        
+        Args:
+            method: Resource method, e.g. ``stripe.Refund.create``
+        
+        Returns:
+            The Stripe object returned by the method
+        """
+        self.breaker.before_call()
+        try:
+            result = method(*args, api_key=self.api_key, **kwargs)
+        except self.failure_errors:
+            self.breaker.record_failure()
+            raise
+        except stripe.error.StripeError:
+            # The API answered, so Stripe itself is healthy
+            self.breaker.record_success()
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return result
+    
+    def create_checkout_session(self, **params):
+        return self.call(stripe.checkout.Session.create, **params)
+    
+    def retrieve_checkout_session(self, session_id: str):
+        return self.call(stripe.checkout.Session.retrieve, session_id)
+    
+    def list_checkout_sessions(self, **params):
+        return self.call(stripe.checkout.Session.list, **params)
+    
+    def retrieve_payment_intent(self, intent_id: str):
+        return self.call(stripe.PaymentIntent.retrieve, intent_id)
+    
+    def create_refund(self, **params):
+        return self.call(stripe.Refund.create, **params)
+    
+    def close(self):
+        self.http_client.close()
+
+
+@lru_cache(maxsize=None)
+def get_stripe_client() -> StripeClient:
+    """Return the process-wide Stripe client configured from settings."""
+    return StripeClient(
+        api_key=settings.STRIPE_SECRET_KEY,
+        api_base=getattr(settings, 'STRIPE_API_BASE', None),
+        connect_timeout=getattr(settings, 'STRIPE_CONNECT_TIMEOUT', 3),
+        read_timeout=getattr(settings, 'STRIPE_READ_TIMEOUT', 10),
+        breaker=CircuitBreaker(
+            'stripe',
+            failure_threshold=getattr(settings, 'STRIPE_CIRCUIT_FAILURE_THRESHOLD', 5),
+            recovery_timeout=getattr(settings, 'STRIPE_CIRCUIT_RECOVERY_TIMEOUT', 30)
+        )
+    )
\ No newline at end of file
@@ -0,0 +1,931 @@
+"""
+Tests for Payments app.
+"""
+
+import pytest
+from datetime import date, timedelta
+
+
+@pytest.mark.django_db
+class TestStripeServiceWithFakeStripe:
+    """Test StripeService against the local fake Stripe API."""
+    
+    @pytest.fixture(autouse=True)
+    def fake_stripe(self, settings):
+        """Run a local fake Stripe server and point the service at it."""
+        from library_service.fakes import FakeStripeServer
+        from payments.stripe_client import get_stripe_client
+        server = FakeStripeServer().start()
+        settings.STRIPE_API_BASE = server.url
+        settings.STRIPE_SECRET_KEY = 'sk_test_fake'
+        settings.STRIPE_CIRCUIT_FAILURE_THRESHOLD = 2
+        settings.STRIPE_CIRCUIT_RECOVERY_TIMEOUT = 0.5
+        get_stripe_client.cache_clear()
+        self.server = server
+        yield server
+        server.stop()
+        get_stripe_client.cache_clear()
+    
+    @pytest.fixture
+    def payment(self, user, book):
+        """Create a pending payment for a 5-day borrowing."""
+        from borrowings.models import Borrowing
+        from payments.models import Payment
+        borrowing = Borrowing.objects.create(
+            user=user,
+            book=book,
+            borrow_date=date.today(),
+            expected_return_date=date.today() + timedelta(days=5)
+        )
+        return Payment.objects.create(borrowing=borrowing, money_to_pay=0)
+    
+    def test_checkout_pay_and_refund(self, payment):
+        """Test the session, payment intent and refund round trip."""
+        import httpx
+        from payments.services import StripeService
+        service = StripeService()
+        
+        session = service.create_payment_session(payment)
+        
+        assert session['session_id'].startswith('cs_test_')
+        assert self.server.sessions[session['session_id']]['amount_total'] == int(payment.money_to_pay * 100)
+        assert self.server.sessions[session['session_id']]['metadata']['payment_id'] == str(payment.id)
+        assert service.verify_payment_session(session['session_id']) is False
+        
+        response = httpx.get(session['session_url'])
+        
+        assert response.status_code == 303
+        assert f"session_id={session['session_id']}" in response.headers['Location']
+        assert service.verify_payment_session(session['session_id']) is True
+        assert service.get_payment_intent(session['session_id'])['amount'] == pytest.approx(float(payment.money_to_pay))
+        refund = service.create_refund(payment, 1)
+        assert refund == {'id': refund['id'], 'amount': 1, 'status': 'succeeded', 'currency': 'usd'}
+    
+    def test_injected_errors(self, payment):
+        """Test that server errors and 429s surface as Stripe errors."""
+        from payments.services import StripeService
+        service = StripeService()
+        self.server.responses = [(500, None)]
+        
+        with pytest.raises(Exception, match='Stripe error'):
+            service.create_payment_session(payment)
+        
+        self.server.rate_limit = 10
+        session = service.create_payment_session(payment)
+        self.server.rate_limit = 1
+        with pytest.raises(Exception, match='rate limit'):
+            service.verify_payment_session(session['session_id'])
+    
+    def test_circuit_opens_fails_fast_and_recovers(self, payment):
+        """Test that repeated 5xx open the circuit, calls fail without reaching Stripe, and a probe closes it."""
+        import time
+        from payments.services import StripeService
+        from payments.stripe_client import CircuitOpenError
+        service = StripeService()
+        session = service.create_payment_session(payment)
+        self.server.error_rate = 1
+        
+        for _ in range(2):
+            with pytest.raises(Exception, match='Fake Stripe server error'):
+                service.verify_payment_session(session['session_id'])
+        requests_before = self.server.stats['requests']
+        with pytest.raises(CircuitOpenError):
+            service.verify_payment_session(session['session_id'])
+        
+        assert self.server.stats['requests'] == requests_before
+        assert service.client.breaker.state == 'open'
+        
+        self.server.error_rate = 0
+        time.sleep(0.5)
+        assert service.client.breaker.state == 'half_open'
+        assert service.verify_payment_session(session['session_id']) is False
+        metrics = service.client.breaker.metrics()
+        assert metrics['state'] == 'closed'
+        assert metrics['transitions'] == {'open': 1, 'half_open': 1, 'closed': 1}
+        assert metrics['rejected'] == 1
+    
+    def test_failed_probe_reopens_and_card_errors_do_not_count(self):
+        """Test half-open probing and which errors count as failures."""
+        import stripe
+        from payments.stripe_client import CircuitBreaker, CircuitOpenError, StripeClient
+        now = [0.0]
+        breaker = CircuitBreaker('test', failure_threshold=2, recovery_timeout=10, clock=lambda: now[0])
+        client = StripeClient('sk_test_fake', breaker=breaker)
+        
+        def declined(*args, **kwargs):
+            raise stripe.error.CardError('Your card was declined.', None, 'card_declined')
+        
+        def unavailable(*args, **kwargs):
+            raise stripe.error.APIConnectionError('timed out')
+        
+        for _ in range(3):
+            with pytest.raises(stripe.error.CardError):
+                client.call(declined)
+        assert breaker.state == 'closed'
+        
+        for _ in range(2):
+            with pytest.raises(stripe.error.APIConnectionError):
+                client.call(unavailable)
+        assert breaker.state == 'open'
+        
+        now[0] = 10
+        with pytest.raises(stripe.error.APIConnectionError):
+            client.call(unavailable)
+        assert breaker.state == 'open'
+        with pytest.raises(CircuitOpenError) as error:
+            client.call(unavailable)
+        assert error.value.retry_after == 10
+    
+    def test_success_view_returns_503_while_circuit_is_open(self, payment):
+        """Test that the success callback answers 503 with Retry-After instead of waiting on Stripe."""
+        from rest_framework.test import APIRequestFactory
+        from payments.stripe_client import get_stripe_client
+        from payments.views import PaymentSuccessView
+        payment.session_id = 'cs_test_missing'
+        payment.save()
+        breaker = get_stripe_client().breaker
+        for _ in range(2):
+            breaker.record_failure()
+        
+        request = APIRequestFactory().get('/api/payments/success/', {'session_id': 'cs_test_missing'})
+        response = PaymentSuccessView.as_view()(request)
+        
+        assert response.status_code == 503
+        assert int(response['Retry-After']) >= 1
+        assert self.server.stats['requests'] == 0
+    
+    def test_initiation_reuses_live_session(self, borrowing):
+        """Test that a second request for the same borrowing and type returns the open session."""
+        from payments.services import PaymentInitiationService
+        service = PaymentInitiationService()
+        
+        first, created = service.initiate(borrowing, 'PAYMENT', 5)
+        second, created_again = service.initiate(borrowing, 'PAYMENT', 5)
+        
+        assert created is True
+        assert created_again is False
+        assert second.pk == first.pk
+        assert first.session_expires_at is not None
+        assert self.server.stats['sessions'] == 1
+    
+    def test_expired_session_is_not_reused(self, borrowing):
+        """Test that a session close to expiry gets a new payment and session."""
+        from django.utils import timezone
+        from payments.models import Payment
+        from payments.services import PaymentInitiationService
+        service = PaymentInitiationService()
+        first, _ = service.initiate(borrowing, 'PAYMENT', 5)
+        Payment.objects.filter(pk=first.pk).update(session_expires_at=timezone.now())
+        
+        second, created = service.initiate(borrowing, 'PAYMENT', 5)
+        
+        assert created is True
+        assert second.pk != first.pk
+        assert self.server.stats['sessions'] == 2
+    
+    def test_idempotency_key_replay_and_conflict(self, borrowing):
+        """Test that a repeated Idempotency-Key returns its payment and cannot be reused for another type."""
+        from payments.models import Payment
+        from payments.services import IdempotencyKeyConflict, PaymentInitiationService
+        service = PaymentInitiationService()
+        payment, _ = service.initiate(borrowing, 'PAYMENT', 5, idempotency_key='key-1')
+        Payment.objects.filter(pk=payment.pk).update(status='EXPIRED')
+        
+        replayed, created = service.initiate(borrowing, 'PAYMENT', 5, idempotency_key='key-1')
+        
+        assert created is False
+        assert replayed.pk == payment.pk
+        with pytest.raises(IdempotencyKeyConflict):
+            service.initiate(borrowing, 'FINE', 5, idempotency_key='key-1')
+        assert self.server.stats['sessions'] == 1
+    
+    def test_stripe_is_called_after_commit_and_retried_with_same_key(self, borrowing):
+        """Test that the session is opened outside the borrowing lock and a failed call is retried by the next request."""
+        from django.db import connection
+        from payments.models import Payment
+        from payments.services import PaymentInitiationService, StripeService
+        depth = len(connection.atomic_blocks)
+        calls = []
+        
+        class FlakyStripeService(StripeService):
+            def create_payment_session(self, payment, idempotency_key=None, quote=None):
+                calls.append((idempotency_key, len(connection.atomic_blocks)))
+                if len(calls) == 1:
+                    raise Exception("Stripe error: unavailable")
+                return super().create_payment_session(payment, idempotency_key=idempotency_key, quote=quote)
+        
+        service = PaymentInitiationService(FlakyStripeService())
+        with pytest.raises(Exception):
+            service.initiate(borrowing, 'PAYMENT', 5, idempotency_key='key-2')
+        pending = Payment.objects.get()
+        assert pending.status == 'PENDING'
+        assert pending.session_id == ''
+        
+        payment, created = service.initiate(borrowing, 'PAYMENT', 5, idempotency_key='key-2')
+        
+        assert created is False
+        assert payment.pk == pending.pk
+        assert payment.session_url
+        assert calls == [(f'key-2-{pending.pk}', depth)] * 2
+        assert self.server.stats['sessions'] == 1
+    
+    def test_create_view_is_idempotent(self, user, borrowing):
+        """Test that a retried POST returns 200 with the same payment instead of creating another."""
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from payments.models import Payment
+        from payments.views import PaymentListView
+        factory = APIRequestFactory()
+        
+        def post():
+            request = factory.post(
+                '/api/payments/',
+                {'borrowing': borrowing.pk, 'type': 'PAYMENT', 'money_to_pay': '5.00'},
+                format='json',
+                HTTP_IDEMPOTENCY_KEY='retry-me'
+            )
+            force_authenticate(request, user=user)
+            return PaymentListView.as_view()(request)
+        
+        first = post()
+        second = post()
+        
+        assert first.status_code == 201
+        assert second.status_code == 200
+        assert second.data['payment']['id'] == first.data['payment']['id']
+        assert second.data['stripe_session']['session_url'] == first.data['stripe_session']['session_url']
+        assert Payment.objects.count() == 1
+    
+    def test_cleanup_expires_payments_by_session_expiry(self, borrowing):
+        """Test that pending payments are expired once their checkout session has expired."""
+        from datetime import timedelta
+        from django.utils import timezone
+        from payments.models import Payment
+        from tasks.scheduled_tasks import cleanup_expired_payments_task
+        stale = Payment.objects.create(
+            borrowing=borrowing, money_to_pay=5, session_expires_at=timezone.now() - timedelta(minutes=1)
+        )
+        live = Payment.objects.create(
+            borrowing=borrowing, money_to_pay=5, session_expires_at=timezone.now() + timedelta(hours=1)
+        )
+        
+        cleanup_expired_payments_task()
+        
+        stale.refresh_from_db()
+        live.refresh_from_db()
+        assert stale.status == 'EXPIRED'
+        assert live.status == 'PENDING'
+    
+    def test_reconciliation_pages_sessions_and_updates_payments(self, borrowing, monkeypatch):
+        """Test that paid and expired sessions update their PENDING payments page by page and are notified."""
+        from notifications.services import TelegramNotificationService
+        from payments.models import Payment
+        from payments.services import PaymentReconciliationService, StripeService
+        digests = []
+        monkeypatch.setattr(
+            TelegramNotificationService, 'send_bulk_notification',
+            lambda service, title, count, details, items, priority='default': digests.append((count, details, items))
+        )
+        payments = [Payment.objects.create(borrowing=borrowing, money_to_pay=5) for _ in range(3)]
+        for payment in payments:
+            StripeService().create_payment_session(payment)
+        paid, expired, still_open = payments
+        with self.server.lock:
+            self.server.pay(self.server.sessions[paid.session_id])
+        self.server.expire(expired.session_id)
+        
+        result = PaymentReconciliationService(page_size=2).reconcile()
+        
+        assert result == {'pages': 2, 'sessions': 3, 'matched': 2, 'paid': 1, 'expired': 1}
+        assert Payment.objects.get(pk=paid.pk).status == 'PAID'
+        assert Payment.objects.get(pk=expired.pk).status == 'EXPIRED'
+        assert Payment.objects.get(pk=still_open.pk).status == 'PENDING'
+        # One digest per page that changed payments, replacing the skipped post_save notifications
+        notified = [item for _, _, items in digests for item in items]
+        assert sum(count for count, _, _ in digests) == 2
+        assert sorted(item.split(' ')[0] + item.split(' ')[-1] for item in notified) == [f'EXPIRED#{expired.pk}', f'PAID#{paid.pk}']
+    
+    def test_reconciliation_skips_stripe_without_pending_payments(self):
+        """Test that nothing is requested from Stripe when no payment is pending."""
+        from payments.services import PaymentReconciliationService
+        
+        result = PaymentReconciliationService().reconcile()
+        
+        assert result['pages'] == 0
+        assert self.server.stats['requests'] == 0    
+    @pytest.fixture
+    def paid_payment(self, borrowing):
+        """Create a payment whose checkout session was paid at the fake Stripe."""
+        from payments.services import PaymentInitiationService
+        payment, _ = PaymentInitiationService().initiate(borrowing, 'PAYMENT', 5)
+        with self.server.lock:
+            self.server.pay(self.server.sessions[payment.session_id])
+        payment.status = 'PAID'
+        payment.save()
+        return payment
+    
+    def test_refund_view_queues_and_task_executes(self, user, paid_payment):
+        """Test that refunds are recorded without Stripe, executed by the task and netted out of revenue."""
+        from decimal import Decimal
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from analytics.services import AnalyticsService
+        from payments.views import PaymentRefundView
+        from tasks.scheduled_tasks import process_refunds_task
+        user.is_staff = True
+        user.save()
+        factory = APIRequestFactory()
+        requests_before = self.server.stats['requests']
+        
+        def post(data):
+            request = factory.post(f'/api/payments/{paid_payment.pk}/refund/', data, format='json')
+            force_authenticate(request, user=user)
+            return PaymentRefundView.as_view()(request, pk=paid_payment.pk)
+        
+        response = post({'amount': '2.00'})
+        
+        assert response.status_code == 202
+        assert response.data['refund']['status'] == 'QUEUED'
+        assert self.server.stats['requests'] == requests_before
+        assert post({'amount': paid_payment.money_to_pay}).status_code == 400
+        
+        process_refunds_task()
+        
+        paid_payment.refresh_from_db()
+        refund = paid_payment.refunds.get()
+        assert refund.status == 'SUCCEEDED'
+        assert refund.stripe_refund_id.startswith('re_')
+        assert paid_payment.refunded_amount == Decimal('2.00')
+        assert self.server.payment_intents[refund.payment_intent]['amount_refunded'] == 200
+        
+        revenue = AnalyticsService().get_revenue_analytics(366)
+        assert revenue['total_refunded'] == Decimal('2.00')
+        assert revenue['total_revenue'] == paid_payment.money_to_pay - Decimal('2.00')
+        
+        rest = post({})
+        assert rest.status_code == 202
+        assert Decimal(rest.data['refund']['amount']) == paid_payment.money_to_pay - Decimal('2.00')
+    
+    def test_refund_retries_with_backoff_and_same_idempotency_key(self, paid_payment):
+        """Test that failed Stripe calls are retried later and a replayed refund is not executed twice."""
+        from decimal import Decimal
+        from django.utils import timezone
+        from payments.models import Payment, Refund
+        from payments.services import RefundService
+        refund, created = RefundService().request_refund(paid_payment, 2)
+        self.server.responses = [(500, None)]
+        
+        retried = RefundService().execute(refund.id)
+        
+        assert created is True
+        assert retried.status == 'QUEUED'
+        assert retried.attempts == 1
+        assert retried.next_attempt_at > timezone.now()
+        assert RefundService().process_due() == {'succeeded': 0, 'failed': 0, 'requeued': 0}
+        
+        Refund.objects.filter(pk=refund.pk).update(next_attempt_at=timezone.now())
+        assert RefundService().process_due() == {'succeeded': 1, 'failed': 0, 'requeued': 0}
+        stripe_refund_id = Refund.objects.get(pk=refund.pk).stripe_refund_id
+        
+        # A worker that died after Stripe accepted the refund but before saving it
+        Refund.objects.filter(pk=refund.pk).update(status='QUEUED', stripe_refund_id='')
+        Payment.objects.filter(pk=paid_payment.pk).update(refunded_amount=0)
+        replayed = RefundService().execute(refund.id)
+        
+        assert replayed.status == 'SUCCEEDED'
+        assert replayed.stripe_refund_id == stripe_refund_id
+        assert replayed.attempts == 3
+        assert self.server.stats['refunds'] == 1
+        assert Payment.objects.get(pk=paid_payment.pk).refunded_amount == Decimal('2.00')
+        
+        other, _ = RefundService().request_refund(paid_payment, 1)
+        self.server.responses = [(500, None)]
+        assert RefundService(max_attempts=1).execute(other.id).status == 'FAILED'    
+    def test_checkout_prices_payment_with_one_query(self, payment, django_assert_num_queries):
+        """Test that a checkout loads borrowing, book and user once and writes the payment once."""
+        from dataclasses import FrozenInstanceError
+        from payments.models import Payment
+        from payments.pricing import PaymentPricer
+        from payments.services import StripeService
+        service = StripeService()
+        unloaded = Payment.objects.get(pk=payment.pk)
+        
+        with django_assert_num_queries(2):
+            session = service.create_payment_session(unloaded)
+        
+        quote = PaymentPricer().quote_payment(Payment.objects.get(pk=payment.pk))
+        with django_assert_num_queries(1):
+            service.create_payment_session(payment, quote=quote)
+        
+        payment.refresh_from_db()
+        assert quote.amount == payment.book.daily_fee * 5
+        assert payment.money_to_pay == session['amount'] == quote.amount
+        assert self.server.sessions[payment.session_id]['amount_total'] == quote.unit_amount
+        with pytest.raises(FrozenInstanceError):
+            quote.amount = 0
+    
+    def test_fine_quote_and_create_serializer_reuse_quote(self, user, book, rf):
+        """Test fine pricing and that the create serializer rejects borrowings with nothing to pay."""
+        from decimal import Decimal
+        from borrowings.models import Borrowing
+        from payments.pricing import PaymentPricer
+        from payments.serializers import PaymentCreateSerializer
+        overdue = Borrowing.objects.create(
+            user=user,
+            book=book,
+            borrow_date=date.today() - timedelta(days=10),
+            expected_return_date=date.today() - timedelta(days=3)
+        )
+        request = rf.post('/api/payments/')
+        request.user = user
+        
+        quote = PaymentPricer(fine_multiplier=2).quote(overdue, 'FINE')
+        serializer = PaymentCreateSerializer(
+            data={'borrowing': overdue.pk, 'type': 'FINE', 'money_to_pay': '1.00'},
+            context={'request': request}
+        )
+        
+        assert quote.days == 3
+        assert quote.amount == (book.daily_fee * 6).quantize(Decimal('0.01'))
+        assert serializer.is_valid(), serializer.errors
+        assert serializer.validated_data['quote'] == quote
+        
+        Borrowing.objects.filter(pk=overdue.pk).update(expected_return_date=overdue.borrow_date)
+        nothing_due = PaymentCreateSerializer(
+            data={'borrowing': overdue.pk, 'type': 'PAYMENT', 'money_to_pay': '1.00'},
+            context={'request': request}
+        )
+        assert not nothing_due.is_valid()
+
+
+@pytest.mark.django_db
+class TestFineLedger:
+    """Test the daily fine accrual ledger and running balances."""
+    
+    @pytest.fixture
+    def overdue(self, user, book):
+        """Create a borrowing that has been overdue for 3 days."""
+        from borrowings.models import Borrowing
+        return Borrowing.objects.create(
+            user=user,
+            book=book,
+            borrow_date=date.today() - timedelta(days=10),
+            expected_return_date=date.today() - timedelta(days=3)
+        )
+    
+    def test_accrual_catches_up_and_is_idempotent(self, overdue, book):
+        """Test that each overdue day is charged once and tomorrow only adds one day."""
+        from decimal import Decimal
+        from payments.fine_ledger import FineLedger
+        from payments.models import FineAccrual
+        ledger = FineLedger(fine_multiplier=2)
+        daily_fine = (book.daily_fee * 2).quantize(Decimal('0.01'))
+        
+        assert ledger.accrue() == {'days': 3, 'accruals': 3}
+        assert ledger.accrue() == {'days': 0, 'accruals': 0}
+        
+        balance = ledger.get_balance(overdue.pk)
+        assert balance.days == 3
+        assert balance.accrued == daily_fine * 3
+        assert balance.accrued_through == date.today()
+        
+        assert ledger.accrue(through=date.today() + timedelta(days=1)) == {'days': 1, 'accruals': 1}
+        assert ledger.get_balance(overdue.pk).accrued == daily_fine * 4
+        assert FineAccrual.objects.filter(borrowing=overdue).count() == 4
+    
+    def test_returned_borrowing_stops_accruing(self, overdue):
+        """Test that the return day is charged and later days are not."""
+        from borrowings.models import Borrowing
+        from payments.fine_ledger import FineLedger
+        FineLedger().accrue(through=date.today() - timedelta(days=2))
+        Borrowing.objects.filter(pk=overdue.pk).update(actual_return_date=date.today() - timedelta(days=1))
+        
+        FineLedger().accrue(through=date.today() + timedelta(days=2))
+        
+        assert FineLedger().get_balance(overdue.pk).days == 2
+    
+    def test_outstanding_without_ledger_annotation(self, overdue):
+        """Test that a balance loaded without FineLedger.balances still computes what is owed."""
+        from decimal import Decimal
+        from payments.fine_ledger import FineLedger
+        from payments.models import FineBalance, Payment
+        FineLedger().accrue()
+        balance = FineBalance.objects.get(pk=overdue.pk)
+        Payment.objects.create(borrowing=overdue, type='FINE', status='PAID', money_to_pay=Decimal('1.00'))
+        
+        assert balance.outstanding == balance.accrued - Decimal('1.00')
+        assert balance.outstanding == FineLedger().get_balance(overdue.pk).outstanding
+    
+    def test_fines_are_priced_from_one_balance_row(self, overdue, django_assert_num_queries):
+        """Test fine creation, checkout pricing from the balance, payment and waiving."""
+        from borrowings.models import Borrowing
+        from payments.fine_service import FineCalculationService
+        from payments.models import Payment
+        from payments.pricing import PaymentPricer
+        service = FineCalculationService()
+        
+        result = service.process_overdue_books()
+        again = service.process_overdue_books()
+        
+        fine = Payment.objects.get(borrowing=overdue, type='FINE')
+        balance = service.ledger.get_balance(overdue.pk)
+        assert result['created_fines'] == 1
+        assert result['accruals'] == 3
+        assert again['created_fines'] == 0
+        assert fine.money_to_pay == balance.accrued
+        
+        borrowing = Borrowing.objects.select_related('book', 'user').get(pk=overdue.pk)
+        with django_assert_num_queries(1):
+            quote = PaymentPricer().quote(borrowing, 'FINE')
+        assert quote.amount == balance.accrued
+        assert quote.days == 3
+        
+        Payment.objects.filter(pk=fine.pk).update(status='PAID')
+        assert PaymentPricer().quote(borrowing, 'FINE').amount == 0
+        service.ledger.accrue(through=date.today() + timedelta(days=1))
+        assert service.calculate_fine_amount(borrowing) == balance.accrued / 3
+        
+        assert service.waive_fine(borrowing) is True
+        assert service.calculate_fine_amount(borrowing) == 0
+
+
+@pytest.mark.django_db
+class TestFinePolicy:
+    """Test fine policies in Python and as SQL expressions."""
+    
+    def random_policy(self, rng):
+        """Build a flat or tiered policy with optional grace days and cap."""
+        from payments.fine_policy import FinePolicy
+        first_days = sorted(rng.sample(range(2, 15), rng.randint(0, 3)))
+        tiers = [(first_day, rng.randint(0, 400) / 100) for first_day in [1] + first_days]
+        cap = rng.choice([None, rng.randint(1, 5000) / 100])
+        return FinePolicy(tiers, grace_days=rng.choice([0, 0, 1, 3]), cap=cap)
+    
+    def test_sql_expression_matches_python(self, user):
+        """Test that the database computes the same fine as Python for random policies and borrowings."""
+        import random
+        from decimal import Decimal
+        from books.models import Book
+        from borrowings.models import Borrowing
+        # Seeded sampling instead of hypothesis, which is not a dependency
+        rng = random.Random(44)
+        books = Book.objects.bulk_create([
+            Book(title=f'Book {index}', author='Author', inventory=1,
+                 daily_fee=Decimal(rng.randint(1, 2000)) / 100)
+            for index in range(10)
+        ])
+        Borrowing.objects.bulk_create([
+            Borrowing(
+                user=user,
+                book=rng.choice(books),
+                borrow_date=date.today() - timedelta(days=60),
+                expected_return_date=date.today() - timedelta(days=rng.randint(-5, 40))
+            )
+            for _ in range(30)
+        ])
+        
+        for _ in range(20):
+            policy = self.random_policy(rng)
+            rows = Borrowing.objects.select_related('book').annotate(fine=policy.borrowing_expression())
+            for borrowing in rows:
+                expected = policy.calculate(borrowing.book.daily_fee, borrowing.overdue_days)
+                assert Decimal(borrowing.fine).quantize(Decimal('0.01')) == expected, policy.as_dict()
+    
+    def test_ledger_accrues_tiered_capped_fine(self, user, book):
+        """Test that daily accruals add up to the policy's fine, including grace days and the cap."""
+        from borrowings.models import Borrowing
+        from payments.fine_ledger import FineLedger
+        from payments.fine_policy import FinePolicy
+        from payments.models import FineAccrual
+        policy = FinePolicy([(1, 1), (3, '2.5')], grace_days=1, cap=book.daily_fee * 6)
+        ledger = FineLedger(policy)
+        borrowing = Borrowing.objects.create(
+            user=user,
+            book=book,
+            borrow_date=date.today() - timedelta(days=20),
+            expected_return_date=date.today() - timedelta(days=2)
+        )
+        
+        for days in range(2, 8):
+            ledger.accrue(through=borrowing.expected_return_date + timedelta(days=days))
+            balance = ledger.get_balance(borrowing.pk)
+            assert balance.accrued == policy.calculate(book.daily_fee, days)
+            assert balance.days == days
+        assert FineAccrual.objects.filter(borrowing=borrowing, amount=0).exists()
+    
+    def test_invalid_policies_are_rejected(self):
+        """Test validation of tiers, rates and grace days."""
+        from payments.fine_policy import FinePolicy
+        for tiers, options in [
+            ([], {}),
+            ([(2, 1)], {}),
+            ([(1, 1), (1, 2)], {}),
+            ([(1, '1.005')], {}),
+            ([(1, -1)], {}),
+            ([(1, 1)], {'grace_days': -1}),
+        ]:
+            with pytest.raises(ValueError):
+                FinePolicy(tiers, **options)
+    
+    def test_policy_from_settings(self, settings):
+        """Test the flat default and a configured tiered policy."""
+        from decimal import Decimal
+        from payments.fine_policy import FinePolicy
+        settings.FINE_POLICY = None
+        settings.FINE_MULTIPLIER = 2.0
+        assert FinePolicy.from_settings().calculate(Decimal('1.25'), 3) == Decimal('7.50')
+        
+        settings.FINE_POLICY = {'tiers': [[1, 1], [8, 2]], 'grace_days': 2, 'cap': 20}
+        policy = FinePolicy.from_settings()
+        assert policy.calculate(Decimal('1.00'), 2) == 0
+        assert policy.calculate(Decimal('1.00'), 11) == Decimal('11.00')
+        assert policy.calculate(Decimal('1.00'), 30) == Decimal('20.00')
+
+
+@pytest.mark.django_db
+class TestFineSimulator:
+    """Test the vectorized fine policy simulation."""
+    
+    def test_simulation_matches_policy_per_borrowing(self, user, book):
+        """Test revenue, affected users and percentiles against per-borrowing fines."""
+        from decimal import Decimal
+        from django.contrib.auth import get_user_model
+        from borrowings.models import ArchivedBorrowing, Borrowing
+        from payments.fine_policy import FinePolicy
+        from payments.fine_simulation import FineSimulator
+        today = date.today()
+        other = get_user_model().objects.create_user(email='other@example.com', password='pass12345',
+                                                     username='other')
+        Borrowing.objects.bulk_create([
+            # Active and 5 days overdue
+            Borrowing(user=user, book=book, borrow_date=today - timedelta(days=20),
+                      expected_return_date=today - timedelta(days=5)),
+            # Returned 3 days late
+            Borrowing(user=other, book=book, borrow_date=today - timedelta(days=20),
+                      expected_return_date=today - timedelta(days=10),
+                      actual_return_date=today - timedelta(days=7)),
+            # Returned on time and not due yet
+            Borrowing(user=other, book=book, borrow_date=today - timedelta(days=20),
+                      expected_return_date=today - timedelta(days=10),
+                      actual_return_date=today - timedelta(days=12)),
+            Borrowing(user=other, book=book, borrow_date=today, expected_return_date=today + timedelta(days=3)),
+        ])
+        ArchivedBorrowing.objects.create(
+            id=10 ** 9, user=user, book_id=book.id, book_title=book.title, book_author=book.author,
+            borrow_date=today - timedelta(days=2000), expected_return_date=today - timedelta(days=1990),
+            actual_return_date=today - timedelta(days=1980)
+        )
+        tiered = FinePolicy([(1, 1), (4, 3)], grace_days=3, cap=book.daily_fee * 10)
+        
+        result = FineSimulator({'tiered': tiered}, chunk_size=2).run()
+        
+        assert result['rows'] == 3
+        for name, policy in [('current', FinePolicy.from_settings()), ('tiered', tiered)]:
+            fines = [policy.calculate(book.daily_fee, days) for days in (5, 3, 10)]
+            summary = result['policies'][name]
+            assert summary['revenue'] == sum(fines)
+            assert summary['fined_borrowings'] == sum(1 for fine in fines if fine > 0)
+            assert summary['percentiles'][99] <= max(fines)
+        assert result['policies']['current']['affected_users'] == 2
+        assert result['policies']['tiered']['affected_users'] == 1
+        assert result['policies']['tiered']['revenue_change'] == (
+            result['policies']['tiered']['revenue'] - result['policies']['current']['revenue']
+        )
+        assert FineSimulator(include_archive=False).run()['rows'] == 2
+        assert FineSimulator(as_of=today - timedelta(days=6)).run()['rows'] == 2
+        assert result['policies']['current']['mean_fine'] == (sum(
+            FinePolicy.from_settings().calculate(book.daily_fee, days) for days in (5, 3, 10)
+        ) / 3).quantize(Decimal('0.01'))
+    
+    def test_simulate_fines_command(self, borrowing):
+        """Test the command with flat and JSON policies, and invalid input."""
+        import json
+        from io import StringIO
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        out = StringIO()
+        
+        call_command(
+            'simulate_fines',
+            '--multiplier', '3',
+            '--policy', '{"name": "capped", "tiers": [[1, 1]], "cap": 5}',
+            '--json',
+            stdout=out
+        )
+        
+        assert set(json.loads(out.getvalue())['policies']) == {'current', 'flat x3', 'capped'}
+        with pytest.raises(CommandError):
+            call_command('simulate_fines', '--policy', '{"tiers": []}', stdout=StringIO())
+
+
+@pytest.mark.django_db
+class TestFineStatistics:
+    """Test the fine statistics query and its cache."""
+    
+    @pytest.fixture(autouse=True)
+    def clear_cache(self):
+        """Start every test with an empty cache."""
+        from django.core.cache import cache
+        cache.clear()
+        yield
+        cache.clear()
+    
+    def test_statistics_from_one_payment_query(self, borrowing, django_assert_num_queries):
+        """Test today's counts from created/paid timestamps and net revenue."""
+        from datetime import datetime
+        from decimal import Decimal
+        from django.utils import timezone
+        from payments.fine_service import FineCalculationService
+        from payments.models import Payment
+        yesterday = timezone.now() - timedelta(days=1)
+        Payment.objects.create(borrowing=borrowing, type='FINE', money_to_pay=Decimal('4.00'))
+        paid = Payment.objects.create(borrowing=borrowing, type='FINE', money_to_pay=Decimal('6.00'), status='PAID')
+        Payment.objects.create(
+            borrowing=borrowing, type='FINE', money_to_pay=Decimal('10.00'), status='PAID',
+            refunded_amount=Decimal('3.00'), created_at=yesterday, paid_at=yesterday
+        )
+        Payment.objects.create(borrowing=borrowing, type='PAYMENT', money_to_pay=Decimal('99.00'), status='PAID')
+        
+        with django_assert_num_queries(3):
+            statistics = FineCalculationService().get_fine_statistics()
+        
+        assert paid.paid_at is not None
+        assert statistics['fines_today'] == 2
+        assert statistics['fines_paid_today'] == 1
+        assert statistics['pending_fines'] == 1
+        assert statistics['paid_fines'] == 2
+        assert statistics['total_fine_revenue'] == Decimal('13.00')
+        assert statistics['fine_revenue_today'] == Decimal('6.00')
+        assert isinstance(statistics['generated_at'], datetime)
+    
+    def test_cache_recomputes_once_and_serves_stale_during_refresh(self):
+        """Test that an expired value is recomputed by one caller while others get the stale copy."""
+        from django.core.cache import cache
+        from library_service.cache import get_or_refresh
+        calls = []
+        
+        def compute():
+            calls.append(1)
+            return len(calls)
+        
+        assert get_or_refresh('stats', compute, timeout=30) == 1
+        assert get_or_refresh('stats', compute, timeout=30) == 1
+        
+        # Stale while another worker holds the refresh lock
+        cache.set('stats', (1, 0), timeout=60)
+        cache.add('stats:refresh', 1)
+        assert get_or_refresh('stats', compute, timeout=30) == 1
+        cache.delete('stats:refresh')
+        assert get_or_refresh('stats', compute, timeout=30) == 2
+        assert len(calls) == 2
+        assert get_or_refresh('stats', compute, timeout=0) == 3
+    
+    def test_statistics_view_is_cached(self, user, django_assert_num_queries):
+        """Test that repeated dashboard polls are answered from the cache."""
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from payments.fine_views import FineStatisticsView
+        user.is_staff = True
+        user.save()
+        
+        def get():
+            request = APIRequestFactory().get('/api/payments/fines/statistics/')
+            force_authenticate(request, user=user)
+            return FineStatisticsView.as_view()(request)
+        
+        first = get()
+        with django_assert_num_queries(0):
+            second = get()
+        
+        assert first.status_code == 200
+        assert second.data == first.data
+
+
+@pytest.mark.django_db
+class TestBulkFineWaiver:
+    """Test waiving fines and expiring payments in bulk."""
+    
+    @pytest.fixture(autouse=True)
+    def telegram(self, settings, monkeypatch):
+        """Record Telegram messages instead of sending them."""
+        from notifications.services import TelegramNotificationService
+        settings.TELEGRAM_BOT_TOKEN = 'test-token'
+        settings.TELEGRAM_CHAT_ID = '1'
+        self.sent = []
+        monkeypatch.setattr(
+            TelegramNotificationService,
+            'send_message',
+            lambda service, message, priority='default': self.sent.append(message) or True
+        )
+    
+    def overdue_fines(self, user, count):
+        """Create overdue borrowings with accrued balances and PENDING fines."""
+        from books.models import Book
+        from borrowings.models import Borrowing
+        from payments.fine_service import FineCalculationService
+        book = Book.objects.create(title='Dune', author='Herbert', cover='HARD', inventory=count, daily_fee=1)
+        borrowings = [
+            Borrowing.objects.create(
+                user=user,
+                book=book,
+                borrow_date=date.today() - timedelta(days=10),
+                expected_return_date=date.today() - timedelta(days=3)
+            )
+            for _ in range(count)
+        ]
+        FineCalculationService().process_overdue_books()
+        self.sent.clear()
+        return borrowings
+    
+    def test_bulk_waive_api(self, user, django_capture_on_commit_callbacks):
+        """Test that the API waives every listed fine, audits it and sends one notification."""
+        from django.contrib.admin.models import LogEntry
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from payments.fine_ledger import FineLedger
+        from payments.fine_views import BulkWaiveFineView
+        from payments.models import Payment
+        borrowings = self.overdue_fines(user, 3)
+        user.is_staff = True
+        user.save()
+        
+        def post(data):
+            request = APIRequestFactory().post('/api/payments/fines/waive/bulk/', data, format='json')
+            force_authenticate(request, user=user)
+            return BulkWaiveFineView.as_view()(request)
+        
+        with django_capture_on_commit_callbacks(execute=True):
+            response = post({'borrowing_ids': [borrowing.id for borrowing in borrowings] + [999999]})
+        
+        assert response.status_code == 200
+        assert response.data['waived'] == 3
+        assert response.data['borrowing_ids'] == sorted(borrowing.id for borrowing in borrowings)
+        assert len(response.data['expired_payment_ids']) == 3
+        assert not Payment.objects.filter(type='FINE', status='PENDING').exists()
+        assert all(FineLedger().get_balance(borrowing.id).outstanding == 0 for borrowing in borrowings)
+        assert LogEntry.objects.filter(user=user, change_message='Waived fine: Admin decision').count() == 3
+        assert len(self.sent) == 1
+        assert 'Fines Waived' in self.sent[0]
+        assert post({'borrowing_ids': []}).status_code == 400
+        assert post({'borrowing_ids': ['x']}).status_code == 400
+    
+    def test_bulk_waive_query_count_does_not_grow(self, user):
+        """Test that waiving many fines costs the same statements as waiving a few."""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from payments.fine_service import FineCalculationService
+        borrowings = self.overdue_fines(user, 6)
+        service = FineCalculationService()
+        
+        with CaptureQueriesContext(connection) as few:
+            assert service.waive_fines([borrowing.id for borrowing in borrowings[:2]])['waived'] == 2
+        with CaptureQueriesContext(connection) as many:
+            assert service.waive_fines([borrowing.id for borrowing in borrowings[2:]])['waived'] == 4
+        
+        assert len(many.captured_queries) == len(few.captured_queries)
+    
+    def test_expire_payments(self, borrowing, user, django_capture_on_commit_callbacks):
+        """Test that only PENDING payments are expired, in one notification."""
+        from decimal import Decimal
+        from payments.models import Payment
+        from payments.services import PaymentExpiryService
+        pending = [
+            Payment.objects.create(borrowing=borrowing, money_to_pay=Decimal('2.50')),
+            Payment.objects.create(borrowing=borrowing, type='FINE', money_to_pay=Decimal('4.00')),
+        ]
+        paid = Payment.objects.create(borrowing=borrowing, money_to_pay=Decimal('1.00'), status='PAID')
+        self.sent.clear()
+        
+        with django_capture_on_commit_callbacks(execute=True):
+            expired = PaymentExpiryService().expire(Payment.objects.all(), user=user)
+        
+        assert sorted(expired) == sorted(payment.id for payment in pending)
+        assert set(Payment.objects.filter(pk__in=expired).values_list('status', flat=True)) == {'EXPIRED'}
+        paid.refresh_from_db()
+        assert paid.status == 'PAID'
+        assert len(self.sent) == 1
+        assert '$6.50' in self.sent[0]
+    
+    def test_update_returning_without_returning_support(self, borrowing, monkeypatch):
+        """Test the locked read + update fallback for databases without UPDATE ... RETURNING."""
+        from decimal import Decimal
+        from django.db import connection
+        from library_service.bulk import update_returning
+        from payments.models import Payment
+        payment = Payment.objects.create(borrowing=borrowing, money_to_pay=Decimal('2.50'))
+        # MariaDB can return columns from INSERT but not from UPDATE
+        monkeypatch.setattr(connection, 'vendor', 'mysql')
+        monkeypatch.setattr(connection.features, 'can_return_columns_from_insert', True)
+        
+        rows = update_returning(Payment.objects.filter(status='PENDING'), ['id', 'money_to_pay'], status='EXPIRED')
+        
+        assert rows == [(payment.id, Decimal('2.50'))]
+        assert Payment.objects.get(pk=payment.pk).status == 'EXPIRED'
+    
+    def test_update_returning_needs_sqlite_3_35(self, monkeypatch):
+        """Test that only PostgreSQL and SQLite 3.35+ are sent UPDATE ... RETURNING."""
+        from django.db import connection
+        from library_service.bulk import supports_update_returning
+        
+        monkeypatch.setattr(connection.Database, 'sqlite_version_info', (3, 34, 1))
+        assert not supports_update_returning(connection)
+        monkeypatch.setattr(connection.Database, 'sqlite_version_info', (3, 35, 0))
+        assert supports_update_returning(connection)
+        monkeypatch.setattr(connection, 'vendor', 'postgresql')
+        assert supports_update_returning(connection)
\ No newline at end of file
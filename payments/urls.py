@@ -17,5 +17,6 @@ urlpatterns = [
     path('fines/process/', fine_views.ProcessFinesView.as_view(), name='process-fines'),
     path('fines/statistics/', fine_views.FineStatisticsView.as_view(), name='fine-statistics'),
     path('fines/waive/', fine_views.WaiveFineView.as_view(), name='waive-fine'),
+    path('fines/waive/bulk/', fine_views.BulkWaiveFineView.as_view(), name='bulk-waive-fines'),
     path('fines/my/', fine_views.UserFinesView.as_view(), name='user-fines'),
 ]
\ No newline at end of file
@@ -7,10 +7,27 @@ from .models import Payment
 from .serializers import (
     PaymentListSerializer, 
     PaymentDetailSerializer, 
-    PaymentCreateSerializer
+    PaymentCreateSerializer,
+    RefundSerializer
 )
 from .permissions import PaymentPermissions, PaymentCreatePermissions
-from .services import StripeService
+from .services import (
+    IdempotencyKeyConflict,
+    PaymentInitiationService,
+    RefundNotAllowed,
+    RefundService,
+    StripeService
+)
+from .stripe_client import CircuitOpenError
+
+
+def stripe_unavailable_response(error: CircuitOpenError) -> Response:
+    """Answer 503 while the Stripe circuit breaker is open."""
+    return Response(
+        {'error': 'Payment provider is temporarily unavailable, please retry later'},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={'Retry-After': str(max(int(error.retry_after), 1))}
+    )
 
 
 class PaymentListView(generics.ListCreateAPIView):
@@ -47,42 +64,56 @@ class PaymentListView(generics.ListCreateAPIView):
         return context
     
     def create(self, request, *args, **kwargs):
-        """Create payment and initialize Stripe session."""
+        """
+        Start a payment, reusing an open checkout session where possible.
+        
+        A repeated ``Idempotency-Key`` header, or a pending payment of the
+        same type with a live session, returns that payment (200) instead of
+        creating another one at Stripe (201).
+        """
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         
-        # Create payment instance
-        payment = serializer.save()
+        idempotency_key = request.headers.get('Idempotency-Key', '').strip()
+        if len(idempotency_key) > 255:
+            return Response(
+                {'error': 'Idempotency-Key must be at most 255 characters'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
         try:
-            # Initialize Stripe service
-            stripe_service = StripeService()
-            
-            # Create payment session
-            session_data = stripe_service.create_payment_session(payment)
-            
-            return Response({
-                'message': 'Payment session created successfully',
-                'payment': PaymentDetailSerializer(payment).data,
-                'stripe_session': {
-                    'session_id': session_data['session_id'],
-                    'session_url': session_data['session_url'],
-                    'amount': session_data['amount']
-                }
-            }, status=status.HTTP_201_CREATED)
-            
+            payment, created = PaymentInitiationService().initiate(
+                serializer.validated_data['borrowing'],
+                serializer.validated_data.get('type', 'PAYMENT'),
+                serializer.validated_data['money_to_pay'],
+                idempotency_key=idempotency_key,
+                quote=serializer.validated_data['quote']
+            )
+        except IdempotencyKeyConflict as e:
+            return Response({'error': str(e)}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        except CircuitOpenError as e:
+            return stripe_unavailable_response(e)
         except Exception as e:
-            # Delete payment if Stripe session creation fails
-            payment.delete()
             return Response({
                 'error': f'Failed to create payment session: {str(e)}'
             }, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({
+            'message': 'Payment session created successfully' if created else 'Existing payment session returned',
+            'payment': PaymentDetailSerializer(payment).data,
+            'stripe_session': {
+                'session_id': payment.session_id,
+                'session_url': payment.session_url,
+                'amount': payment.money_to_pay,
+                'expires_at': payment.session_expires_at,
+            }
+        }, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
 
 
 class PaymentDetailView(generics.RetrieveAPIView):
     """View for retrieving payment details."""
     
-    queryset = Payment.objects.all()
+    queryset = Payment.objects.prefetch_related('refunds')
     serializer_class = PaymentDetailSerializer
     permission_classes = [PaymentPermissions]
 
@@ -125,12 +156,14 @@ class PaymentSuccessView(generics.GenericAPIView):
                     {"error": "Payment verification failed"},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-                
+        
         except Payment.DoesNotExist:
             return Response(
                 {"error": "Payment not found"},
                 status=status.HTTP_404_NOT_FOUND
             )
+        except CircuitOpenError as e:
+            return stripe_unavailable_response(e)
         except Exception as e:
             return Response(
                 {"error": f"Payment verification error: {str(e)}"},
@@ -155,42 +188,48 @@ class PaymentCancelView(generics.GenericAPIView):
 
 
 class PaymentRefundView(generics.GenericAPIView):
-    """View for creating refunds."""
+    """View for queueing refunds."""
     
     permission_classes = [permissions.IsAdminUser]
     
     def post(self, request, *args, **kwargs):
-        """Create a refund for a payment."""
+        """
+        Queue a refund for a payment.
+        
+        The refund is recorded and executed at Stripe in the background
+        (202). A repeated ``Idempotency-Key`` header returns the refund it
+        created (200).
+        """
         payment_id = kwargs.get('pk')
         
         try:
             payment = Payment.objects.get(id=payment_id)
-            
-            if payment.status != 'PAID':
-                return Response(
-                    {"error": "Only paid payments can be refunded"},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            # Get refund amount from request
-            amount = request.data.get('amount')
-            
-            # Create refund
-            stripe_service = StripeService()
-            refund_data = stripe_service.create_refund(payment, amount)
-            
-            return Response({
-                "message": "Refund created successfully",
-                "refund": refund_data
-            }, status=status.HTTP_200_OK)
-            
         except Payment.DoesNotExist:
             return Response(
                 {"error": "Payment not found"},
                 status=status.HTTP_404_NOT_FOUND
             )
-        except Exception as e:
+        
+        idempotency_key = request.headers.get('Idempotency-Key', '').strip()
+        if len(idempotency_key) > 255:
             return Response(
-                {"error": f"Refund creation failed: {str(e)}"},
+                {'error': 'Idempotency-Key must be at most 255 characters'},
                 status=status.HTTP_400_BAD_REQUEST
-            )
\ No newline at end of file
+            )
+        
+        try:
+            refund, created = RefundService().request_refund(
+                payment,
+                request.data.get('amount'),
+                requested_by=request.user,
+                idempotency_key=idempotency_key
+            )
+        except IdempotencyKeyConflict as e:
+            return Response({'error': str(e)}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        except RefundNotAllowed as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({
+            "message": "Refund queued" if created else "Existing refund returned",
+            "refund": RefundSerializer(refund).data
+        }, status=status.HTTP_202_ACCEPTED if created else status.HTTP_200_OK)
\ No newline at end of file
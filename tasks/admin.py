@@ -0,0 +1,27 @@
+from django.contrib import admin
+from .models import BatchJobChunk, BatchJobRun
+
+
+class BatchJobChunkInline(admin.TabularInline):
+    """Read-only chunk timings of a run."""
+    
+    model = BatchJobChunk
+    fields = ('first_id', 'last_id', 'rows', 'processed', 'duration_ms', 'created_at')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+
+@admin.register(BatchJobRun)
+class BatchJobRunAdmin(admin.ModelAdmin):
+    """Admin configuration for BatchJobRun model."""
+    
+    list_display = ('job', 'run_key', 'status', 'shard_count', 'processed', 'chunks', 'attempts', 'started_at', 'finished_at')
+    list_filter = ('job', 'status')
+    search_fields = ('job', 'run_key')
+    ordering = ('-started_at',)
+    readonly_fields = (
+        'job', 'run_key', 'status', 'parent', 'shard_count', 'min_id', 'max_id', 'last_id', 'processed', 'chunks',
+        'attempts', 'error', 'started_at', 'updated_at', 'finished_at'
+    )
+    inlines = [BatchJobChunkInline]
\ No newline at end of file
@@ -3,4 +3,8 @@ from django.apps import AppConfig
 
 class TasksConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'tasks'
\ No newline at end of file
+    name = 'tasks'
+    
+    def ready(self):
+        """Import signals when app is ready."""
+        import tasks.signals
\ No newline at end of file
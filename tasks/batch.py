@@ -0,0 +1,374 @@
+import logging
+import time
+from datetime import date, timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max, Min, Q, Sum
+from django.utils import timezone
+from django_q.tasks import async_task
+from .locks import LockLost, current_lock
+from .models import BatchJobChunk, BatchJobRun
+
+logger = logging.getLogger(__name__)
+
+
+def split_id_range(first_id: int, last_id: int, shards: int) -> list:
+    """
+    Split the inclusive range ``first_id``-``last_id`` into contiguous ranges of near-equal width.
+    
+    Returns:
+        list: ``(min_id, max_id)`` pairs, at most ``shards`` and never empty
+    """
+    width = last_id - first_id + 1
+    shards = max(1, min(shards, width))
+    step, extra = divmod(width, shards)
+    ranges = []
+    start = first_id
+    for index in range(shards):
+        end = start + step + (1 if index < extra else 0) - 1
+        ranges.append((start, end))
+        start = end + 1
+    return ranges
+
+
+class BatchJob:
+    """
+    Resumable job that walks a queryset in primary key order, one chunk at a time.
+    
+    A run is identified by the job ``name`` and a ``run_key``, the ISO date
+    the run is for (today by default), and its progress is kept in a
+    ``BatchJobRun``. Rows are read with keyset pagination (``pk > last_id``)
+    and each chunk is processed in its own transaction together with the
+    checkpoint update, so a run killed by a crash or the Django-Q timeout
+    resumes after its last committed chunk and never repeats one.
+    
+    The duration of every chunk is recorded. An invocation stops before a
+    chunk that would not fit in ``BATCH_JOB_TIME_BUDGET`` and re-queues its
+    ``task`` to carry on from the checkpoint, so no invocation runs into
+    the worker timeout however large the run is. Runs abandoned by a
+    killed worker are picked up again by ``resume_stale``. When the task
+    holds a ``TaskLock`` its lease is renewed before every chunk, and the
+    invocation stops if another run has taken it over.
+    
+    ``fan_out`` splits a run over the ``key`` range into shard runs, one
+    Django-Q task each, so every worker of the cluster takes a share; the
+    shard that completes last adds up the totals (see ``reduce``).
+    
+    Subclasses set ``name`` and ``task`` (dotted path of a task function
+    taking the run key) and implement ``get_queryset`` and ``process_chunk``.
+    ``key`` is the unique integer column rows are ordered, paginated and
+    sharded by.
+    """
+    
+    name = None
+    task = None
+    key = 'pk'
+    registry = {}
+    
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.name:
+            BatchJob.registry[cls.name] = cls
+    
+    def __init__(self, run_key: str = None, chunk_size: int = None, time_budget: float = None,
+                 clock=time.monotonic):
+        self.run_key = run_key or date.today().isoformat()
+        self.chunk_size = chunk_size or getattr(settings, 'BATCH_JOB_CHUNK_SIZE', 500)
+        self.time_budget = time_budget if time_budget is not None else getattr(settings, 'BATCH_JOB_TIME_BUDGET', 45)
+        self.clock = clock
+    
+    @property
+    def as_of(self) -> date:
+        """Day the run is for, so a resumed run selects the same rows as the original one."""
+        # Shard keys append ':<shard>/<count>' to the date
+        return date.fromisoformat(self.run_key[:10])
+    
+    def setup(self):
+        """Run before the first chunk of every invocation; must be safe to repeat."""
+    
+    def get_queryset(self):
+        """Rows to process; they are ordered and filtered by ``key`` here."""
+        raise NotImplementedError
+    
+    def process_chunk(self, rows: list) -> int:
+        """
+        Process one chunk inside the chunk transaction.
+        
+        Args:
+            rows: Up to ``chunk_size`` rows in ``key`` order
+        
+        Returns:
+            int: Number of rows that were acted on
+        """
+        raise NotImplementedError
+    
+    def run(self) -> dict:
+        """
+        Process chunks until the run completes or the time budget is spent.
+        
+        Returns:
+            dict: Run status, progress and what this invocation did
+        """
+        run, _ = BatchJobRun.objects.get_or_create(job=self.name, run_key=self.run_key)
+        result = {'job': self.name, 'run_key': self.run_key, 'chunks': 0, 'rows': 0, 'requeued': False}
+        if run.status == 'COMPLETED' or run.shard_count:
+            # Fanned-out runs are processed by their shards
+            return self.summary(run, result)
+        
+        BatchJobRun.objects.filter(pk=run.pk).update(
+            status='RUNNING', attempts=F('attempts') + 1, error='', updated_at=timezone.now()
+        )
+        started = self.clock()
+        slowest = 0.0
+        lock = current_lock()
+        # Kept after the lease is lost: checkpoints written with it are refused once a successor wrote one
+        token = lock.token if lock is not None else None
+        try:
+            if run.parent_id is None:
+                # Shards rely on the setup done by fan_out
+                self.setup()
+            while True:
+                if result['chunks'] and self.clock() - started + slowest > self.time_budget:
+                    if lock is not None:
+                        # Let the continuation take the lock as soon as it starts
+                        lock.release()
+                    result['requeued'] = self.requeue()
+                    break
+                if lock is not None and not lock.extend():
+                    result['lock_lost'] = True
+                    break
+                chunk_started = self.clock()
+                rows, done = self.run_chunk(run.pk, token)
+                slowest = max(slowest, self.clock() - chunk_started)
+                result['chunks'] += 1 if rows else 0
+                result['rows'] += rows
+                if done:
+                    break
+        except LockLost:
+            logger.warning(f"Batch job {self.name} {self.run_key} stopped: a newer run holds its lock")
+            result['lock_lost'] = True
+        except Exception as e:
+            BatchJobRun.objects.filter(pk=run.pk).update(status='FAILED', error=str(e), updated_at=timezone.now())
+            logger.error(f"Batch job {self.name} {self.run_key} failed: {str(e)}")
+            raise
+        
+        run.refresh_from_db()
+        if run.status == 'COMPLETED' and run.parent_id is not None:
+            result['fan_in'] = self.reduce(run.parent_id)
+        return self.summary(run, result)
+    
+    def run_chunk(self, run_id: int, token: int = None) -> tuple:
+        """
+        Process the chunk after the checkpoint and advance the checkpoint, in one transaction.
+        
+        Args:
+            run_id: BatchJobRun to advance
+            token: Fencing token of the task lock this invocation holds, if any
+        
+        Returns:
+            tuple: Rows read and whether the run is complete
+        
+        Raises:
+            LockLost: A run with a newer token has already written a checkpoint
+        """
+        with transaction.atomic():
+            # Writing the run row first locks it, so concurrent invocations take turns
+            runs = BatchJobRun.objects.filter(pk=run_id)
+            if token is None:
+                runs.update(updated_at=timezone.now())
+            elif not runs.filter(lock_token__lte=token).update(lock_token=token, updated_at=timezone.now()):
+                raise LockLost(f"Batch job run {run_id} was checkpointed by a newer lock holder")
+            run = BatchJobRun.objects.get(pk=run_id)
+            if run.status == 'COMPLETED':
+                return 0, True
+            
+            chunk_started = self.clock()
+            queryset = self.get_queryset().order_by(self.key)
+            if run.min_id is not None:
+                queryset = queryset.filter(**{f'{self.key}__gte': run.min_id, f'{self.key}__lte': run.max_id})
+            if run.last_id is not None:
+                queryset = queryset.filter(**{f'{self.key}__gt': run.last_id})
+            rows = list(queryset[:self.chunk_size])
+            processed = self.process_chunk(rows) if rows else 0
+            done = len(rows) < self.chunk_size
+            
+            updates = {'updated_at': timezone.now()}
+            if rows:
+                BatchJobChunk.objects.create(
+                    run_id=run_id,
+                    first_id=getattr(rows[0], self.key),
+                    last_id=getattr(rows[-1], self.key),
+                    rows=len(rows),
+                    processed=processed,
+                    duration_ms=int((self.clock() - chunk_started) * 1000)
+                )
+                updates.update(
+                    last_id=getattr(rows[-1], self.key),
+                    processed=F('processed') + processed,
+                    chunks=F('chunks') + 1
+                )
+            if done:
+                updates.update(status='COMPLETED', finished_at=timezone.now())
+            BatchJobRun.objects.filter(pk=run_id).update(**updates)
+        return len(rows), done
+    
+    def requeue(self) -> bool:
+        """Queue the task to continue this run; if the broker is down ``resume_stale`` picks it up."""
+        return self.enqueue(self.run_key)
+    
+    def enqueue(self, run_key: str) -> bool:
+        try:
+            async_task(self.task, run_key)
+            return True
+        except Exception as e:
+            logger.warning(f"Failed to queue batch job {self.name} {run_key}: {str(e)}")
+            return False
+    
+    def start(self, shards: int = 1) -> dict:
+        """
+        Run the job here, or fan it out over ``shards`` workers.
+        
+        Shard runs and runs that were started unsharded always continue
+        here, so a re-queued invocation never fans out twice.
+        
+        Returns:
+            dict: Summary from ``run`` or ``fan_out``
+        """
+        run = BatchJobRun.objects.filter(job=self.name, run_key=self.run_key).first()
+        if shards > 1 and (run is None or run.shard_count):
+            return self.fan_out(shards)
+        return self.run()
+    
+    def fan_out(self, shards: int, id_range: tuple = None, enqueue=None) -> dict:
+        """
+        Split the run into shard runs over the ``key`` range and queue one task per shard.
+        
+        Args:
+            shards: Number of shards, usually the number of Django-Q workers
+            id_range: Inclusive ``(min_id, max_id)`` to split instead of the queryset's range
+            enqueue: Callable taking a shard run key (default: queue ``task`` in Django-Q)
+        
+        Returns:
+            dict: Parent run summary with the number of shards queued
+        """
+        enqueue = enqueue or self.enqueue
+        with transaction.atomic():
+            parent, created = BatchJobRun.objects.get_or_create(
+                job=self.name,
+                run_key=self.run_key,
+                defaults={'shard_count': shards}
+            )
+            if not created:
+                # Already fanned out: the shards carry on by themselves
+                return {**self.summary(parent, {'job': self.name, 'run_key': self.run_key}), 'queued': 0}
+            
+            self.setup()
+            if id_range is None:
+                bounds = self.get_queryset().aggregate(first=Min(self.key), last=Max(self.key))
+                id_range = (bounds['first'], bounds['last'])
+            if id_range[0] is None:
+                parent.status = 'COMPLETED'
+                parent.shard_count = 0
+                parent.finished_at = timezone.now()
+                parent.save()
+                return {**self.summary(parent, {'job': self.name, 'run_key': self.run_key}), 'queued': 0}
+            
+            ranges = split_id_range(id_range[0], id_range[1], shards)
+            parent.shard_count = len(ranges)
+            parent.save(update_fields=['shard_count'])
+            shard_runs = BatchJobRun.objects.bulk_create([
+                BatchJobRun(
+                    job=self.name,
+                    run_key=f'{self.run_key}:{index}/{len(ranges)}',
+                    parent=parent,
+                    min_id=min_id,
+                    max_id=max_id
+                )
+                for index, (min_id, max_id) in enumerate(ranges, 1)
+            ])
+        
+        # Queued after commit so no worker looks for a shard that does not exist yet
+        queued = sum(1 for shard in shard_runs if enqueue(shard.run_key))
+        return {**self.summary(parent, {'job': self.name, 'run_key': self.run_key}), 'queued': queued}
+    
+    def reduce(self, parent_id: int) -> dict:
+        """
+        Complete a fanned-out run with the totals of its shards once every shard has completed.
+        
+        Returns:
+            dict: Aggregated summary, or None if shards are still running or another shard reduced
+        """
+        with transaction.atomic():
+            # Locks the parent, so only one finishing shard reduces
+            BatchJobRun.objects.filter(pk=parent_id).update(updated_at=timezone.now())
+            parent = BatchJobRun.objects.get(pk=parent_id)
+            if parent.status == 'COMPLETED' or parent.shards.exclude(status='COMPLETED').exists():
+                return None
+            
+            totals = parent.shards.aggregate(
+                processed=Sum('processed'),
+                chunks=Sum('chunks'),
+                attempts=Sum('attempts'),
+                last_finished=Max('finished_at')
+            )
+            parent.status = 'COMPLETED'
+            parent.processed = totals['processed'] or 0
+            parent.chunks = totals['chunks'] or 0
+            parent.finished_at = timezone.now()
+            parent.save()
+        
+        summary = {
+            'job': parent.job,
+            'run_key': parent.run_key,
+            'shards': parent.shard_count,
+            'processed': parent.processed,
+            'chunks': parent.chunks,
+            'shard_attempts': totals['attempts'] or 0,
+            'elapsed': (totals['last_finished'] - parent.started_at).total_seconds(),
+        }
+        logger.info(f"Batch job {parent.job} {parent.run_key} completed: {summary}")
+        return summary
+    
+    @staticmethod
+    def summary(run: BatchJobRun, result: dict) -> dict:
+        return {
+            **result,
+            'status': run.status,
+            'processed': run.processed,
+            'total_chunks': run.chunks,
+            'last_id': run.last_id,
+        }
+    
+    @classmethod
+    def resume_stale(cls) -> list:
+        """
+        Re-queue runs whose worker died, and failed runs that have attempts left.
+        
+        A run counts as abandoned once it has not committed a chunk for
+        ``BATCH_JOB_STALE_AFTER`` seconds, which is longer than the worker
+        timeout. Failed runs are retried after the same delay, at most
+        ``BATCH_JOB_MAX_ATTEMPTS`` times in total. Fanned-out parents are
+        not re-queued themselves; their shards are, and a parent whose
+        shards all completed is reduced here in case its last shard died
+        before reducing it.
+        
+        Returns:
+            list: Re-queued runs
+        """
+        stale_after = getattr(settings, 'BATCH_JOB_STALE_AFTER', 120)
+        max_attempts = getattr(settings, 'BATCH_JOB_MAX_ATTEMPTS', 3)
+        runs = BatchJobRun.objects.filter(
+            Q(status='RUNNING') | Q(status='FAILED', attempts__lt=max_attempts),
+            job__in=list(cls.registry),
+            updated_at__lt=timezone.now() - timedelta(seconds=stale_after)
+        )
+        for parent in runs.filter(shard_count__gt=0):
+            cls.registry[parent.job](parent.run_key).reduce(parent.pk)
+        
+        resumed = []
+        for run in runs.filter(shard_count=0):
+            # Touch the run so the next sweep leaves it to this attempt
+            claimed = BatchJobRun.objects.filter(pk=run.pk, updated_at=run.updated_at).update(updated_at=timezone.now())
+            if claimed and cls.registry[run.job](run.run_key).requeue():
+                resumed.append(run)
+        return resumed
\ No newline at end of file
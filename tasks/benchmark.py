@@ -0,0 +1,493 @@
+import statistics
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+import httpx
+from django.contrib.auth import get_user_model
+from django.db import DatabaseError, connection, connections, transaction
+from django.test.utils import override_settings
+from books.models import Book
+from borrowings.models import ArchivedBorrowing, Borrowing
+from borrowings.services import BorrowingArchiveService
+from library_service.fakes import FakeStripeServer, FakeTelegramServer
+from notifications.models import OutboundMessage, OverdueNotificationState
+from notifications.outbound import OutboundTelegramSender, get_token_bucket
+from payments.models import FineBalance, Payment
+from payments.services import PaymentInitiationService, StripeService
+from payments.stripe_client import get_stripe_client
+from .jobs import FineJob, OverdueAlertJob
+from .models import BatchJobChunk, BatchJobRun
+
+User = get_user_model()
+
+
+class CheckoutBenchmark:
+    """
+    End-to-end borrow -> pay -> notify benchmark against the fake APIs.
+    
+    Each worker thread borrows a book, opens a Stripe checkout session,
+    pays it through the fake checkout page and verifies it, with the
+    Telegram notifications of every step going through the normal signal
+    and outbound queue path. Whatever the rate limiter held back is
+    drained at the end. Benchmark users, books and messages are deleted
+    afterwards unless ``keep`` is set.
+    """
+    
+    stages = ['borrow', 'checkout', 'verify', 'flow']
+    
+    def __init__(self, iterations: int = 100, concurrency: int = 1, stripe_url: str = None,
+                 telegram_url: str = None, telegram_rate: float = None, drain_timeout: float = 60,
+                 keep: bool = False, **faults):
+        self.iterations = iterations
+        self.concurrency = max(1, min(concurrency, iterations))
+        self.stripe_url = stripe_url
+        self.telegram_url = telegram_url
+        self.telegram_rate = telegram_rate
+        self.drain_timeout = drain_timeout
+        self.keep = keep
+        self.faults = faults
+        self.run_id = uuid.uuid4().hex[:8]
+        self.timings = defaultdict(list)
+        self.failures = defaultdict(int)
+        self.lock = threading.Lock()
+    
+    def record(self, stage: str, started: float) -> float:
+        now = time.perf_counter()
+        with self.lock:
+            self.timings[stage].append(now - started)
+        return now
+    
+    def fail(self, stage: str):
+        with self.lock:
+            self.failures[stage] += 1
+    
+    def create_fixtures(self, worker: int):
+        username = f'benchmark-{self.run_id}-{worker}'
+        user = User.objects.create_user(username=username, email=f'{username}@example.com', password='benchmark')
+        book = Book.objects.create(
+            title=f'Benchmark {self.run_id} #{worker}',
+            author='Benchmark',
+            cover='SOFT',
+            inventory=self.iterations,
+            daily_fee=1
+        )
+        return user, book
+    
+    def run_flow(self, user, book, client):
+        """Borrow, pay and verify once; notifications are sent by the signals."""
+        started = time.perf_counter()
+        try:
+            borrowing = Borrowing.objects.create(
+                user=user,
+                book=book,
+                expected_return_date=date.today() + timedelta(days=7)
+            )
+        except Exception:
+            return self.fail('borrow')
+        checkpoint = self.record('borrow', started)
+        
+        stripe_service = StripeService()
+        try:
+            payment, _ = PaymentInitiationService(stripe_service).initiate(borrowing, 'PAYMENT', 1)
+        except Exception:
+            return self.fail('checkout')
+        self.record('checkout', checkpoint)
+        
+        # The customer completes the hosted checkout page (not timed)
+        client.get(payment.session_url)
+        
+        checkpoint = time.perf_counter()
+        try:
+            if not stripe_service.verify_payment_session(payment.session_id):
+                return self.fail('verify')
+        except Exception:
+            return self.fail('verify')
+        payment.status = 'PAID'
+        payment.save()
+        self.record('verify', checkpoint)
+        self.record('flow', started)
+    
+    def worker(self, index: int, iterations: int):
+        try:
+            user, book = self.create_fixtures(index)
+            with httpx.Client(timeout=10) as client:
+                for _ in range(iterations):
+                    self.run_flow(user, book, client)
+        finally:
+            connections.close_all()
+    
+    def run_workers(self) -> float:
+        share, extra = divmod(self.iterations, self.concurrency)
+        counts = [share + (1 if index < extra else 0) for index in range(self.concurrency)]
+        started = time.perf_counter()
+        if self.concurrency == 1:
+            # Keep the caller's connection (and its test transaction) usable
+            user, book = self.create_fixtures(0)
+            with httpx.Client(timeout=10) as client:
+                for _ in range(counts[0]):
+                    self.run_flow(user, book, client)
+        else:
+            threads = [
+                threading.Thread(target=self.worker, args=(index, count))
+                for index, count in enumerate(counts)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        return time.perf_counter() - started
+    
+    def cleanup(self, first_message_id: int):
+        User.objects.filter(username__startswith=f'benchmark-{self.run_id}-').delete()
+        Book.objects.filter(title__startswith=f'Benchmark {self.run_id} #').delete()
+        OutboundMessage.objects.filter(id__gt=first_message_id).delete()
+    
+    def summarize(self, stage: str) -> dict:
+        values = sorted(self.timings[stage])
+        if not values:
+            return {'count': 0, 'failed': self.failures[stage]}
+        percentiles = statistics.quantiles(values, n=100, method='inclusive') if len(values) > 1 else values * 99
+        return {
+            'count': len(values),
+            'failed': self.failures[stage],
+            'mean_ms': statistics.mean(values) * 1000,
+            'p50_ms': percentiles[49] * 1000,
+            'p95_ms': percentiles[94] * 1000,
+            'max_ms': values[-1] * 1000,
+        }
+    
+    def run(self) -> dict:
+        """
+        Run the benchmark.
+        
+        Fake servers are started in-process unless ``stripe_url`` and
+        ``telegram_url`` point at running ones (see ``run_fake_services``).
+        
+        Returns:
+            dict: Per-stage latency summaries, throughput and fake API stats
+        """
+        stripe_server = telegram_server = None
+        if not self.stripe_url:
+            stripe_server = FakeStripeServer(**self.faults).start()
+            self.stripe_url = stripe_server.url
+        if not self.telegram_url:
+            telegram_server = FakeTelegramServer(**self.faults).start()
+            self.telegram_url = telegram_server.url
+        
+        overrides = {
+            'STRIPE_API_BASE': self.stripe_url,
+            'STRIPE_SECRET_KEY': 'sk_test_benchmark',
+            'TELEGRAM_API_URL': self.telegram_url,
+            'TELEGRAM_BOT_TOKEN': 'benchmark-token',
+            'TELEGRAM_CHAT_ID': '1000',
+            'TELEGRAM_OUTBOUND_QUEUE_ENABLED': True,
+            'TELEGRAM_RATE_LIMIT_BACKEND': 'memory',
+        }
+        if self.telegram_rate:
+            overrides['TELEGRAM_RATE_PER_SECOND'] = self.telegram_rate
+        
+        first_message_id = OutboundMessage.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        try:
+            with override_settings(**overrides):
+                get_token_bucket.cache_clear()
+                get_stripe_client.cache_clear()
+                elapsed = self.run_workers()
+                
+                drain_started = time.perf_counter()
+                sent = OutboundTelegramSender().drain(duration=self.drain_timeout)
+                drain_elapsed = time.perf_counter() - drain_started
+                pending = OutboundMessage.objects.filter(id__gt=first_message_id).count()
+        finally:
+            get_token_bucket.cache_clear()
+            get_stripe_client.cache_clear()
+            if not self.keep:
+                self.cleanup(first_message_id)
+            for server in (stripe_server, telegram_server):
+                if server is not None:
+                    server.stop()
+        
+        completed = len(self.timings['flow'])
+        return {
+            'iterations': self.iterations,
+            'concurrency': self.concurrency,
+            'elapsed': elapsed,
+            'throughput': completed / elapsed if elapsed else 0,
+            'stages': {stage: self.summarize(stage) for stage in self.stages},
+            'drain': {'elapsed': drain_elapsed, 'pending': pending, **sent},
+            'stripe': dict(stripe_server.stats) if stripe_server else None,
+            'telegram': dict(telegram_server.stats, delivered=len(telegram_server.received)) if telegram_server else None,
+        }
+
+
+class FanOutBenchmark:
+    """
+    Scaling benchmark of a fanned-out nightly job at several worker counts.
+    
+    Creates ``borrowings`` overdue borrowings that owe a fine and have an
+    overdue alert due, then for every worker count fans the job out into
+    that many shards over the benchmark's borrowing ids and runs the
+    shards on as many threads, standing in for Django-Q workers. Telegram
+    messages only go to the outbound queue. Fines, alert state and queued
+    messages are reset between rounds and deleted afterwards unless
+    ``keep`` is set.
+    """
+    
+    jobs = {'fines': FineJob, 'overdue_alerts': OverdueAlertJob}
+    
+    def __init__(self, job: str = 'fines', borrowings: int = 10000, workers=(1, 2, 4, 8), chunk_size: int = None,
+                 keep: bool = False):
+        self.job_class = self.jobs[job]
+        self.borrowings = borrowings
+        self.workers = list(workers)
+        self.chunk_size = chunk_size
+        self.keep = keep
+        self.run_id = uuid.uuid4().hex[:8]
+        self.alert_on = date.today() - timedelta(days=2)
+    
+    def create_fixtures(self):
+        """Bulk create the overdue borrowings with their balances and alert state."""
+        username = f'benchmark-{self.run_id}'
+        user = User.objects.create_user(username=username, email=f'{username}@example.com', password='benchmark')
+        book = Book.objects.create(
+            title=f'Benchmark {self.run_id}',
+            author='Benchmark',
+            cover='SOFT',
+            inventory=self.borrowings,
+            daily_fee=1
+        )
+        today = date.today()
+        borrowings = Borrowing.objects.bulk_create([
+            Borrowing(user=user, book=book, borrow_date=today - timedelta(days=10),
+                      expected_return_date=today - timedelta(days=3))
+            for _ in range(self.borrowings)
+        ], batch_size=1000)
+        ids = sorted(borrowing.id for borrowing in borrowings)
+        FineBalance.objects.bulk_create([
+            FineBalance(borrowing_id=borrowing_id, accrued=Decimal('6.00'), days=3, accrued_through=today)
+            for borrowing_id in ids
+        ], batch_size=1000)
+        OverdueNotificationState.objects.bulk_create([
+            OverdueNotificationState(borrowing_id=borrowing_id, next_alert_on=self.alert_on)
+            for borrowing_id in ids
+        ], batch_size=1000)
+        return user, book, (ids[0], ids[-1])
+    
+    def reset(self, book):
+        Payment.objects.filter(borrowing__book=book).delete()
+        OverdueNotificationState.objects.filter(borrowing__book=book).update(
+            alert_count=0,
+            last_alerted_on=None,
+            next_alert_on=self.alert_on
+        )
+    
+    def run_shard(self, run_key: str, failures: list, close: bool):
+        try:
+            # No time budget: a re-queued shard would leave the benchmark
+            self.job_class(run_key, chunk_size=self.chunk_size, time_budget=float('inf')).run()
+        except Exception as e:
+            failures.append(str(e))
+        finally:
+            if close:
+                connections.close_all()
+    
+    def run_round(self, workers: int, id_range: tuple) -> dict:
+        """Fan the job out into ``workers`` shards and run them concurrently."""
+        run_key = f'{date.today().isoformat()}:benchmark-{self.run_id}-{workers}'
+        shard_keys = []
+        failures = []
+        started = time.perf_counter()
+        self.job_class(run_key, chunk_size=self.chunk_size).fan_out(
+            workers,
+            id_range=id_range,
+            enqueue=lambda key: shard_keys.append(key) or True
+        )
+        if workers == 1:
+            # Keep the caller's connection (and its test transaction) usable
+            for key in shard_keys:
+                self.run_shard(key, failures, close=False)
+        else:
+            threads = [threading.Thread(target=self.run_shard, args=(key, failures, True)) for key in shard_keys]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        elapsed = time.perf_counter() - started
+        
+        parent = BatchJobRun.objects.get(job=self.job_class.name, run_key=run_key)
+        durations = list(BatchJobChunk.objects.filter(run__parent=parent).values_list('duration_ms', flat=True))
+        return {
+            'workers': workers,
+            'shards': parent.shard_count,
+            'status': parent.status,
+            'processed': parent.processed,
+            'elapsed': elapsed,
+            'rows_per_second': self.borrowings / elapsed if elapsed else 0,
+            'chunks': len(durations),
+            'chunk_mean_ms': statistics.mean(durations) if durations else 0,
+            'chunk_max_ms': max(durations, default=0),
+            'failures': failures,
+        }
+    
+    def cleanup(self, first_message_id: int):
+        User.objects.filter(username=f'benchmark-{self.run_id}').delete()
+        Book.objects.filter(title=f'Benchmark {self.run_id}').delete()
+        BatchJobRun.objects.filter(job=self.job_class.name, run_key__contains=f':benchmark-{self.run_id}-').delete()
+        OutboundMessage.objects.filter(id__gt=first_message_id).delete()
+    
+    def run(self) -> dict:
+        """
+        Run one round per worker count.
+        
+        Returns:
+            dict: Per-round timings with the speed-up over the first round
+        """
+        overrides = {
+            'TELEGRAM_BOT_TOKEN': 'benchmark-token',
+            'TELEGRAM_CHAT_ID': '1000',
+            'TELEGRAM_OUTBOUND_QUEUE_ENABLED': True,
+        }
+        first_message_id = OutboundMessage.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        rounds = []
+        try:
+            with override_settings(**overrides):
+                user, book, id_range = self.create_fixtures()
+                # Catch the ledger up once so no round pays for it
+                self.job_class(chunk_size=self.chunk_size).setup()
+                for workers in self.workers:
+                    self.reset(book)
+                    rounds.append(self.run_round(workers, id_range))
+        finally:
+            if not self.keep:
+                self.cleanup(first_message_id)
+        
+        for result in rounds:
+            result['speedup'] = rounds[0]['elapsed'] / result['elapsed'] if result['elapsed'] else 0
+        return {
+            'job': self.job_class.name,
+            'borrowings': self.borrowings,
+            'rounds': rounds,
+        }
+
+
+class ArchiveBenchmark:
+    """
+    Benchmark of the borrowing archive: overdue scans before and after archiving.
+    
+    Creates ``history`` borrowings returned over the last ``years`` years
+    and ``active`` ones still out (a tenth of them overdue), times the
+    overdue scan and the size of the active-loans index, archives
+    everything returned more than ``keep_years`` years ago and measures
+    again. Benchmark rows (live and archived) are deleted afterwards
+    unless ``keep`` is set.
+    """
+    
+    index_name = 'borrowing_active_due_idx'
+    
+    def __init__(self, history: int = 100000, active: int = 2000, years: int = 10, keep_years: int = 3,
+                 repeat: int = 5, batch_size: int = None, keep: bool = False):
+        self.history = history
+        self.active = active
+        self.years = years
+        self.keep_years = keep_years
+        self.repeat = repeat
+        self.batch_size = batch_size
+        self.keep = keep
+        self.run_id = uuid.uuid4().hex[:8]
+    
+    def create_fixtures(self):
+        """Bulk create the returned and active borrowings of one benchmark user and book."""
+        username = f'benchmark-{self.run_id}'
+        user = User.objects.create_user(username=username, email=f'{username}@example.com', password='benchmark')
+        book = Book.objects.create(
+            title=f'Benchmark {self.run_id}',
+            author='Benchmark',
+            cover='SOFT',
+            inventory=self.active,
+            daily_fee=1
+        )
+        today = date.today()
+        days = self.years * 365
+        returned = (
+            Borrowing(user=user, book=book, borrow_date=borrowed, expected_return_date=borrowed + timedelta(days=14),
+                      actual_return_date=borrowed + timedelta(days=7))
+            for borrowed in (today - timedelta(days=8 + i * days // self.history) for i in range(self.history))
+        )
+        Borrowing.objects.bulk_create(returned, batch_size=1000)
+        Borrowing.objects.bulk_create([
+            Borrowing(user=user, book=book, borrow_date=today - timedelta(days=7),
+                      expected_return_date=today + timedelta(days=-1 if i % 10 == 0 else 7))
+            for i in range(self.active)
+        ], batch_size=1000)
+        return user, book
+    
+    def overdue_scan(self) -> float:
+        """Best time in milliseconds of the overdue scan over ``repeat`` runs."""
+        timings = []
+        for _ in range(self.repeat):
+            started = time.perf_counter()
+            list(Borrowing.objects.filter(
+                actual_return_date__isnull=True,
+                expected_return_date__lt=date.today()
+            ).values_list('id', flat=True))
+            timings.append((time.perf_counter() - started) * 1000)
+        return min(timings)
+    
+    def index_size(self):
+        """Size in bytes of the active-loans index, or None where the database cannot report it."""
+        queries = {
+            'postgresql': 'SELECT pg_relation_size(%s::regclass)',
+            # Needs SQLite built with SQLITE_ENABLE_DBSTAT_VTAB
+            'sqlite': 'SELECT SUM(pgsize) FROM dbstat WHERE name = %s',
+        }
+        if connection.vendor not in queries:
+            return None
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(queries[connection.vendor], [self.index_name])
+                return cursor.fetchone()[0]
+        except DatabaseError:
+            return None
+    
+    def measure(self) -> dict:
+        return {
+            'rows': Borrowing.objects.count(),
+            'overdue_scan_ms': self.overdue_scan(),
+            'index_bytes': self.index_size(),
+        }
+    
+    def cleanup(self):
+        ArchivedBorrowing.objects.filter(user__username=f'benchmark-{self.run_id}').delete()
+        User.objects.filter(username=f'benchmark-{self.run_id}').delete()
+        Book.objects.filter(title=f'Benchmark {self.run_id}').delete()
+    
+    def run(self) -> dict:
+        """
+        Measure, archive and measure again.
+        
+        Returns:
+            dict: Table rows, overdue scan time and index size before and after, and the archive throughput
+        """
+        try:
+            self.create_fixtures()
+            before = self.measure()
+            service = BorrowingArchiveService(batch_size=self.batch_size)
+            started = time.perf_counter()
+            archived = service.archive(service.get_cutoff(self.keep_years))
+            elapsed = time.perf_counter() - started
+            after = self.measure()
+        finally:
+            if not self.keep:
+                self.cleanup()
+        return {
+            'history': self.history,
+            'active': self.active,
+            'before': before,
+            'after': after,
+            'archived': archived,
+            'archive_seconds': elapsed,
+            'archived_per_second': archived / elapsed if elapsed else 0,
+        }
\ No newline at end of file
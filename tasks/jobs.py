@@ -0,0 +1,68 @@
+from datetime import timedelta
+from borrowings.models import Borrowing
+from notifications.services import OverdueAlertService, TelegramNotificationService
+from payments.fine_service import FineCalculationService
+from .batch import BatchJob
+
+
+class FineJob(BatchJob):
+    """Accrue the day's fines, then open fine payments for owing balances chunk by chunk."""
+    
+    name = 'process_fines'
+    task = 'tasks.scheduled_tasks.process_fines_task'
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.service = FineCalculationService()
+    
+    def setup(self):
+        # Set-based and idempotent: days already in the ledger are skipped
+        self.service.ledger.accrue(through=self.as_of)
+    
+    def get_queryset(self):
+        return self.service.owing_balances()
+    
+    def process_chunk(self, rows: list) -> int:
+        created, errors = self.service.create_fines(rows)
+        for error in errors:
+            print(f"Error creating fine for borrowing {error['borrowing_id']}: {error['error']}")
+        return len(created)
+
+
+class OverdueAlertJob(BatchJob):
+    """Send the escalating overdue alerts that are due on the run's day."""
+    
+    name = 'overdue_alerts'
+    task = 'tasks.scheduled_tasks.check_overdue_books_task'
+    # One state per borrowing: shards split the same borrowing id range as the fines job
+    key = 'borrowing_id'
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.service = OverdueAlertService()
+    
+    def get_queryset(self):
+        return self.service.due_states(self.as_of)
+    
+    def process_chunk(self, rows: list) -> int:
+        return self.service.send_alerts(rows, self.as_of)
+
+
+class ReminderJob(BatchJob):
+    """Remind borrowers whose books are due one or two days after the run's day."""
+    
+    name = 'due_reminders'
+    task = 'tasks.scheduled_tasks.send_reminder_notifications_task'
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.telegram_service = TelegramNotificationService()
+    
+    def get_queryset(self):
+        return Borrowing.objects.filter(
+            expected_return_date__in=[self.as_of + timedelta(days=1), self.as_of + timedelta(days=2)],
+            actual_return_date__isnull=True
+        ).select_related('user', 'book')
+    
+    def process_chunk(self, rows: list) -> int:
+        return sum(1 for borrowing in rows if self.telegram_service.send_reminder_notification(borrowing))
\ No newline at end of file
@@ -0,0 +1,288 @@
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import timedelta
+from functools import lru_cache, wraps
+
+import redis
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from django.db.models import F
+from django.utils import timezone
+from library_service.bulk import update_returning
+from .models import TaskLease
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+# Tasks wrapped by ``locked_task``, for ``task_lock_metrics``
+locked_tasks = []
+
+
+class LockLost(Exception):
+    """A newer holder of the task's lock (higher fencing token) has written first."""
+
+
+class DatabaseLeaseStore:
+    """Leases kept in ``TaskLease`` rows; works on every database the project supports."""
+    
+    def acquire(self, name: str, owner: str, ttl: float):
+        """Take the lease if it is free; return the new fencing token, or None."""
+        now = timezone.now()
+        TaskLease.objects.get_or_create(name=name, defaults={'expires_at': now})
+        rows = update_returning(
+            TaskLease.objects.filter(name=name, expires_at__lte=now),
+            ['token'],
+            token=F('token') + 1,
+            owner=owner,
+            acquired_at=now,
+            expires_at=now + timedelta(seconds=ttl)
+        )
+        return rows[0][0] if rows else None
+    
+    def extend(self, name: str, token: int, ttl: float) -> bool:
+        now = timezone.now()
+        return bool(TaskLease.objects.filter(name=name, token=token, expires_at__gt=now).update(
+            expires_at=now + timedelta(seconds=ttl)
+        ))
+    
+    def release(self, name: str, token: int):
+        TaskLease.objects.filter(name=name, token=token).update(expires_at=timezone.now())
+
+
+class RedisLeaseStore:
+    """Leases kept in Redis with ``SET NX PX``; the fencing token is a per-lock counter."""
+    
+    ACQUIRE_SCRIPT = """
+        if redis.call('EXISTS', KEYS[1]) == 1 then
+            return false
+        end
+        local token = redis.call('INCR', KEYS[2])
+        redis.call('SET', KEYS[1], token, 'NX', 'PX', ARGV[1])
+        return token
+    """
+    
+    EXTEND_SCRIPT = """
+        if redis.call('GET', KEYS[1]) == ARGV[1] then
+            return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+        end
+        return 0
+    """
+    
+    RELEASE_SCRIPT = """
+        if redis.call('GET', KEYS[1]) == ARGV[1] then
+            return redis.call('DEL', KEYS[1])
+        end
+        return 0
+    """
+    
+    def __init__(self, url: str, prefix: str = 'library:task_lock'):
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._acquire = self.client.register_script(self.ACQUIRE_SCRIPT)
+        self._extend = self.client.register_script(self.EXTEND_SCRIPT)
+        self._release = self.client.register_script(self.RELEASE_SCRIPT)
+    
+    def _key(self, name: str) -> str:
+        return f'{self.prefix}:{name}'
+    
+    def acquire(self, name: str, owner: str, ttl: float):
+        token = self._acquire(keys=[self._key(name), f'{self._key(name)}:fence'], args=[int(ttl * 1000)])
+        return int(token) if token is not None else None
+    
+    def extend(self, name: str, token: int, ttl: float) -> bool:
+        return bool(self._extend(keys=[self._key(name)], args=[token, int(ttl * 1000)]))
+    
+    def release(self, name: str, token: int):
+        self._release(keys=[self._key(name)], args=[token])
+
+
+@lru_cache(maxsize=None)
+def get_lease_store():
+    """Return the process-wide lease store configured by ``TASK_LOCK_BACKEND``."""
+    backend = getattr(settings, 'TASK_LOCK_BACKEND', 'database')
+    if backend == 'database':
+        return DatabaseLeaseStore()
+    if backend == 'redis':
+        return RedisLeaseStore(settings.REDIS_URL)
+    raise ImproperlyConfigured(f"Unknown TASK_LOCK_BACKEND: {backend}")
+
+
+class TaskLock:
+    """
+    Lease-based lock that keeps a scheduled task from running twice at once across nodes.
+    
+    The lease expires after ``ttl`` seconds (``TASK_LOCK_TTL``), so a
+    killed worker never blocks a task for long; while the task runs, a
+    heartbeat thread renews it every third of ``ttl``, so runs without a
+    timeout (``run_task``) keep it however long they take. Every
+    acquisition gets a higher fencing token. ``extend`` and ``release``
+    only act while the token is still current, and writes that must not
+    come from a stale holder (batch job checkpoints) store the token and
+    refuse a lower one, raising ``LockLost``.
+    
+    Acquisitions, waits and skips are counted in the cache (shared by all
+    workers) under ``task_lock:<metric>:<event>``.
+    """
+    
+    def __init__(self, name: str, ttl: float = None, metric: str = None, store=None):
+        self.name = name
+        self.ttl = ttl or getattr(settings, 'TASK_LOCK_TTL', 120)
+        self.metric = metric or name
+        self.store = store or get_lease_store()
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+        self.token = None
+        self._heartbeat = None
+        self._stopped = threading.Event()
+    
+    @property
+    def held(self) -> bool:
+        return self.token is not None
+    
+    def acquire(self, wait: float = 0, poll: float = 0.5) -> bool:
+        """
+        Take the lock, waiting up to ``wait`` seconds for the current holder.
+        
+        Returns:
+            bool: True if the lock is now held
+        """
+        started = time.monotonic()
+        attempts = 0
+        while True:
+            attempts += 1
+            self.token = self.store.acquire(self.name, self.owner, self.ttl)
+            if self.token is not None or time.monotonic() - started + poll > wait:
+                break
+            time.sleep(poll)
+        
+        if attempts > 1:
+            self.record('waited')
+            self.record('wait_ms', int((time.monotonic() - started) * 1000))
+        self.record('acquired' if self.token is not None else 'skipped')
+        return self.token is not None
+    
+    def extend(self) -> bool:
+        """Renew the lease; False if it expired and someone else took it."""
+        if self.token is None:
+            return False
+        if self.store.extend(self.name, self.token, self.ttl):
+            return True
+        logger.warning(f"Lost task lock {self.name} (token {self.token})")
+        self.record('lost')
+        self.token = None
+        return False
+    
+    def start_heartbeat(self):
+        """Renew the lease from a background thread until ``stop_heartbeat`` or until it is lost."""
+        self._stopped.clear()
+        self._heartbeat = threading.Thread(target=self._beat, daemon=True)
+        self._heartbeat.start()
+    
+    def _beat(self):
+        try:
+            while not self._stopped.wait(self.ttl / 3):
+                try:
+                    if not self.extend():
+                        break
+                except Exception as e:
+                    # Retried on the next beat; the lease outlives two missed beats
+                    logger.error(f"Failed to renew task lock {self.name}: {str(e)}")
+        finally:
+            connections.close_all()
+    
+    def stop_heartbeat(self):
+        if self._heartbeat is not None:
+            self._stopped.set()
+            self._heartbeat.join()
+            self._heartbeat = None
+    
+    def release(self):
+        if self.token is None:
+            return
+        try:
+            self.store.release(self.name, self.token)
+        except Exception as e:
+            # The lease still expires by itself
+            logger.error(f"Failed to release task lock {self.name}: {str(e)}")
+        self.token = None
+    
+    def record(self, event: str, amount: int = 1):
+        try:
+            key = f'task_lock:{self.metric}:{event}'
+            cache.add(key, 0, timeout=None)
+            cache.incr(key, amount)
+        except Exception as e:
+            logger.error(f"Failed to record task lock metric {event} for {self.metric}: {str(e)}")
+
+
+def current_lock():
+    """Return the ``TaskLock`` held by the task running in this thread, if any."""
+    return getattr(_local, 'lock', None)
+
+
+def locked_task(key=None, ttl: float = None):
+    """
+    Run the decorated task only if no other run of it holds its lock.
+    
+    The lock is named after the function plus ``key(*args, **kwargs)``
+    (default: the arguments), so e.g. each refund or each shard of a batch
+    job has its own lock, renewed by a heartbeat for as long as the task
+    runs. A run that finds the lock taken is skipped and counted. ``task.run_locked(*args, wait=seconds, **kwargs)`` waits
+    for the lock instead and returns ``(ran, result)``.
+    
+    Args:
+        key: Callable taking the task's arguments and returning the lock key suffix
+        ttl: Lease length in seconds (default ``TASK_LOCK_TTL``)
+    """
+    def decorator(func):
+        def run_locked(*args, wait: float = 0, **kwargs):
+            suffix = key(*args, **kwargs) if key else ':'.join(str(arg) for arg in [*args, *kwargs.values()])
+            name = f'{func.__name__}:{suffix}' if suffix else func.__name__
+            lock = TaskLock(name, ttl=ttl, metric=func.__name__)
+            if not lock.acquire(wait=wait):
+                logger.info(f"Skipped {name}: another run holds the lock")
+                return False, None
+            previous, _local.lock = current_lock(), lock
+            lock.start_heartbeat()
+            try:
+                return True, func(*args, **kwargs)
+            finally:
+                _local.lock = previous
+                lock.stop_heartbeat()
+                lock.release()
+        
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            return run_locked(*args, **kwargs)[1]
+        
+        wrapper.run_locked = run_locked
+        locked_tasks.append(func.__name__)
+        return wrapper
+    return decorator
+
+
+def task_lock_metrics(names=None) -> dict:
+    """
+    Return lock counters of all workers per task.
+    
+    Returns:
+        dict: ``acquired``, ``waited``, ``wait_ms``, ``skipped`` and ``lost`` per task name
+    """
+    if names is None:
+        # Importing the task module registers its locked tasks
+        import tasks.scheduled_tasks
+        names = locked_tasks
+    events = ('acquired', 'waited', 'wait_ms', 'skipped', 'lost')
+    try:
+        counters = cache.get_many([f'task_lock:{name}:{event}' for name in names for event in events])
+    except Exception:
+        return {}
+    return {
+        name: {event: counters.get(f'task_lock:{name}:{event}', 0) for event in events}
+        for name in names
+    }
\ No newline at end of file
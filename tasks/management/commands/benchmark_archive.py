@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from tasks.benchmark import ArchiveBenchmark
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the overdue scan and active-loans index before and after archiving old borrowings'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--history', type=int, default=100000, help='Number of returned borrowings to create')
+        parser.add_argument('--active', type=int, default=2000, help='Number of active borrowings to create')
+        parser.add_argument('--years', type=int, default=10, help='Years of history the returned borrowings span')
+        parser.add_argument('--keep-years', type=int, default=3, help='Archive borrowings returned before this many years ago')
+        parser.add_argument('--repeat', type=int, default=5, help='Overdue scans per measurement (the best is reported)')
+        parser.add_argument('--batch-size', type=int, default=None, help='Override BORROWING_ARCHIVE_BATCH_SIZE')
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark user, book and borrowings')
+    
+    def handle(self, *args, **options):
+        """Run the benchmark and print the before/after measurements."""
+        if min(options['history'], options['years'], options['keep_years'], options['repeat']) < 1:
+            self.stdout.write(
+                self.style.ERROR('--history, --years, --keep-years and --repeat must be at least 1')
+            )
+            return
+        
+        result = ArchiveBenchmark(
+            history=options['history'],
+            active=options['active'],
+            years=options['years'],
+            keep_years=options['keep_years'],
+            repeat=options['repeat'],
+            batch_size=options['batch_size'],
+            keep=options['keep'],
+        ).run()
+        
+        self.stdout.write(f"{result['history']} returned and {result['active']} active borrowings")
+        for label in ['before', 'after']:
+            measured = result[label]
+            index = f"{measured['index_bytes'] / 1024:.1f} KiB" if measured['index_bytes'] is not None else 'n/a'
+            self.stdout.write(
+                f"  {label:<6} rows={measured['rows']} overdue scan={measured['overdue_scan_ms']:.2f}ms index={index}"
+            )
+        self.stdout.write(
+            f"  archived {result['archived']} in {result['archive_seconds']:.2f}s "
+            f"({result['archived_per_second']:.0f} rows/s)"
+        )
\ No newline at end of file
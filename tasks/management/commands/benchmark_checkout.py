@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand
+from tasks.benchmark import CheckoutBenchmark
+
+
+class Command(BaseCommand):
+    help = 'Benchmark borrow -> pay -> notify throughput against local fake Stripe and Telegram APIs'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=100, help='Number of borrow -> pay flows')
+        parser.add_argument('--concurrency', type=int, default=1, help='Number of worker threads')
+        parser.add_argument('--stripe-url', default=None, help='Use a running fake Stripe API instead of starting one')
+        parser.add_argument('--telegram-url', default=None, help='Use a running fake Telegram API instead of starting one')
+        parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every fake API response')
+        parser.add_argument('--jitter', type=float, default=0.0, help='Random +/- seconds added to the latency')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of fake API requests failing with a 500')
+        parser.add_argument('--rate-limit', type=float, default=0, help='Fake API requests per second before 429s; 0 disables')
+        parser.add_argument('--telegram-rate', type=float, default=None, help='Override TELEGRAM_RATE_PER_SECOND')
+        parser.add_argument('--drain-timeout', type=float, default=60, help='Seconds allowed to drain queued notifications')
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark users, books and borrowings')
+    
+    def handle(self, *args, **options):
+        """Run the benchmark and print a latency summary."""
+        if options['iterations'] < 1:
+            self.stdout.write(
+                self.style.ERROR('--iterations must be at least 1')
+            )
+            return
+        
+        result = CheckoutBenchmark(
+            iterations=options['iterations'],
+            concurrency=options['concurrency'],
+            stripe_url=options['stripe_url'],
+            telegram_url=options['telegram_url'],
+            telegram_rate=options['telegram_rate'],
+            drain_timeout=options['drain_timeout'],
+            keep=options['keep'],
+            latency=options['latency'],
+            jitter=options['jitter'],
+            error_rate=options['error_rate'],
+            rate_limit=options['rate_limit'],
+        ).run()
+        
+        self.stdout.write(
+            f"{result['iterations']} flows, {result['concurrency']} workers, {result['elapsed']:.2f}s"
+        )
+        for stage, summary in result['stages'].items():
+            if summary['count']:
+                self.stdout.write(
+                    f"  {stage:<9} ok={summary['count']} failed={summary['failed']} "
+                    f"mean={summary['mean_ms']:.1f}ms p50={summary['p50_ms']:.1f}ms "
+                    f"p95={summary['p95_ms']:.1f}ms max={summary['max_ms']:.1f}ms"
+                )
+            else:
+                self.stdout.write(f"  {stage:<9} ok=0 failed={summary['failed']}")
+        drain = result['drain']
+        self.stdout.write(
+            f"  notify    drained sent={drain['sent']} throttled={drain['throttled']} dead={drain['dead']} "
+            f"pending={drain['pending']} in {drain['elapsed']:.2f}s"
+        )
+        if result['stripe'] is not None:
+            self.stdout.write(f"  stripe    {result['stripe']}")
+        if result['telegram'] is not None:
+            self.stdout.write(f"  telegram  {result['telegram']}")
+        self.stdout.write(
+            self.style.SUCCESS(f"Throughput: {result['throughput']:.1f} flows/s")
+        )
\ No newline at end of file
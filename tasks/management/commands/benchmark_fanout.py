@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from tasks.benchmark import FanOutBenchmark
+
+
+class Command(BaseCommand):
+    help = 'Benchmark fanned-out fine processing or overdue alerts at several worker counts'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--job', choices=sorted(FanOutBenchmark.jobs), default='fines', help='Job to fan out')
+        parser.add_argument('--borrowings', type=int, default=10000, help='Number of overdue borrowings to create')
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help='Worker counts to compare')
+        parser.add_argument('--chunk-size', type=int, default=None, help='Override BATCH_JOB_CHUNK_SIZE')
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark user, book and borrowings')
+    
+    def handle(self, *args, **options):
+        """Run the benchmark and print one line per worker count."""
+        if options['borrowings'] < 1 or min(options['workers']) < 1:
+            self.stdout.write(
+                self.style.ERROR('--borrowings and --workers must be at least 1')
+            )
+            return
+        
+        result = FanOutBenchmark(
+            job=options['job'],
+            borrowings=options['borrowings'],
+            workers=options['workers'],
+            chunk_size=options['chunk_size'],
+            keep=options['keep'],
+        ).run()
+        
+        self.stdout.write(f"{result['job']}: {result['borrowings']} overdue borrowings")
+        for round_result in result['rounds']:
+            self.stdout.write(
+                f"  workers={round_result['workers']:<3} {round_result['status']:<9} "
+                f"processed={round_result['processed']} {round_result['elapsed']:.2f}s "
+                f"{round_result['rows_per_second']:.0f} rows/s speedup={round_result['speedup']:.2f}x "
+                f"chunks={round_result['chunks']} mean={round_result['chunk_mean_ms']:.0f}ms "
+                f"max={round_result['chunk_max_ms']}ms"
+            )
+            for failure in round_result['failures']:
+                self.stdout.write(self.style.WARNING(f"    shard failed: {failure}"))
\ No newline at end of file
@@ -0,0 +1,48 @@
+import time
+from django.core.management.base import BaseCommand
+from library_service.fakes import FakeStripeServer, FakeTelegramServer
+
+
+class Command(BaseCommand):
+    help = 'Run local fake Stripe and Telegram APIs for load tests and integration benchmarks'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help='Interface to listen on')
+        parser.add_argument('--stripe-port', type=int, default=12111, help='Port of the fake Stripe API')
+        parser.add_argument('--telegram-port', type=int, default=12112, help='Port of the fake Telegram Bot API')
+        parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response')
+        parser.add_argument('--jitter', type=float, default=0.0, help='Random +/- seconds added to the latency')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with a 500')
+        parser.add_argument(
+            '--rate-limit',
+            type=float,
+            default=0,
+            help='Requests per second (per chat for Telegram) before answering 429; 0 disables'
+        )
+        parser.add_argument('--retry-after', type=int, default=1, help='retry_after returned with Telegram 429s')
+        parser.add_argument('--auto-pay', action='store_true', help='Mark checkout sessions as paid when created')
+    
+    def handle(self, *args, **options):
+        """Serve both fake APIs until interrupted."""
+        faults = {
+            'host': options['host'],
+            'latency': options['latency'],
+            'jitter': options['jitter'],
+            'error_rate': options['error_rate'],
+            'rate_limit': options['rate_limit'],
+            'retry_after': options['retry_after'],
+        }
+        stripe_server = FakeStripeServer(port=options['stripe_port'], auto_pay=options['auto_pay'], **faults)
+        telegram_server = FakeTelegramServer(port=options['telegram_port'], **faults)
+        
+        with stripe_server, telegram_server:
+            self.stdout.write(self.style.SUCCESS(f'STRIPE_API_BASE={stripe_server.url}'))
+            self.stdout.write(self.style.SUCCESS(f'TELEGRAM_API_URL={telegram_server.url}'))
+            try:
+                while True:
+                    time.sleep(1)
+            except KeyboardInterrupt:
+                pass
+        
+        self.stdout.write(f'Stripe: {dict(stripe_server.stats)}')
+        self.stdout.write(f'Telegram: {dict(telegram_server.stats)}, {len(telegram_server.received)} messages')
\ No newline at end of file
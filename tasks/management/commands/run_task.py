@@ -6,8 +6,16 @@ from tasks.scheduled_tasks import (
     send_weekly_summary_task,
     send_monthly_report_task,
     cleanup_expired_payments_task,
+    reconcile_payments_task,
+    process_refunds_task,
     send_reminder_notifications_task,
-    generate_system_health_report
+    generate_system_health_report,
+    process_due_events_task,
+    schedule_due_events_task,
+    flush_notification_digests_task,
+    deliver_telegram_messages_task,
+    requeue_telegram_dead_letters_task,
+    resume_batch_jobs_task
 )
 
 
@@ -20,6 +28,12 @@ class Command(BaseCommand):
             type=str,
             help='Name of the task to run'
         )
+        parser.add_argument(
+            '--lock-wait',
+            type=float,
+            default=0,
+            help='Seconds to wait for a run of the task already in progress (default: skip)'
+        )
     
     def handle(self, *args, **options):
         """Run the specified task."""
@@ -33,8 +47,16 @@ class Command(BaseCommand):
             'weekly_summary': send_weekly_summary_task,
             'monthly_report': send_monthly_report_task,
             'cleanup_payments': cleanup_expired_payments_task,
+            'reconcile_payments': reconcile_payments_task,
+            'process_refunds': process_refunds_task,
             'reminder_notifications': send_reminder_notifications_task,
             'system_health': generate_system_health_report,
+            'due_events': process_due_events_task,
+            'schedule_due_events': schedule_due_events_task,
+            'notification_digest': flush_notification_digests_task,
+            'telegram_outbound': deliver_telegram_messages_task,
+            'telegram_requeue_dead': requeue_telegram_dead_letters_task,
+            'resume_batch_jobs': resume_batch_jobs_task,
         }
         
         if task_name not in tasks:
@@ -48,7 +70,12 @@ class Command(BaseCommand):
         
         try:
             task_func = tasks[task_name]
-            task_func()
+            ran, _ = task_func.run_locked(wait=options['lock_wait'])
+            if not ran:
+                self.stdout.write(
+                    self.style.WARNING(f'Skipped task {task_name}: it is already running')
+                )
+                return
             self.stdout.write(
                 self.style.SUCCESS(f'Successfully ran task: {task_name}')
             )
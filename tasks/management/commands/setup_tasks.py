@@ -8,7 +8,12 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         """Setup all scheduled tasks."""
         try:
-            setup_scheduled_tasks()
+            ran, _ = setup_scheduled_tasks.run_locked(wait=30)
+            if not ran:
+                self.stdout.write(
+                    self.style.WARNING('Scheduled tasks are being set up by another process')
+                )
+                return
             self.stdout.write(
                 self.style.SUCCESS('Successfully setup scheduled tasks')
             )
@@ -0,0 +1,131 @@
+from django.db import models
+
+
+class DueDateEvent(models.Model):
+    """
+    Pending due-date event (reminder or overdue transition) for a borrowing.
+    
+    Rows are created when a book is borrowed, deleted when the book is
+    returned and deleted by ``process_due_events_task`` once ``fire_at`` has
+    passed and the notification went out, so the worker only ever reads
+    events that are due. ``attempts`` counts failed sends.
+    """
+    
+    KIND_CHOICES = [
+        ('REMINDER', 'Reminder'),
+        ('OVERDUE', 'Overdue'),
+    ]
+    
+    borrowing = models.ForeignKey('borrowings.Borrowing', on_delete=models.CASCADE, related_name='due_events')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    fire_at = models.DateTimeField(db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        verbose_name = 'Due date event'
+        verbose_name_plural = 'Due date events'
+        ordering = ['fire_at']
+        constraints = [
+            models.UniqueConstraint(fields=['borrowing', 'kind', 'fire_at'], name='unique_due_date_event'),
+        ]
+    
+    def __str__(self):
+        return f"{self.kind} for borrowing {self.borrowing_id} at {self.fire_at}"
+
+
+class BatchJobRun(models.Model):
+    """
+    Checkpoint of one run of a batch job (e.g. the fines job for one day).
+    
+    ``last_id`` is the primary key of the last row whose chunk committed;
+    it is written in the same transaction as the chunk's work, so a run
+    killed by the worker timeout resumes after the last committed chunk
+    instead of starting over.
+    
+    A run fanned out over several workers is a parent with ``shard_count``
+    shard runs, each limited to the key range ``min_id``-``max_id``; the
+    parent completes with the totals of its shards once all of them have.
+    
+    ``lock_token`` is the highest task lock fencing token that wrote a
+    checkpoint; a holder with a lower token lost its lease and is refused.
+    """
+    
+    STATUS_CHOICES = [
+        ('RUNNING', 'Running'),
+        ('COMPLETED', 'Completed'),
+        ('FAILED', 'Failed'),
+    ]
+    
+    job = models.CharField(max_length=50)
+    run_key = models.CharField(max_length=50)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='RUNNING')
+    parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='shards')
+    shard_count = models.PositiveSmallIntegerField(default=0)
+    min_id = models.BigIntegerField(null=True, blank=True)
+    max_id = models.BigIntegerField(null=True, blank=True)
+    last_id = models.BigIntegerField(null=True, blank=True)
+    processed = models.PositiveIntegerField(default=0)
+    chunks = models.PositiveIntegerField(default=0)
+    attempts = models.PositiveIntegerField(default=0)
+    lock_token = models.BigIntegerField(default=0)
+    error = models.TextField(blank=True)
+    started_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        verbose_name = 'Batch job run'
+        verbose_name_plural = 'Batch job runs'
+        ordering = ['-started_at']
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'run_key'], name='unique_batch_job_run'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'updated_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.job} {self.run_key} - {self.status}"
+
+
+class BatchJobChunk(models.Model):
+    """Timing of one committed chunk of a batch job run."""
+    
+    run = models.ForeignKey(BatchJobRun, on_delete=models.CASCADE, related_name='chunk_log')
+    first_id = models.BigIntegerField()
+    last_id = models.BigIntegerField()
+    rows = models.PositiveIntegerField()
+    processed = models.PositiveIntegerField()
+    duration_ms = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = 'Batch job chunk'
+        verbose_name_plural = 'Batch job chunks'
+        ordering = ['run', 'first_id']
+    
+    def __str__(self):
+        return f"{self.run} ids {self.first_id}-{self.last_id} ({self.duration_ms} ms)"
+
+
+class TaskLease(models.Model):
+    """
+    Lease of a scheduled task lock (the ``database`` backend of ``TaskLock``).
+    
+    A lease is free once ``expires_at`` has passed; taking it increments
+    ``token``, the fencing token that tells a holder whose lease expired
+    and was taken over that it no longer owns the lock.
+    """
+    
+    name = models.CharField(max_length=200, primary_key=True)
+    token = models.BigIntegerField(default=0)
+    owner = models.CharField(max_length=200, blank=True)
+    acquired_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField()
+    
+    class Meta:
+        verbose_name = 'Task lease'
+        verbose_name_plural = 'Task leases'
+    
+    def __str__(self):
+        return f"{self.name} #{self.token} until {self.expires_at}"
\ No newline at end of file
@@ -1,54 +1,135 @@
 from datetime import date, timedelta
+from django.conf import settings
 from django.utils import timezone
 from django.db.models import Q, Sum, Count
 from django_q.tasks import schedule
 from django_q.models import Schedule
 from borrowings.models import Borrowing
 from payments.models import Payment
-from notifications.signals import check_overdue_books, send_daily_summary
-from payments.fine_service import FineCalculationService
-from notifications.services import TelegramNotificationService
+from notifications.signals import send_daily_summary
+from payments.services import PaymentReconciliationService, RefundService
+from notifications.services import TelegramNotificationService, OverdueAlertService, NotificationDigestService
+from notifications.outbound import OutboundTelegramSender
+from .batch import BatchJob
+from .jobs import FineJob, OverdueAlertJob, ReminderJob
+from .locks import locked_task
+from .scheduler import DueDateScheduler
 
 
+def run_key_lock(run_key: str = None) -> str:
+    """Lock key of a batch job task: its run key, today's date for the scheduled run."""
+    return run_key or date.today().isoformat()
+
+
+def ensure_schedule(func: str, **options):
+    """
+    Create the schedule of a task, or update the existing one.
+    
+    Duplicates left by earlier setups are deleted and an existing
+    schedule keeps its ``next_run``, so setup can run any number of times.
+    """
+    existing = list(Schedule.objects.filter(func=func).order_by('id'))
+    if not existing:
+        return schedule(func, **options)
+    
+    current = existing[0]
+    Schedule.objects.filter(pk__in=[duplicate.pk for duplicate in existing[1:]]).delete()
+    options.pop('next_run', None)
+    for field, value in options.items():
+        setattr(current, field, value)
+    current.save()
+    return current
+
+
+@locked_task()
 def setup_scheduled_tasks():
     """Setup all scheduled tasks for the library system."""
     
     # Daily summary at 9:00 AM
-    schedule(
+    ensure_schedule(
         'tasks.scheduled_tasks.send_daily_summary_task',
         schedule_type=Schedule.DAILY,
         next_run=timezone.now().replace(hour=9, minute=0, second=0, microsecond=0)
     )
     
-    # Check overdue books daily at 8:00 AM
-    schedule(
+    # Deliver due-date reminders and overdue alerts every minute
+    ensure_schedule(
+        'tasks.scheduled_tasks.process_due_events_task',
+        schedule_type=Schedule.MINUTES,
+        minutes=1,
+        next_run=timezone.now()
+    )
+    
+    # Drain the outbound Telegram queue (runs for up to 50 seconds per minute)
+    ensure_schedule(
+        'tasks.scheduled_tasks.deliver_telegram_messages_task',
+        schedule_type=Schedule.MINUTES,
+        minutes=1,
+        next_run=timezone.now()
+    )
+    
+    # Flush notification digests every minute
+    ensure_schedule(
+        'tasks.scheduled_tasks.flush_notification_digests_task',
+        schedule_type=Schedule.MINUTES,
+        minutes=1,
+        next_run=timezone.now()
+    )
+    
+    # Execute due and retried refunds every minute
+    ensure_schedule(
+        'tasks.scheduled_tasks.process_refunds_task',
+        schedule_type=Schedule.MINUTES,
+        minutes=1,
+        next_run=timezone.now()
+    )
+    
+    # Reconcile pending payments with Stripe every 15 minutes
+    ensure_schedule(
+        'tasks.scheduled_tasks.reconcile_payments_task',
+        schedule_type=Schedule.MINUTES,
+        minutes=15,
+        next_run=timezone.now()
+    )
+    
+    # Escalating overdue alerts daily at 8:00 AM (only borrowings whose next alert is due)
+    ensure_schedule(
         'tasks.scheduled_tasks.check_overdue_books_task',
         schedule_type=Schedule.DAILY,
         next_run=timezone.now().replace(hour=8, minute=0, second=0, microsecond=0)
     )
     
     # Process fines daily at 8:30 AM
-    schedule(
+    ensure_schedule(
         'tasks.scheduled_tasks.process_fines_task',
         schedule_type=Schedule.DAILY,
         next_run=timezone.now().replace(hour=8, minute=30, second=0, microsecond=0)
     )
     
+    # Resume batch job runs (fines, overdue alerts, reminders) abandoned by a killed worker
+    ensure_schedule(
+        'tasks.scheduled_tasks.resume_batch_jobs_task',
+        schedule_type=Schedule.MINUTES,
+        minutes=5,
+        next_run=timezone.now()
+    )
+    
     # Weekly statistics every Monday at 10:00 AM
-    schedule(
+    ensure_schedule(
         'tasks.scheduled_tasks.send_weekly_summary_task',
         schedule_type=Schedule.WEEKLY,
         next_run=timezone.now().replace(hour=10, minute=0, second=0, microsecond=0)
     )
     
     # Monthly report on 1st of month at 11:00 AM
-    schedule(
+    ensure_schedule(
         'tasks.scheduled_tasks.send_monthly_report_task',
         schedule_type=Schedule.MONTHLY,
         next_run=timezone.now().replace(hour=11, minute=0, second=0, microsecond=0)
     )
 
 
+@locked_task()
 def send_daily_summary_task():
     """Send daily summary notification."""
     try:
@@ -58,25 +139,103 @@ def send_daily_summary_task():
         print(f"Error sending daily summary: {str(e)}")
 
 
-def check_overdue_books_task():
-    """Check for overdue books and send notifications."""
+@locked_task(key=run_key_lock)
+def check_overdue_books_task(run_key: str = None):
+    """Send the overdue alerts due today, in resumable chunks fanned out over the workers."""
     try:
-        check_overdue_books()
-        print("Overdue books check completed")
+        result = OverdueAlertJob(run_key).start(shards=getattr(settings, 'BATCH_JOB_SHARDS', 1))
+        print(f"Overdue books check: {result}")
     except Exception as e:
         print(f"Error checking overdue books: {str(e)}")
 
 
-def process_fines_task():
-    """Process overdue books and create fines."""
+@locked_task()
+def process_due_events_task():
+    """Deliver reminder and overdue events whose time has come."""
+    try:
+        telegram_service = TelegramNotificationService()
+        result = DueDateScheduler().process_due(telegram_service)
+        if any(result.values()):
+            print(f"Due events processed: {result}")
+    except Exception as e:
+        print(f"Error processing due events: {str(e)}")
+
+
+@locked_task()
+def schedule_due_events_task():
+    """Schedule due-date events and overdue alert state for active borrowings that have none."""
+    try:
+        count = DueDateScheduler().backfill()
+        print(f"Scheduled due events for {count} borrowings")
+        count = OverdueAlertService.backfill()
+        print(f"Created overdue alert state for {count} borrowings")
+    except Exception as e:
+        print(f"Error scheduling due events: {str(e)}")
+
+
+@locked_task()
+def flush_notification_digests_task():
+    """Send notification digests whose window has elapsed."""
+    try:
+        sent = NotificationDigestService().flush_due()
+        if sent:
+            print(f"Notification digests sent: {sent}")
+    except Exception as e:
+        print(f"Error flushing notification digests: {str(e)}")
+
+
+@locked_task()
+def deliver_telegram_messages_task():
+    """Deliver queued Telegram messages within the per-chat rate limit."""
+    try:
+        result = OutboundTelegramSender().drain(duration=50)
+        if any(result.values()):
+            print(f"Telegram outbound delivery: {result}")
+    except Exception as e:
+        print(f"Error delivering Telegram messages: {str(e)}")
+
+
+@locked_task()
+def deliver_telegram_message_task(message_id: int):
+    """Deliver one queued Telegram message (queued by ``TelegramNotificationService.queue_message``)."""
+    try:
+        OutboundTelegramSender().deliver_now(message_id)
+    except Exception as e:
+        print(f"Error delivering Telegram message {message_id}: {str(e)}")
+
+
+@locked_task()
+def requeue_telegram_dead_letters_task():
+    """Move dead-lettered Telegram messages back to the outbound queue."""
     try:
-        fine_service = FineCalculationService()
-        result = fine_service.process_overdue_books()
-        print(f"Fine processing completed: {result}")
+        count = OutboundTelegramSender().requeue_dead()
+        print(f"Requeued {count} dead-lettered Telegram messages")
+    except Exception as e:
+        print(f"Error requeueing Telegram dead letters: {str(e)}")
+
+
+@locked_task(key=run_key_lock)
+def process_fines_task(run_key: str = None):
+    """Accrue today's fines and create fine payments, in resumable chunks fanned out over the workers."""
+    try:
+        result = FineJob(run_key).start(shards=getattr(settings, 'BATCH_JOB_SHARDS', 1))
+        print(f"Fine processing: {result}")
     except Exception as e:
         print(f"Error processing fines: {str(e)}")
 
 
+@locked_task()
+def resume_batch_jobs_task():
+    """Re-queue batch job runs left unfinished by a crashed or timed out worker."""
+    try:
+        runs = BatchJob.resume_stale()
+        if runs:
+            print(f"Resumed batch job runs: {', '.join(str(run) for run in runs)}")
+    except Exception as e:
+        print(f"Error resuming batch jobs: {str(e)}")
+
+
+@locked_task()
 def send_weekly_summary_task():
     """Send weekly summary notification."""
     try:
@@ -126,13 +285,14 @@ def send_weekly_summary_task():
             f"📈 Weekly Performance Report"
         )
         
-        telegram_service.send_message(message)
+        telegram_service.send_message(message, priority='summary')
         print("Weekly summary sent successfully")
         
     except Exception as e:
         print(f"Error sending weekly summary: {str(e)}")
 
 
+@locked_task()
 def send_monthly_report_task():
     """Send monthly report notification."""
     try:
@@ -202,23 +362,64 @@ def send_monthly_report_task():
         for i, book in enumerate(top_books, 1):
             message += f"{i}. {book['book__title']} ({book['borrow_count']} times)\n"
         
-        telegram_service.send_message(message)
+        telegram_service.send_message(message, priority='summary')
         print("Monthly report sent successfully")
         
     except Exception as e:
         print(f"Error sending monthly report: {str(e)}")
 
 
+@locked_task()
+def reconcile_payments_task():
+    """Sync PENDING payments with their Stripe checkout sessions."""
+    try:
+        result = PaymentReconciliationService().reconcile()
+        print(
+            f"Reconciled payments: {result['paid']} paid, {result['expired']} expired "
+            f"({result['sessions']} sessions in {result['pages']} pages)"
+        )
+    except Exception as e:
+        print(f"Error reconciling payments: {str(e)}")
+
+
+@locked_task()
+def process_refund_task(refund_id: int):
+    """Execute one queued refund at Stripe (queued by ``RefundService.request_refund``)."""
+    try:
+        refund = RefundService().execute(refund_id)
+        if refund is not None:
+            print(f"Refund {refund.id}: {refund.status}")
+    except Exception as e:
+        print(f"Error processing refund {refund_id}: {str(e)}")
+
+
+@locked_task()
+def process_refunds_task():
+    """Execute refunds whose retry is due or whose queued task was lost."""
+    try:
+        result = RefundService().process_due()
+        if any(result.values()):
+            print(
+                f"Processed refunds: {result['succeeded']} succeeded, {result['failed']} failed, "
+                f"{result['requeued']} requeued"
+            )
+    except Exception as e:
+        print(f"Error processing refunds: {str(e)}")
+
+
+@locked_task()
 def cleanup_expired_payments_task():
     """Clean up expired payment sessions."""
     try:
         from datetime import datetime, timedelta
         
-        # Find payments that are older than 24 hours and still pending
-        yesterday = timezone.now() - timedelta(hours=24)
-        expired_payments = Payment.objects.filter(
-            status='PENDING',
-            borrowing__borrow_date__lt=yesterday
+        # Pending payments whose checkout session expired; payments created
+        # before expiry was tracked fall back to the 24 hour rule
+        now = timezone.now()
+        yesterday = now - timedelta(hours=24)
+        expired_payments = Payment.objects.filter(status='PENDING').filter(
+            Q(session_expires_at__lte=now) |
+            Q(session_expires_at__isnull=True, created_at__lt=yesterday)
         )
         
         expired_count = expired_payments.count()
@@ -232,50 +433,26 @@ def cleanup_expired_payments_task():
             telegram_service.send_message(
                 f"🧹 <b>Payment Cleanup</b>\n\n"
                 f"Cleaned up {expired_count} expired payment sessions\n"
-                f"Timestamp: {timezone.now().strftime('%Y-%m-%d %H:%M:%S')}"
+                f"Timestamp: {timezone.now().strftime('%Y-%m-%d %H:%M:%S')}",
+                priority='summary'
             )
         
     except Exception as e:
         print(f"Error cleaning up expired payments: {str(e)}")
 
 
-def send_reminder_notifications_task():
-    """Send reminder notifications for books due soon."""
+@locked_task(key=run_key_lock)
+def send_reminder_notifications_task(run_key: str = None):
+    """Send reminder notifications for books due in the next two days, in resumable chunks."""
     try:
-        today = date.today()
-        tomorrow = today + timedelta(days=1)
-        day_after_tomorrow = today + timedelta(days=2)
-        
-        # Find borrowings due in next 2 days
-        due_soon = Borrowing.objects.filter(
-            expected_return_date__in=[tomorrow, day_after_tomorrow],
-            actual_return_date__isnull=True
-        ).select_related('user', 'book')
-        
-        telegram_service = TelegramNotificationService()
-        
-        for borrowing in due_soon:
-            days_until_due = (borrowing.expected_return_date - today).days
-            
-            message = (
-                f"📚 <b>Return Reminder</b>\n\n"
-                f"👤 User: {borrowing.user.get_full_name() or borrowing.user.email}\n"
-                f"📖 Book: {borrowing.book.title} by {borrowing.book.author}\n"
-                f"📅 Due Date: {borrowing.expected_return_date}\n"
-                f"⏰ Days Until Due: {days_until_due}\n\n"
-                f"Please return the book on time to avoid fines.\n\n"
-                f"ID: {borrowing.id}"
-            )
-            
-            telegram_service.send_message(message)
-        
-        if due_soon.count() > 0:
-            print(f"Sent {due_soon.count()} reminder notifications")
-        
+        result = ReminderJob(run_key).run()
+        if result['rows']:
+            print(f"Reminder notifications: {result}")
     except Exception as e:
         print(f"Error sending reminder notifications: {str(e)}")
 
 
+@locked_task()
 def generate_system_health_report():
     """Generate and send system health report."""
     try:
@@ -312,7 +489,7 @@ def generate_system_health_report():
         )
         
         telegram_service = TelegramNotificationService()
-        telegram_service.send_message(message)
+        telegram_service.send_message(message, priority='summary')
         print("System health report sent successfully")
         
     except Exception as e:
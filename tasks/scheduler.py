@@ -0,0 +1,185 @@
+import logging
+from datetime import datetime, time, timedelta
+from functools import reduce
+from operator import or_
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from borrowings.models import Borrowing
+from notifications.services import OverdueAlertService
+from .models import DueDateEvent
+
+logger = logging.getLogger(__name__)
+
+
+class DueDateScheduler:
+    """
+    Event-driven scheduler for due-date reminders and overdue transitions.
+    
+    Each active borrowing owns a handful of ``DueDateEvent`` rows keyed by
+    ``fire_at``. The worker pops only rows that are due, so its cost is
+    proportional to the number of events rather than the size of the
+    Borrowing table. An event is deleted in the transaction that sends
+    it, so a failed send or a killed worker never loses a reminder.
+    """
+    
+    def __init__(self):
+        self.reminder_days = getattr(settings, 'DUE_REMINDER_DAYS_BEFORE', [2, 1])
+        self.batch_size = getattr(settings, 'DUE_EVENTS_BATCH_SIZE', 500)
+        self.max_attempts = getattr(settings, 'DUE_EVENTS_MAX_ATTEMPTS', 5)
+    
+    @staticmethod
+    def reminder_time(borrowing) -> time:
+        """
+        Return the time of day reminders for a borrowing go out.
+        
+        Reminders are spread over 09:00-17:00 by borrowing id instead of
+        all being sent at once; the time is stable across reschedules.
+        """
+        minutes = borrowing.id % (8 * 60)
+        return time(9 + minutes // 60, minutes % 60)
+    
+    def get_events(self, borrowing) -> list:
+        """
+        Return the (kind, fire_at) pairs a borrowing should have.
+        
+        Args:
+            borrowing: Active borrowing
+        
+        Returns:
+            list: Desired events
+        """
+        tz = timezone.get_current_timezone()
+        due_date = borrowing.expected_return_date
+        events = [
+            ('REMINDER', timezone.make_aware(datetime.combine(due_date - timedelta(days=days), self.reminder_time(borrowing)), tz))
+            for days in self.reminder_days
+        ]
+        # Overdue from the first moment expected_return_date < today
+        events.append(('OVERDUE', timezone.make_aware(datetime.combine(due_date + timedelta(days=1), time.min), tz)))
+        return events
+    
+    def schedule(self, borrowing):
+        """
+        Create or update the pending events of a borrowing.
+        
+        Reminders whose time has already passed are not created; events that
+        no longer match the due date are removed. Returned borrowings have
+        all pending events cancelled.
+        """
+        if not borrowing.is_active:
+            self.cancel(borrowing)
+            return
+        
+        now = timezone.now()
+        events = [
+            (kind, fire_at) for kind, fire_at in self.get_events(borrowing)
+            if kind == 'OVERDUE' or fire_at > now
+        ]
+        
+        stale = DueDateEvent.objects.filter(borrowing=borrowing)
+        if events:
+            stale = stale.exclude(reduce(or_, (Q(kind=kind, fire_at=fire_at) for kind, fire_at in events)))
+        stale.delete()
+        
+        DueDateEvent.objects.bulk_create(
+            [DueDateEvent(borrowing=borrowing, kind=kind, fire_at=fire_at) for kind, fire_at in events],
+            ignore_conflicts=True
+        )
+    
+    def cancel(self, borrowing):
+        """Cancel all pending events of a borrowing."""
+        DueDateEvent.objects.filter(borrowing=borrowing).delete()
+    
+    def backfill(self) -> int:
+        """
+        Schedule events for active borrowings that have none (e.g. created before the scheduler existed).
+        
+        Returns:
+            int: Number of borrowings scheduled
+        """
+        borrowings = Borrowing.objects.filter(actual_return_date__isnull=True, due_events__isnull=True)
+        count = 0
+        for borrowing in borrowings.iterator():
+            self.schedule(borrowing)
+            count += 1
+        return count
+    
+    def due_ids(self, now, skip=()) -> list:
+        """Return the ids of up to ``batch_size`` due events, oldest first, leaving out ``skip``."""
+        return list(
+            DueDateEvent.objects.filter(fire_at__lte=now)
+            .exclude(id__in=skip)
+            .order_by('fire_at')
+            .values_list('id', flat=True)[:self.batch_size]
+        )
+    
+    def deliver(self, event_id: int, telegram_service, overdue_service, now) -> str:
+        """
+        Deliver one due event and remove it, in one transaction.
+        
+        The event is locked with ``SKIP LOCKED`` where supported, so several
+        workers can drain the queue concurrently without double delivery,
+        and it is only deleted together with the send (or the outbound queue
+        row), so a worker killed mid-send leaves it for the next run. A
+        failed send keeps the event for the next run until it has been tried
+        ``DUE_EVENTS_MAX_ATTEMPTS`` times.
+        
+        Returns:
+            str: ``REMINDER`` or ``OVERDUE`` if a notification was sent,
+            ``failed``, or ``skipped`` (claimed elsewhere, returned, or no
+            alert due)
+        """
+        with transaction.atomic():
+            locked = DueDateEvent.objects.select_for_update(skip_locked=True).filter(id=event_id, fire_at__lte=now)
+            if not locked.values_list('id', flat=True):
+                return 'skipped'
+            event = DueDateEvent.objects.select_related('borrowing__user', 'borrowing__book').get(id=event_id)
+            borrowing = event.borrowing
+            outcome = 'skipped'
+            if borrowing.is_active:
+                try:
+                    if event.kind == 'REMINDER':
+                        outcome = 'REMINDER' if telegram_service.send_reminder_notification(borrowing) else 'failed'
+                    elif overdue_service.alert_borrowing(borrowing, timezone.localdate(now)):
+                        # Shares the escalation state with the overdue sweep, so no duplicates
+                        outcome = 'OVERDUE'
+                except Exception as e:
+                    logger.error(f"Failed to deliver {event.kind} event for borrowing {borrowing.id}: {str(e)}")
+                    outcome = 'failed'
+            
+            if outcome == 'failed' and event.attempts + 1 < self.max_attempts:
+                DueDateEvent.objects.filter(id=event_id).update(attempts=F('attempts') + 1)
+            else:
+                if outcome == 'failed':
+                    logger.error(f"Dropped {event.kind} event for borrowing {borrowing.id} after {self.max_attempts} attempts")
+                event.delete()
+        return outcome
+    
+    def process_due(self, telegram_service, now=None) -> dict:
+        """
+        Deliver all due events.
+        
+        Args:
+            telegram_service: Service used to send the notifications
+            now: Reference time (defaults to now)
+        
+        Returns:
+            dict: Number of reminders and overdue alerts sent, and of failed sends kept for a retry
+        """
+        now = now or timezone.now()
+        overdue_service = OverdueAlertService(telegram_service)
+        sent = {'REMINDER': 0, 'OVERDUE': 0, 'failed': 0, 'skipped': 0}
+        failed = []
+        while True:
+            event_ids = self.due_ids(now, failed)
+            for event_id in event_ids:
+                outcome = self.deliver(event_id, telegram_service, overdue_service, now)
+                sent[outcome] += 1
+                if outcome == 'failed':
+                    # Retried by the next run, not again by this one
+                    failed.append(event_id)
+            if len(event_ids) < self.batch_size:
+                break
+        return {'reminders': sent['REMINDER'], 'overdue': sent['OVERDUE'], 'failed': sent['failed']}
\ No newline at end of file
@@ -0,0 +1,15 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from borrowings.models import Borrowing
+from .scheduler import DueDateScheduler
+
+
+@receiver(post_save, sender=Borrowing)
+def schedule_due_events(sender, instance, **kwargs):
+    """
+    Schedule reminder/overdue events for a borrowing, or cancel them on return.
+    
+    Runs in the borrowing's transaction so events never outlive a rolled
+    back borrowing or return.
+    """
+    DueDateScheduler().schedule(instance)
\ No newline at end of file
@@ -0,0 +1,474 @@
+"""
+Tests for Tasks app.
+"""
+
+import pytest
+from datetime import date, datetime, time, timedelta
+from unittest.mock import MagicMock
+from django.utils import timezone
+
+
+@pytest.mark.django_db
+class TestDueDateScheduler:
+    """Test the due-date event scheduler."""
+    
+    @pytest.fixture
+    def book(self):
+        """Create a book with enough copies for several borrowings."""
+        from books.models import Book
+        return Book.objects.create(title='Dune', author='Herbert', cover='HARD', inventory=10, daily_fee=1)
+    
+    def create_borrowing(self, user, book, due_in_days=7):
+        """Create an active borrowing due in the given number of days."""
+        from borrowings.models import Borrowing
+        return Borrowing.objects.create(
+            user=user,
+            book=book,
+            expected_return_date=date.today() + timedelta(days=due_in_days)
+        )
+    
+    def test_borrow_schedules_events(self, user, book):
+        """Test that borrowing a book queues reminder and overdue events."""
+        from tasks.models import DueDateEvent
+        borrowing = self.create_borrowing(user, book)
+        
+        events = list(DueDateEvent.objects.filter(borrowing=borrowing).values_list('kind', 'fire_at'))
+        
+        assert [kind for kind, _ in events] == ['REMINDER', 'REMINDER', 'OVERDUE']
+        assert events[-1][1] == timezone.make_aware(
+            datetime.combine(borrowing.expected_return_date + timedelta(days=1), time.min)
+        )
+        assert events[0][1].date() == borrowing.expected_return_date - timedelta(days=2)
+    
+    def test_return_cancels_events(self, user, book):
+        """Test that returning a book cancels its pending events."""
+        from tasks.models import DueDateEvent
+        borrowing = self.create_borrowing(user, book)
+        
+        borrowing.actual_return_date = date.today()
+        borrowing.save()
+        
+        assert not DueDateEvent.objects.filter(borrowing=borrowing).exists()
+    
+    def test_due_date_change_reschedules(self, user, book):
+        """Test that moving the due date replaces the pending events."""
+        from tasks.models import DueDateEvent
+        borrowing = self.create_borrowing(user, book)
+        
+        borrowing.expected_return_date += timedelta(days=7)
+        borrowing.save()
+        
+        overdue = DueDateEvent.objects.get(borrowing=borrowing, kind='OVERDUE')
+        assert DueDateEvent.objects.filter(borrowing=borrowing).count() == 3
+        assert overdue.fire_at.date() == borrowing.expected_return_date + timedelta(days=1)
+    
+    def test_process_due_only_touches_due_events(self, user, book, django_assert_num_queries):
+        """Test that the worker delivers due events once and leaves future ones."""
+        from tasks.models import DueDateEvent
+        from tasks.scheduler import DueDateScheduler
+        borrowing = self.create_borrowing(user, book, due_in_days=3)
+        self.create_borrowing(user, book, due_in_days=30)
+        telegram_service = MagicMock()
+        now = timezone.make_aware(datetime.combine(borrowing.expected_return_date - timedelta(days=2), time(18)))
+        
+        # Due ids, then per event: lock it, load it, delete it (plus savepoint/release)
+        with django_assert_num_queries(6):
+            result = DueDateScheduler().process_due(telegram_service, now=now)
+        
+        assert result == {'reminders': 1, 'overdue': 0, 'failed': 0}
+        telegram_service.send_reminder_notification.assert_called_once_with(borrowing)
+        assert DueDateEvent.objects.count() == 5
+        assert DueDateScheduler().process_due(telegram_service, now=now) == {'reminders': 0, 'overdue': 0, 'failed': 0}
+    
+    def test_failed_send_keeps_event_for_retry(self, user, book, settings):
+        """Test that an event is only removed once its notification went out, or after the last attempt."""
+        from tasks.models import DueDateEvent
+        from tasks.scheduler import DueDateScheduler
+        settings.DUE_EVENTS_MAX_ATTEMPTS = 3
+        borrowing = self.create_borrowing(user, book, due_in_days=3)
+        telegram_service = MagicMock()
+        telegram_service.send_reminder_notification.side_effect = [RuntimeError('worker killed'), False, True]
+        now = timezone.make_aware(datetime.combine(borrowing.expected_return_date - timedelta(days=2), time(18)))
+        reminders = DueDateEvent.objects.filter(borrowing=borrowing, kind='REMINDER', fire_at__lte=now)
+        
+        assert DueDateScheduler().process_due(telegram_service, now=now) == {'reminders': 0, 'overdue': 0, 'failed': 1}
+        assert reminders.get().attempts == 1
+        assert DueDateScheduler().process_due(telegram_service, now=now)['failed'] == 1
+        assert DueDateScheduler().process_due(telegram_service, now=now)['reminders'] == 1
+        assert not reminders.exists()
+        assert telegram_service.send_reminder_notification.call_count == 3
+        
+        telegram_service.send_reminder_notification.side_effect = None
+        telegram_service.send_reminder_notification.return_value = False
+        later = now + timedelta(days=1)
+        for _ in range(3):
+            assert DueDateScheduler().process_due(telegram_service, now=later)['failed'] == 1
+        assert not DueDateEvent.objects.filter(borrowing=borrowing, kind='REMINDER').exists()
+    
+    def test_process_due_sends_overdue(self, user, book):
+        """Test that the overdue event fires the day after the due date."""
+        from tasks.scheduler import DueDateScheduler
+        borrowing = self.create_borrowing(user, book, due_in_days=1)
+        telegram_service = MagicMock()
+        now = timezone.make_aware(datetime.combine(borrowing.expected_return_date + timedelta(days=1), time(0, 1)))
+        
+        result = DueDateScheduler().process_due(telegram_service, now=now)
+        
+        assert result['overdue'] == 1
+        telegram_service.send_overdue_notification.assert_called_once_with(borrowing)
+    
+    def test_backfill_schedules_missing_events(self, user, book):
+        """Test that backfill queues events for borrowings without any."""
+        from tasks.models import DueDateEvent
+        from tasks.scheduler import DueDateScheduler
+        borrowing = self.create_borrowing(user, book)
+        DueDateEvent.objects.all().delete()
+        
+        assert DueDateScheduler().backfill() == 1
+        assert DueDateEvent.objects.filter(borrowing=borrowing).count() == 3
+        assert DueDateScheduler().backfill() == 0
+
+
+
+@pytest.mark.django_db
+class TestBatchJobs:
+    """Test the checkpointed nightly batch jobs."""
+    
+    @pytest.fixture(autouse=True)
+    def telegram(self, settings, monkeypatch):
+        """Record reminders instead of sending them."""
+        from notifications.services import TelegramNotificationService
+        settings.TELEGRAM_BOT_TOKEN = 'test-token'
+        settings.TELEGRAM_CHAT_ID = '1'
+        self.reminded = []
+        self.fail_on = None
+        
+        def send_reminder_notification(service, borrowing):
+            if borrowing.id == self.fail_on:
+                raise RuntimeError('worker killed')
+            self.reminded.append(borrowing.id)
+            return True
+        monkeypatch.setattr(TelegramNotificationService, 'send_reminder_notification', send_reminder_notification)
+    
+    @pytest.fixture
+    def queued(self, monkeypatch):
+        """Record re-queued tasks instead of sending them to the broker."""
+        calls = []
+        monkeypatch.setattr('tasks.batch.async_task', lambda *args: calls.append(args))
+        return calls
+    
+    def due_tomorrow(self, user, count):
+        """Create active borrowings due tomorrow."""
+        from books.models import Book
+        from borrowings.models import Borrowing
+        book = Book.objects.create(title='Dune', author='Herbert', cover='HARD', inventory=count, daily_fee=1)
+        return [
+            Borrowing.objects.create(user=user, book=book, expected_return_date=date.today() + timedelta(days=1))
+            for _ in range(count)
+        ]
+    
+    def test_resumes_from_checkpoint(self, user):
+        """Test that a run killed mid-chunk resumes after the last committed chunk without duplicates."""
+        from tasks.jobs import ReminderJob
+        from tasks.models import BatchJobRun
+        borrowings = self.due_tomorrow(user, 5)
+        ids = [borrowing.id for borrowing in borrowings]
+        self.fail_on = ids[2]
+        
+        with pytest.raises(RuntimeError):
+            ReminderJob(chunk_size=2).run()
+        
+        run = BatchJobRun.objects.get(job='due_reminders')
+        assert (run.status, run.last_id, run.processed) == ('FAILED', ids[1], 2)
+        
+        self.fail_on = None
+        result = ReminderJob(chunk_size=2).run()
+        
+        run.refresh_from_db()
+        assert self.reminded == ids
+        assert (result['status'], result['rows'], result['processed']) == ('COMPLETED', 3, 5)
+        assert (run.attempts, run.chunks) == (2, 3)
+        assert list(run.chunk_log.values_list('first_id', 'last_id', 'rows')) == [
+            (ids[0], ids[1], 2), (ids[2], ids[3], 2), (ids[4], ids[4], 1)
+        ]
+        assert ReminderJob(chunk_size=2).run()['rows'] == 0
+        assert self.reminded == ids
+    
+    def test_time_budget_requeues(self, user, queued):
+        """Test that an invocation stops before a chunk that would overrun the budget and re-queues itself."""
+        from itertools import count
+        from tasks.jobs import ReminderJob
+        self.due_tomorrow(user, 3)
+        clock = count(step=10).__next__
+        
+        result = ReminderJob(chunk_size=1, time_budget=15, clock=clock).run()
+        
+        assert (result['status'], result['chunks'], result['requeued']) == ('RUNNING', 1, True)
+        assert queued == [('tasks.scheduled_tasks.send_reminder_notifications_task', date.today().isoformat())]
+        assert ReminderJob(*queued[0][1:], chunk_size=1).run()['status'] == 'COMPLETED'
+        assert len(self.reminded) == 3
+    
+    def test_stale_lock_holder_cannot_checkpoint(self, user, monkeypatch):
+        """Test that a chunk written under a newer fencing token stops a run still holding an older one."""
+        from types import SimpleNamespace
+        from tasks.jobs import ReminderJob
+        from tasks.locks import LockLost
+        from tasks.models import BatchJobRun
+        ids = [borrowing.id for borrowing in self.due_tomorrow(user, 3)]
+        run = BatchJobRun.objects.create(job='due_reminders', run_key=date.today().isoformat())
+        
+        assert ReminderJob(chunk_size=1).run_chunk(run.pk, 5) == (1, False)
+        with pytest.raises(LockLost):
+            ReminderJob(chunk_size=1).run_chunk(run.pk, 3)
+        stale = SimpleNamespace(token=3, extend=lambda: True)
+        monkeypatch.setattr('tasks.batch.current_lock', lambda: stale)
+        result = ReminderJob(chunk_size=1).run()
+        
+        run.refresh_from_db()
+        assert result['lock_lost'] and result['rows'] == 0
+        assert (run.status, run.last_id, run.lock_token) == ('RUNNING', ids[0], 5)
+        assert self.reminded == ids[:1]
+    
+    def test_resume_stale_runs(self, queued):
+        """Test that abandoned and failed runs are re-queued once and finished or fresh ones are left alone."""
+        from tasks.batch import BatchJob
+        from tasks.models import BatchJobRun
+        old = timezone.now() - timedelta(hours=1)
+        for job, status, attempts in [
+            ('process_fines', 'RUNNING', 1),
+            ('overdue_alerts', 'FAILED', 1),
+            ('due_reminders', 'FAILED', 3),
+            ('unknown', 'RUNNING', 1),
+        ]:
+            run = BatchJobRun.objects.create(job=job, run_key='2026-01-05', status=status, attempts=attempts)
+            BatchJobRun.objects.filter(pk=run.pk).update(updated_at=old)
+        BatchJobRun.objects.create(job='process_fines', run_key='2026-01-06')
+        
+        resumed = BatchJob.resume_stale()
+        
+        assert sorted(run.job for run in resumed) == ['overdue_alerts', 'process_fines']
+        assert sorted(queued) == [
+            ('tasks.scheduled_tasks.check_overdue_books_task', '2026-01-05'),
+            ('tasks.scheduled_tasks.process_fines_task', '2026-01-05'),
+        ]
+        assert BatchJob.resume_stale() == []
+    
+    def test_fine_job(self, user, book):
+        """Test that the fines job accrues the ledger and opens one fine per overdue borrowing."""
+        from borrowings.models import Borrowing
+        from payments.fine_policy import FinePolicy
+        from payments.models import FineBalance, Payment
+        from tasks.jobs import FineJob
+        borrowing = Borrowing.objects.create(
+            user=user,
+            book=book,
+            borrow_date=date.today() - timedelta(days=10),
+            expected_return_date=date.today() - timedelta(days=3)
+        )
+        
+        result = FineJob().run()
+        FineJob(run_key=(date.today() + timedelta(days=1)).isoformat()).run()
+        
+        # The next day's run accrues one more day but leaves the PENDING fine alone
+        fine = Payment.objects.get(borrowing=borrowing, type='FINE')
+        assert (result['status'], result['processed']) == ('COMPLETED', 1)
+        assert fine.money_to_pay == FinePolicy.from_settings().calculate(book.daily_fee, 3)
+        assert FineBalance.objects.get(borrowing=borrowing).days == 4
+    
+    def test_fan_out_and_reduce(self, user):
+        """Test that a job split into shards covers every borrowing once and the last shard adds up the totals."""
+        from books.models import Book
+        from borrowings.models import Borrowing
+        from payments.models import Payment
+        from tasks.batch import split_id_range
+        from tasks.jobs import FineJob
+        from tasks.models import BatchJobRun
+        # Enough copies for every borrowing, whatever the book fixture's inventory
+        book = Book.objects.create(title='Dune', author='Herbert', cover='HARD', inventory=10, daily_fee=1)
+        borrowings = [
+            Borrowing.objects.create(
+                user=user,
+                book=book,
+                borrow_date=date.today() - timedelta(days=10),
+                expected_return_date=date.today() - timedelta(days=3)
+            )
+            for _ in range(3)
+        ]
+        shard_keys = []
+        
+        summary = FineJob(chunk_size=1).fan_out(2, enqueue=lambda key: shard_keys.append(key) or True)
+        results = [FineJob(key, chunk_size=1).run() for key in shard_keys]
+        
+        parent = BatchJobRun.objects.get(job='process_fines', run_key=date.today().isoformat())
+        assert split_id_range(1, 5, 2) == [(1, 3), (4, 5)]
+        assert summary['queued'] == 2
+        assert shard_keys == [f'{parent.run_key}:1/2', f'{parent.run_key}:2/2']
+        assert list(parent.shards.order_by('min_id').values_list('min_id', 'max_id')) == [
+            (borrowings[0].id, borrowings[1].id), (borrowings[2].id, borrowings[2].id)
+        ]
+        assert results[0].get('fan_in') is None
+        assert (results[1]['fan_in']['processed'], results[1]['fan_in']['shards']) == (3, 2)
+        assert (parent.status, parent.processed, parent.chunks) == ('COMPLETED', 3, 3)
+        assert Payment.objects.filter(type='FINE').count() == 3
+        assert FineJob().start(shards=2)['queued'] == 0
+    
+    def test_fan_out_benchmark(self):
+        """Test that the scaling benchmark processes every borrowing and cleans up."""
+        from borrowings.models import Borrowing
+        from tasks.benchmark import FanOutBenchmark
+        from tasks.models import BatchJobRun
+        
+        result = FanOutBenchmark(job='overdue_alerts', borrowings=6, workers=(1,), chunk_size=4).run()
+        
+        assert result['rounds'][0]['status'] == 'COMPLETED'
+        assert (result['rounds'][0]['processed'], result['rounds'][0]['chunks']) == (6, 2)
+        assert not Borrowing.objects.exists()
+        assert not BatchJobRun.objects.exists()
+
+    
+    def test_archive_benchmark(self):
+        """Test that the archive benchmark archives the old history and cleans up."""
+        from borrowings.models import ArchivedBorrowing, Borrowing
+        from tasks.benchmark import ArchiveBenchmark
+        
+        result = ArchiveBenchmark(history=20, active=10, years=10, keep_years=3, repeat=1).run()
+        
+        assert 10 <= result['archived'] < 20
+        assert result['before']['rows'] == 30
+        assert result['after']['rows'] == 30 - result['archived']
+        assert not Borrowing.objects.exists()
+        assert not ArchivedBorrowing.objects.exists()
+
+
+@pytest.mark.django_db
+class TestTaskLocks:
+    """Test the lease-based scheduled task locks."""
+    
+    def test_fencing_token(self):
+        """Test that an expired lease can be taken over and its old holder can no longer renew or release it."""
+        from tasks.locks import TaskLock, task_lock_metrics
+        from tasks.models import TaskLease
+        first, second = TaskLock('nightly', ttl=60), TaskLock('nightly', ttl=60)
+        
+        assert first.acquire()
+        assert not second.acquire()
+        TaskLease.objects.filter(name='nightly').update(expires_at=timezone.now() - timedelta(seconds=1))
+        assert second.acquire()
+        
+        assert second.token == first.token + 1
+        assert not first.extend()
+        first.release()
+        assert second.extend()
+        assert TaskLease.objects.get(name='nightly').expires_at > timezone.now()
+        assert task_lock_metrics(['nightly'])['nightly'] == {
+            'acquired': 2, 'waited': 0, 'wait_ms': 0, 'skipped': 1, 'lost': 1
+        }
+    
+    def test_heartbeat_keeps_lease_for_whole_run(self, monkeypatch):
+        """Test that a task running longer than its lease keeps the lock until it returns."""
+        from threading import Event
+        from time import monotonic
+        from tasks.locks import TaskLock, locked_task
+        
+        class MemoryLeaseStore:
+            def __init__(self):
+                self.leases = {}
+                self.fence = 0
+            
+            def acquire(self, name, owner, ttl):
+                if self.leases.get(name, (None, 0))[1] > monotonic():
+                    return None
+                self.fence += 1
+                self.leases[name] = (self.fence, monotonic() + ttl)
+                return self.fence
+            
+            def extend(self, name, token, ttl):
+                held, expires = self.leases.get(name, (None, 0))
+                if held != token or expires <= monotonic():
+                    return False
+                self.leases[name] = (token, monotonic() + ttl)
+                return True
+            
+            def release(self, name, token):
+                if self.leases.get(name, (None, 0))[0] == token:
+                    del self.leases[name]
+        
+        store = MemoryLeaseStore()
+        monkeypatch.setattr('tasks.locks.get_lease_store', lambda: store)
+        
+        @locked_task(ttl=0.3)
+        def slow_task():
+            Event().wait(1)
+            return TaskLock('slow_task', ttl=0.3).acquire()
+        
+        assert slow_task() is False
+        assert store.leases == {}
+    
+    def test_overlapping_run_is_skipped(self, monkeypatch):
+        """Test that a task started while another run holds its lock is skipped and a waiting run gets it."""
+        from tasks.locks import TaskLock, locked_task, task_lock_metrics
+        runs = []
+        
+        @locked_task()
+        def nightly_task(day):
+            runs.append(day)
+            return day
+        
+        holder = TaskLock('nightly_task:monday')
+        holder.acquire()
+        assert nightly_task('monday') is None
+        assert nightly_task('tuesday') == 'tuesday'
+        monkeypatch.setattr('tasks.locks.time.sleep', lambda seconds: holder.release())
+        assert nightly_task.run_locked('monday', wait=5) == (True, 'monday')
+        
+        assert runs == ['tuesday', 'monday']
+        metrics = task_lock_metrics(['nightly_task'])['nightly_task']
+        assert (metrics['acquired'], metrics['skipped'], metrics['waited']) == (2, 1, 1)
+    
+    def test_metrics_cover_scheduled_tasks(self):
+        """Test that the default metrics list every scheduled task without the caller importing them."""
+        from tasks.locks import task_lock_metrics
+        
+        metrics = task_lock_metrics()
+        
+        assert {'deliver_telegram_messages_task', 'cleanup_expired_payments_task'} <= set(metrics)
+    
+    def test_run_task_and_setup_respect_locks(self):
+        """Test that run_task skips a running task and setup_tasks never duplicates schedules."""
+        from io import StringIO
+        from django.core.management import call_command
+        from django_q.models import Schedule
+        from tasks.locks import TaskLock
+        TaskLock('resume_batch_jobs_task').acquire()
+        out = StringIO()
+        
+        call_command('run_task', 'resume_batch_jobs', stdout=out)
+        call_command('setup_tasks', stdout=StringIO())
+        Schedule.objects.create(func='tasks.scheduled_tasks.process_fines_task', schedule_type=Schedule.DAILY)
+        call_command('setup_tasks', stdout=StringIO())
+        
+        assert 'Skipped task resume_batch_jobs' in out.getvalue()
+        assert Schedule.objects.filter(func='tasks.scheduled_tasks.process_fines_task').count() == 1
+        assert Schedule.objects.count() == len(set(Schedule.objects.values_list('func', flat=True)))
+
+
+@pytest.mark.django_db(transaction=True)
+class TestCheckoutBenchmark:
+    """Test the borrow -> pay -> notify benchmark against the fake APIs."""
+    
+    def test_benchmark_runs_and_cleans_up(self):
+        """Test that every flow completes, notifications are delivered and data is removed."""
+        from books.models import Book
+        from borrowings.models import Borrowing
+        from notifications.models import OutboundMessage
+        from tasks.benchmark import CheckoutBenchmark
+        
+        result = CheckoutBenchmark(iterations=4, concurrency=1, telegram_rate=100).run()
+        
+        assert result['stages']['flow']['count'] == 4
+        assert result['stripe']['paid'] == 4
+        assert result['telegram']['delivered'] >= 8
+        assert result['drain']['pending'] == 0
+        assert not Borrowing.objects.exists()
+        assert not Book.objects.exists()
+        assert not OutboundMessage.objects.exists()
\ No newline at end of file